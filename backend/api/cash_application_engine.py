@@ -0,0 +1,480 @@
+"""
+Cash application engine.
+Applies incoming bank credits (TransaccionBancaria with a positive amount) to
+the open receivables (CuentaPorCobrar) of the business, creating the Pago
+records that PagoViewSet would otherwise require by hand.
+"""
+import logging
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger('api.cash_application')
+
+OPEN_STATES = ('PENDIENTE', 'PARCIAL', 'VENCIDA')
+
+
+@dataclass
+class Propuesta:
+    """Proposed application of one bank credit: [(CuentaPorCobrar, monto)]."""
+    transaccion: object
+    metodo: str
+    confianza: Decimal
+    asignaciones: list
+    cliente_id: Optional[object] = None
+
+
+class CashApplicationEngine:
+    """
+    Match bank credits to open receivables of one business.
+
+    Rules, in order (the first one that finds something wins):
+    1. Reference — invoice numbers (CxC número, sale número or NCF) quoted in
+       the description/reference; the referenced invoices, or a combination
+       of them, must add up to the credit.
+    2. Client — the client is identified by RNC/cédula in the text (or by its
+       full name); the credit is matched to one open invoice of the same
+       amount, else to a combination of that client's invoices (bounded
+       subset-sum), else spread oldest-first as a partial payment.
+    3. Amount — no client identified: an open invoice of exactly the amount.
+
+    Proposals from AUTO_CONFIDENCE on are applied at once (Pago rows and
+    receivable balances written in bulk, receivable rows locked); the rest
+    go to the review queue as SugerenciaCobro PENDIENTE (one per credit).
+    Open receivables are loaded once per run and indexed in memory.
+    """
+
+    AUTO_CONFIDENCE = Decimal('0.95')  # From this on the credit is applied
+    BATCH_SIZE = 1000  # Rows per bulk_create / bulk_update
+    SUBSET_MAX_INVOICES = 20  # Oldest open invoices of a client tried in combinations
+    SUBSET_MAX_SIZE = 6  # Invoices per combination
+    SUBSET_MAX_STEPS = 20_000  # Search nodes per credit before giving up
+    NAME_MIN_LENGTH = 8  # Shorter client names are not searched in descriptions
+
+    def __init__(self, negocio):
+        self.negocio = negocio
+
+    def run(self, transacciones=None, usuario=None):
+        """
+        Apply the pending bank credits of the business (or of the given
+        TransaccionBancaria queryset). Credits already applied, queued or
+        rejected are skipped, so running it twice does nothing new.
+        Returns dict with statistics.
+        """
+        from api.models import TransaccionBancaria
+
+        if transacciones is None:
+            transacciones = TransaccionBancaria.objects.filter(negocio=self.negocio)
+        with transaction.atomic():
+            # Credits held by a concurrent run are skipped; the pending filter is
+            # evaluated under the lock, so a committed run's credits drop out too
+            transacciones = list(
+                transacciones.filter(negocio=self.negocio, monto__gt=0)
+                .exclude(estado='EXCLUIDA')
+                .filter(sugerencia_cobro__isnull=True, pagos__isnull=True)
+                .select_for_update(skip_locked=True, of=('self',))
+                .order_by('fecha', 'creado_en')
+            )
+            stats = {'total': len(transacciones), 'aplicadas': 0, 'en_revision': 0, 'sin_match': 0, 'pagos': 0}
+            if not transacciones:
+                return stats
+
+            index = self.load_receivables()
+            propuestas = []
+            for txn in transacciones:
+                propuesta = self.propose(txn, index)
+                if propuesta is None:
+                    stats['sin_match'] += 1
+                    continue
+                if propuesta.confianza >= self.AUTO_CONFIDENCE:
+                    # Later credits must not claim what this one is about to pay
+                    index.reserve(propuesta.asignaciones)
+                propuestas.append(propuesta)
+
+            self._save(propuestas, usuario, stats)
+
+        logger.info(
+            'Cash application for %s: %d/%d credits applied, %d queued for review',
+            self.negocio.pk, stats['aplicadas'], stats['total'], stats['en_revision'],
+        )
+        return stats
+
+    def load_receivables(self):
+        """One query for all open receivables of the business, indexed in memory."""
+        from api.models import CuentaPorCobrar
+
+        index = ReceivableIndex(self.NAME_MIN_LENGTH)
+        qs = (
+            CuentaPorCobrar.objects.filter(negocio=self.negocio, estado__in=OPEN_STATES, saldo_pendiente__gt=0)
+            .select_related('cliente', 'venta')
+            .order_by('fecha_vencimiento', 'fecha_emision', 'numero')
+        )
+        for cxc in qs.iterator(chunk_size=self.BATCH_SIZE):
+            index.add(cxc)
+        return index
+
+    def propose(self, txn, index):
+        """Best Propuesta for one credit, or None when nothing fits."""
+        monto = _cents(txn.monto)
+        texto = f'{txn.referencia or ""} {txn.descripcion or ""}'
+
+        propuesta = self._reference_match(txn, monto, index.by_tokens(texto), index)
+        if propuesta is not None:
+            return propuesta
+
+        cliente_id, por_rnc = index.identify_client(texto)
+        if cliente_id is not None:
+            return self._client_match(txn, monto, cliente_id, por_rnc, index)
+        return self._amount_match(txn, monto, index)
+
+    def _reference_match(self, txn, monto, referenciadas, index):
+        if not referenciadas:
+            return None
+        saldos = [index.saldo(c) for c in referenciadas]
+        cliente_id = referenciadas[0].cliente_id if len({c.cliente_id for c in referenciadas}) == 1 else None
+        if sum(saldos) == monto:
+            return self._propuesta(txn, 'REFERENCIA', '0.98', referenciadas, saldos, cliente_id)
+        soluciones, completa = subset_sum(saldos, monto, self.SUBSET_MAX_SIZE, self.SUBSET_MAX_STEPS)
+        if soluciones:
+            elegidas = [referenciadas[i] for i in soluciones[0]]
+            confianza = '0.96' if len(soluciones) == 1 and completa else '0.80'
+            return self._propuesta(txn, 'REFERENCIA', confianza, elegidas, [index.saldo(c) for c in elegidas], cliente_id)
+        if monto < sum(saldos):
+            # Partial payment of the quoted invoices
+            return self._fifo(txn, 'REFERENCIA', '0.80', referenciadas, monto, index, cliente_id)
+        return None
+
+    def _client_match(self, txn, monto, cliente_id, por_rnc, index):
+        # Identified by name only: nothing but a unique exact amount is auto-applied
+        penalty = Decimal('0') if por_rnc else Decimal('0.05')
+        facturas = index.of_client(cliente_id)
+        if not facturas:
+            return None
+
+        exactas = [c for c in facturas if index.saldo(c) == monto]
+        if exactas:
+            # Several invoices of the same amount: the oldest one is paid first
+            if len(exactas) == 1:
+                confianza = Decimal('0.98') if por_rnc else Decimal('0.95')
+            else:
+                confianza = Decimal('0.96') - penalty
+            return self._propuesta(txn, 'CLIENTE', confianza, exactas[:1], [monto], cliente_id)
+
+        candidatas = facturas[:self.SUBSET_MAX_INVOICES]
+        soluciones, completa = subset_sum(
+            [index.saldo(c) for c in candidatas], monto, self.SUBSET_MAX_SIZE, self.SUBSET_MAX_STEPS,
+        )
+        if soluciones:
+            elegidas = [candidatas[i] for i in soluciones[0]]
+            confianza = (Decimal('0.96') if len(soluciones) == 1 and completa else Decimal('0.80')) - penalty
+            return self._propuesta(txn, 'COMBINACION', confianza, elegidas, [index.saldo(c) for c in elegidas], cliente_id)
+
+        if monto < sum(index.saldo(c) for c in facturas):
+            return self._fifo(txn, 'CLIENTE', Decimal('0.70') - penalty, facturas, monto, index, cliente_id)
+        return None
+
+    def _amount_match(self, txn, monto, index):
+        exactas = index.by_amount(monto)
+        if not exactas:
+            return None
+        confianza = '0.85' if len(exactas) == 1 else '0.70'
+        return self._propuesta(txn, 'MONTO', confianza, exactas[:1], [monto], exactas[0].cliente_id)
+
+    def _fifo(self, txn, metodo, confianza, facturas, monto, index, cliente_id):
+        facturas_fifo, montos = [], []
+        for cxc in facturas:
+            if monto <= 0:
+                break
+            parte = min(index.saldo(cxc), monto)
+            facturas_fifo.append(cxc)
+            montos.append(parte)
+            monto -= parte
+        return self._propuesta(txn, metodo, confianza, facturas_fifo, montos, cliente_id)
+
+    def _propuesta(self, txn, metodo, confianza, facturas, montos_cents, cliente_id):
+        return Propuesta(
+            transaccion=txn, metodo=metodo, confianza=Decimal(confianza), cliente_id=cliente_id,
+            asignaciones=[(cxc, Decimal(m) / 100) for cxc, m in zip(facturas, montos_cents)],
+        )
+
+    def _save(self, propuestas, usuario, stats):
+        from api.models import CuentaPorCobrar, Pago, SugerenciaCobro
+
+        ids = sorted({
+            cxc.pk for p in propuestas if p.confianza >= self.AUTO_CONFIDENCE for cxc, _ in p.asignaciones
+        })
+        # Balances may have moved since the index was loaded (manual payments)
+        vigentes = {
+            cxc.pk: cxc for cxc in CuentaPorCobrar.objects.select_for_update()
+            .filter(id__in=ids, estado__in=OPEN_STATES).order_by('id')
+        } if ids else {}
+
+        pagos, sugerencias = [], []
+        for propuesta in propuestas:
+            estado = 'PENDIENTE'
+            if propuesta.confianza >= self.AUTO_CONFIDENCE and all(
+                cxc.pk in vigentes and monto <= vigentes[cxc.pk].saldo_pendiente
+                for cxc, monto in propuesta.asignaciones
+            ):
+                asignaciones = [(vigentes[cxc.pk], monto) for cxc, monto in propuesta.asignaciones]
+                pagos.extend(self._pagos(propuesta.transaccion, asignaciones, usuario))
+                estado = 'APLICADA'
+                stats['aplicadas'] += 1
+            else:
+                stats['en_revision'] += 1
+            sugerencias.append(SugerenciaCobro(
+                negocio=self.negocio, transaccion=propuesta.transaccion, cliente_id=propuesta.cliente_id,
+                metodo=propuesta.metodo, confianza=propuesta.confianza, estado=estado,
+                asignaciones=_serializar(propuesta.asignaciones),
+            ))
+
+        if pagos:
+            Pago.objects.bulk_create(pagos, batch_size=self.BATCH_SIZE)
+            CuentaPorCobrar.objects.bulk_update(
+                [vigentes[pk] for pk in {p.cuenta_por_cobrar_id for p in pagos}],
+                ['monto_pagado', 'saldo_pendiente', 'estado'], batch_size=self.BATCH_SIZE,
+            )
+        SugerenciaCobro.objects.bulk_create(sugerencias, batch_size=self.BATCH_SIZE)
+        stats['pagos'] += len(pagos)
+
+    def _pagos(self, txn, asignaciones, usuario):
+        """Unsaved Pago rows for (locked CuentaPorCobrar, monto) pairs; balances updated in place."""
+        from api.models import Pago
+
+        pagos = []
+        for cxc, monto in asignaciones:
+            cxc.monto_pagado += monto
+            cxc.saldo_pendiente = cxc.monto_original - cxc.monto_pagado
+            cxc.estado = 'PAGADA' if cxc.saldo_pendiente <= 0 else 'PARCIAL'
+            pagos.append(Pago(
+                negocio_id=cxc.negocio_id, tipo='COBRO', metodo_pago='TRANSFERENCIA',
+                fecha=txn.fecha, monto=monto, referencia=(txn.referencia or '')[:50],
+                cuenta_por_cobrar=cxc, cuenta_bancaria_id=txn.cuenta_bancaria_id,
+                transaccion_bancaria=txn, creado_por=usuario,
+                notas='Aplicación automática de cobro bancario',
+            ))
+        return pagos
+
+    @transaction.atomic
+    def accept(self, sugerencia, usuario, asignaciones=None):
+        """
+        Apply a queued suggestion, optionally with corrected allocations
+        ([{'cuenta_por_cobrar': id, 'monto': ...}]). Raises ValueError when the
+        allocations no longer fit the receivables or the credit.
+        """
+        from api.models import CuentaPorCobrar, Pago, SugerenciaCobro
+
+        sugerencia = SugerenciaCobro.objects.select_for_update().select_related('transaccion').get(pk=sugerencia.pk)
+        if sugerencia.estado != 'PENDIENTE':
+            raise ValueError('La sugerencia ya fue revisada.')
+        txn = sugerencia.transaccion
+        if txn.pagos.exists():
+            raise ValueError('El crédito bancario ya fue aplicado.')
+
+        pedidas = asignaciones if asignaciones is not None else sugerencia.asignaciones
+        try:
+            montos = [(str(a['cuenta_por_cobrar']), Decimal(str(a['monto']))) for a in pedidas]
+        except (KeyError, TypeError, ArithmeticError):
+            raise ValueError('Asignaciones inválidas.')
+        if not montos or any(m <= 0 for _, m in montos):
+            raise ValueError('Cada asignación debe tener un monto positivo.')
+        if len({pk for pk, _ in montos}) != len(montos):
+            raise ValueError('Cada cuenta por cobrar puede asignarse una sola vez.')
+        if sum(m for _, m in montos) > txn.monto:
+            raise ValueError('Las asignaciones superan el monto del crédito bancario.')
+
+        cuentas = {
+            str(cxc.pk): cxc for cxc in CuentaPorCobrar.objects.select_for_update()
+            .filter(negocio=self.negocio, id__in=[pk for pk, _ in montos], estado__in=OPEN_STATES)
+            .order_by('id')
+        }
+        for pk, monto in montos:
+            if pk not in cuentas or monto > cuentas[pk].saldo_pendiente:
+                raise ValueError('Una cuenta por cobrar ya no tiene saldo suficiente.')
+
+        asignadas = [(cuentas[pk], monto) for pk, monto in montos]
+        Pago.objects.bulk_create(self._pagos(txn, asignadas, usuario))
+        CuentaPorCobrar.objects.bulk_update(list(cuentas.values()), ['monto_pagado', 'saldo_pendiente', 'estado'])
+
+        sugerencia.asignaciones = _serializar(asignadas)
+        sugerencia.estado = 'APLICADA'
+        sugerencia.revisado_por = usuario
+        sugerencia.fecha_revision = timezone.now()
+        sugerencia.save(update_fields=['asignaciones', 'estado', 'revisado_por', 'fecha_revision'])
+        return sugerencia
+
+    @transaction.atomic
+    def reject(self, sugerencia, usuario):
+        """Drop a queued suggestion; the credit is not proposed again."""
+        from api.models import SugerenciaCobro
+
+        # Same row lock as accept(): a concurrent accept cannot be overwritten
+        sugerencia = SugerenciaCobro.objects.select_for_update().get(pk=sugerencia.pk)
+        if sugerencia.estado != 'PENDIENTE':
+            raise ValueError('La sugerencia ya fue revisada.')
+        sugerencia.estado = 'RECHAZADA'
+        sugerencia.revisado_por = usuario
+        sugerencia.fecha_revision = timezone.now()
+        sugerencia.save(update_fields=['estado', 'revisado_por', 'fecha_revision'])
+        return sugerencia
+
+
+def subset_sum(amounts, target, max_size=6, max_steps=20_000, limit=2):
+    """
+    Combinations (lists of indexes) of ``amounts`` (positive integer cents)
+    adding up exactly to ``target``.
+
+    Depth-first in the given order, so the first solution prefers the first
+    items (oldest invoices). Stops after ``limit`` solutions (two are enough
+    to know the match is ambiguous) or ``max_steps`` search nodes. Returns
+    (solutions, complete) where complete is False when the step budget ran
+    out and more solutions could exist.
+    """
+    n = len(amounts)
+    suffix = [0] * (n + 1)
+    for i in range(n - 1, -1, -1):
+        suffix[i] = suffix[i + 1] + amounts[i]
+
+    solutions = []
+    chosen = []
+    steps = 0
+
+    def search(start, remaining):
+        nonlocal steps
+        for i in range(start, n):
+            if len(solutions) >= limit or steps >= max_steps or suffix[i] < remaining:
+                return
+            steps += 1
+            amount = amounts[i]
+            if amount > remaining:
+                continue
+            chosen.append(i)
+            if amount == remaining:
+                solutions.append(list(chosen))
+            elif len(chosen) < max_size:
+                search(i + 1, remaining - amount)
+            chosen.pop()
+
+    if target > 0:
+        search(0, target)
+    return solutions, steps < max_steps
+
+
+def normalize_text(text):
+    """Upper-case ASCII words separated by single spaces."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).upper()
+    return ' '.join(re.split(r'[^A-Z0-9]+', text)).strip()
+
+
+def _cents(monto):
+    return int((Decimal(monto) * 100).to_integral_value())
+
+
+def _digits(value):
+    return re.sub(r'\D', '', value or '')
+
+
+def _token(value):
+    return re.sub(r'[^A-Z0-9]', '', (value or '').upper())
+
+
+def _usable_token(token):
+    # Short or purely numeric tokens collide with amounts and dates in descriptions
+    return len(token) >= 4 and (not token.isdigit() or len(token) >= 6)
+
+
+def _serializar(asignaciones):
+    return [
+        {'cuenta_por_cobrar': str(cxc.pk), 'numero': cxc.numero, 'monto': f'{monto:.2f}'}
+        for cxc, monto in asignaciones
+    ]
+
+
+class ReceivableIndex:
+    """
+    In-memory lookups over the open receivables of a business: by remaining
+    balance (cents), by client, by document tokens (CxC número, sale número,
+    NCF) and clients by RNC/cédula digits and by name. reserve() lowers the
+    remaining balances as credits are applied during a run.
+    """
+
+    def __init__(self, name_min_length=8):
+        self.name_min_length = name_min_length
+        self._saldos = {}
+        self._amounts = defaultdict(list)
+        self._clients = defaultdict(list)
+        self._tokens = defaultdict(list)
+        self._documents = {}
+        self._names = defaultdict(list)
+        self._seen_clients = set()
+
+    def add(self, cxc):
+        self._saldos[cxc.pk] = _cents(cxc.saldo_pendiente)
+        self._amounts[self._saldos[cxc.pk]].append(cxc)
+        self._clients[cxc.cliente_id].append(cxc)
+        tokens = {_token(cxc.numero)}
+        if cxc.venta_id:
+            tokens |= {_token(cxc.venta.numero), _token(cxc.venta.ncf)}
+        for token in tokens:
+            if _usable_token(token):
+                self._tokens[token].append(cxc)
+
+        cliente = cxc.cliente
+        if cliente.pk not in self._seen_clients:
+            self._seen_clients.add(cliente.pk)
+            documento = _digits(cliente.numero_documento)
+            if len(documento) >= 9:
+                self._documents[documento] = cliente.pk
+            nombre = normalize_text(cliente.nombre)
+            if len(nombre) >= self.name_min_length:
+                self._names[nombre.split()[0]].append((f' {nombre} ', cliente.pk))
+
+    def saldo(self, cxc):
+        return self._saldos[cxc.pk]
+
+    def reserve(self, asignaciones):
+        for cxc, monto in asignaciones:
+            self._saldos[cxc.pk] -= _cents(monto)
+
+    def _open(self, cuentas):
+        return [c for c in cuentas if self._saldos[c.pk] > 0]
+
+    def by_amount(self, cents):
+        # Keyed by the loaded balance: partially applied invoices are re-checked
+        return [c for c in self._amounts.get(cents, ()) if self._saldos[c.pk] == cents]
+
+    def of_client(self, cliente_id):
+        return self._open(self._clients.get(cliente_id, ()))
+
+    def by_tokens(self, texto):
+        encontradas = {}
+        for palabra in re.findall(r'[A-Za-z0-9][A-Za-z0-9-]{3,}', texto or ''):
+            for cxc in self._tokens.get(_token(palabra), ()):
+                encontradas[cxc.pk] = cxc
+        return self._open(encontradas.values())
+
+    def identify_client(self, texto):
+        """(cliente_id, by_document) for the client quoted in the text, or (None, False)."""
+        # RNC/cédula may be written with dashes: 1-01-12345-6
+        compacto = re.sub(r'(?<=\d)-(?=\d)', '', texto or '')
+        for numero in re.findall(r'(?<!\d)\d{9,11}(?!\d)', compacto):
+            if numero in self._documents:
+                return self._documents[numero], True
+
+        normalizado = f' {normalize_text(texto)} '
+        encontrados = {
+            cliente_id
+            for palabra in set(normalizado.split())
+            for nombre, cliente_id in self._names.get(palabra, ())
+            if nombre in normalizado
+        }
+        if len(encontrados) == 1:
+            return encontrados.pop(), False
+        return None, False
@@ -5,6 +5,7 @@ Uses pybreaker to protect against cascading failures.
 import pybreaker
 import logging
 import time
+from datetime import datetime, timedelta, timezone
 
 logger = logging.getLogger('api.circuit_breakers')
 
@@ -63,6 +64,15 @@ external_api_breaker = pybreaker.CircuitBreaker(
 )
 
 
+# Redis stream of the async audit log (falls back to direct DB writes)
+audit_stream_breaker = pybreaker.CircuitBreaker(
+    fail_max=3,
+    reset_timeout=30,
+    name='Audit_Stream',
+    listeners=[_listener],
+)
+
+
 # =============================================================================
 # REGISTRY
 # =============================================================================
@@ -71,6 +81,7 @@ BREAKERS = {
     'dgii': dgii_breaker,
     'claude': claude_breaker,
     'external': external_api_breaker,
+    'audit_stream': audit_stream_breaker,
 }
 
 
@@ -88,6 +99,22 @@ def get_all_status():
     return result
 
 
+def reset_timeout_elapsed(cb):
+    """
+    True if an open breaker would let the next call through as a half-open probe.
+
+    pybreaker only leaves the "open" state when a call is attempted, so
+    current_state keeps reporting "open" after reset_timeout; callers that skip
+    work while open use this to know when to send the probe.
+    """
+    opened_at = cb._state_storage.opened_at
+    if opened_at is None:
+        return True
+    # pybreaker stores opened_at as naive UTC
+    ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+    return ahora >= opened_at + timedelta(seconds=cb.reset_timeout)
+
+
 def reset_breaker(name):
     """Manually reset a circuit breaker."""
     cb = BREAKERS.get(name)
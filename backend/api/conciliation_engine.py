@@ -4,9 +4,15 @@ Auto-matches imported bank transactions against internal MovimientoBancario reco
 using multiple matching strategies with confidence scoring.
 """
 import logging
-from decimal import Decimal
+import math
+import re
+import unicodedata
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+from decimal import Decimal, ROUND_FLOOR
 from datetime import timedelta
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import F, Q, Sum
 from django.utils import timezone
 
 logger = logging.getLogger('api.conciliation')
@@ -17,64 +23,425 @@ class ConciliationEngine:
     Auto-match imported bank transactions (TransaccionBancaria) against
     internal records (MovimientoBancario).
 
-    Matching rules (in priority order):
+    Matching rules (each scores a transaction/movement pair):
     1. Exact match — same amount, date, and reference
     2. Reference match — same reference, amount within tolerance
     3. Close amount — same date range, amount within tolerance
-    4. AI match — description similarity (placeholder for Claude integration)
+    4. Description match — TF-IDF cosine similarity within amount/date window
+
+    Pairs are not picked per transaction: every candidate pair of the import
+    goes into a sparse score matrix and a global one-to-one assignment
+    (see solve_assignment) decides, so two transactions never claim the same
+    movement and an early weak match cannot take a later exact one.
+
+    Before the rules above, learned rules (ReglaConciliacion, built from the
+    matches confirmed by hand) are looked up by (account, description
+    pattern) in a dict; a hit skips the rule scoring for that transaction.
     """
 
     TOLERANCE_AMOUNT = Decimal('0.01')  # Amount tolerance for fuzzy matches
     TOLERANCE_DAYS = 3  # Date tolerance in days
+    MIN_CONFIDENCE = Decimal('0.70')  # Below this a pair is not suggested
+    AUTO_CONFIDENCE = Decimal('0.95')  # From this on the pair is reconciled
+    BATCH_SIZE = 1000  # Rows per bulk_update / iterator chunk
+    HUNGARIAN_MAX_CELLS = 40_000  # Larger components use the greedy bound
+    RULE_CONFIDENCE = Decimal('0.97')  # Learned rule hit (auto-reconciles)
+    RULE_MIN_CONFIRMATIONS = 2  # Manual confirmations before a rule applies
+    RULE_AMOUNT_MARGIN = Decimal('0.10')  # Relative slack around the learned amount range
 
     def auto_match(self, importacion):
         """
         Run auto-matching on all pending transactions for an import file.
+
+        The unreconciled movements of the import window are loaded once and
+        indexed in memory (see CandidateIndex), every candidate pair is scored
+        and the one-to-one assignment is written back with bulk_update in a
+        single transaction. Movements reconciled by someone else meanwhile are
+        locked out and their pairs dropped.
         Returns dict with match statistics.
         """
-        from api.models import TransaccionBancaria, MovimientoBancario
+        from api.models import TransaccionBancaria, MovimientoBancario, ReglaConciliacion
 
-        transacciones = TransaccionBancaria.objects.filter(
+        transacciones = list(TransaccionBancaria.objects.filter(
             importacion=importacion,
             estado='PENDIENTE',
-        )
-
-        stats = {'total': transacciones.count(), 'matched': 0, 'unmatched': 0}
-
-        for txn in transacciones:
-            movimientos = MovimientoBancario.objects.filter(
-                cuenta=txn.cuenta_bancaria,
-                conciliado=False,
-            )
-
-            match, confidence = self._find_best_match(txn, movimientos)
-
-            if match and confidence >= Decimal('0.70'):
+        ))
+
+        stats = {'total': len(transacciones), 'matched': 0, 'unmatched': 0, 'rule_matched': 0}
+        indexes = self._load_candidates(transacciones)
+        scores, movimientos, reglas = self.rule_candidates(transacciones, indexes)
+        fuzzy, fuzzy_movs = self.score_candidates(transacciones, indexes, skip=scores.keys())
+        scores.update(fuzzy)
+        movimientos.update(fuzzy_movs)
+        asignacion = solve_assignment(scores, self.HUNGARIAN_MAX_CELLS)
+
+        with transaction.atomic():
+            vigentes = set(
+                MovimientoBancario.objects.select_for_update()
+                .filter(id__in=sorted(asignacion.values()), conciliado=False)
+                .order_by('id').values_list('id', flat=True)
+            ) if asignacion else set()
+
+            txns_update = []
+            movs_update = []
+            reglas_update = {}
+            ahora = timezone.now()
+            for row, txn in enumerate(transacciones):
+                mov_id = asignacion.get(row)
+                if mov_id not in vigentes:
+                    stats['unmatched'] += 1
+                    continue
+                match = movimientos[mov_id]
+                confidence = scores[row][mov_id]
                 txn.movimiento_match = match
                 txn.confianza_match = confidence
-                if confidence >= Decimal('0.95'):
+                if confidence >= self.AUTO_CONFIDENCE:
                     txn.estado = 'CONCILIADA'
                     match.conciliado = True
-                    match.save(update_fields=['conciliado'])
-                txn.save(update_fields=['movimiento_match', 'confianza_match', 'estado'])
+                    movs_update.append(match)
+                regla = reglas.get(row)
+                if regla is not None:
+                    regla.aciertos += 1
+                    regla.ultima_aplicacion = ahora
+                    reglas_update[regla.pk] = regla
+                    stats['rule_matched'] += 1
+                txns_update.append(txn)
                 stats['matched'] += 1
-            else:
-                stats['unmatched'] += 1
 
-        # Update import stats
-        importacion.registros_conciliados = stats['matched']
-        importacion.save(update_fields=['registros_conciliados'])
+            if movs_update:
+                MovimientoBancario.objects.bulk_update(movs_update, ['conciliado'], batch_size=self.BATCH_SIZE)
+            if txns_update:
+                TransaccionBancaria.objects.bulk_update(
+                    txns_update, ['movimiento_match', 'confianza_match', 'estado'],
+                    batch_size=self.BATCH_SIZE,
+                )
+            if reglas_update:
+                ReglaConciliacion.objects.bulk_update(
+                    list(reglas_update.values()), ['aciertos', 'ultima_aplicacion'],
+                )
+            # Update import stats
+            importacion.registros_conciliados = stats['matched']
+            importacion.save(update_fields=['registros_conciliados'])
 
         logger.info(
-            'Auto-match for import %s: %d/%d matched',
-            importacion.id, stats['matched'], stats['total'],
+            'Auto-match for import %s: %d/%d matched (%d by learned rules)',
+            importacion.id, stats['matched'], stats['total'], stats['rule_matched'],
         )
         return stats
 
-    def confirm_match(self, transaccion, usuario):
-        """Manually confirm a suggested match."""
+    def score_candidates(self, transacciones, indexes, skip=()):
+        """
+        Build the sparse score matrix of an import.
+
+        Returns ({row: {mov_id: confidence}}, {mov_id: movimiento}) where row is
+        the position of the transaction in ``transacciones``. Only pairs at or
+        above MIN_CONFIDENCE are kept; rows in ``skip`` (already resolved by a
+        learned rule) are not scored.
+        """
+        scores = {}
+        movimientos = {}
+        for row, txn in enumerate(transacciones):
+            index = indexes.get(txn.cuenta_bancaria_id)
+            if index is None or row in skip:
+                continue
+            fila = {}
+            for mov, confidence in self._score_pairs(txn, index):
+                if confidence >= self.MIN_CONFIDENCE and confidence > fila.get(mov.pk, 0):
+                    fila[mov.pk] = confidence
+                    movimientos[mov.pk] = mov
+            if fila:
+                scores[row] = fila
+        return scores, movimientos
+
+    def rule_candidates(self, transacciones, indexes):
+        """
+        Apply the learned rules of the import's accounts.
+
+        Rules are loaded once into {(cuenta_id, patron): regla}, so each
+        transaction costs one dict lookup. A hit needs the amount inside the
+        learned range (plus RULE_AMOUNT_MARGIN) and exactly one candidate in the
+        date window with the learned movement pattern and, when the rule knows
+        it, the learned counterpart account.
+        Returns ({row: {mov_id: RULE_CONFIDENCE}}, {mov_id: movimiento}, {row: regla}).
+        """
+        from api.models import LineaAsiento, ReglaConciliacion
+
+        scores, movimientos, aplicadas = {}, {}, {}
+        if not transacciones:
+            return scores, movimientos, aplicadas
+
+        reglas = {
+            (r.cuenta_bancaria_id, r.patron): r
+            for r in ReglaConciliacion.objects.filter(
+                cuenta_bancaria_id__in={t.cuenta_bancaria_id for t in transacciones},
+                activa=True,
+                confirmaciones__gte=self.RULE_MIN_CONFIRMATIONS,
+            )
+        }
+        if not reglas:
+            return scores, movimientos, aplicadas
+
+        hits = []
+        for row, txn in enumerate(transacciones):
+            regla = reglas.get((txn.cuenta_bancaria_id, description_pattern(txn.descripcion)))
+            index = indexes.get(txn.cuenta_bancaria_id)
+            if regla is None or index is None:
+                continue
+            margen = max(abs(regla.monto_min), abs(regla.monto_max)) * self.RULE_AMOUNT_MARGIN
+            if not regla.monto_min - margen <= txn.monto <= regla.monto_max + margen:
+                continue
+            candidatos = [
+                mov for mov in index.window(
+                    txn.monto,
+                    txn.fecha - timedelta(days=self.TOLERANCE_DAYS),
+                    txn.fecha + timedelta(days=self.TOLERANCE_DAYS),
+                )
+                if index.pattern(mov) == regla.patron_movimiento
+            ]
+            if candidatos:
+                hits.append((row, regla, candidatos))
+
+        # Counterpart accounts of the hit candidates, in one query
+        asientos = {
+            mov.asiento_contable_id
+            for _, regla, candidatos in hits if regla.cuenta_contrapartida_id
+            for mov in candidatos if mov.asiento_contable_id
+        }
+        contrapartidas = defaultdict(set)
+        if asientos:
+            for asiento_id, cuenta_id in LineaAsiento.objects.filter(
+                asiento_id__in=asientos,
+            ).values_list('asiento_id', 'cuenta_id'):
+                contrapartidas[asiento_id].add(cuenta_id)
+
+        for row, regla, candidatos in hits:
+            if regla.cuenta_contrapartida_id:
+                candidatos = [
+                    mov for mov in candidatos
+                    if not mov.asiento_contable_id
+                    or regla.cuenta_contrapartida_id in contrapartidas[mov.asiento_contable_id]
+                ]
+            if len(candidatos) == 1:
+                mov = candidatos[0]
+                scores[row] = {mov.pk: self.RULE_CONFIDENCE}
+                movimientos[mov.pk] = mov
+                aplicadas[row] = regla
+        return scores, movimientos, aplicadas
+
+    def learn_rule(self, transaccion, mov):
+        """
+        Learn (or reinforce) the rule behind a manually confirmed match.
+        Returns the ReglaConciliacion, or None when the bank description has
+        nothing to learn from (only prefixes/numbers).
+        """
+        from api.models import ReglaConciliacion
+
+        patron = description_pattern(transaccion.descripcion)
+        if not patron:
+            return None
+        patron_movimiento = description_pattern(mov.descripcion)
+        contrapartida = self._counterpart(transaccion.cuenta_bancaria, mov)
+
+        regla, creada = ReglaConciliacion.objects.select_for_update().get_or_create(
+            cuenta_bancaria_id=transaccion.cuenta_bancaria_id,
+            patron=patron,
+            defaults={
+                'negocio_id': transaccion.negocio_id,
+                'patron_movimiento': patron_movimiento,
+                'monto_min': transaccion.monto,
+                'monto_max': transaccion.monto,
+                'cuenta_contrapartida_id': contrapartida,
+            },
+        )
+        if creada:
+            return regla
+
+        if regla.patron_movimiento != patron_movimiento:
+            # The same bank line now goes elsewhere: start learning again
+            regla.patron_movimiento = patron_movimiento
+            regla.monto_min = regla.monto_max = transaccion.monto
+            regla.confirmaciones = 1
+        else:
+            regla.monto_min = min(regla.monto_min, transaccion.monto)
+            regla.monto_max = max(regla.monto_max, transaccion.monto)
+            regla.confirmaciones += 1
+        regla.cuenta_contrapartida_id = contrapartida or regla.cuenta_contrapartida_id
+        regla.activa = True
+        regla.save(update_fields=[
+            'patron_movimiento', 'monto_min', 'monto_max', 'confirmaciones',
+            'cuenta_contrapartida', 'activa',
+        ])
+        return regla
+
+    def _counterpart(self, cuenta, mov):
+        """Largest non-bank line account of the movement's journal entry, if any."""
+        from api.models import LineaAsiento
+
+        if not mov.asiento_contable_id:
+            return None
+        lineas = LineaAsiento.objects.filter(asiento_id=mov.asiento_contable_id)
+        if cuenta.cuenta_contable_id:
+            lineas = lineas.exclude(cuenta_id=cuenta.cuenta_contable_id)
+        linea = lineas.annotate(importe=F('debe') + F('haber')).order_by('-importe').first()
+        return linea.cuenta_id if linea else None
+
+    def _load_candidates(self, transacciones):
+        """
+        Load the unreconciled movements that any strategy could pick for these
+        transactions in a single query: the widest date window used by the
+        strategies plus any movement sharing a reference (rule 2 has no date
+        limit). Returns {cuenta_id: CandidateIndex}.
+        """
         from api.models import MovimientoBancario
 
+        if not transacciones:
+            return {}
+
+        margen = timedelta(days=self.TOLERANCE_DAYS * 2)
+        fecha_min = min(t.fecha for t in transacciones) - margen
+        fecha_max = max(t.fecha for t in transacciones) + margen
+        referencias = {t.referencia for t in transacciones if t.referencia}
+
+        ventana = Q(fecha__gte=fecha_min, fecha__lte=fecha_max)
+        if referencias:
+            ventana |= Q(referencia__in=referencias)
+
+        movimientos = MovimientoBancario.objects.filter(
+            ventana,
+            cuenta_id__in={t.cuenta_bancaria_id for t in transacciones},
+            conciliado=False,
+        )
+
+        indexes = {}
+        for mov in movimientos.iterator(chunk_size=self.BATCH_SIZE):
+            index = indexes.get(mov.cuenta_id)
+            if index is None:
+                index = indexes[mov.cuenta_id] = CandidateIndex(self.TOLERANCE_AMOUNT)
+            index.add(mov)
+        for index in indexes.values():
+            index.freeze()
+        return indexes
+
+    def match_ledger(self, cuenta, fecha_desde, fecha_hasta, dias=None):
+        """
+        Reconcile the account's unreconciled MovimientoBancario in
+        [fecha_desde, fecha_hasta] against posted AsientoContable.
+
+        The amount compared is the entry's net effect on the bank's ledger
+        account (sum of debe - haber of its lines on cuenta.cuenta_contable):
+        a deposit (CREDITO) matches +monto, a withdrawal (DEBITO) -monto, so
+        multi-line entries match on their bank leg. Without a ledger account
+        the entry total (total_debe) is compared with the absolute amount.
+
+        One query loads every free entry of the widened window with its net
+        already aggregated; movements and entries are joined in memory on
+        (amount, date ± dias), conflicts (several movements for one entry) go
+        through solve_assignment preferring the closest date and a matching
+        reference, and the result is written with one bulk_update while the
+        movements and the chosen entries are locked (entries another run linked
+        in the meantime are left out). Returns {'conciliados': n, 'pendientes': m}.
+        """
+        from api.models import AsientoContable, MovimientoBancario
+
+        dias = self.TOLERANCE_DAYS if dias is None else dias
+        margen = timedelta(days=dias)
+
+        with transaction.atomic():
+            movimientos = list(
+                MovimientoBancario.objects.select_for_update().filter(
+                    cuenta=cuenta,
+                    fecha__gte=fecha_desde,
+                    fecha__lte=fecha_hasta,
+                    conciliado=False,
+                ).order_by('fecha', 'creado_en')
+            )
+
+            # Free entries are read under the movement lock, so a concurrent run on
+            # this account sees what the previous one linked
+            asientos = AsientoContable.objects.filter(
+                negocio_id=cuenta.negocio_id,
+                estado='CONTABILIZADO',
+                fecha__gte=fecha_desde - margen,
+                fecha__lte=fecha_hasta + margen,
+            ).exclude(
+                id__in=MovimientoBancario.objects.filter(
+                    cuenta__negocio_id=cuenta.negocio_id,
+                    asiento_contable__isnull=False,
+                ).values('asiento_contable'),
+            )
+            if cuenta.cuenta_contable_id:
+                filas = asientos.annotate(
+                    neto=Sum(
+                        F('lineas__debe') - F('lineas__haber'),
+                        filter=Q(lineas__cuenta_id=cuenta.cuenta_contable_id),
+                    ),
+                ).exclude(neto__isnull=True).exclude(neto=0).values_list('id', 'fecha', 'referencia', 'neto')
+            else:
+                filas = asientos.values_list('id', 'fecha', 'referencia', 'total_debe')
+
+            # (amount key) -> entries sorted by date
+            por_monto = defaultdict(list)
+            for fila in filas:
+                por_monto[fila[3]].append(fila)
+            fechas = {}
+            for monto, entradas in por_monto.items():
+                entradas.sort(key=lambda f: (f[1], str(f[0])))
+                fechas[monto] = [f[1] for f in entradas]
+
+            scores = {}
+            for row, mov in enumerate(movimientos):
+                monto = abs(mov.monto)
+                if cuenta.cuenta_contable_id and mov.tipo == 'DEBITO':
+                    monto = -monto
+                entradas = por_monto.get(monto)
+                if not entradas:
+                    continue
+                lo = bisect_left(fechas[monto], mov.fecha - margen)
+                hi = bisect_right(fechas[monto], mov.fecha + margen)
+                fila = {}
+                for asiento_id, fecha, referencia, _ in entradas[lo:hi]:
+                    # 0.90 same day down to 0.50 at the window edge, +0.10 same reference
+                    cercania = Decimal(dias + 1 - abs((fecha - mov.fecha).days)) / (dias + 1)
+                    score = Decimal('0.50') + Decimal('0.40') * cercania
+                    if mov.referencia and referencia == mov.referencia:
+                        score += Decimal('0.10')
+                    fila[asiento_id] = score
+                if fila:
+                    scores[row] = fila
+
+            asignacion = solve_assignment(scores, self.HUNGARIAN_MAX_CELLS)
+            if asignacion:
+                # Runs on other accounts (or on total_debe) may pick the same entry:
+                # lock the chosen entries and drop the ones linked meanwhile
+                elegidos = set(asignacion.values())
+                list(
+                    AsientoContable.objects.select_for_update()
+                    .filter(id__in=elegidos).order_by('id').values_list('id', flat=True)
+                )
+                tomados = set(
+                    MovimientoBancario.objects.filter(asiento_contable_id__in=elegidos)
+                    .values_list('asiento_contable_id', flat=True)
+                )
+                asignacion = {row: a for row, a in asignacion.items() if a not in tomados}
+            conciliados = []
+            for row, asiento_id in asignacion.items():
+                mov = movimientos[row]
+                mov.conciliado = True
+                mov.asiento_contable_id = asiento_id
+                conciliados.append(mov)
+            MovimientoBancario.objects.bulk_update(
+                conciliados, ['conciliado', 'asiento_contable'], batch_size=self.BATCH_SIZE,
+            )
+
+        logger.info(
+            'Ledger match for account %s (%s..%s): %d/%d reconciled',
+            cuenta.id, fecha_desde, fecha_hasta, len(conciliados), len(movimientos),
+        )
+        return {'conciliados': len(conciliados), 'pendientes': len(movimientos) - len(conciliados)}
+
+    @transaction.atomic
+    def confirm_match(self, transaccion, usuario):
+        """Manually confirm a suggested match and learn a rule from it."""
         if transaccion.movimiento_match is None:
             raise ValueError('No match to confirm')
 
@@ -88,12 +455,25 @@ class ConciliationEngine:
         mov = transaccion.movimiento_match
         mov.conciliado = True
         mov.save(update_fields=['conciliado'])
+        self.learn_rule(transaccion, mov)
 
         logger.info('Manually confirmed match txn %s <-> mov %s',
                      transaccion.id, mov.id)
 
     def reject_match(self, transaccion):
-        """Reject a suggested match and reset to pending."""
+        """
+        Reject a suggested match and reset to pending. A learned rule that
+        would produce this same pair is deactivated until confirmed again.
+        """
+        from api.models import ReglaConciliacion
+
+        if transaccion.movimiento_match is not None:
+            ReglaConciliacion.objects.filter(
+                cuenta_bancaria_id=transaccion.cuenta_bancaria_id,
+                patron=description_pattern(transaccion.descripcion),
+                patron_movimiento=description_pattern(transaccion.movimiento_match.descripcion),
+            ).update(activa=False)
+
         transaccion.movimiento_match = None
         transaccion.confianza_match = Decimal('0')
         transaccion.estado = 'PENDIENTE'
@@ -112,116 +492,360 @@ class ConciliationEngine:
     # Matching strategies
     # -------------------------------------------------------------------------
 
-    def _find_best_match(self, txn, movimientos):
-        """
-        Try all matching strategies in priority order.
-        Returns (MovimientoBancario, confidence) or (None, 0).
-        """
-        # Strategy 1: Exact match
-        match = self._exact_match(txn, movimientos)
-        if match:
-            return match, Decimal('1.00')
-
-        # Strategy 2: Reference match
-        match, conf = self._reference_match(txn, movimientos)
-        if match:
-            return match, conf
-
-        # Strategy 3: Close amount match
-        match, conf = self._close_amount_match(txn, movimientos)
-        if match:
-            return match, conf
+    def _score_pairs(self, txn, index):
+        """Yield (MovimientoBancario, confidence) for every rule that applies."""
+        yield from self._exact_match(txn, index)
+        yield from self._reference_match(txn, index)
+        yield from self._close_amount_match(txn, index)
+        yield from self._description_match(txn, index)
 
-        # Strategy 4: AI/description similarity (basic implementation)
-        match, conf = self._description_match(txn, movimientos)
-        if match:
-            return match, conf
-
-        return None, Decimal('0')
-
-    def _exact_match(self, txn, movimientos):
+    def _exact_match(self, txn, index):
         """Rule 1: Exact amount + date + reference."""
         if not txn.referencia:
-            return None
+            return []
 
-        result = movimientos.filter(
-            monto=txn.monto,
-            fecha=txn.fecha,
-            referencia=txn.referencia,
-        ).first()
-        return result
+        return [
+            (mov, Decimal('1.00'))
+            for mov in index.by_amount_date(txn.monto, txn.fecha)
+            if mov.referencia == txn.referencia
+        ]
 
-    def _reference_match(self, txn, movimientos):
-        """Rule 2: Same reference, amount within tolerance."""
+    def _reference_match(self, txn, index):
+        """Rule 2: Same reference, amount within tolerance (only if unambiguous)."""
         if not txn.referencia:
-            return None, Decimal('0')
+            return []
 
-        results = movimientos.filter(
-            referencia=txn.referencia,
-            monto__gte=txn.monto - self.TOLERANCE_AMOUNT,
-            monto__lte=txn.monto + self.TOLERANCE_AMOUNT,
-        )
+        results = [
+            mov for mov in index.by_reference(txn.referencia)
+            if abs(mov.monto - txn.monto) <= self.TOLERANCE_AMOUNT
+        ]
 
-        if results.count() == 1:
-            mov = results.first()
+        if len(results) == 1:
+            mov = results[0]
             # Higher confidence if date is also close
             if abs((mov.fecha - txn.fecha).days) <= self.TOLERANCE_DAYS:
-                return mov, Decimal('0.95')
-            return mov, Decimal('0.85')
+                return [(mov, Decimal('0.95'))]
+            return [(mov, Decimal('0.85'))]
 
-        return None, Decimal('0')
+        return []
 
-    def _close_amount_match(self, txn, movimientos):
-        """Rule 3: Same date range, exact amount."""
+    def _close_amount_match(self, txn, index):
+        """Rule 3: Same date range, exact amount (only if unambiguous)."""
         fecha_min = txn.fecha - timedelta(days=self.TOLERANCE_DAYS)
         fecha_max = txn.fecha + timedelta(days=self.TOLERANCE_DAYS)
 
-        results = movimientos.filter(
-            monto=txn.monto,
-            fecha__gte=fecha_min,
-            fecha__lte=fecha_max,
-        )
-
-        if results.count() == 1:
-            return results.first(), Decimal('0.80')
+        results = [
+            mov for mov in index.window(txn.monto, fecha_min, fecha_max)
+            if mov.monto == txn.monto
+        ]
 
-        return None, Decimal('0')
+        if len(results) == 1:
+            return [(results[0], Decimal('0.80'))]
 
-    def _description_match(self, txn, movimientos):
-        """Rule 4: Description similarity (basic keyword matching)."""
-        if not txn.descripcion:
-            return None, Decimal('0')
+        return []
 
-        # Extract meaningful words from the transaction description
-        words = [w.lower() for w in txn.descripcion.split() if len(w) > 3]
-        if not words:
-            return None, Decimal('0')
+    def _description_match(self, txn, index):
+        """
+        Rule 4: Description similarity — cosine of TF-IDF vectors built over
+        the account's candidate movements (see DescriptionVectorizer), so rare
+        tokens (a customer name, an invoice number) weigh more than "PAGO".
+        """
+        vector = index.vectorizer.transform(txn.descripcion)
+        if not vector:
+            return []
 
         fecha_min = txn.fecha - timedelta(days=self.TOLERANCE_DAYS * 2)
         fecha_max = txn.fecha + timedelta(days=self.TOLERANCE_DAYS * 2)
 
         # Filter by amount and date range
-        candidates = movimientos.filter(
-            monto__gte=txn.monto - self.TOLERANCE_AMOUNT,
-            monto__lte=txn.monto + self.TOLERANCE_AMOUNT,
-            fecha__gte=fecha_min,
-            fecha__lte=fecha_max,
-        )
+        pairs = []
+        for mov in index.window(txn.monto, fecha_min, fecha_max):
+            score = cosine(vector, index.vector(mov))
+            if score >= 0.5:
+                pairs.append((mov, Decimal(str(min(0.75, 0.5 + score * 0.25))).quantize(Decimal('0.01'))))
 
-        best_match = None
-        best_score = 0
+        return pairs
 
-        for mov in candidates:
-            desc_lower = (mov.descripcion or '').lower()
-            matches = sum(1 for w in words if w in desc_lower)
-            score = matches / len(words) if words else 0
 
-            if score > best_score:
-                best_score = score
-                best_match = mov
+def solve_assignment(scores, hungarian_max_cells=40_000):
+    """
+    One-to-one assignment maximizing the total score of a sparse matrix
+    {row: {col: score}}. Returns {row: col}.
+
+    The bipartite graph is split into connected components; each component is
+    solved exactly with the Hungarian algorithm when rows x cols fits in
+    ``hungarian_max_cells`` and with the greedy max-weight bound (at least half
+    of the optimum) otherwise. Bank statements produce many small components,
+    so the exact solver covers almost every pair.
+    """
+    asignacion = {}
+    for rows, cols in _components(scores):
+        if len(rows) * len(cols) <= hungarian_max_cells:
+            asignacion.update(_hungarian(scores, rows, cols))
+        else:
+            asignacion.update(_greedy(scores, rows))
+    return asignacion
+
+
+def _components(scores):
+    """Connected components of the bipartite graph, rows and cols in input order."""
+    parent = {}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for row, fila in scores.items():
+        parent.setdefault(('r', row), ('r', row))
+        for col in fila:
+            parent.setdefault(('c', col), ('c', col))
+            a, b = find(('r', row)), find(('c', col))
+            if a != b:
+                parent[b] = a
+
+    grupos = {}
+    for row, fila in scores.items():
+        rows, cols = grupos.setdefault(find(('r', row)), ([], {}))
+        rows.append(row)
+        for col in fila:
+            cols.setdefault(col, None)
+    return [(rows, list(cols)) for rows, cols in grupos.values()]
+
+
+def _greedy(scores, rows):
+    """Take pairs by descending score while both ends are free."""
+    edges = sorted(
+        ((score, i, row, col) for i, row in enumerate(rows) for col, score in scores[row].items()),
+        key=lambda e: (-e[0], e[1]),
+    )
+    asignacion = {}
+    usados = set()
+    for _, _, row, col in edges:
+        if row not in asignacion and col not in usados:
+            asignacion[row] = col
+            usados.add(col)
+    return asignacion
+
+
+def _hungarian(scores, rows, cols):
+    """
+    Exact maximum-weight assignment of one component (Kuhn-Munkres with
+    potentials, O(n^2 m)). Missing pairs weigh 0, i.e. "leave unmatched".
+    """
+    transpuesta = len(rows) > len(cols)
+    if transpuesta:
+        rows, cols = cols, rows
+
+    def peso(r, c):
+        fila, col = (c, r) if transpuesta else (r, c)
+        return scores[fila].get(col, 0)
+
+    # Integer costs (hundredths) keep the potentials exact
+    cost = [[-int(peso(r, c) * 100) for c in cols] for r in rows]
+    n, m = len(rows), len(cols)
+    u = [0] * (n + 1)
+    v = [0] * (m + 1)
+    p = [0] * (m + 1)
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [float('inf')] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            fila = cost[i0 - 1]
+            delta = float('inf')
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = fila[j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while True:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+
+    asignacion = {}
+    for j in range(1, m + 1):
+        if p[j] and cost[p[j] - 1][j - 1] < 0:
+            r, c = rows[p[j] - 1], cols[j - 1]
+            if transpuesta:
+                r, c = c, r
+            asignacion[r] = c
+    return asignacion
+
+
+# Leading tokens banks prepend to the concept ("TRANSF", "DEP", "POS"...).
+# They say how the money moved, not who moved it.
+BANK_PREFIXES = frozenset({
+    'ach', 'avance', 'cargo', 'cheque', 'chk', 'chq', 'cr', 'credito', 'db', 'debito',
+    'dep', 'deposito', 'ib', 'lbtr', 'nc', 'nd', 'pag', 'pago', 'pos', 'ret', 'retiro',
+    'tb', 'tef', 'trans', 'transf', 'transferencia', 'trf', 'web',
+})
+STOPWORDS = frozenset({'a', 'al', 'de', 'del', 'el', 'en', 'la', 'las', 'los', 'por', 'para', 'y'})
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def tokenize_description(text):
+    """
+    Lowercase, strip accents and punctuation, drop the leading bank prefixes
+    and stopwords: 'TRANSF. ACH Pago Farmacia Núñez' -> ['farmacia', 'nunez'].
+    """
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    tokens = [t for t in _NON_WORD.split(text) if t]
+    i = 0
+    while i < len(tokens) and tokens[i] in BANK_PREFIXES:
+        i += 1
+    return [t for t in tokens[i:] if len(t) > 1 and t not in STOPWORDS]
+
+
+def description_pattern(text):
+    """
+    Key of a recurring description: its tokens with every number masked,
+    'COMISION MANEJO CTA 03/2025' -> 'comision manejo cta #'. Empty when no
+    word is left (a bare reference number says nothing about recurrence).
+    """
+    pattern = []
+    for token in tokenize_description(text):
+        token = '#' if any(c.isdigit() for c in token) else token
+        if not (token == '#' and pattern and pattern[-1] == '#'):
+            pattern.append(token)
+    if all(token == '#' for token in pattern):
+        return ''
+    return ' '.join(pattern)[:300]
 
-        if best_match and best_score >= 0.5:
-            confidence = Decimal(str(min(0.75, 0.5 + best_score * 0.25)))
-            return best_match, confidence
 
-        return None, Decimal('0')
+def cosine(a, b):
+    """Dot product of two L2-normalized sparse vectors ({term: weight})."""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(w * b.get(t, 0.0) for t, w in a.items())
+
+
+class DescriptionVectorizer:
+    """
+    TF-IDF over the descriptions of one account's candidate movements.
+
+    Vectors are sparse dicts, L2-normalized, with sublinear tf (1 + log tf)
+    and smoothed idf (log((1 + N) / (1 + df)) + 1). Bank statements carry a
+    few words per line, so dict dot products over the window candidates are
+    cheaper than materializing a matrix.
+    """
+
+    def __init__(self, documents):
+        documents = [tokenize_description(d) for d in documents]
+        df = Counter(t for tokens in documents for t in set(tokens))
+        n = len(documents)
+        self.idf = {t: math.log((1 + n) / (1 + c)) + 1 for t, c in df.items()}
+
+    def transform(self, text):
+        counts = Counter(t for t in tokenize_description(text) if t in self.idf)
+        vector = {t: (1 + math.log(c)) * self.idf[t] for t, c in counts.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        return {t: w / norm for t, w in vector.items()} if norm else {}
+
+
+class CandidateIndex:
+    """
+    In-memory indexes over the unreconciled movements of one bank account.
+
+    - (monto, fecha) hash for exact matches.
+    - referencia hash for reference matches.
+    - Amount buckets of TOLERANCE_AMOUNT width, each with a date-sorted list,
+      so "amount ± tolerance within N days" is two bisects over at most three
+      buckets instead of a scan.
+    - TF-IDF description vectors fitted on these movements.
+
+    Lookups return movements in query order (-fecha, -creado_en).
+    """
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self._orden = {}
+        self._amount_date = defaultdict(list)
+        self._reference = defaultdict(list)
+        self._buckets = defaultdict(list)
+        self._bucket_dates = {}
+        self._movs = []
+        self._vectors = {}
+        self._patterns = {}
+        self.vectorizer = None
+
+    def _bucket(self, monto):
+        return int((monto / self.tolerance).to_integral_value(rounding=ROUND_FLOOR))
+
+    def add(self, mov):
+        self._orden[mov.pk] = len(self._orden)
+        self._movs.append(mov)
+        self._amount_date[(mov.monto, mov.fecha)].append(mov)
+        if mov.referencia:
+            self._reference[mov.referencia].append(mov)
+        self._buckets[self._bucket(mov.monto)].append(mov)
+
+    def freeze(self):
+        """Sort the amount buckets by date and fit the vectorizer once all movements are loaded."""
+        for key, movs in self._buckets.items():
+            movs.sort(key=lambda m: (m.fecha, self._orden[m.pk]))
+            self._bucket_dates[key] = [m.fecha for m in movs]
+        self.vectorizer = DescriptionVectorizer(m.descripcion for m in self._movs)
+
+    def vector(self, mov):
+        """TF-IDF vector of a movement's description, computed on first use."""
+        vector = self._vectors.get(mov.pk)
+        if vector is None:
+            vector = self._vectors[mov.pk] = self.vectorizer.transform(mov.descripcion)
+        return vector
+
+    def pattern(self, mov):
+        """description_pattern of a movement, computed on first use."""
+        pattern = self._patterns.get(mov.pk)
+        if pattern is None:
+            pattern = self._patterns[mov.pk] = description_pattern(mov.descripcion)
+        return pattern
+
+    def by_amount_date(self, monto, fecha):
+        return self._amount_date.get((monto, fecha), [])
+
+    def by_reference(self, referencia):
+        return self._reference.get(referencia, [])
+
+    def window(self, monto, fecha_min, fecha_max):
+        """Movements with amount within tolerance and fecha_min <= fecha <= fecha_max."""
+        centro = self._bucket(monto)
+        found = []
+        for key in (centro - 1, centro, centro + 1):
+            fechas = self._bucket_dates.get(key)
+            if not fechas:
+                continue
+            movs = self._buckets[key]
+            lo = bisect_left(fechas, fecha_min)
+            hi = bisect_right(fechas, fecha_max)
+            found.extend(
+                m for m in movs[lo:hi]
+                if abs(m.monto - monto) <= self.tolerance
+            )
+        found.sort(key=lambda m: self._orden[m.pk])
+        return found
@@ -66,3 +66,17 @@ class NotificacionesConsumer(AsyncJsonWebsocketConsumer):
             'type': 'notificacion',
             'data': event.get('data', {}),
         })
+
+    async def ecf_lote(self, event):
+        """Handle batch e-CF emission progress."""
+        await self.send_json({
+            'type': 'ecf_lote',
+            'data': event.get('data', {}),
+        })
+
+    async def ecf_emision(self, event):
+        """Handle single e-CF emission result."""
+        await self.send_json({
+            'type': 'ecf_emision',
+            'data': event.get('data', {}),
+        })
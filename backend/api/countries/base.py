@@ -108,3 +108,8 @@ class CountryConfig(ABC):
     def get_denominations(self) -> List[Dict]:
         """Returns currency denominations for cash drawer."""
         ...
+
+    @property
+    def fiscal_strategy(self) -> str:
+        """Dotted path of the FiscalStrategy for this country (imported lazily)."""
+        return 'api.fiscal.strategies.libro_fiscal.LibroFiscalStrategy'
@@ -82,6 +82,10 @@ class DominicanRepublicConfig(CountryConfig):
     def invoice_format(self) -> str:
         return 'e-CF'
 
+    @property
+    def fiscal_strategy(self) -> str:
+        return 'api.fiscal.strategies.dgii.DGIIDominicanaStrategy'
+
     def get_withholding_types(self) -> List[Dict]:
         return [
             {'codigo': 'ISR', 'nombre': 'Retención ISR', 'tasa': Decimal('10.00')},
@@ -0,0 +1,115 @@
+"""
+Registro de estrategias fiscales por país.
+
+Las estrategias se indexan con los códigos del CountryRegistry ('DO', 'MX', ...)
+y se guardan como rutas 'modulo.Clase'. El módulo de cada estrategia se importa
+la primera vez que se usa, de modo que un worker no carga la maquinaria de
+reportes de todos los países al arrancar. La clase resuelta queda cacheada
+en el proceso.
+"""
+import logging
+import threading
+from typing import Dict, Optional
+
+from django.utils.module_loading import import_string
+
+from ..countries.registry import CountryRegistry
+
+logger = logging.getLogger('api')
+
+# Pais.codigo histórico (ISO alfa-3) -> código del CountryRegistry (alfa-2)
+PAIS_ALIASES = {
+    'DOM': 'DO',
+    'MEX': 'MX',
+    'COL': 'CO',
+    'ARG': 'AR',
+    'USA': 'US',
+}
+
+
+def normalizar_codigo_pais(codigo: str) -> str:
+    codigo = (codigo or '').upper()
+    return PAIS_ALIASES.get(codigo, codigo)
+
+
+class FiscalStrategyRegistry:
+    """Registry pattern para estrategias fiscales, con carga perezosa."""
+    _paths: Dict[str, str] = {}
+    _classes: Dict[str, type] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def register(cls, code: str, path: str):
+        """Registra (o reemplaza) la estrategia de un país por ruta 'modulo.Clase'."""
+        with cls._lock:
+            cls._paths[code] = path
+            cls._classes.pop(code, None)
+
+    @staticmethod
+    def _load_countries():
+        # Los módulos de países solo declaran datos; importarlos es barato.
+        from ..countries import rd, mx, co, ar, us  # noqa: F401
+
+    @classmethod
+    def _country_config(cls, code: str):
+        cls._load_countries()
+        return CountryRegistry.get(code)
+
+    @classmethod
+    def get_path(cls, code: str) -> Optional[str]:
+        if code in cls._paths:
+            return cls._paths[code]
+        config = cls._country_config(code)
+        return config.fiscal_strategy if config else None
+
+    @classmethod
+    def get_class(cls, code: str) -> type:
+        code = normalizar_codigo_pais(code)
+        strategy_cls = cls._classes.get(code)
+        if strategy_cls is not None:
+            return strategy_cls
+
+        path = cls.get_path(code)
+        if not path:
+            raise NotImplementedError(
+                f"Estrategia fiscal no implementada para el país: {code}"
+            )
+        with cls._lock:
+            strategy_cls = cls._classes.get(code)
+            if strategy_cls is None:
+                strategy_cls = import_string(path)
+                cls._classes[code] = strategy_cls
+                logger.debug('Estrategia fiscal %s cargada para %s', path, code)
+        return strategy_cls
+
+    @classmethod
+    def get(cls, negocio):
+        code = normalizar_codigo_pais(negocio.pais_id)
+        strategy_cls = cls.get_class(code)
+        return strategy_cls(negocio, country_config=cls._country_config(code))
+
+    @classmethod
+    def available_codes(cls) -> list:
+        cls._load_countries()
+        codes = CountryRegistry.available_codes()
+        return codes + [c for c in cls._paths if c not in codes]
+
+    @classmethod
+    def loaded_codes(cls) -> list:
+        """Códigos cuya estrategia ya fue importada en este proceso."""
+        return list(cls._classes.keys())
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._lock:
+            for strategy_cls in cls._classes.values():
+                strategy_cls.tablas.cache_clear()
+            cls._classes.clear()
+
+
+class FiscalStrategyFactory:
+    """Factory para obtener la estrategia correcta según el país del negocio."""
+
+    @staticmethod
+    def get_strategy(negocio):
+        return FiscalStrategyRegistry.get(negocio)
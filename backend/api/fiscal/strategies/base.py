@@ -0,0 +1,50 @@
+import functools
+from abc import ABC, abstractmethod
+
+
+class FiscalStrategy(ABC):
+    """
+    Estrategia Base para la generación de reportes fiscales internacionales.
+    Cada país debe implementar esta clase.
+
+    TIPOS_REPORTE mapea el código de reporte (ej: '607') al método que lo genera.
+    Las tablas estáticas de la estrategia se construyen una sola vez por proceso
+    (ver tablas()).
+    """
+
+    TIPOS_REPORTE = {}
+    TIPO_DEFECTO = None
+
+    def __init__(self, negocio, country_config=None):
+        self.negocio = negocio
+        self.country_config = country_config
+
+    @classmethod
+    @functools.cache
+    def tablas(cls):
+        """Tablas estáticas (catálogos, mapeos de códigos), cacheadas por proceso."""
+        return cls._build_tablas()
+
+    @classmethod
+    def _build_tablas(cls):
+        return {}
+
+    def generar_reporte(self, tipo, year, month):
+        metodo = self.TIPOS_REPORTE.get(tipo)
+        if not metodo:
+            raise ValueError(
+                f"Reporte {tipo} no soportado. Disponibles: {', '.join(self.TIPOS_REPORTE)}"
+            )
+        return getattr(self, metodo)(year, month)
+
+    @abstractmethod
+    def generar_reporte_ventas(self, year, month):
+        pass
+
+    @abstractmethod
+    def generar_reporte_compras(self, year, month):
+        pass
+
+    @abstractmethod
+    def exportar_archivo(self, tipo_reporte, year, month):
+        pass
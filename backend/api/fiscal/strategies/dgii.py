@@ -1,30 +1,8 @@
-from abc import ABC, abstractmethod
-from datetime import datetime
 from decimal import Decimal
-from django.db.models import Sum, Q
-from ...models import Venta, Compra, Negocio, Pais
-
-
-class FiscalStrategy(ABC):
-    """
-    Estrategia Base para la generación de reportes fiscales internacionales.
-    Cada país debe implementar esta clase.
-    """
-
-    def __init__(self, negocio):
-        self.negocio = negocio
-
-    @abstractmethod
-    def generar_reporte_ventas(self, year, month):
-        pass
-
-    @abstractmethod
-    def generar_reporte_compras(self, year, month):
-        pass
-
-    @abstractmethod
-    def exportar_archivo(self, tipo_reporte, year, month):
-        pass
+from django.db.models import F, Sum
+from ...models import AnulacionNCF, Venta, Compra
+from ...utils.ncf_manager import formatear_ncf
+from .base import FiscalStrategy
 
 
 class DGIIDominicanaStrategy(FiscalStrategy):
@@ -33,6 +11,35 @@ class DGIIDominicanaStrategy(FiscalStrategy):
     Formatos: 606, 607, 608.
     """
 
+    TIPOS_REPORTE = {
+        '606': 'generar_reporte_compras',
+        '607': 'generar_reporte_ventas',
+        '608': 'generar_reporte_anulaciones',
+    }
+    TIPO_DEFECTO = '607'
+
+    @classmethod
+    def _build_tablas(cls):
+        return {
+            # Forma de pago 606
+            'forma_pago_606': {
+                'EFECTIVO': '01',
+                'CHEQUE': '02',
+                'TRANSFERENCIA': '03',
+                'TARJETA': '04',
+                'CREDITO': '05',
+            },
+            # Columna de forma de pago 607 según tipo_pago de la venta
+            'columna_pago_607': {
+                'EFECTIVO': 'Efectivo',
+                'CHEQUE': 'Cheque_Transferencia',
+                'TRANSFERENCIA': 'Cheque_Transferencia',
+                'TARJETA': 'Tarjeta',
+                'CREDITO': 'Venta_Credito',
+                'MIXTO': 'Otras_Formas_Ventas',
+            },
+        }
+
     def generar_reporte_ventas(self, year, month):
         """Reporte 607 - Ventas de Bienes y Servicios"""
         ventas = Venta.objects.filter(
@@ -42,6 +49,7 @@ class DGIIDominicanaStrategy(FiscalStrategy):
             estado__in=['COMPLETADA', 'ANULADA'],
         ).select_related('cliente', 'venta_referencia')
 
+        columna_pago = self.tablas()['columna_pago_607']
         reporte = []
         for v in ventas:
             rnc_cedula = v.cliente.numero_documento if v.cliente else "000000000"
@@ -81,15 +89,18 @@ class DGIIDominicanaStrategy(FiscalStrategy):
                 "Impuesto_Selectivo": 0.0,
                 "Otros_Impuestos": 0.0,
                 "Propina_Legal": 0.0,
-                "Efectivo": float(v.monto_pagado) if v.tipo_pago == 'EFECTIVO' else 0.0,
-                "Cheque_Transferencia": float(v.monto_pagado) if v.tipo_pago in ['CHEQUE', 'TRANSFERENCIA'] else 0.0,
-                "Tarjeta": float(v.monto_pagado) if v.tipo_pago == 'TARJETA' else 0.0,
-                "Venta_Credito": float(v.monto_pagado) if v.tipo_pago == 'CREDITO' else 0.0,
+                "Efectivo": 0.0,
+                "Cheque_Transferencia": 0.0,
+                "Tarjeta": 0.0,
+                "Venta_Credito": 0.0,
                 "Bonos": 0.0,
                 "Permutas": 0.0,
-                "Otras_Formas_Ventas": float(v.monto_pagado) if v.tipo_pago == 'MIXTO' else 0.0,
+                "Otras_Formas_Ventas": 0.0,
                 "Tipo_Anulacion": tipo_anulacion,
             }
+            columna = columna_pago.get(v.tipo_pago)
+            if columna:
+                linea[columna] = float(v.monto_pagado)
             reporte.append(linea)
         return reporte
 
@@ -100,20 +111,14 @@ class DGIIDominicanaStrategy(FiscalStrategy):
             fecha__year=year,
             fecha__month=month,
             estado='RECIBIDA',
-        ).select_related('proveedor')
+        ).select_related('proveedor').prefetch_related('detalles__producto')
 
+        forma_pago_map = self.tablas()['forma_pago_606']
         reporte = []
         for c in compras:
             tipo_bienes = c.tipo_bienes_servicios or '02'
 
             # Forma de pago real
-            forma_pago_map = {
-                'EFECTIVO': '01',
-                'CHEQUE': '02',
-                'TRANSFERENCIA': '03',
-                'TARJETA': '04',
-                'CREDITO': '05',
-            }
             forma_pago = forma_pago_map.get(c.forma_pago, '01')
 
             # Fecha de pago real
@@ -162,27 +167,57 @@ class DGIIDominicanaStrategy(FiscalStrategy):
         return reporte
 
     def generar_reporte_anulaciones(self, year, month):
-        """Reporte 608 - NCFs anulados del periodo."""
+        """Reporte 608 - NCFs anulados del periodo (lista; el TXT se genera en streaming)."""
+        return list(self.iter_reporte_anulaciones(year, month))
+
+    def _anulaciones(self, year, month):
         ventas_anuladas = Venta.objects.filter(
             negocio=self.negocio,
             fecha__year=year,
             fecha__month=month,
             estado='ANULADA',
         ).exclude(ncf='')
-
-        reporte = []
-        for v in ventas_anuladas:
+        # Números de bloques cerrados o secuencias vencidas sin usar
+        rangos = AnulacionNCF.objects.filter(
+            negocio=self.negocio,
+            fecha__year=year,
+            fecha__month=month,
+        )
+        return ventas_anuladas, rangos
+
+    def contar_anulaciones(self, year, month):
+        """Líneas del 608 sin generarlas: ventas anuladas + tamaño de cada rango."""
+        ventas_anuladas, rangos = self._anulaciones(year, month)
+        numeros = rangos.aggregate(n=Sum(F('hasta') - F('desde') + 1))['n'] or 0
+        return ventas_anuladas.count() + numeros
+
+    def iter_reporte_anulaciones(self, year, month):
+        """
+        Líneas del 608 una a una. Un rango de AnulacionNCF (p. ej. el resto de
+        una secuencia vencida) puede tener millones de números y el formato
+        pide una línea por NCF, así que nunca se expande completo en memoria.
+        """
+        ventas_anuladas, rangos = self._anulaciones(year, month)
+        for v in ventas_anuladas.iterator():
             tipo_anulacion = "02"  # 02 = Deterioro
-            if v.venta_referencia:
+            if v.venta_referencia_id:
                 tipo_anulacion = "04"  # 04 = Reemplazo por NC
 
-            linea = {
+            yield {
                 "NCF": v.ncf,
                 "Fecha_Comprobante": v.fecha.strftime('%Y%m%d'),
                 "Tipo_Anulacion": tipo_anulacion,
             }
-            reporte.append(linea)
-        return reporte
+
+        for rango in rangos.select_related('secuencia').order_by('fecha', 'desde').iterator():
+            tipo, serie = rango.secuencia.tipo_comprobante, rango.secuencia.serie
+            fecha = rango.fecha.strftime('%Y%m%d')
+            for numero in range(rango.desde, rango.hasta + 1):
+                yield {
+                    "NCF": formatear_ncf(tipo, serie, numero),
+                    "Fecha_Comprobante": fecha,
+                    "Tipo_Anulacion": rango.tipo_anulacion,
+                }
 
     def exportar_archivo(self, tipo_reporte, year, month):
         """Genera el archivo TXT delimitado por pipes (|) formato DGII."""
@@ -244,34 +279,21 @@ class DGIIDominicanaStrategy(FiscalStrategy):
             return "\n".join(content), filename, "text/plain"
 
         elif tipo_reporte == '608':
-            data = self.generar_reporte_anulaciones(year, month)
             filename = f"DGII_F_608_{rnc}_{periodo}.txt"
-            header = f"608|{rnc}|{periodo}|{len(data)}"
+            header = f"608|{rnc}|{periodo}|{self.contar_anulaciones(year, month)}"
 
-            content = [header]
-            for row in data:
-                line = "|".join([
-                    str(row["NCF"]),
-                    str(row["Fecha_Comprobante"]),
-                    str(row["Tipo_Anulacion"]),
-                ])
-                content.append(line)
+            def lineas():
+                yield header
+                for row in self.iter_reporte_anulaciones(year, month):
+                    yield "\n" + "|".join([
+                        str(row["NCF"]),
+                        str(row["Fecha_Comprobante"]),
+                        str(row["Tipo_Anulacion"]),
+                    ])
 
-            return "\n".join(content), filename, "text/plain"
+            # Iterable: el view lo envía con StreamingHttpResponse
+            return lineas(), filename, "text/plain"
 
         else:
             raise ValueError(f"Reporte {tipo_reporte} no soportado para DGII")
 
-
-class FiscalStrategyFactory:
-    """Factory para obtener la estrategia correcta según el país del negocio."""
-
-    @staticmethod
-    def get_strategy(negocio):
-        pais_codigo = negocio.pais.codigo
-        if pais_codigo == 'DOM':
-            return DGIIDominicanaStrategy(negocio)
-        else:
-            raise NotImplementedError(
-                f"Estrategia fiscal no implementada para el país: {pais_codigo}"
-            )
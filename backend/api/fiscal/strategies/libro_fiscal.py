@@ -0,0 +1,94 @@
+import csv
+import io
+from decimal import Decimal
+from ...models import Venta, Compra
+from .base import FiscalStrategy
+
+
+class LibroFiscalStrategy(FiscalStrategy):
+    """
+    Estrategia fiscal genérica: Libro de Ventas y Libro de Compras.
+    Usada por los países del CountryRegistry sin formato propio (MX, CO, AR, US).
+    Nombre del impuesto, autoridad y tasas vienen del CountryConfig del país.
+    """
+
+    TIPOS_REPORTE = {
+        'VENTAS': 'generar_reporte_ventas',
+        'COMPRAS': 'generar_reporte_compras',
+    }
+    TIPO_DEFECTO = 'VENTAS'
+
+    COLUMNAS = [
+        'Fecha', 'Comprobante', 'Identificacion', 'Nombre',
+        'Base_Imponible', 'Impuesto', 'Total', 'Estado',
+    ]
+
+    @property
+    def autoridad(self):
+        if self.country_config:
+            return self.country_config.fiscal_authority
+        return 'FISCAL'
+
+    def generar_reporte_ventas(self, year, month):
+        """Libro de Ventas del periodo."""
+        ventas = Venta.objects.filter(
+            negocio=self.negocio,
+            fecha__year=year,
+            fecha__month=month,
+            estado__in=['COMPLETADA', 'ANULADA'],
+        ).select_related('cliente').order_by('fecha')
+
+        reporte = []
+        for v in ventas:
+            reporte.append({
+                'Fecha': v.fecha.strftime('%Y-%m-%d'),
+                'Comprobante': v.ncf or v.numero,
+                'Identificacion': v.cliente.numero_documento if v.cliente else '',
+                'Nombre': v.cliente.nombre if v.cliente else 'CONSUMIDOR FINAL',
+                'Base_Imponible': float(v.subtotal_con_descuento or v.subtotal),
+                'Impuesto': float(v.total_impuestos),
+                'Total': float(v.total),
+                'Estado': v.estado,
+            })
+        return reporte
+
+    def generar_reporte_compras(self, year, month):
+        """Libro de Compras del periodo."""
+        compras = Compra.objects.filter(
+            negocio=self.negocio,
+            fecha__year=year,
+            fecha__month=month,
+            estado='RECIBIDA',
+        ).select_related('proveedor').order_by('fecha')
+
+        reporte = []
+        for c in compras:
+            reporte.append({
+                'Fecha': c.fecha.strftime('%Y-%m-%d'),
+                'Comprobante': c.ncf_proveedor or c.factura_proveedor or c.numero,
+                'Identificacion': c.proveedor.identificacion_fiscal,
+                'Nombre': c.proveedor.nombre,
+                'Base_Imponible': float(c.subtotal),
+                'Impuesto': float(c.total_impuestos or Decimal('0')),
+                'Total': float(c.total),
+                'Estado': c.estado,
+            })
+        return reporte
+
+    def exportar_archivo(self, tipo_reporte, year, month):
+        """Genera el libro en CSV."""
+        data = self.generar_reporte(tipo_reporte, year, month)
+        tax_id = self.negocio.identificacion_fiscal.replace('-', '')
+        filename = f"{self.autoridad}_{tipo_reporte}_{tax_id}_{year}{month:02d}.csv"
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=self.COLUMNAS)
+        writer.writeheader()
+        for row in data:
+            writer.writerow({
+                **row,
+                'Base_Imponible': f"{row['Base_Imponible']:.2f}",
+                'Impuesto': f"{row['Impuesto']:.2f}",
+                'Total': f"{row['Total']:.2f}",
+            })
+        return buffer.getvalue(), filename, "text/csv"
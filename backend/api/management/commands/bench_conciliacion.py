@@ -0,0 +1,112 @@
+"""
+Benchmark de la conciliación bancaria automática (sin base de datos).
+
+Genera un extracto sintético de N transacciones contra M movimientos internos
+de una misma cuenta (montos repetidos, fechas desplazadas, referencias
+parciales y ruido de un centavo) y mide cada etapa de ConciliationEngine:
+
+1. Índices en memoria (CandidateIndex).
+2. Matriz dispersa de puntajes (todas las reglas).
+3. Asignación uno a uno (Hungarian por componente / cota greedy).
+
+Usage:
+    python manage.py bench_conciliacion
+    python manage.py bench_conciliacion --transacciones 10000 --movimientos 10000
+    python manage.py bench_conciliacion --hungaro-max 0   # solo greedy
+"""
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+
+PALABRAS = ['pago', 'cliente', 'transferencia', 'deposito', 'farmacia', 'colmado',
+            'ferreteria', 'nomina', 'alquiler', 'seguro', 'factura', 'servicio']
+
+
+def _datos_sinteticos(n_txn, n_mov, semilla):
+    rnd = random.Random(semilla)
+    inicio = date(2025, 1, 1)
+    movimientos = []
+    for i in range(n_mov):
+        movimientos.append(SimpleNamespace(
+            pk=i, cuenta_id='bench',
+            fecha=inicio + timedelta(days=rnd.randrange(90)),
+            # Pocos montos distintos para forzar candidatos ambiguos
+            monto=Decimal(rnd.randrange(100, 400) * 25) / 100,
+            referencia=f'REF{i:06d}' if rnd.random() < 0.3 else '',
+            descripcion=' '.join(rnd.sample(PALABRAS, 3)),
+        ))
+    transacciones = []
+    for i in range(n_txn):
+        if i < n_mov and rnd.random() < 0.85:
+            base = movimientos[i]
+            monto = base.monto + (Decimal('0.01') if rnd.random() < 0.05 else 0)
+            transacciones.append(SimpleNamespace(
+                cuenta_bancaria_id='bench',
+                fecha=base.fecha + timedelta(days=rnd.randint(-3, 3)),
+                monto=monto, referencia=base.referencia,
+                descripcion=base.descripcion.upper(),
+            ))
+        else:
+            transacciones.append(SimpleNamespace(
+                cuenta_bancaria_id='bench',
+                fecha=inicio + timedelta(days=rnd.randrange(90)),
+                monto=Decimal(rnd.randrange(100, 400) * 25) / 100,
+                referencia='', descripcion=' '.join(rnd.sample(PALABRAS, 2)),
+            ))
+    movimientos.sort(key=lambda m: m.fecha, reverse=True)
+    return transacciones, movimientos
+
+
+class Command(BaseCommand):
+    help = 'Benchmark de la conciliación automática: índices, matriz de puntajes y asignación global'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transacciones', type=int, default=10000, help='Transacciones del extracto')
+        parser.add_argument('--movimientos', type=int, default=10000, help='Movimientos internos sin conciliar')
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument(
+            '--hungaro-max', type=int, default=None,
+            help='Celdas máximas por componente para Hungarian (por defecto HUNGARIAN_MAX_CELLS)',
+        )
+
+    def handle(self, *args, **options):
+        from api.conciliation_engine import CandidateIndex, ConciliationEngine, _components, solve_assignment
+
+        engine = ConciliationEngine()
+        hungaro_max = options['hungaro_max']
+        if hungaro_max is None:
+            hungaro_max = engine.HUNGARIAN_MAX_CELLS
+        transacciones, movimientos = _datos_sinteticos(
+            options['transacciones'], options['movimientos'], options['semilla'],
+        )
+
+        def medir(nombre, fn):
+            t0 = time.perf_counter()
+            resultado = fn()
+            self.stdout.write(f'{nombre:<24} {time.perf_counter() - t0:8.3f}s')
+            return resultado
+
+        def indexar():
+            index = CandidateIndex(engine.TOLERANCE_AMOUNT)
+            for mov in movimientos:
+                index.add(mov)
+            index.freeze()
+            return {'bench': index}
+
+        indexes = medir('Índices', indexar)
+        scores, _ = medir('Matriz de puntajes', lambda: engine.score_candidates(transacciones, indexes))
+        asignacion = medir('Asignación global', lambda: solve_assignment(scores, hungaro_max))
+
+        componentes = _components(scores)
+        exactas = sum(1 for rows, cols in componentes if len(rows) * len(cols) <= hungaro_max)
+        pares = sum(len(fila) for fila in scores.values())
+        total = sum(scores[row][col] for row, col in asignacion.items())
+        self.stdout.write(
+            f'{len(transacciones)} x {len(movimientos)}: {pares} pares candidatos, '
+            f'{len(componentes)} componentes ({exactas} exactas), '
+            f'{len(asignacion)} asignadas, puntaje total {total}'
+        )
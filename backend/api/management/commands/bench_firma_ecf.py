@@ -0,0 +1,147 @@
+"""
+Benchmark de firma de e-CF.
+
+Compara el camino sin cache (descifrar el .p12 en cada factura, como hacían
+emitir_ecf + sign_ecf_xml) contra el SignerCache del proceso, y mide el
+rendimiento de firma por núcleo con un pool de procesos.
+
+Sin --p12 se genera un certificado RSA autofirmado temporal.
+
+Usage:
+    python manage.py bench_firma_ecf
+    python manage.py bench_firma_ecf --firmas 500 --procesos 4
+    python manage.py bench_firma_ecf --p12 /ruta/cert.p12 --password-env CERT_PASS --venta 123
+"""
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+XML_MUESTRA = (
+    '<ECF><Encabezado><Version>1.0</Version>'
+    '<IdDoc><TipoeCF>32</TipoeCF><eNCF>E320000000001</eNCF></IdDoc>'
+    '<Emisor><RNCEmisor>101000000</RNCEmisor><RazonSocialEmisor>BENCH SRL</RazonSocialEmisor></Emisor>'
+    '<Totales><MontoTotal>1180.00</MontoTotal><TotalITBIS>180.00</TotalITBIS></Totales>'
+    '</Encabezado><DetallesItems><Item><NumeroLinea>1</NumeroLinea>'
+    '<NombreItem>Producto</NombreItem><MontoItem>1000.00</MontoItem></Item></DetallesItems></ECF>'
+).encode('utf-8')
+
+
+def _firmar_lote(args):
+    """Worker del pool: firma `cantidad` documentos con la cache del proceso hijo."""
+    from api.utils.xml_signer import sign_ecf_xml
+
+    xml_content, p12_path, p12_password, cantidad = args
+    for _ in range(cantidad):
+        sign_ecf_xml(xml_content, p12_path, p12_password, tenant='bench')
+    return cantidad
+
+
+def _generar_p12(directorio, password):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.serialization import pkcs12
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nombre = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'Benchmark e-CF')])
+    ahora = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(nombre).issuer_name(nombre)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(ahora - timedelta(days=1))
+        .not_valid_after(ahora + timedelta(days=365))
+        .sign(key, hashes.SHA256())
+    )
+    data = pkcs12.serialize_key_and_certificates(
+        b'bench', key, cert, None,
+        serialization.BestAvailableEncryption(password.encode()),
+    )
+    path = os.path.join(directorio, 'bench.p12')
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+class Command(BaseCommand):
+    help = 'Benchmark de firma de e-CF: sin cache vs SignerCache y firmas/seg por núcleo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--p12', type=str, default=None, help='Ruta a un certificado .p12')
+        parser.add_argument(
+            '--password-env', type=str, default=None,
+            help='Variable de entorno con la contraseña del .p12',
+        )
+        parser.add_argument('--venta', type=int, default=None, help='Firmar el XML de esta venta')
+        parser.add_argument('--firmas', type=int, default=200, help='Firmas por escenario')
+        parser.add_argument(
+            '--procesos', type=int, default=os.cpu_count() or 1,
+            help='Procesos del pool (por defecto, núcleos disponibles)',
+        )
+
+    def handle(self, *args, **options):
+        from api.utils.cert_validator import validate_p12_certificate
+        from api.utils.xml_signer import SignerCache, sign_ecf_xml
+
+        firmas = max(1, options['firmas'])
+        procesos = max(1, options['procesos'])
+
+        xml_content = XML_MUESTRA
+        if options['venta']:
+            from api.models import Venta
+            from api.utils.ecf_generator import ECFGenerator
+            try:
+                venta = Venta.objects.select_related('negocio', 'cliente').get(id=options['venta'])
+            except Venta.DoesNotExist:
+                raise CommandError(f"Venta {options['venta']} no existe")
+            xml_content = ECFGenerator(venta).generate_xml().encode('utf-8')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            if options['p12']:
+                p12_path = options['p12']
+                p12_password = os.getenv(options['password_env'] or '', '')
+            else:
+                p12_password = 'bench'
+                p12_path = _generar_p12(tmp, p12_password)
+
+            # Sin cache: validación en la vista + validación y carga en el firmador
+            n_frio = max(1, firmas // 10)
+            t0 = time.perf_counter()
+            for _ in range(n_frio):
+                validate_p12_certificate(p12_path, p12_password)
+                validate_p12_certificate(p12_path, p12_password)
+                SignerCache.invalidate(p12_path)
+                sign_ecf_xml(xml_content, p12_path, p12_password, tenant='bench')
+            sin_cache = n_frio / (time.perf_counter() - t0)
+
+            # Con cache, un solo proceso
+            SignerCache.get(p12_path, p12_password, tenant='bench')
+            t0 = time.perf_counter()
+            for _ in range(firmas):
+                sign_ecf_xml(xml_content, p12_path, p12_password, tenant='bench')
+            con_cache = firmas / (time.perf_counter() - t0)
+
+            # Pool de procesos: cada hijo carga el .p12 una vez
+            lotes = [firmas // procesos + (1 if i < firmas % procesos else 0) for i in range(procesos)]
+            t0 = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=procesos) as pool:
+                total = sum(pool.map(
+                    _firmar_lote,
+                    [(xml_content, p12_path, p12_password, n) for n in lotes if n],
+                ))
+            en_pool = total / (time.perf_counter() - t0)
+
+        self.stdout.write(f'Documento: {len(xml_content)} bytes')
+        self.stdout.write(f'Sin cache (3 descifrados/factura): {sin_cache:10.1f} firmas/s')
+        self.stdout.write(f'Con SignerCache (1 núcleo):        {con_cache:10.1f} firmas/s')
+        self.stdout.write(
+            f'Pool de {procesos} procesos:               {en_pool:10.1f} firmas/s '
+            f'({en_pool / procesos:.1f} por núcleo)'
+        )
+        self.stdout.write(self.style.SUCCESS(f'Mejora por cache: {con_cache / sin_cache:.1f}x'))
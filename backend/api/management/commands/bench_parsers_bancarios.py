@@ -0,0 +1,151 @@
+"""
+Benchmark de los parsers de extractos bancarios en streaming (sin base de datos).
+
+Genera en un directorio temporal un extracto camt.053 sintético (por defecto
+~50 MB, varias cuentas y páginas, entradas en lote) y un CSV con las mismas
+transacciones de la cuenta importada, y recorre cada uno con iter_parse en un
+proceso hijo midiendo tiempo, transacciones y pico de memoria residente. El
+pico se toma con getrusage y no con tracemalloc porque libxml2 reserva fuera
+del heap de Python.
+
+Usage:
+    python manage.py bench_parsers_bancarios
+    python manage.py bench_parsers_bancarios --entradas 20000 --cuentas 1
+"""
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+CUENTA = '00123456'
+PALABRAS = ['pago', 'cliente', 'transferencia', 'deposito', 'farmacia', 'colmado',
+            'ferreteria', 'nomina', 'alquiler', 'seguro', 'factura', 'servicio']
+
+
+def _generar(directorio, entradas, cuentas, por_pagina, semilla):
+    """Escribe extracto.xml y extracto.csv; devuelve las transacciones esperadas de CUENTA."""
+    rnd = random.Random(semilla)
+    inicio = date(2025, 1, 1)
+    numeros = [CUENTA] + [f'{90000000 + i:08d}' for i in range(1, cuentas)]
+    esperadas = 0
+    xml_path = os.path.join(directorio, 'extracto.xml')
+    csv_path = os.path.join(directorio, 'extracto.csv')
+    with open(xml_path, 'w', encoding='utf-8') as xml, open(csv_path, 'w', encoding='utf-8') as csv:
+        xml.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02"><BkToCstmrStmt>\n'
+            '<GrpHdr><MsgId>BENCH</MsgId><CreDtTm>2025-04-01T00:00:00</CreDtTm></GrpHdr>\n'
+        )
+        csv.write('fecha;descripcion;referencia;monto\n')
+        for numero in numeros:
+            for pagina, desde in enumerate(range(0, entradas // len(numeros), por_pagina)):
+                xml.write(
+                    f'<Stmt><Id>{numero}-{pagina}</Id><ElctrncSeqNb>{pagina + 1}</ElctrncSeqNb>'
+                    f'<Acct><Id><Othr><Id>{numero}</Id></Othr></Id><Ccy>DOP</Ccy></Acct>\n'
+                )
+                for i in range(desde, min(desde + por_pagina, entradas // len(numeros))):
+                    fecha = inicio + timedelta(days=rnd.randrange(90))
+                    partes = [Decimal(rnd.randrange(100, 40000)) / 100 for _ in range(3 if i % 10 == 0 else 1)]
+                    credito = rnd.random() < 0.5
+                    ref = f'{numero[-4:]}-{i:07d}'
+                    detalles = []
+                    for j, monto in enumerate(partes):
+                        desc = ' '.join(rnd.sample(PALABRAS, 3))
+                        detalles.append(
+                            f'<TxDtls><Refs><EndToEndId>{ref}-{j}</EndToEndId></Refs>'
+                            f'<AmtDtls><TxAmt><Amt Ccy="DOP">{monto}</Amt></TxAmt></AmtDtls>'
+                            f'<RltdPties><Dbtr><Nm>Cliente {i}</Nm></Dbtr></RltdPties>'
+                            f'<RmtInf><Ustrd>{desc}</Ustrd></RmtInf></TxDtls>'
+                        )
+                        if numero == CUENTA:
+                            signo = '' if credito else '-'
+                            csv.write(f'{fecha:%d/%m/%Y};{desc};{ref}-{j};{signo}{monto}\n')
+                            esperadas += 1
+                    xml.write(
+                        f'<Ntry><NtryRef>{ref}</NtryRef><Amt Ccy="DOP">{sum(partes)}</Amt>'
+                        f'<CdtDbtInd>{"CRDT" if credito else "DBIT"}</CdtDbtInd><Sts>BOOK</Sts>'
+                        f'<BookgDt><Dt>{fecha.isoformat()}</Dt></BookgDt>'
+                        f'<ValDt><Dt>{fecha.isoformat()}</Dt></ValDt>'
+                        f'<AcctSvcrRef>{ref}</AcctSvcrRef>'
+                        f'<BkTxCd><Domn><Cd>PMNT</Cd><Fmly><Cd>RCDT</Cd><SubFmlyCd>ESCT</SubFmlyCd>'
+                        f'</Fmly></Domn></BkTxCd>'
+                        f'<NtryDtls>{"".join(detalles)}</NtryDtls>'
+                        f'<AddtlNtryInf>Movimiento {ref}</AddtlNtryInf></Ntry>\n'
+                    )
+                xml.write('</Stmt>\n')
+        xml.write('</BkToCstmrStmt></Document>\n')
+    return xml_path, csv_path, esperadas
+
+
+def _pico_rss_kb():
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reporta bytes, Linux kilobytes
+    return pico // 1024 if sys.platform == 'darwin' else pico
+
+
+def _medir_en_hijo(formato, ruta):
+    """Recorre el archivo en un proceso hijo y devuelve (segundos, transacciones, rss_base_kb, rss_pico_kb)."""
+    lector, escritor = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(lector)
+        try:
+            from api.parsers import get_parser
+            parser = get_parser(formato)
+            base = _pico_rss_kb()
+            t0 = time.perf_counter()
+            with open(ruta, 'rb') as archivo:
+                total = sum(1 for _ in parser.iter_parse(archivo, cuenta=CUENTA))
+            resultado = f'{time.perf_counter() - t0} {total} {base} {_pico_rss_kb()}'
+            os.write(escritor, resultado.encode())
+        finally:
+            os._exit(0)
+    os.close(escritor)
+    with os.fdopen(lector) as pipe:
+        datos = pipe.read().split()
+    os.waitpid(pid, 0)
+    if len(datos) != 4:
+        raise CommandError(f'El proceso de {formato} terminó sin resultado')
+    return float(datos[0]), int(datos[1]), int(datos[2]), int(datos[3])
+
+
+class Command(BaseCommand):
+    help = 'Benchmark de los parsers bancarios en streaming: camt.053 (lxml iterparse) contra CSV equivalente'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entradas', type=int, default=76000, help='Entradas <Ntry> en el camt.053 (~50 MB)')
+        parser.add_argument('--cuentas', type=int, default=2, help='Cuentas distintas dentro del archivo')
+        parser.add_argument('--por-pagina', type=int, default=5000, help='Entradas por <Stmt> (página)')
+        parser.add_argument('--semilla', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if not hasattr(os, 'fork'):
+            raise CommandError('Este benchmark necesita os.fork para aislar la memoria de cada parser')
+
+        directorio = tempfile.mkdtemp(prefix='bench_parsers_')
+        try:
+            t0 = time.perf_counter()
+            xml_path, csv_path, esperadas = _generar(
+                directorio, options['entradas'], max(options['cuentas'], 1),
+                max(options['por_pagina'], 1), options['semilla'],
+            )
+            self.stdout.write(f'Archivos generados en {time.perf_counter() - t0:.1f}s')
+
+            for formato, ruta in (('CSV_BANCO', csv_path), ('CAMT053', xml_path)):
+                segundos, total, base, pico = _medir_en_hijo(formato, ruta)
+                tamano = os.path.getsize(ruta) / (1024 * 1024)
+                self.stdout.write(
+                    f'{formato:<10} {tamano:7.1f} MB {segundos:8.2f}s {total:>8} txns '
+                    f'({total / segundos:,.0f}/s)  RSS +{(pico - base) / 1024:.1f} MB (pico {pico / 1024:.1f} MB)'
+                )
+                if total != esperadas:
+                    self.stderr.write(f'{formato}: se esperaban {esperadas} transacciones')
+        finally:
+            shutil.rmtree(directorio, ignore_errors=True)
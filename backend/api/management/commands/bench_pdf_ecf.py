@@ -0,0 +1,112 @@
+"""
+Benchmark de la representación impresa de e-CF (PDF).
+
+Mide páginas por segundo de tres caminos:
+
+1. Por factura: un documento por factura en el proceso actual (lo que hace una
+   petición por factura).
+2. Lote en un PDF: todas las facturas en un solo documento (encabezado como
+   form XObject compartido).
+3. Lote en ZIP: un PDF por factura renderizados en el pool de procesos.
+
+Sin --negocio usa datos sintéticos en memoria (solo CPU). Con --negocio usa
+las últimas ventas con NCF del negocio, consultas incluidas.
+
+Usage:
+    python manage.py bench_pdf_ecf
+    python manage.py bench_pdf_ecf --facturas 2000 --items 8 --procesos 4
+    python manage.py bench_pdf_ecf --negocio <uuid> --facturas 500
+"""
+import time
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _datos_sinteticos(n, items):
+    fecha = datetime(2025, 1, 31, 15, 30, tzinfo=timezone.utc)
+    detalles = [
+        {
+            'cantidad': Decimal('2.00'), 'precio_unitario': Decimal('500.00'),
+            'impuesto': Decimal('180.00'), 'total': Decimal('1180.00'),
+            'producto__nombre': f'Producto {i}',
+        }
+        for i in range(items)
+    ]
+    return [
+        {
+            'id': uuid.uuid4(), 'numero': f'V-{i:06d}', 'ncf': f'E32{i:010d}', 'ecf_tipo': '32',
+            'fecha': fecha, 'fecha_vencimiento': None, 'venta_referencia__ncf': None,
+            'subtotal': Decimal('1000.00') * items, 'descuento': Decimal('0.00'),
+            'total_impuestos': Decimal('180.00') * items, 'total': Decimal('1180.00') * items,
+            'codigo_seguridad_dgii': '123456', 'cliente__nombre': None, 'cliente__numero_documento': None,
+            'ecf_data__qr_code_url': f'https://dgii.gov.do/ecf?rnc=101000001&encf=E32{i:010d}&sc=123456',
+            'ecf_data__fecha_firma': fecha, 'detalles': detalles,
+        }
+        for i in range(n)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark de la representación impresa e-CF: por factura vs lote (PDF y ZIP en pool)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--facturas', type=int, default=1000, help='Facturas por escenario')
+        parser.add_argument('--items', type=int, default=5, help='Items por factura (sintético)')
+        parser.add_argument('--procesos', type=int, default=None, help='Procesos del pool para el ZIP')
+        parser.add_argument('--negocio', type=str, default=None, help='Medir con las ventas de este negocio')
+
+    def handle(self, *args, **options):
+        from api.utils.ecf_pdf import RecursosNegocio, RepresentacionImpresa, generar_zip, renderizar
+        from api.utils.xml_signer import signing_pool
+
+        n = options['facturas']
+        if options['negocio']:
+            from api.models import Negocio, Venta
+            try:
+                negocio = Negocio.objects.get(id=options['negocio'])
+            except (Negocio.DoesNotExist, ValueError):
+                raise CommandError(f"Negocio {options['negocio']} no existe")
+            impresor = RepresentacionImpresa(negocio)
+            ids = list(
+                Venta.objects.filter(negocio=negocio).exclude(ncf='')
+                .order_by('-fecha').values_list('id', flat=True)[:n]
+            )
+            if not ids:
+                raise CommandError('El negocio no tiene ventas con NCF')
+            t0 = time.perf_counter()
+            facturas = impresor.cargar(ids)
+            recursos = impresor.recursos()
+            self.stdout.write(f'Carga de {len(facturas)} facturas: {time.perf_counter() - t0:.2f}s')
+        else:
+            facturas = _datos_sinteticos(n, options['items'])
+            recursos = RecursosNegocio(
+                negocio_id='bench', razon_social='EMPRESA DE PRUEBA SRL', nombre_comercial='Prueba',
+                rnc='101000001', direccion='Av. Principal 1, Santo Domingo', telefono='809-555-0000',
+            )
+
+        def medir(nombre, fn):
+            t0 = time.perf_counter()
+            paginas = fn()
+            segundos = time.perf_counter() - t0
+            self.stdout.write(
+                f'{nombre:<28} {paginas:6d} páginas en {segundos:6.2f}s = {paginas / segundos:8.1f} páginas/s'
+            )
+
+        medir('Por factura', lambda: sum(renderizar(recursos, [datos])[1] for datos in facturas))
+        medir('Lote en un PDF', lambda: renderizar(recursos, facturas)[1])
+
+        pool = signing_pool(options['procesos'])
+        try:
+            def zip_pool():
+                resumen = {}
+                for _ in generar_zip(recursos, facturas, pool=pool, resumen=resumen):
+                    pass
+                return resumen['paginas']
+            procesos = pool._max_workers if pool else 1
+            medir(f'Lote en ZIP ({procesos} procesos)', zip_pool)
+        finally:
+            if pool:
+                pool.shutdown()
@@ -0,0 +1,91 @@
+"""
+Benchmark de reportes fiscales por país.
+
+Mide, para cada país del CountryRegistry, la carga en frío de la estrategia
+fiscal (import del módulo), la resolución ya cacheada y el tiempo de generación
+de cada tipo de reporte sobre los negocios existentes de ese país.
+
+Usage:
+    python manage.py bench_reportes_fiscales --mes 2024-01
+    python manage.py bench_reportes_fiscales --mes 2024-01 --pais DO --iteraciones 5
+"""
+import time
+import statistics
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Benchmark de generación de reportes fiscales por país'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mes', type=str, required=True,
+            help='Periodo a reportar en formato YYYY-MM',
+        )
+        parser.add_argument(
+            '--pais', type=str, default=None,
+            help='Código de país (DO, MX, CO, AR, US). Por defecto todos.',
+        )
+        parser.add_argument(
+            '--iteraciones', type=int, default=3,
+            help='Repeticiones por reporte (se reporta la mediana)',
+        )
+
+    def handle(self, *args, **options):
+        from api.models import Negocio
+        from api.fiscal.registry import (
+            FiscalStrategyRegistry, PAIS_ALIASES, normalizar_codigo_pais,
+        )
+
+        try:
+            year, month = (int(p) for p in options['mes'].split('-'))
+        except (ValueError, AttributeError):
+            raise CommandError('Formato de mes inválido. Use YYYY-MM')
+
+        iteraciones = max(1, options['iteraciones'])
+        FiscalStrategyRegistry.clear_cache()
+
+        codes = FiscalStrategyRegistry.available_codes()
+        if options['pais']:
+            codes = [normalizar_codigo_pais(options['pais'])]
+
+        for code in codes:
+            t0 = time.perf_counter()
+            try:
+                strategy_cls = FiscalStrategyRegistry.get_class(code)
+            except NotImplementedError as e:
+                self.stderr.write(f'{code}: {e}')
+                continue
+            carga_fria = (time.perf_counter() - t0) * 1000
+
+            t0 = time.perf_counter()
+            FiscalStrategyRegistry.get_class(code)
+            carga_cache = (time.perf_counter() - t0) * 1000
+
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'\n{code} -> {strategy_cls.__name__} '
+                f'(carga fría {carga_fria:.2f} ms, cacheada {carga_cache:.4f} ms)'
+            ))
+
+            pais_codes = [code] + [k for k, v in PAIS_ALIASES.items() if v == code]
+            negocios = Negocio.objects.filter(pais_id__in=pais_codes)
+            if not negocios.exists():
+                self.stdout.write('  Sin negocios para este país')
+                continue
+
+            for negocio in negocios:
+                strategy = FiscalStrategyRegistry.get(negocio)
+                for tipo in strategy.TIPOS_REPORTE:
+                    tiempos = []
+                    filas = 0
+                    for _ in range(iteraciones):
+                        t0 = time.perf_counter()
+                        filas = len(strategy.generar_reporte(tipo, year, month))
+                        tiempos.append((time.perf_counter() - t0) * 1000)
+                    self.stdout.write(
+                        f'  {negocio.nombre_comercial[:30]:<30} {tipo:<8} '
+                        f'{filas:>7} filas  mediana {statistics.median(tiempos):9.2f} ms'
+                    )
+
+        self.stdout.write(self.style.SUCCESS('\nBenchmark completado'))
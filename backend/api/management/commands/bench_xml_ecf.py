@@ -0,0 +1,125 @@
+"""
+Benchmark de generación de XML e-CF.
+
+Compara el camino por factura (ECFGenerator: árbol completo, pretty print y
+el parseo que luego hace el firmador) contra PlantillaECF (Emisor en cache,
+datos con values(), árbol entregado directo al firmador).
+
+Sin --negocio usa datos sintéticos en memoria (solo CPU). Con --negocio mide
+también el camino completo sobre las ventas del negocio, consultas incluidas.
+
+Usage:
+    python manage.py bench_xml_ecf
+    python manage.py bench_xml_ecf --facturas 20000 --items 5
+    python manage.py bench_xml_ecf --negocio <uuid> --facturas 2000
+"""
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from lxml import etree
+
+
+def _datos_sinteticos(n, items):
+    fecha = datetime(2025, 1, 31, 15, 30, tzinfo=timezone.utc)
+    detalles = [
+        {
+            'cantidad': Decimal('2.00'), 'precio_unitario': Decimal('500.00'),
+            'descuento': Decimal('0.00'), 'subtotal': Decimal('1000.00'),
+            'impuesto': Decimal('180.00'), 'producto__nombre': f'Producto {i}',
+            'producto__tipo': 'PRODUCTO', 'producto__aplica_impuesto': True,
+            'producto__tasa_impuesto': Decimal('18.00'),
+        }
+        for i in range(items)
+    ]
+    return [
+        {
+            'id': i, 'ecf_tipo': '32', 'ncf': f'E32{i:010d}', 'fecha': fecha,
+            'fecha_vencimiento': None, 'total_impuestos': Decimal('180.00') * items,
+            'total': Decimal('1180.00') * items, 'tipo_pago': 'EFECTIVO',
+            'codigo_seguridad_dgii': '123456', 'sucursal__codigo': '001',
+            'cliente_id': None, 'cliente__numero_documento': None, 'cliente__nombre': None,
+            'venta_referencia_id': None, 'venta_referencia__ncf': None,
+            'venta_referencia__fecha': None, 'detalles': detalles,
+        }
+        for i in range(n)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark de generación de XML e-CF: por factura vs plantilla por negocio'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--facturas', type=int, default=5000, help='Facturas por escenario')
+        parser.add_argument('--items', type=int, default=3, help='Items por factura (sintético)')
+        parser.add_argument('--negocio', type=str, default=None, help='Medir con las ventas de este negocio')
+
+    def handle(self, *args, **options):
+        from api.utils.ecf_generator import PlantillaECF, construir_ecf, construir_emisor
+
+        n = max(1, options['facturas'])
+        datos = _datos_sinteticos(n, max(1, options['items']))
+        negocio = SimpleNamespace(
+            id='bench', identificacion_fiscal='101-00000-1', razon_social='BENCH SRL',
+            nombre_comercial='Bench', direccion='Av. Principal 1, Santo Domingo',
+        )
+
+        # Por factura: Emisor completo, string con pretty print y re-parseo en el firmador
+        t0 = time.perf_counter()
+        for d in datos:
+            emisor = construir_emisor(
+                negocio.identificacion_fiscal, negocio.razon_social,
+                negocio.nombre_comercial, d['sucursal__codigo'], negocio.direccion,
+            )
+            xml = etree.tostring(
+                construir_ecf(d, emisor), pretty_print=True, encoding='UTF-8', xml_declaration=True,
+            )
+            etree.fromstring(xml)
+        por_factura = n / (time.perf_counter() - t0)
+
+        # Plantilla: Emisor en cache y árbol directo al firmador
+        plantilla = PlantillaECF(negocio)
+        t0 = time.perf_counter()
+        for d in datos:
+            plantilla.construir(d)
+        con_plantilla = n / (time.perf_counter() - t0)
+        PlantillaECF.invalidar('bench')
+
+        self.stdout.write(f'Sintético ({options["items"]} items/factura, 1 núcleo):')
+        self.stdout.write(f'  Por factura + round-trip string: {por_factura:10.1f} XML/s')
+        self.stdout.write(f'  PlantillaECF (árbol directo):    {con_plantilla:10.1f} XML/s')
+
+        if options['negocio']:
+            self._con_base_de_datos(options['negocio'], n)
+
+        self.stdout.write(self.style.SUCCESS(f'Mejora: {con_plantilla / por_factura:.1f}x'))
+
+    def _con_base_de_datos(self, negocio_id, n):
+        from api.models import Negocio, Venta
+        from api.utils.ecf_generator import ECFGenerator, PlantillaECF
+
+        try:
+            negocio = Negocio.objects.get(id=negocio_id)
+        except (Negocio.DoesNotExist, ValueError):
+            raise CommandError(f'Negocio {negocio_id} no existe')
+        ids = list(
+            Venta.objects.filter(negocio=negocio, estado='COMPLETADA')
+            .order_by('-fecha').values_list('id', flat=True)[:n]
+        )
+        if not ids:
+            raise CommandError('El negocio no tiene ventas completadas')
+
+        t0 = time.perf_counter()
+        for venta in Venta.objects.filter(id__in=ids):
+            etree.fromstring(ECFGenerator(venta).generate_xml().encode('utf-8'))
+        por_factura = len(ids) / (time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        PlantillaECF(negocio).generar(ids)
+        con_plantilla = len(ids) / (time.perf_counter() - t0)
+
+        self.stdout.write(f'Base de datos ({len(ids)} ventas, consultas incluidas):')
+        self.stdout.write(f'  ECFGenerator (FKs perezosas):    {por_factura:10.1f} XML/s')
+        self.stdout.write(f'  PlantillaECF (2 consultas):      {con_plantilla:10.1f} XML/s')
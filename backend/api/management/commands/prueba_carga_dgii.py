@@ -0,0 +1,215 @@
+"""
+Prueba de carga del pipeline e-CF contra el simulador local de la DGII.
+
+Clona ventas de un negocio (dentro de una transacción que se revierte al
+final: no queda nada en la base de datos) y mide tres escenarios:
+
+1. Emisión en lote (EmisorLoteECF) con la DGII sana: e-CF por segundo.
+2. Caída de la DGII durante la emisión: las facturas quedan en contingencia y
+   se mide cuánto tarda ColaContingenciaECF en drenarlas al volver el servicio
+   (el beat se comprime a --intervalo segundos y el backoff de cada factura se
+   vence en cada ciclo).
+3. Transiciones de dgii_breaker durante toda la prueba.
+
+Sin --p12 se usa un certificado autofirmado temporal.
+
+Usage:
+    python manage.py prueba_carga_dgii --negocio <uuid>
+    python manage.py prueba_carga_dgii --negocio <uuid> --ventas 2000 --latencia-ms 80 --tasa-error 0.02
+    python manage.py prueba_carga_dgii --negocio <uuid> --caida-segundos 30 --procesos 4
+"""
+import os
+import tempfile
+import time
+import uuid
+
+import pybreaker
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+
+class _Rollback(Exception):
+    pass
+
+
+class _RegistroBreaker(pybreaker.CircuitBreakerListener):
+    def __init__(self, inicio):
+        self.inicio = inicio
+        self.transiciones = []
+
+    def state_change(self, cb, old_state, new_state):
+        self.transiciones.append((
+            time.perf_counter() - self.inicio,
+            old_state.name if old_state else None,
+            new_state.name,
+        ))
+
+
+class Command(BaseCommand):
+    help = 'Prueba de carga e-CF contra el simulador DGII: throughput, drenado de contingencia y breaker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--negocio', type=str, required=True, help='Negocio cuyas ventas se clonan')
+        parser.add_argument('--ventas', type=int, default=500, help='Ventas por escenario')
+        parser.add_argument('--latencia-ms', type=float, default=50)
+        parser.add_argument('--tasa-error', type=float, default=0.0)
+        parser.add_argument('--tasa-401', type=float, default=0.0)
+        parser.add_argument('--caida-segundos', type=float, default=0, help='Duración extra de la caída')
+        parser.add_argument('--procesos', type=int, default=None, help='Procesos de firma')
+        parser.add_argument('--concurrencia', type=int, default=None, help='Envíos simultáneos a la DGII')
+        parser.add_argument('--intervalo', type=float, default=1.0, help='Segundos entre ciclos de la cola')
+        parser.add_argument('--timeout', type=float, default=600, help='Límite del drenado en segundos')
+        parser.add_argument('--p12', type=str, default=None, help='Ruta a un certificado .p12')
+        parser.add_argument('--password-env', type=str, default=None)
+
+    def handle(self, *args, **options):
+        from api.circuit_breakers import dgii_breaker, reset_breaker
+        from api.management.commands.bench_firma_ecf import _generar_p12
+        from api.models import Negocio
+        from api.utils import dgii_api
+        from api.utils.dgii_simulador import SimuladorDGII
+
+        try:
+            negocio = Negocio.objects.get(id=options['negocio'])
+        except (Negocio.DoesNotExist, ValueError):
+            raise CommandError(f"Negocio {options['negocio']} no existe")
+
+        simulador = SimuladorDGII(
+            latencia_ms=options['latencia_ms'], tasa_error=options['tasa_error'],
+            tasa_401=options['tasa_401'],
+        )
+        ambientes = (dgii_api.AMBIENTES, dgii_api.AMBIENTES_FC)
+        ambiente_local = [a.get('LOCAL') for a in ambientes]
+        registro = _RegistroBreaker(time.perf_counter())
+        reset_breaker('dgii')
+        dgii_breaker.add_listener(registro)
+
+        with tempfile.TemporaryDirectory() as tmp, simulador:
+            for ambiente in ambientes:
+                ambiente['LOCAL'] = simulador.base_url
+            if options['p12']:
+                p12_path, pass_env = options['p12'], options['password_env']
+            else:
+                p12_path, pass_env = _generar_p12(tmp, 'bench'), 'DGII_CARGA_P12_PASS'
+                os.environ[pass_env] = 'bench'
+            try:
+                with transaction.atomic():
+                    Negocio.objects.filter(id=negocio.id).update(
+                        ambiente_fiscal='LOCAL',
+                        certificado_digital_path=p12_path,
+                        certificado_pass_env=pass_env,
+                    )
+                    negocio.refresh_from_db()
+                    self._escenarios(negocio, simulador, options)
+                    raise _Rollback()
+            except _Rollback:
+                pass
+            finally:
+                dgii_breaker.remove_listener(registro)
+                reset_breaker('dgii')
+                for ambiente, anterior in zip(ambientes, ambiente_local):
+                    if anterior:
+                        ambiente['LOCAL'] = anterior
+                    else:
+                        ambiente.pop('LOCAL', None)
+
+        self.stdout.write('Breaker dgii:')
+        for segundo, anterior, nuevo in registro.transiciones:
+            self.stdout.write(f'  t={segundo:7.1f}s  {anterior} -> {nuevo}')
+        self.stdout.write(f'Simulador: {simulador.resumen()}')
+        self.stdout.write(self.style.SUCCESS('Prueba terminada (cambios revertidos).'))
+
+    def _escenarios(self, negocio, simulador, options):
+        from django.core.cache import cache
+        from api.models import ContingenciaECF
+        from api.utils.ecf_contingencia import ColaContingenciaECF
+        from api.utils.ecf_lote import EmisorLoteECF
+
+        n = max(1, options['ventas'])
+
+        # 1. Throughput con la DGII sana
+        ids = self._clonar_ventas(negocio, n, desde=0)
+        emisor = EmisorLoteECF(negocio, procesos=options['procesos'], concurrencia=options['concurrencia'])
+        emisor.notificar = lambda data: None
+        t0 = time.perf_counter()
+        resumen = emisor.ejecutar(venta_ids=ids)
+        duracion = time.perf_counter() - t0
+        self.stdout.write(
+            f'Emisión: {resumen["total"]} e-CF en {duracion:.1f}s = {resumen["total"] / duracion:.1f} e-CF/s '
+            f'(enviadas {resumen["enviadas"]}, contingencia {resumen["contingencia"]}, '
+            f'rechazadas {resumen["rechazadas"]}, errores {resumen["errores"]})'
+        )
+
+        # 2. Caída durante la emisión y drenado de la contingencia
+        ids = self._clonar_ventas(negocio, n, desde=n)
+        simulador.caida = True
+        t_caida = time.perf_counter()
+        resumen = emisor.ejecutar(venta_ids=ids)
+        self.stdout.write(f'Emisión durante la caída: {resumen["contingencia"]} en contingencia')
+        restante = options['caida_segundos'] - (time.perf_counter() - t_caida)
+        if restante > 0:
+            time.sleep(restante)
+        simulador.caida = False
+
+        cache.delete(ColaContingenciaECF.CACHE_CAPACIDAD)
+        cola = ColaContingenciaECF()
+        t0 = time.perf_counter()
+        ciclos = 0
+        breaker = None
+        while time.perf_counter() - t0 < options['timeout']:
+            ContingenciaECF.objects.filter(estado='PENDIENTE', negocio=negocio).update(
+                proximo_intento=timezone.now(),
+            )
+            r = cola.ejecutar()
+            ciclos += 1
+            metricas = ColaContingenciaECF.metricas(negocio)
+            if r['procesadas'] or metricas['breaker'] != breaker:
+                breaker = metricas['breaker']
+                self.stdout.write(
+                    f'  ciclo {ciclos:3d} t={time.perf_counter() - t0:6.1f}s breaker={breaker:9s} '
+                    f'capacidad={r["capacidad"]:5d} resueltas={r["resueltas"]:5d} '
+                    f'backlog={metricas["backlog"]:5d} dead_letter={metricas["dead_letter"]}'
+                )
+            if ciclos > 1 and not metricas['backlog']:
+                break
+            time.sleep(options['intervalo'])
+        drenado = time.perf_counter() - t0
+        metricas = ColaContingenciaECF.metricas(negocio)
+        estado = 'completo' if not metricas['backlog'] else f'incompleto ({metricas["backlog"]} pendientes)'
+        self.stdout.write(f'Drenado de contingencia {estado}: {drenado:.1f}s en {ciclos} ciclos')
+
+    def _clonar_ventas(self, negocio, n, desde):
+        """Copias de la última venta con detalles, PENDIENTE y con NCF ficticio."""
+        from api.models import DetalleVenta, Venta
+
+        plantilla = (
+            Venta.objects.filter(negocio=negocio, estado='COMPLETADA', detalles__isnull=False)
+            .order_by('-fecha').first()
+        )
+        if plantilla is None:
+            raise CommandError('El negocio no tiene ventas completadas con detalles para clonar')
+        detalles = list(DetalleVenta.objects.filter(venta=plantilla))
+
+        campos_venta = [f.attname for f in Venta._meta.concrete_fields]
+        campos_detalle = [f.attname for f in DetalleVenta._meta.concrete_fields]
+        ventas, nuevos_detalles = [], []
+        base = int(time.time()) % 10**6 * 1000
+        for i in range(n):
+            venta = Venta(**{c: getattr(plantilla, c) for c in campos_venta})
+            venta.id = uuid.uuid4()
+            venta.numero = f'CARGA-{desde + i:06d}'
+            venta.tipo_comprobante = 'B02'
+            venta.ncf = f'E32{base + desde + i:010d}'
+            venta.estado_fiscal = 'PENDIENTE'
+            venta.codigo_seguridad_dgii = ''
+            venta.venta_referencia_id = None
+            ventas.append(venta)
+            for detalle in detalles:
+                copia = DetalleVenta(**{c: getattr(detalle, c) for c in campos_detalle})
+                copia.id = uuid.uuid4()
+                copia.venta_id = venta.id
+                nuevos_detalles.append(copia)
+        Venta.objects.bulk_create(ventas, batch_size=500)
+        DetalleVenta.objects.bulk_create(nuevos_detalles, batch_size=1000)
+        return [v.id for v in ventas]
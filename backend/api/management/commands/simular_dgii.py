@@ -0,0 +1,48 @@
+"""
+Levanta el simulador local de la API de e-CF de la DGII.
+
+Los negocios con ambiente_fiscal='LOCAL' envían a settings.DGII_LOCAL_URL
+(por defecto http://127.0.0.1:8089/ en DEBUG).
+
+Usage:
+    python manage.py simular_dgii
+    python manage.py simular_dgii --puerto 8089 --latencia-ms 120 --tasa-error 0.05 --tasa-401 0.01
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Simulador local de la API e-CF de la DGII (recepción, consulta, timbre)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default='127.0.0.1')
+        parser.add_argument('--puerto', type=int, default=8089)
+        parser.add_argument('--latencia-ms', type=float, default=0, help='Mediana de la latencia')
+        parser.add_argument('--latencia-sigma', type=float, default=0.5, help='Dispersión lognormal')
+        parser.add_argument('--tasa-error', type=float, default=0.0, help='Fracción de HTTP 500')
+        parser.add_argument('--tasa-401', type=float, default=0.0, help='Fracción de HTTP 401')
+        parser.add_argument('--tasa-rechazo', type=float, default=0.0, help='Fracción de HTTP 400 en recepción')
+        parser.add_argument(
+            '--tasa-aceptado', type=float, default=1.0,
+            help='Probabilidad de que una consulta resuelva ACEPTADO',
+        )
+
+    def handle(self, *args, **options):
+        from api.utils.dgii_simulador import SimuladorDGII
+
+        simulador = SimuladorDGII(
+            host=options['host'], puerto=options['puerto'],
+            latencia_ms=options['latencia_ms'], latencia_sigma=options['latencia_sigma'],
+            tasa_error=options['tasa_error'], tasa_401=options['tasa_401'],
+            tasa_rechazo=options['tasa_rechazo'], tasa_aceptado=options['tasa_aceptado'],
+        )
+        with simulador:
+            self.stdout.write(self.style.SUCCESS(f'Simulador DGII en {simulador.base_url} (Ctrl+C para salir)'))
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+        self.stdout.write(f'Resumen: {simulador.resumen()}')
@@ -89,9 +89,9 @@ class AuditMiddleware(MiddlewareMixin):
             return response
 
         try:
-            from .models import AuditLog
-            negocio = getattr(request.user, 'negocio', None)
-            if not negocio:
+            from .utils.auditoria import registrar_auditoria
+            negocio_id = getattr(request.user, 'negocio_id', None)
+            if not negocio_id:
                 return response
 
             action_map = {
@@ -126,9 +126,10 @@ class AuditMiddleware(MiddlewareMixin):
             if start_time:
                 duracion_ms = int((time.time() - start_time) * 1000)
 
-            AuditLog.objects.create(
-                negocio=negocio,
-                usuario=request.user,
+            # Encolado: el INSERT lo hace el volcador, no esta respuesta
+            registrar_auditoria(
+                negocio_id=negocio_id,
+                usuario_id=request.user.pk,
                 accion=action_map.get(request.method, 'UPDATE'),
                 modelo=modelo,
                 objeto_id=objeto_id[:100],
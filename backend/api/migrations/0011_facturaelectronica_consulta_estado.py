@@ -0,0 +1,28 @@
+# Generated by Django 5.0.1 on 2026-10-19 00:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_workflow_presupuesto_conciliacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facturaelectronica',
+            name='consultas_estado',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='facturaelectronica',
+            name='proxima_consulta',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='facturaelectronica',
+            name='ultima_consulta',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
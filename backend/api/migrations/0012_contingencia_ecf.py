@@ -0,0 +1,31 @@
+# Generated by Django 5.0.1 on 2026-10-19 00:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_facturaelectronica_consulta_estado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContingenciaECF',
+            fields=[
+                ('venta', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='contingencia', serialize=False, to='api.venta')),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('RESUELTA', 'Resuelta'), ('DEAD_LETTER', 'Descartada tras reintentos')], default='PENDIENTE', max_length=15)),
+                ('intentos', models.PositiveIntegerField(default=0)),
+                ('proximo_intento', models.DateTimeField()),
+                ('ultimo_error', models.TextField(blank=True)),
+                ('fecha_venta', models.DateTimeField(help_text='Prioridad: las ventas más antiguas primero')),
+                ('fecha_ingreso', models.DateTimeField(auto_now_add=True)),
+                ('fecha_resuelta', models.DateTimeField(blank=True, null=True)),
+                ('negocio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='contingencias_ecf', to='api.negocio')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['estado', 'fecha_venta'], name='api_conting_estado_9df566_idx'), models.Index(fields=['negocio', 'estado'], name='api_conting_negocio_4c3aac_idx'), models.Index(fields=['estado', 'fecha_resuelta'], name='api_conting_estado_66e835_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 00:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_contingencia_ecf'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='negocio',
+            name='ambiente_fiscal',
+            field=models.CharField(choices=[('TEST', 'Pruebas'), ('PROD', 'Producción'), ('LOCAL', 'Simulador local')], default='TEST', max_length=10),
+        ),
+    ]
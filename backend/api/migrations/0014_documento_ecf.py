@@ -0,0 +1,102 @@
+# Generated by Django 5.0.1 on 2026-10-19 00:58
+
+import hashlib
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depende del entorno
+    zstandard = None
+
+
+# Copia de api.utils.ecf_documentos (huella, comprimir, descomprimir) al momento de la migración
+def _huella(datos):
+    return hashlib.sha256(datos).hexdigest()
+
+
+def _comprimir(datos):
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=19).compress(datos)
+    return 'zlib', zlib.compress(datos, 9)
+
+
+def _descomprimir(algoritmo, datos):
+    if algoritmo == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstandard es necesario para leer este documento. Instale con: pip install zstandard')
+        return zstandard.ZstdDecompressor().decompress(datos)
+    if algoritmo == 'zlib':
+        return zlib.decompress(datos)
+    raise ValueError(f'Algoritmo de compresión desconocido: {algoritmo}')
+
+
+def mover_xml_firmado(apps, schema_editor):
+    """Pasa xml_firmado de cada FacturaElectronica a DocumentoECF comprimido."""
+    FacturaElectronica = apps.get_model('api', 'FacturaElectronica')
+    DocumentoECF = apps.get_model('api', 'DocumentoECF')
+    qs = FacturaElectronica.objects.exclude(xml_firmado='').only('pk', 'xml_firmado')
+    facturas, documentos = [], {}
+
+    def guardar():
+        DocumentoECF.objects.bulk_create(list(documentos.values()), ignore_conflicts=True)
+        FacturaElectronica.objects.bulk_update(facturas, ['documento'])
+        facturas.clear()
+        documentos.clear()
+
+    for factura in qs.iterator(chunk_size=500):
+        datos = factura.xml_firmado.encode('utf-8')
+        factura.documento_id = _huella(datos)
+        if factura.documento_id not in documentos:
+            algoritmo, contenido = _comprimir(datos)
+            documentos[factura.documento_id] = DocumentoECF(
+                sha256=factura.documento_id, algoritmo=algoritmo, contenido=contenido,
+                tamano=len(datos), tamano_comprimido=len(contenido),
+            )
+        facturas.append(factura)
+        if len(facturas) >= 500:
+            guardar()
+    if facturas:
+        guardar()
+
+
+def restaurar_xml_firmado(apps, schema_editor):
+    FacturaElectronica = apps.get_model('api', 'FacturaElectronica')
+    DocumentoECF = apps.get_model('api', 'DocumentoECF')
+    for factura in FacturaElectronica.objects.filter(documento__isnull=False).iterator(chunk_size=500):
+        documento = DocumentoECF.objects.get(pk=factura.documento_id)
+        factura.xml_firmado = _descomprimir(documento.algoritmo, bytes(documento.contenido)).decode('utf-8')
+        factura.save(update_fields=['xml_firmado'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_negocio_ambiente_local'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentoECF',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('algoritmo', models.CharField(max_length=10)),
+                ('contenido', models.BinaryField()),
+                ('tamano', models.PositiveIntegerField(help_text='Bytes sin comprimir')),
+                ('tamano_comprimido', models.PositiveIntegerField()),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='facturaelectronica',
+            name='documento',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='facturas', to='api.documentoecf'),
+        ),
+        migrations.RunPython(mover_xml_firmado, restaurar_xml_firmado),
+        migrations.RemoveField(
+            model_name='facturaelectronica',
+            name='xml_firmado',
+        ),
+    ]
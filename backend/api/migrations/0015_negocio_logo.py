@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 01:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_documento_ecf'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='negocio',
+            name='logo',
+            field=models.ImageField(blank=True, help_text='Logo de la representación impresa', upload_to='negocios/'),
+        ),
+    ]
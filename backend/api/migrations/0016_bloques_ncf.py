@@ -0,0 +1,58 @@
+# Generated by Django 5.0.1 on 2026-10-19 01:10
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_negocio_logo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BloqueNCF',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('caja', models.CharField(blank=True, help_text='Caja o proceso dentro de la sucursal', max_length=50)),
+                ('desde', models.BigIntegerField()),
+                ('hasta', models.BigIntegerField()),
+                ('actual', models.BigIntegerField(help_text='Siguiente número a asignar')),
+                ('estado', models.CharField(choices=[('ACTIVO', 'Activo'), ('AGOTADO', 'Agotado'), ('CERRADO', 'Cerrado con números sin usar')], default='ACTIVO', max_length=10)),
+                ('fecha_reserva', models.DateTimeField(auto_now_add=True)),
+                ('fecha_cierre', models.DateTimeField(blank=True, null=True)),
+                ('negocio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bloques_ncf', to='api.negocio')),
+                ('secuencia', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bloques', to='api.secuenciancf')),
+                ('sucursal', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='api.sucursal')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AnulacionNCF',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('desde', models.BigIntegerField()),
+                ('hasta', models.BigIntegerField()),
+                ('tipo_anulacion', models.CharField(choices=[('08', 'Errores en secuencia de NCF'), ('09', 'Por cese de operaciones')], default='08', max_length=2)),
+                ('motivo', models.CharField(max_length=200)),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('negocio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='anulaciones_ncf', to='api.negocio')),
+                ('secuencia', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='anulaciones', to='api.secuenciancf')),
+                ('bloque', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.bloquencf')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='bloquencf',
+            index=models.Index(fields=['negocio', 'sucursal', 'caja', 'estado'], name='api_bloquen_negocio_3d9253_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bloquencf',
+            index=models.Index(fields=['secuencia', 'estado'], name='api_bloquen_secuenc_3df5f4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='anulacionncf',
+            index=models.Index(fields=['negocio', 'fecha'], name='api_anulaci_negocio_c8dc36_idx'),
+        ),
+    ]
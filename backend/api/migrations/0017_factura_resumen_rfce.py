@@ -0,0 +1,19 @@
+# Generated by Django 5.0.1 on 2026-10-19 01:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_bloques_ncf'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facturaelectronica',
+            name='resumen',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='resumenes', to='api.documentoecf'),
+        ),
+    ]
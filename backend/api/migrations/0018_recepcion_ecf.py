@@ -0,0 +1,28 @@
+# Generated by Django 5.0.1 on 2026-10-19 01:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_factura_resumen_rfce'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compra',
+            name='documento_ecf',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='compras', to='api.documentoecf'),
+        ),
+        migrations.AddField(
+            model_name='detallecompra',
+            name='descripcion',
+            field=models.CharField(blank=True, help_text='Descripción del proveedor (e-CF recibido)', max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='compra',
+            index=models.Index(fields=['negocio', 'ncf_proveedor'], name='api_compra_negocio_c2bba5_idx'),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.0.1 on 2026-10-19 01:38
+
+import hashlib
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def _hash(cuenta_id, fecha, monto, referencia, descripcion, ocurrencia):
+    # Copia de api.utils.importacion_bancaria.hash_contenido al momento de la migración
+    partes = [
+        str(cuenta_id), fecha.isoformat(), f'{monto:.2f}',
+        (referencia or '').strip(), ' '.join((descripcion or '').split()).upper(),
+        str(ocurrencia),
+    ]
+    return hashlib.sha256('\x1f'.join(partes).encode('utf-8')).hexdigest()
+
+
+def calcular_hashes(apps, schema_editor):
+    """Hash de las filas existentes; las repetidas reciben ocurrencias 0, 1, 2... por antigüedad."""
+    for modelo, campo_cuenta in (('MovimientoBancario', 'cuenta_id'), ('TransaccionBancaria', 'cuenta_bancaria_id')):
+        Modelo = apps.get_model('api', modelo)
+        ocurrencias = Counter()
+        pendientes = []
+        filas = Modelo.objects.order_by('creado_en', 'id').only(
+            'id', campo_cuenta, 'fecha', 'monto', 'referencia', 'descripcion',
+        )
+        for fila in filas.iterator(chunk_size=2000):
+            cuenta_id = getattr(fila, campo_cuenta)
+            contenido = (cuenta_id, fila.fecha, fila.monto, fila.referencia, fila.descripcion)
+            base = _hash(*contenido, 0)
+            fila.hash_contenido = _hash(*contenido, ocurrencias[base])
+            ocurrencias[base] += 1
+            pendientes.append(fila)
+            if len(pendientes) >= 2000:
+                Modelo.objects.bulk_update(pendientes, ['hash_contenido'])
+                pendientes = []
+        if pendientes:
+            Modelo.objects.bulk_update(pendientes, ['hash_contenido'])
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_recepcion_ecf'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivoimportacionbancaria',
+            name='registros_duplicados',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='archivoimportacionbancaria',
+            name='registros_invalidos',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movimientobancario',
+            name='hash_contenido',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-256 de cuenta, fecha, monto, referencia y descripción (deduplicación de importaciones)', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='transaccionbancaria',
+            name='hash_contenido',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-256 de cuenta, fecha, monto, referencia y descripción (deduplicación de importaciones)', max_length=64),
+        ),
+        migrations.RunPython(calcular_hashes, noop),
+        migrations.AddConstraint(
+            model_name='movimientobancario',
+            constraint=models.UniqueConstraint(condition=models.Q(('hash_contenido', ''), _negated=True), fields=('cuenta', 'hash_contenido'), name='movimiento_bancario_hash_unico'),
+        ),
+        migrations.AddConstraint(
+            model_name='transaccionbancaria',
+            constraint=models.UniqueConstraint(condition=models.Q(('hash_contenido', ''), _negated=True), fields=('cuenta_bancaria', 'hash_contenido'), name='transaccion_bancaria_hash_unico'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.1 on 2026-10-19 01:50
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_importacion_bancaria_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReglaConciliacion',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('patron', models.CharField(help_text='Descripción normalizada de la línea del banco', max_length=300)),
+                ('patron_movimiento', models.CharField(help_text='Descripción normalizada del movimiento interno', max_length=300)),
+                ('monto_min', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('monto_max', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('confirmaciones', models.IntegerField(default=1)),
+                ('aciertos', models.IntegerField(default=0, help_text='Conciliaciones automáticas hechas por la regla')),
+                ('activa', models.BooleanField(default=True)),
+                ('ultima_aplicacion', models.DateTimeField(blank=True, null=True)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('cuenta_bancaria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reglas_conciliacion', to='api.cuentabancaria')),
+                ('cuenta_contrapartida', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.cuentacontable')),
+                ('negocio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reglas_conciliacion', to='api.negocio')),
+            ],
+            options={
+                'ordering': ['-confirmaciones'],
+                'unique_together': {('cuenta_bancaria', 'patron')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 01:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_reglas_conciliacion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivoimportacionbancaria',
+            name='formato',
+            field=models.CharField(choices=[('OFX', 'OFX/QFX'), ('MT940', 'MT940/SWIFT'), ('CSV_BANCO', 'CSV Banco'), ('QIF', 'QIF'), ('CAMT053', 'ISO 20022 camt.053')], max_length=10),
+        ),
+    ]
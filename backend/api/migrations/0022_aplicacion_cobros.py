@@ -0,0 +1,41 @@
+# Generated by Django 5.0.1 on 2026-10-19 01:58
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_formato_camt053'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pago',
+            name='transaccion_bancaria',
+            field=models.ForeignKey(blank=True, help_text='Crédito del extracto bancario aplicado (aplicación automática de cobros)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pagos', to='api.transaccionbancaria'),
+        ),
+        migrations.CreateModel(
+            name='SugerenciaCobro',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('metodo', models.CharField(choices=[('REFERENCIA', 'Referencia de factura'), ('CLIENTE', 'RNC / nombre del cliente'), ('COMBINACION', 'Combinación de facturas'), ('MONTO', 'Monto exacto')], max_length=12)),
+                ('confianza', models.DecimalField(decimal_places=2, max_digits=3)),
+                ('asignaciones', models.JSONField(default=list)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente de revisión'), ('APLICADA', 'Aplicada'), ('RECHAZADA', 'Rechazada')], default='PENDIENTE', max_length=10)),
+                ('fecha_revision', models.DateTimeField(blank=True, null=True)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('cliente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.cliente')),
+                ('negocio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sugerencias_cobro', to='api.negocio')),
+                ('revisado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('transaccion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sugerencias_cobro', to='api.transaccionbancaria')),
+            ],
+            options={
+                'ordering': ['-creado_en'],
+                'indexes': [models.Index(fields=['negocio', 'estado'], name='api_sugeren_negocio_a3758f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,128 @@
+# Generated by Django 5.0.1 on 2026-10-19 02:08
+
+import django.db.models.deletion
+import uuid
+from datetime import date, datetime, timezone
+
+from django.conf import settings
+from django.db import migrations, models
+
+TABLA = 'api_auditlog'
+MESES_ADELANTE = 3
+
+
+def _siguiente(mes):
+    return date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+def _definiciones(cursor, tabla):
+    """Índices (salvo la llave primaria) y llaves foráneas de la tabla, para recrearlos."""
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s",
+        [tabla, f'{tabla}_pkey'],
+    )
+    indices = [fila[0] for fila in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = 'f'",
+        [tabla],
+    )
+    return indices, cursor.fetchall()
+
+
+def _reemplazar(cursor, nueva, indices, foraneas):
+    cursor.execute(f'INSERT INTO {nueva} SELECT * FROM {TABLA}')
+    cursor.execute(f'DROP TABLE {TABLA}')
+    cursor.execute(f'ALTER TABLE {nueva} RENAME TO {TABLA}')
+    cursor.execute(f'ALTER TABLE {TABLA} RENAME CONSTRAINT {nueva}_pkey TO {TABLA}_pkey')
+    for indice in indices:
+        cursor.execute(indice)
+    for nombre, definicion in foraneas:
+        cursor.execute(f'ALTER TABLE {TABLA} ADD CONSTRAINT {nombre} {definicion}')
+
+
+def particionar(apps, schema_editor):
+    """
+    Pasa api_auditlog a particiones mensuales por fecha: una por cada mes con
+    datos hasta MESES_ADELANTE meses en el futuro, más una DEFAULT de respaldo.
+    Copia de la lógica de api.utils.particiones_auditoria al momento de la migración.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    nueva = f'{TABLA}_particionada'
+    with schema_editor.connection.cursor() as cursor:
+        indices, foraneas = _definiciones(cursor, TABLA)
+        cursor.execute(f"SELECT min(fecha) FROM {TABLA}")
+        primera = cursor.fetchone()[0]
+        hoy = datetime.now(timezone.utc).date().replace(day=1)
+        mes = min(primera.astimezone(timezone.utc).date().replace(day=1), hoy) if primera else hoy
+        ultimo = hoy
+        for _ in range(MESES_ADELANTE):
+            ultimo = _siguiente(ultimo)
+
+        cursor.execute(
+            f'CREATE TABLE {nueva} (LIKE {TABLA} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE (fecha)'
+        )
+        # La llave de partición debe ser parte de la llave primaria
+        cursor.execute(f'ALTER TABLE {nueva} ADD CONSTRAINT {nueva}_pkey PRIMARY KEY (id, fecha)')
+        cursor.execute(f'CREATE TABLE {TABLA}_default PARTITION OF {nueva} DEFAULT')
+        while mes <= ultimo:
+            cursor.execute(
+                f'CREATE TABLE {TABLA}_p{mes:%Y%m} PARTITION OF {nueva} FOR VALUES FROM (%s) TO (%s)',
+                [datetime(mes.year, mes.month, 1, tzinfo=timezone.utc),
+                 datetime.combine(_siguiente(mes), datetime.min.time(), tzinfo=timezone.utc)],
+            )
+            mes = _siguiente(mes)
+        _reemplazar(cursor, nueva, indices, foraneas)
+
+
+def desparticionar(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    nueva = f'{TABLA}_simple'
+    with schema_editor.connection.cursor() as cursor:
+        indices, foraneas = _definiciones(cursor, TABLA)
+        cursor.execute(f'CREATE TABLE {nueva} (LIKE {TABLA} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(f'ALTER TABLE {nueva} ADD CONSTRAINT {nueva}_pkey PRIMARY KEY (id)')
+        _reemplazar(cursor, nueva, [i.replace(' ONLY ', ' ') for i in indices], foraneas)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_auditlog_fecha_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivoAuditoria',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('mes', models.DateField(help_text='Primer día del mes archivado (UTC)', unique=True)),
+                ('archivo', models.CharField(max_length=500)),
+                ('registros', models.IntegerField(default=0)),
+                ('tamano_bytes', models.BigIntegerField(default=0)),
+                ('checksum_sha256', models.CharField(max_length=64)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-mes'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='auditlog',
+            name='api_auditlo_resulta_7c3aea_idx',
+        ),
+        migrations.AlterField(
+            model_name='auditlog',
+            name='negocio',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.negocio'),
+        ),
+        migrations.AlterField(
+            model_name='auditlog',
+            name='usuario',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(particionar, desparticionar),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.1 on 2026-10-19 02:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def quitar_duplicadas(apps, schema_editor):
+    """Una sugerencia por crédito: se conserva la aplicada, si no la revisada, si no la más antigua."""
+    SugerenciaCobro = apps.get_model('api', 'SugerenciaCobro')
+    prioridad = {'APLICADA': 0, 'RECHAZADA': 1, 'PENDIENTE': 2}
+    repetidas = (
+        SugerenciaCobro.objects.values('transaccion_id')
+        .annotate(n=models.Count('id')).filter(n__gt=1)
+        .values_list('transaccion_id', flat=True)
+    )
+    for transaccion_id in repetidas:
+        sugerencias = sorted(
+            SugerenciaCobro.objects.filter(transaccion_id=transaccion_id),
+            key=lambda s: (prioridad.get(s.estado, 3), s.creado_en),
+        )
+        SugerenciaCobro.objects.filter(id__in=[s.id for s in sugerencias[1:]]).delete()
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_auditlog_particiones'),
+    ]
+
+    operations = [
+        migrations.RunPython(quitar_duplicadas, noop),
+        migrations.AlterField(
+            model_name='sugerenciacobro',
+            name='transaccion',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sugerencia_cobro', to='api.transaccionbancaria'),
+        ),
+    ]
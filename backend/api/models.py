@@ -102,6 +102,7 @@ class Negocio(models.Model):
     email = models.EmailField()
     direccion = models.TextField()
     ciudad = models.CharField(max_length=100)
+    logo = models.ImageField(upload_to='negocios/', blank=True, help_text="Logo de la representación impresa")
     
     # Configuración internacional
     pais = models.ForeignKey(Pais, on_delete=models.PROTECT, default='DOM')
@@ -123,7 +124,7 @@ class Negocio(models.Model):
     certificado_pass_env = models.CharField(max_length=100, blank=True, help_text="Nombre de ENV VAR con la clave")
     api_fiscal_usuario = models.CharField(max_length=100, blank=True)
     api_fiscal_clave = models.CharField(max_length=255, blank=True)  # Encriptado
-    ambiente_fiscal = models.CharField(max_length=10, choices=[('TEST', 'Pruebas'), ('PROD', 'Producción')], default='TEST')
+    ambiente_fiscal = models.CharField(max_length=10, choices=[('TEST', 'Pruebas'), ('PROD', 'Producción'), ('LOCAL', 'Simulador local')], default='TEST')
     
     # Configuracion contable
     plan_cuentas_activo = models.BooleanField(default=True)
@@ -257,7 +258,13 @@ class Usuario(AbstractUser):
 # =============================================================================
 
 class AuditLog(models.Model):
-    """Registro de auditoria INMUTABLE de TODAS las acciones"""
+    """
+    Registro de auditoria INMUTABLE de TODAS las acciones.
+
+    La tabla está particionada por mes sobre fecha (PostgreSQL, migración
+    0024; llave primaria física (id, fecha)). Las particiones futuras y el
+    archivo de las vencidas los maneja api.utils.particiones_auditoria.
+    """
     ACCION_CHOICES = [
         ('LOGIN', 'Inicio de Sesion'),
         ('LOGOUT', 'Cierre de Sesion'),
@@ -283,8 +290,9 @@ class AuditLog(models.Model):
     ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    negocio = models.ForeignKey(Negocio, on_delete=models.CASCADE)
-    usuario = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True)
+    # Sin índice propio: los cubren (negocio, fecha) y (usuario, accion)
+    negocio = models.ForeignKey(Negocio, on_delete=models.CASCADE, db_index=False)
+    usuario = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True, db_index=False)
 
     accion = models.CharField(max_length=20, choices=ACCION_CHOICES)
     modelo = models.CharField(max_length=100)
@@ -300,7 +308,8 @@ class AuditLog(models.Model):
     duracion_ms = models.IntegerField(null=True, blank=True)
     resultado = models.CharField(max_length=10, choices=RESULTADO_CHOICES, default='SUCCESS')
 
-    fecha = models.DateTimeField(auto_now_add=True)
+    # default y no auto_now_add: los eventos encolados conservan su hora al volcarse
+    fecha = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ['-fecha']
@@ -308,23 +317,38 @@ class AuditLog(models.Model):
             models.Index(fields=['negocio', 'fecha']),
             models.Index(fields=['usuario', 'accion']),
             models.Index(fields=['modelo', 'objeto_id']),
-            models.Index(fields=['resultado']),
         ]
 
     def save(self, *args, **kwargs):
-        # Inmutable: solo permitir inserts, no updates
-        if self.pk:
-            try:
-                AuditLog.objects.get(pk=self.pk)
-                raise ValidationError("Los registros de auditoria son inmutables.")
-            except AuditLog.DoesNotExist:
-                pass
+        # Inmutable: solo permitir inserts, no updates. Una instancia leída de
+        # la base no está en estado "adding"; una nueva se inserta sin consultar
+        # antes (un id repetido falla por la llave primaria)
+        if not self._state.adding:
+            raise ValidationError("Los registros de auditoria son inmutables.")
+        kwargs['force_insert'] = True
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
         raise ValidationError("Los registros de auditoria no se pueden eliminar.")
 
 
+class ArchivoAuditoria(models.Model):
+    """Mes de AuditLog exportado a un archivo comprimido y retirado de la tabla"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    mes = models.DateField(unique=True, help_text="Primer día del mes archivado (UTC)")
+    archivo = models.CharField(max_length=500)
+    registros = models.IntegerField(default=0)
+    tamano_bytes = models.BigIntegerField(default=0)
+    checksum_sha256 = models.CharField(max_length=64)
+    creado_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-mes']
+
+    def __str__(self):
+        return f"AuditLog {self.mes:%Y-%m} ({self.registros} registros)"
+
+
 # =============================================================================
 # CONTABILIDAD - MOTOR CONTABLE REAL (Task 3 & 4)
 # =============================================================================
@@ -781,6 +805,57 @@ class SecuenciaNCF(models.Model):
         unique_together = ['negocio', 'tipo_comprobante', 'serie']
 
 
+class BloqueNCF(models.Model):
+    """Sub-rango de una SecuenciaNCF reservado por una sucursal o caja (ver utils/ncf_manager.py)"""
+    ESTADO_CHOICES = [
+        ('ACTIVO', 'Activo'),
+        ('AGOTADO', 'Agotado'),
+        ('CERRADO', 'Cerrado con números sin usar'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    negocio = models.ForeignKey(Negocio, on_delete=models.CASCADE, related_name='bloques_ncf')
+    secuencia = models.ForeignKey(SecuenciaNCF, on_delete=models.CASCADE, related_name='bloques')
+    sucursal = models.ForeignKey(Sucursal, on_delete=models.PROTECT, null=True, blank=True)
+    caja = models.CharField(max_length=50, blank=True, help_text="Caja o proceso dentro de la sucursal")
+    desde = models.BigIntegerField()
+    hasta = models.BigIntegerField()
+    actual = models.BigIntegerField(help_text="Siguiente número a asignar")
+    estado = models.CharField(max_length=10, choices=ESTADO_CHOICES, default='ACTIVO')
+    fecha_reserva = models.DateTimeField(auto_now_add=True)
+    fecha_cierre = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['negocio', 'sucursal', 'caja', 'estado']),
+            models.Index(fields=['secuencia', 'estado']),
+        ]
+
+    def __str__(self):
+        return f"{self.secuencia.tipo_comprobante} {self.desde}-{self.hasta} ({self.estado})"
+
+
+class AnulacionNCF(models.Model):
+    """Rango de NCF que no se usará (bloque cerrado o secuencia vencida); se reporta en el 608"""
+    TIPO_ANULACION = [
+        ('08', 'Errores en secuencia de NCF'),
+        ('09', 'Por cese de operaciones'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    negocio = models.ForeignKey(Negocio, on_delete=models.CASCADE, related_name='anulaciones_ncf')
+    secuencia = models.ForeignKey(SecuenciaNCF, on_delete=models.CASCADE, related_name='anulaciones')
+    bloque = models.ForeignKey(BloqueNCF, on_delete=models.SET_NULL, null=True, blank=True)
+    desde = models.BigIntegerField()
+    hasta = models.BigIntegerField()
+    tipo_anulacion = models.CharField(max_length=2, choices=TIPO_ANULACION, default='08')
+    motivo = models.CharField(max_length=200)
+    fecha = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['negocio', 'fecha'])]
+
+
 class Venta(models.Model):
     """Ventas con soporte de facturación electrónica"""
     TIPO_PAGO = [
@@ -870,23 +945,87 @@ class Venta(models.Model):
         return f"{self.numero} - RD${self.total}"
 
 
+class DocumentoECF(models.Model):
+    """XML firmado de un e-CF, comprimido y direccionado por su SHA-256 (ver utils/ecf_documentos.py)"""
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    algoritmo = models.CharField(max_length=10)  # zstd | zlib
+    contenido = models.BinaryField()
+    tamano = models.PositiveIntegerField(help_text="Bytes sin comprimir")
+    tamano_comprimido = models.PositiveIntegerField()
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def xml(self):
+        from .utils.ecf_documentos import leer
+        return leer(self)
+
+    def __str__(self):
+        return self.sha256
+
+
 class FacturaElectronica(models.Model):
     """Extension de Venta para e-CF DGII (Task 1: Invoice Model)"""
     venta = models.OneToOneField(Venta, on_delete=models.CASCADE, related_name='ecf_data', primary_key=True)
-    
+
     track_id = models.CharField(max_length=50, unique=True, null=True, blank=True)
     ecf_tipo = models.CharField(max_length=3, default='31') # 31: Factura Crédito Fiscal, 32: Consumo, etc.
     fecha_firma = models.DateTimeField(null=True, blank=True)
-    
-    xml_firmado = models.TextField(blank=True, help_text="XML completo firmado (XMLDSig)")
+
+    # XML completo firmado (XMLDSig) fuera de la fila; documento_id es su SHA-256
+    documento = models.ForeignKey(
+        DocumentoECF, on_delete=models.PROTECT, null=True, blank=True, related_name='facturas',
+    )
+    # RFCE firmado: e-CF de consumo bajo el umbral, reportados con el resumen
+    resumen = models.ForeignKey(
+        DocumentoECF, on_delete=models.PROTECT, null=True, blank=True, related_name='resumenes',
+    )
     respuesta_dgii = models.JSONField(null=True, blank=True, help_text="Respuesta cruda de la DGII")
     
     qr_code_url = models.URLField(max_length=500, blank=True)
-    
+
+    # Consulta de estado del track_id (ver utils/ecf_estado.py)
+    consultas_estado = models.PositiveIntegerField(default=0)
+    ultima_consulta = models.DateTimeField(null=True, blank=True)
+    proxima_consulta = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    @property
+    def xml_firmado(self):
+        """XML firmado, cargado y verificado bajo demanda ('' si aún no hay)."""
+        return self.documento.xml if self.documento_id else ''
+
     def __str__(self):
         return f"eCF: {self.venta.ncf}"
 
 
+class ContingenciaECF(models.Model):
+    """Cola de reintento de e-CF en contingencia (ver utils/ecf_contingencia.py)"""
+    ESTADO_CHOICES = [
+        ('PENDIENTE', 'Pendiente'),
+        ('RESUELTA', 'Resuelta'),
+        ('DEAD_LETTER', 'Descartada tras reintentos'),
+    ]
+
+    venta = models.OneToOneField(Venta, on_delete=models.CASCADE, related_name='contingencia', primary_key=True)
+    negocio = models.ForeignKey(Negocio, on_delete=models.CASCADE, related_name='contingencias_ecf')
+    estado = models.CharField(max_length=15, choices=ESTADO_CHOICES, default='PENDIENTE')
+    intentos = models.PositiveIntegerField(default=0)
+    proximo_intento = models.DateTimeField()
+    ultimo_error = models.TextField(blank=True)
+    fecha_venta = models.DateTimeField(help_text="Prioridad: las ventas más antiguas primero")
+    fecha_ingreso = models.DateTimeField(auto_now_add=True)
+    fecha_resuelta = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['estado', 'fecha_venta']),
+            models.Index(fields=['negocio', 'estado']),
+            models.Index(fields=['estado', 'fecha_resuelta']),
+        ]
+
+    def __str__(self):
+        return f"Contingencia {self.venta_id} ({self.estado}, {self.intentos} intentos)"
+
+
 class DetalleVenta(models.Model):
     """Detalle de productos vendidos"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -970,15 +1109,26 @@ class Compra(models.Model):
     estado = models.CharField(max_length=15, choices=ESTADO, default='BORRADOR')
     asiento = models.ForeignKey(AsientoContable, on_delete=models.SET_NULL, null=True, blank=True)
 
+    # e-CF del proveedor, si la compra se importó de su XML (ver utils/ecf_recepcion.py)
+    documento_ecf = models.ForeignKey(
+        DocumentoECF, on_delete=models.PROTECT, null=True, blank=True, related_name='compras',
+    )
+
     notas = models.TextField(blank=True)
     creado_en = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['negocio', 'ncf_proveedor']),
+        ]
+
 
 class DetalleCompra(models.Model):
     """Detalle de productos comprados"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     compra = models.ForeignKey(Compra, on_delete=models.CASCADE, related_name='detalles')
     producto = models.ForeignKey(Producto, on_delete=models.PROTECT)
+    descripcion = models.CharField(max_length=200, blank=True, help_text="Descripción del proveedor (e-CF recibido)")
     
     cantidad = models.DecimalField(max_digits=12, decimal_places=2)
     precio_unitario = models.DecimalField(max_digits=12, decimal_places=2)
@@ -1104,6 +1254,10 @@ class MovimientoBancario(models.Model):
         AsientoContable, on_delete=models.SET_NULL, null=True, blank=True,
     )
     importado_de = models.CharField(max_length=100, blank=True, help_text="Fuente del extracto")
+    hash_contenido = models.CharField(
+        max_length=64, blank=True, editable=False,
+        help_text="SHA-256 de cuenta, fecha, monto, referencia y descripción (deduplicación de importaciones)",
+    )
 
     creado_en = models.DateTimeField(auto_now_add=True)
 
@@ -1113,6 +1267,12 @@ class MovimientoBancario(models.Model):
             models.Index(fields=['cuenta', 'fecha']),
             models.Index(fields=['cuenta', 'conciliado']),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['cuenta', 'hash_contenido'], condition=~Q(hash_contenido=''),
+                name='movimiento_bancario_hash_unico',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.fecha} - {self.descripcion} - {self.monto}"
@@ -1402,6 +1562,10 @@ class Pago(models.Model):
     cuenta_por_pagar = models.ForeignKey(CuentaPorPagar, on_delete=models.SET_NULL, null=True, blank=True, related_name='pagos')
 
     cuenta_bancaria = models.ForeignKey(CuentaBancaria, on_delete=models.SET_NULL, null=True, blank=True)
+    transaccion_bancaria = models.ForeignKey(
+        'TransaccionBancaria', on_delete=models.SET_NULL, null=True, blank=True, related_name='pagos',
+        help_text="Crédito del extracto bancario aplicado (aplicación automática de cobros)",
+    )
     asiento = models.ForeignKey(AsientoContable, on_delete=models.SET_NULL, null=True, blank=True)
 
     notas = models.TextField(blank=True)
@@ -2382,6 +2546,7 @@ class ArchivoImportacionBancaria(models.Model):
         ('MT940', 'MT940/SWIFT'),
         ('CSV_BANCO', 'CSV Banco'),
         ('QIF', 'QIF'),
+        ('CAMT053', 'ISO 20022 camt.053'),
     ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -2391,6 +2556,8 @@ class ArchivoImportacionBancaria(models.Model):
     formato = models.CharField(max_length=10, choices=FORMATO_CHOICES)
     fecha_importacion = models.DateTimeField(auto_now_add=True)
     registros_importados = models.IntegerField(default=0)
+    registros_duplicados = models.IntegerField(default=0)
+    registros_invalidos = models.IntegerField(default=0)
     registros_conciliados = models.IntegerField(default=0)
     importado_por = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True)
 
@@ -2426,6 +2593,10 @@ class TransaccionBancaria(models.Model):
     conciliada_por = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True, blank=True)
     fecha_conciliacion = models.DateTimeField(null=True, blank=True)
     notas = models.TextField(blank=True)
+    hash_contenido = models.CharField(
+        max_length=64, blank=True, editable=False,
+        help_text="SHA-256 de cuenta, fecha, monto, referencia y descripción (deduplicación de importaciones)",
+    )
     creado_en = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -2434,6 +2605,84 @@ class TransaccionBancaria(models.Model):
             models.Index(fields=['cuenta_bancaria', 'estado']),
             models.Index(fields=['cuenta_bancaria', 'fecha']),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['cuenta_bancaria', 'hash_contenido'], condition=~Q(hash_contenido=''),
+                name='transaccion_bancaria_hash_unico',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.fecha} - {self.descripcion} - {self.monto}"
+
+
+class ReglaConciliacion(models.Model):
+    """
+    Regla aprendida de los matches confirmados a mano: una línea del banco con
+    este patrón de descripción y monto dentro del rango se concilia con el
+    movimiento interno cuyo patrón es patron_movimiento (y, si se conoce, cuya
+    contrapartida contable es cuenta_contrapartida).
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    negocio = models.ForeignKey(Negocio, on_delete=models.CASCADE, related_name='reglas_conciliacion')
+    cuenta_bancaria = models.ForeignKey(CuentaBancaria, on_delete=models.CASCADE, related_name='reglas_conciliacion')
+    patron = models.CharField(max_length=300, help_text="Descripción normalizada de la línea del banco")
+    patron_movimiento = models.CharField(max_length=300, help_text="Descripción normalizada del movimiento interno")
+    monto_min = models.DecimalField(max_digits=15, decimal_places=2)
+    monto_max = models.DecimalField(max_digits=15, decimal_places=2)
+    cuenta_contrapartida = models.ForeignKey(
+        CuentaContable, on_delete=models.SET_NULL, null=True, blank=True,
+    )
+    confirmaciones = models.IntegerField(default=1)
+    aciertos = models.IntegerField(default=0, help_text="Conciliaciones automáticas hechas por la regla")
+    activa = models.BooleanField(default=True)
+    ultima_aplicacion = models.DateTimeField(null=True, blank=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['cuenta_bancaria', 'patron']
+        ordering = ['-confirmaciones']
+
+    def __str__(self):
+        return f"{self.patron} -> {self.patron_movimiento}"
+
+
+class SugerenciaCobro(models.Model):
+    """
+    Aplicación de un crédito bancario a cuentas por cobrar propuesta por el
+    motor de cobros. Las seguras se aplican al momento (APLICADA, con sus
+    Pago); el resto queda PENDIENTE en la cola de revisión.
+    asignaciones: [{"cuenta_por_cobrar": id, "numero": "CXC-...", "monto": "100.00"}]
+    """
+    METODO_CHOICES = [
+        ('REFERENCIA', 'Referencia de factura'),
+        ('CLIENTE', 'RNC / nombre del cliente'),
+        ('COMBINACION', 'Combinación de facturas'),
+        ('MONTO', 'Monto exacto'),
+    ]
+    ESTADO_CHOICES = [
+        ('PENDIENTE', 'Pendiente de revisión'),
+        ('APLICADA', 'Aplicada'),
+        ('RECHAZADA', 'Rechazada'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    negocio = models.ForeignKey(Negocio, on_delete=models.CASCADE, related_name='sugerencias_cobro')
+    transaccion = models.OneToOneField(TransaccionBancaria, on_delete=models.CASCADE, related_name='sugerencia_cobro')
+    cliente = models.ForeignKey(Cliente, on_delete=models.SET_NULL, null=True, blank=True)
+    metodo = models.CharField(max_length=12, choices=METODO_CHOICES)
+    confianza = models.DecimalField(max_digits=3, decimal_places=2)
+    asignaciones = models.JSONField(default=list)
+    estado = models.CharField(max_length=10, choices=ESTADO_CHOICES, default='PENDIENTE')
+    revisado_por = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True, blank=True)
+    fecha_revision = models.DateTimeField(null=True, blank=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-creado_en']
+        indexes = [
+            models.Index(fields=['negocio', 'estado']),
+        ]
+
+    def __str__(self):
+        return f"{self.transaccion} -> {self.metodo} ({self.confianza})"
@@ -2,11 +2,13 @@ from .base import BaseParser
 from .ofx_parser import OFXParser
 from .mt940_parser import MT940Parser
 from .csv_parser import CSVBankParser
+from .camt053_parser import CAMT053Parser
 
 PARSERS = {
     'OFX': OFXParser,
     'MT940': MT940Parser,
     'CSV_BANCO': CSVBankParser,
+    'CAMT053': CAMT053Parser,
 }
 
 
@@ -1,11 +1,12 @@
 """
 Base parser interface for bank file imports.
 """
+import io
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from decimal import Decimal
 from datetime import date
-from typing import List
+from typing import Iterator, List
 
 
 @dataclass
@@ -21,7 +22,12 @@ class ParsedTransaction:
 class BaseParser(ABC):
     """Base class for bank file parsers."""
 
-    @abstractmethod
+    # Rows the last parse() call could not interpret (reported as invalid)
+    invalidos = 0
+
+    # Bytes read from the stream per chunk by iter_parse
+    CHUNK_SIZE = 64 * 1024
+
     def parse(self, file_content, **kwargs) -> List[ParsedTransaction]:
         """
         Parse file content and return list of standardized transactions.
@@ -33,9 +39,59 @@ class BaseParser(ABC):
         Returns:
             List of ParsedTransaction objects
         """
+        if isinstance(file_content, str):
+            file_content = file_content.encode('utf-8')
+        return list(self.iter_parse(io.BytesIO(file_content), **kwargs))
+
+    @abstractmethod
+    def iter_parse(self, stream, **kwargs) -> Iterator[ParsedTransaction]:
+        """
+        Yield standardized transactions while reading ``stream`` incrementally.
+
+        Args:
+            stream: Binary file-like object (an UploadedFile, open file, BytesIO)
+            **kwargs: Additional format-specific options
+
+        Memory use does not depend on the file size; the stream is left open.
+        """
         raise NotImplementedError
 
     @abstractmethod
     def validate(self, file_content) -> bool:
         """Check if the file content is valid for this parser."""
         raise NotImplementedError
+
+
+def buffered_stream(stream, chunk_size=BaseParser.CHUNK_SIZE):
+    """
+    Buffered binary reader over ``stream`` (peek() looks at the file header
+    without consuming it). The caller's stream is never closed.
+    """
+    return io.BufferedReader(_Unclosable(stream), buffer_size=chunk_size)
+
+
+def text_stream(stream, chunk_size=BaseParser.CHUNK_SIZE, errors='ignore', encoding='utf-8'):
+    """
+    Decode a binary stream as text (UTF-8 by default) without reading it
+    whole (iterate it for lines). Invalid bytes are ignored by default, as the
+    parsers always did. ``stream`` may be a buffered_stream() already peeked
+    at. The caller's stream is never closed.
+    """
+    if not isinstance(getattr(stream, 'raw', None), _Unclosable):
+        stream = buffered_stream(stream, chunk_size)
+    return io.TextIOWrapper(stream, encoding=encoding, errors=errors, newline='')
+
+
+class _Unclosable(io.RawIOBase):
+    """Raw adapter so TextIOWrapper never closes the caller's stream."""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
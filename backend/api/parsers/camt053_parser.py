@@ -0,0 +1,188 @@
+"""
+ISO 20022 camt.053 (BankToCustomerStatement) parser.
+Streams <Ntry> elements with lxml iterparse and frees each one after use, so
+memory stays flat whatever the file size. Namespace-agnostic: works with
+camt.053.001.02 through .08.
+"""
+import logging
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from typing import Iterator
+
+from lxml import etree
+
+from .base import BaseParser, ParsedTransaction
+
+logger = logging.getLogger('api.parsers')
+
+NOT_PROVIDED = 'NOTPROVIDED'
+
+
+def _text(elem, path):
+    value = elem.findtext(path)
+    return value.strip() if value else ''
+
+
+def _digits(value):
+    return re.sub(r'\D', '', value or '')
+
+
+class CAMT053Parser(BaseParser):
+    """
+    Parser for ISO 20022 camt.053 bank statement files.
+
+    - Multi-account: every <Stmt> carries its own <Acct>; pass ``cuenta``
+      (the account number) to iter_parse to keep only that account's entries.
+    - Multi-page: pages are consecutive <Stmt> elements (or separate files);
+      entries are streamed in order and repeated pages are caught by the
+      import's content hash.
+    - Batch booking: an entry whose <NtryDtls> has several <TxDtls> with
+      amounts adding up to the entry amount is split into one transaction per
+      <TxDtls>; otherwise the entry is imported as a single line.
+    - Only booked entries (Sts BOOK) are returned; pending/info entries are skipped.
+    """
+
+    def iter_parse(self, stream, cuenta=None, **kwargs) -> Iterator[ParsedTransaction]:
+        count = 0
+        skipped = 0
+        self.invalidos = 0
+        cuenta_digits = _digits(cuenta)
+        accounts = {}
+
+        context = etree.iterparse(
+            stream, events=('end',), tag=('{*}Ntry', '{*}Stmt'),
+            resolve_entities=False, no_network=True,
+        )
+        for _, elem in context:
+            parent = elem.getparent()
+            if etree.QName(elem).localname == 'Stmt':
+                accounts.pop(elem, None)
+                self._release(elem, parent)
+                continue
+
+            if parent not in accounts:
+                accounts[parent] = self._account(parent)
+            account = accounts[parent]
+
+            if cuenta_digits and not _digits(account).endswith(cuenta_digits):
+                skipped += 1
+            else:
+                txns = self._parse_entry(elem)
+                if txns is None:
+                    self.invalidos += 1
+                else:
+                    for txn in txns:
+                        count += 1
+                        yield txn
+            self._release(elem, parent)
+
+        logger.info(
+            'Parsed %d transactions from camt.053 file (%d entries of other accounts skipped)',
+            count, skipped,
+        )
+
+    def validate(self, file_content) -> bool:
+        if isinstance(file_content, str):
+            file_content = file_content.encode('utf-8')
+        head = file_content[:4096]
+        return b'camt.053' in head or b'BkToCstmrStmt' in head
+
+    def _release(self, elem, parent):
+        """Free an element and its already processed siblings of the same kind."""
+        tag = elem.tag
+        elem.clear(keep_tail=False)
+        if parent is None:
+            return
+        previous = elem.getprevious()
+        while previous is not None and previous.tag == tag:
+            parent.remove(previous)
+            previous = elem.getprevious()
+
+    def _account(self, stmt):
+        if stmt is None:
+            return ''
+        return (
+            _text(stmt, '{*}Acct/{*}Id/{*}IBAN')
+            or _text(stmt, '{*}Acct/{*}Id/{*}Othr/{*}Id')
+        )
+
+    def _parse_entry(self, ntry):
+        """ParsedTransaction list for one <Ntry> ([] when not booked, None when unreadable)."""
+        status = _text(ntry, '{*}Sts/{*}Cd') or _text(ntry, '{*}Sts')
+        if status and status != 'BOOK':
+            return []
+
+        try:
+            monto = self._signed_amount(ntry, _text(ntry, '{*}CdtDbtInd'))
+            fecha = self._date(ntry.find('{*}BookgDt')) or self._date(ntry.find('{*}ValDt'))
+            if monto is None or fecha is None:
+                return None
+        except (ValueError, InvalidOperation) as e:
+            logger.debug('Failed to parse camt.053 entry: %s', e)
+            return None
+
+        entry_ref = _text(ntry, '{*}AcctSvcrRef') or _text(ntry, '{*}NtryRef')
+        entry_desc = _text(ntry, '{*}AddtlNtryInf')
+        details = ntry.findall('{*}NtryDtls/{*}TxDtls')
+
+        if len(details) > 1:
+            try:
+                parts = [
+                    self._signed_amount(tx, _text(tx, '{*}CdtDbtInd') or _text(ntry, '{*}CdtDbtInd'))
+                    for tx in details
+                ]
+            except (ValueError, InvalidOperation):
+                parts = [None]
+            if None not in parts and sum(parts) == monto:
+                return [
+                    ParsedTransaction(
+                        fecha=fecha,
+                        descripcion=self._description(tx) or entry_desc,
+                        monto=part,
+                        referencia=self._reference(tx) or entry_ref,
+                    )
+                    for tx, part in zip(details, parts)
+                ]
+
+        detail = details[0] if len(details) == 1 else None
+        return [ParsedTransaction(
+            fecha=fecha,
+            descripcion=(self._description(detail) if detail is not None else '') or entry_desc,
+            monto=monto,
+            referencia=(self._reference(detail) if detail is not None else '') or entry_ref,
+        )]
+
+    def _signed_amount(self, elem, indicator):
+        amount = _text(elem, '{*}Amt') or _text(elem, '{*}AmtDtls/{*}TxAmt/{*}Amt')
+        if not amount:
+            return None
+        value = Decimal(amount)
+        return -value if indicator == 'DBIT' else value
+
+    def _date(self, elem):
+        if elem is None:
+            return None
+        value = _text(elem, '{*}Dt') or _text(elem, '{*}DtTm')
+        if not value:
+            return None
+        return date.fromisoformat(value[:10])
+
+    def _reference(self, tx):
+        for path in ('{*}Refs/{*}EndToEndId', '{*}Refs/{*}AcctSvcrRef', '{*}Refs/{*}InstrId', '{*}Refs/{*}TxId'):
+            value = _text(tx, path)
+            if value and value != NOT_PROVIDED:
+                return value
+        return ''
+
+    def _description(self, tx):
+        ustrd = ' '.join(t.text.strip() for t in tx.findall('{*}RmtInf/{*}Ustrd') if t.text and t.text.strip())
+        if ustrd:
+            return ustrd
+        for path in ('{*}RltdPties/{*}Dbtr/{*}Nm', '{*}RltdPties/{*}Cdtr/{*}Nm',
+                     '{*}RltdPties/{*}Dbtr/{*}Pty/{*}Nm', '{*}RltdPties/{*}Cdtr/{*}Pty/{*}Nm',
+                     '{*}AddtlTxInf'):
+            value = _text(tx, path)
+            if value:
+                return value
+        return ''
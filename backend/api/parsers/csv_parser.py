@@ -3,13 +3,14 @@ CSV bank statement parser.
 Handles common CSV formats from Dominican banks.
 """
 import csv
+import itertools
 import logging
 from decimal import Decimal, InvalidOperation
 from datetime import datetime
 from io import StringIO
-from typing import List
+from typing import Iterator
 
-from .base import BaseParser, ParsedTransaction
+from .base import BaseParser, ParsedTransaction, text_stream
 
 logger = logging.getLogger('api.parsers')
 
@@ -28,29 +29,35 @@ class CSVBankParser(BaseParser):
 
     DATE_FORMATS = ['%d/%m/%Y', '%Y-%m-%d', '%m/%d/%Y', '%d-%m-%Y']
 
-    def parse(self, file_content, **kwargs) -> List[ParsedTransaction]:
-        if isinstance(file_content, bytes):
-            file_content = file_content.decode('utf-8', errors='ignore')
+    def iter_parse(self, stream, **kwargs) -> Iterator[ParsedTransaction]:
+        text = text_stream(stream, self.CHUNK_SIZE)
 
-        # Detect delimiter
-        dialect = csv.Sniffer().sniff(file_content[:2048], delimiters=',;\t|')
-        reader = csv.DictReader(StringIO(file_content), dialect=dialect)
+        # Detect delimiter on the first 2KB, completed to a full line
+        sample = text.read(2048)
+        sample += text.readline()
+        dialect = csv.Sniffer().sniff(sample[:2048], delimiters=',;\t|')
+        reader = csv.DictReader(itertools.chain(StringIO(sample), text), dialect=dialect)
 
         # Map columns
         fieldnames = [f.strip().lower() for f in (reader.fieldnames or [])]
         col_map = self._map_columns(fieldnames)
 
-        transactions = []
+        count = 0
+        self.invalidos = 0
         for row in reader:
             # Normalize keys
-            normalized = {k.strip().lower(): v.strip() for k, v in row.items() if v}
+            normalized = {k.strip().lower(): v.strip() for k, v in row.items() if k and v}
+            if not normalized:
+                continue
 
             txn = self._parse_row(normalized, col_map)
             if txn:
-                transactions.append(txn)
+                count += 1
+                yield txn
+            else:
+                self.invalidos += 1
 
-        logger.info('Parsed %d transactions from CSV file', len(transactions))
-        return transactions
+        logger.info('Parsed %d transactions from CSV file', count)
 
     def validate(self, file_content) -> bool:
         if isinstance(file_content, bytes):
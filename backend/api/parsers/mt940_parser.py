@@ -6,9 +6,9 @@ import re
 import logging
 from decimal import Decimal
 from datetime import datetime
-from typing import List
+from typing import Iterator
 
-from .base import BaseParser, ParsedTransaction
+from .base import BaseParser, ParsedTransaction, text_stream
 
 logger = logging.getLogger('api.parsers')
 
@@ -20,46 +20,50 @@ TAG_86 = re.compile(r':86:(.*)')
 class MT940Parser(BaseParser):
     """Parser for MT940/SWIFT bank statement files."""
 
-    def parse(self, file_content, **kwargs) -> List[ParsedTransaction]:
-        if isinstance(file_content, bytes):
-            file_content = file_content.decode('utf-8', errors='ignore')
-
-        transactions = []
-        lines = file_content.split('\n')
-        i = 0
+    def iter_parse(self, stream, **kwargs) -> Iterator[ParsedTransaction]:
+        """
+        Line-by-line state machine: a :61: line opens a transaction, the
+        first :86: after it (plus continuation lines) is its description, and
+        the next tag closes it.
+        """
+        count = 0
+        self.invalidos = 0
+        txn = None
+        description_parts = None
 
-        while i < len(lines):
-            line = lines[i].strip()
+        for raw in text_stream(stream, self.CHUNK_SIZE):
+            line = raw.strip()
 
             if line.startswith(':61:'):
+                if txn is not None:
+                    count += 1
+                    yield self._finish(txn, description_parts)
                 txn = self._parse_tag_61(line)
-                if txn:
-                    # Look for :86: tag on next lines
-                    description_parts = []
-                    j = i + 1
-                    while j < len(lines):
-                        next_line = lines[j].strip()
-                        if next_line.startswith(':86:'):
-                            description_parts.append(next_line[4:])
-                            j += 1
-                            # Continuation lines
-                            while j < len(lines) and not lines[j].strip().startswith(':'):
-                                description_parts.append(lines[j].strip())
-                                j += 1
-                            break
-                        elif next_line.startswith(':'):
-                            break
-                        j += 1
-
-                    if description_parts:
-                        txn.descripcion = ' '.join(description_parts)
-
-                    transactions.append(txn)
-
-            i += 1
-
-        logger.info('Parsed %d transactions from MT940 file', len(transactions))
-        return transactions
+                description_parts = None
+                if txn is None:
+                    self.invalidos += 1
+            elif txn is None:
+                continue
+            elif line.startswith(':86:') and description_parts is None:
+                description_parts = [line[4:]]
+            elif line.startswith(':'):
+                count += 1
+                yield self._finish(txn, description_parts)
+                txn = None
+            elif description_parts is not None and line:
+                # Continuation lines
+                description_parts.append(line)
+
+        if txn is not None:
+            count += 1
+            yield self._finish(txn, description_parts)
+
+        logger.info('Parsed %d transactions from MT940 file', count)
+
+    def _finish(self, txn, description_parts):
+        if description_parts:
+            txn.descripcion = ' '.join(description_parts)
+        return txn
 
     def validate(self, file_content) -> bool:
         if isinstance(file_content, bytes):
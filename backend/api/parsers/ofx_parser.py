@@ -1,44 +1,89 @@
 """
 OFX/QFX bank file parser.
-Uses ofxparse library.
+Streams <STMTTRN> blocks out of the file (SGML OFX 1.x and XML OFX 2.x)
+instead of loading the whole document into ofxparse. The text is decoded with
+the codec the file declares (SGML ENCODING/CHARSET header or the XML
+declaration), as ofxparse did.
 """
+import codecs
+import html
 import logging
-from decimal import Decimal
-from io import BytesIO
-from typing import List
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from typing import Iterator
 
-from .base import BaseParser, ParsedTransaction
+from .base import BaseParser, ParsedTransaction, buffered_stream, text_stream
 
 logger = logging.getLogger('api.parsers')
 
+STMTTRN_OPEN = '<STMTTRN>'
+STMTTRN_BLOCK = re.compile(r'<STMTTRN>(.*?)</STMTTRN>', re.S | re.I)
+# Leaf elements: closing tag optional in SGML OFX
+FIELD = re.compile(r'<(\w+)>([^<\r\n]*)')
+SGML_HEADER = re.compile(rb'^\s*(ENCODING|CHARSET)\s*:\s*([\w-]+)', re.M | re.I)
+XML_DECLARATION = re.compile(rb'<\?xml[^>]*encoding\s*=\s*["\']([\w.-]+)["\']', re.I)
 
-class OFXParser(BaseParser):
-    """Parser for OFX and QFX bank statement files."""
 
-    def parse(self, file_content, **kwargs) -> List[ParsedTransaction]:
-        try:
-            from ofxparse import OfxParser as _OfxParser
-        except ImportError:
-            raise ImportError('ofxparse is required. Install with: pip install ofxparse')
+def ofx_encoding(head):
+    """
+    Codec for an OFX file from its first bytes: OFX 1.x ENCODING:USASCII uses
+    the CHARSET code page (1252 when missing or NONE, 8859-1 is Latin-1);
+    ENCODING:UTF-8/UNICODE and OFX 2.x without an XML encoding are UTF-8.
+    """
+    body = head.find(b'<')
+    sgml = head if body < 0 else head[:body]
+    headers = {k.upper(): v.upper() for k, v in SGML_HEADER.findall(sgml)}
+    if headers.get(b'ENCODING') == b'USASCII':
+        charset = headers.get(b'CHARSET', b'1252').decode('ascii')
+        if charset == 'NONE':
+            charset = '1252'
+        encoding = 'iso-8859-1' if charset in ('8859-1', 'ISO-8859-1') else f'cp{charset}'
+    elif b'ENCODING' in headers:
+        encoding = 'utf-8'
+    else:
+        declared = XML_DECLARATION.search(head)
+        encoding = declared.group(1).decode('ascii') if declared else 'utf-8'
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        logger.warning('Unknown OFX encoding %s, reading as UTF-8', encoding)
+        return 'utf-8'
 
-        if isinstance(file_content, str):
-            file_content = file_content.encode('utf-8')
 
-        ofx = _OfxParser.parse(BytesIO(file_content))
-        transactions = []
+class OFXParser(BaseParser):
+    """Parser for OFX and QFX bank statement files."""
+
+    def iter_parse(self, stream, **kwargs) -> Iterator[ParsedTransaction]:
+        count = 0
+        self.invalidos = 0
+        buffered = buffered_stream(stream, self.CHUNK_SIZE)
+        text = text_stream(buffered, encoding=ofx_encoding(buffered.peek(self.CHUNK_SIZE)))
+        buffer = ''
 
-        for account in ofx.accounts:
-            for txn in account.statement.transactions:
-                transactions.append(ParsedTransaction(
-                    fecha=txn.date.date() if hasattr(txn.date, 'date') else txn.date,
-                    descripcion=txn.memo or txn.payee or '',
-                    monto=Decimal(str(txn.amount)),
-                    referencia=txn.id or '',
-                    saldo=None,
-                ))
+        while True:
+            chunk = text.read(self.CHUNK_SIZE)
+            buffer += chunk
+            end = 0
+            for match in STMTTRN_BLOCK.finditer(buffer):
+                end = match.end()
+                txn = self._parse_block(match.group(1))
+                if txn is None:
+                    self.invalidos += 1
+                else:
+                    count += 1
+                    yield txn
+            buffer = buffer[end:]
+            if not chunk:
+                break
+            # Keep only what may still hold an unfinished transaction
+            start = buffer.upper().rfind(STMTTRN_OPEN)
+            if start >= 0:
+                buffer = buffer[start:]
+            else:
+                buffer = buffer[-(len(STMTTRN_OPEN) - 1):]
 
-        logger.info('Parsed %d transactions from OFX file', len(transactions))
-        return transactions
+        logger.info('Parsed %d transactions from OFX file', count)
 
     def validate(self, file_content) -> bool:
         if isinstance(file_content, str):
@@ -46,3 +91,26 @@ class OFXParser(BaseParser):
 
         content_str = file_content.decode('utf-8', errors='ignore')
         return 'OFXHEADER' in content_str or '<OFX>' in content_str.upper()
+
+    def _parse_block(self, block):
+        """Build a ParsedTransaction from the body of one <STMTTRN>."""
+        fields = {tag.upper(): html.unescape(value.strip()) for tag, value in FIELD.findall(block)}
+        try:
+            # DTPOSTED: YYYYMMDD[HHMMSS[.XXX]][[gmt offset:tz name]] — the posting date as the bank reports it
+            posted = fields['DTPOSTED']
+            fecha = date(int(posted[:4]), int(posted[4:6]), int(posted[6:8]))
+            amount = fields['TRNAMT']
+            if ',' in amount and '.' not in amount:
+                amount = amount.replace(',', '.')
+            monto = Decimal(amount)
+        except (KeyError, ValueError, InvalidOperation) as e:
+            logger.debug('Failed to parse OFX transaction: %s', e)
+            return None
+
+        return ParsedTransaction(
+            fecha=fecha,
+            descripcion=fields.get('MEMO') or fields.get('NAME') or '',
+            monto=monto,
+            referencia=fields.get('FITID', ''),
+            saldo=None,
+        )
@@ -17,7 +17,7 @@ from .models import (
     CategoriaActivo, ActivoFijo, DepreciacionMensual, BajaActivo,
     WorkflowConfig, WorkflowStep, SolicitudAprobacion, DecisionAprobacion,
     Presupuesto, LineaPresupuesto,
-    ArchivoImportacionBancaria, TransaccionBancaria,
+    ArchivoImportacionBancaria, TransaccionBancaria, SugerenciaCobro, ArchivoAuditoria,
 )
 
 
@@ -697,6 +697,14 @@ class AuditLogSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
+class ArchivoAuditoriaSerializer(serializers.ModelSerializer):
+    # El archivo y sus totales son de todos los negocios: solo se expone el mes
+    class Meta:
+        model = ArchivoAuditoria
+        fields = ['mes', 'creado_en']
+        read_only_fields = fields
+
+
 class LicenciaSistemaSerializer(serializers.ModelSerializer):
     class Meta:
         model = LicenciaSistema
@@ -996,7 +1004,31 @@ class ArchivoImportacionBancariaSerializer(serializers.ModelSerializer):
         model = ArchivoImportacionBancaria
         fields = [
             'id', 'cuenta_bancaria', 'archivo_nombre', 'formato',
-            'fecha_importacion', 'registros_importados', 'registros_conciliados',
+            'fecha_importacion', 'registros_importados', 'registros_duplicados',
+            'registros_invalidos', 'registros_conciliados',
             'importado_por', 'importado_por_nombre',
         ]
-        read_only_fields = ['id', 'fecha_importacion', 'registros_importados', 'registros_conciliados']
+        read_only_fields = [
+            'id', 'fecha_importacion', 'registros_importados', 'registros_duplicados',
+            'registros_invalidos', 'registros_conciliados',
+        ]
+
+
+class SugerenciaCobroSerializer(serializers.ModelSerializer):
+    transaccion_fecha = serializers.DateField(source='transaccion.fecha', read_only=True)
+    transaccion_descripcion = serializers.CharField(source='transaccion.descripcion', read_only=True)
+    transaccion_referencia = serializers.CharField(source='transaccion.referencia', read_only=True)
+    transaccion_monto = serializers.DecimalField(
+        source='transaccion.monto', max_digits=15, decimal_places=2, read_only=True,
+    )
+    cliente_nombre = serializers.CharField(source='cliente.nombre', read_only=True, default=None)
+
+    class Meta:
+        model = SugerenciaCobro
+        fields = [
+            'id', 'transaccion', 'transaccion_fecha', 'transaccion_descripcion',
+            'transaccion_referencia', 'transaccion_monto', 'cliente', 'cliente_nombre',
+            'metodo', 'confianza', 'asignaciones', 'estado', 'revisado_por',
+            'fecha_revision', 'creado_en',
+        ]
+        read_only_fields = fields
@@ -4,9 +4,10 @@ from django.dispatch import receiver
 from django.core.cache import cache
 from django.utils import timezone as tz_utils
 from .models import (
-    Venta, Compra, Producto, FacturaElectronica, AuditLog,
+    Venta, Compra, Producto, FacturaElectronica,
     Usuario, CuadreCaja, AlertaSeguridad,
 )
+from .utils.auditoria import registrar_auditoria
 
 logger = logging.getLogger('audit')
 
@@ -29,9 +30,9 @@ def audit_venta_update(sender, instance, **kwargs):
             changes[field] = {'old': str(old_val), 'new': str(new_val)}
 
     if changes and instance.negocio_id:
-        AuditLog.objects.create(
+        registrar_auditoria(
             negocio_id=instance.negocio_id,
-            usuario=instance.cajero,
+            usuario_id=instance.cajero_id,
             accion='UPDATE',
             modelo='Venta',
             objeto_id=str(instance.pk),
@@ -54,9 +55,9 @@ def audit_venta_update(sender, instance, **kwargs):
 def audit_venta_create(sender, instance, created, **kwargs):
     """Log new sales."""
     if created and instance.negocio_id:
-        AuditLog.objects.create(
+        registrar_auditoria(
             negocio_id=instance.negocio_id,
-            usuario=instance.cajero,
+            usuario_id=instance.cajero_id,
             accion='CREATE',
             modelo='Venta',
             objeto_id=str(instance.pk),
@@ -98,7 +99,7 @@ def audit_venta_create(sender, instance, created, **kwargs):
                         f'Venta {instance.numero} por ${instance.total} '
                         f'requiere doble confirmacion (umbral: ${umbral})'
                     ),
-                    usuario=instance.cajero,
+                    usuario_id=instance.cajero_id,
                     datos={'venta_id': str(instance.pk), 'total': str(instance.total)},
                 )
         except Exception as e:
@@ -111,9 +112,9 @@ def audit_ecf_create(sender, instance, created, **kwargs):
     if created:
         venta = instance.venta
         if venta.negocio_id:
-            AuditLog.objects.create(
+            registrar_auditoria(
                 negocio_id=venta.negocio_id,
-                usuario=venta.cajero,
+                usuario_id=venta.cajero_id,
                 accion='CREATE',
                 modelo='FacturaElectronica',
                 objeto_id=str(instance.pk),
@@ -140,9 +141,9 @@ def audit_producto_price_change(sender, instance, **kwargs):
             changes[field] = {'old': str(old_val), 'new': str(new_val)}
 
     if changes and instance.negocio_id:
-        AuditLog.objects.create(
+        registrar_auditoria(
             negocio_id=instance.negocio_id,
-            usuario=None,
+            usuario_id=None,
             accion='UPDATE',
             modelo='Producto',
             objeto_id=str(instance.pk),
@@ -184,9 +185,9 @@ def detect_role_change(sender, instance, **kwargs):
         return
 
     if old.rol != instance.rol and instance.negocio_id:
-        AuditLog.objects.create(
+        registrar_auditoria(
             negocio_id=instance.negocio_id,
-            usuario=None,
+            usuario_id=None,
             accion='ROLE_CHANGE',
             modelo='Usuario',
             objeto_id=str(instance.pk),
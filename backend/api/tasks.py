@@ -1,3 +1,4 @@
+import os
 from celery import shared_task
 import logging
 
@@ -8,57 +9,120 @@ logger = logging.getLogger('api')
 # FISCAL TASKS (existing)
 # =============================================================================
 
-@shared_task(bind=True, max_retries=3, default_retry_delay=60)
-def enviar_ecf_async(self, venta_id):
-    """Envia e-CF a DGII en background."""
+@shared_task(bind=True)
+def enviar_ecf_async(self, venta_id, usuario_id=None, job_id=None):
+    """
+    Firma y envía el e-CF de una venta a la DGII en background.
+
+    La venta ya tiene NCF (asignado por emitir_ecf). Si ya existe un XML
+    firmado (reintento de contingencia) se reenvía tal cual. Las facturas de
+    consumo bajo el umbral se reportan con el RFCE (ver ecf_lote). El resultado
+    se publica al usuario por WebSocket ('ecf_emision').
+
+    Si el envío falla la venta queda EN_CONTINGENCIA y la tarea termina: los
+    reintentos son de la cola de contingencia (ecf_contingencia), no de Celery.
+    """
+    from datetime import timedelta
+    from django.db import transaction
+    from django.utils import timezone
     from api.models import Venta, FacturaElectronica
-    from api.utils.ecf_generator import ECFGenerator
+    from api.utils.ecf_documentos import guardar_documentos
+    from api.utils.ecf_generator import ECFGenerator, construir_rfce, es_resumen_consumo
+    from api.utils.ecf_estado import intervalo_consulta
+    from api.utils.ecf_lote import ESTADO_FISCAL_DGII, ESTADO_FISCAL_RESUMEN, liberar_emision, qr_code_url
+    from api.utils.ncf_manager import TIPO_ECF_MAP
+    from api.utils.notificaciones import notificar_usuario
     from api.utils.xml_signer import sign_ecf_xml
     from api.utils.dgii_api import DGIIClient
 
+    job_id = job_id or self.request.id
+
+    def _notificar(data):
+        if usuario_id:
+            notificar_usuario(usuario_id, 'ecf_emision', {
+                'job_id': job_id, 'venta_id': str(venta_id), **data,
+            })
+
     try:
-        venta = Venta.objects.select_related('negocio', 'cliente').get(id=venta_id)
+        venta = (
+            Venta.objects.select_related('negocio', 'cliente', 'sucursal', 'venta_referencia')
+            .prefetch_related('detalles__producto')
+            .get(id=venta_id)
+        )
+        if venta.estado_fiscal in ('ENVIADO', 'ACEPTADO', 'RECHAZADO'):
+            logger.info('e-CF de venta %s ya procesado (%s)', venta.numero, venta.estado_fiscal)
+            return {'status': 'skip', 'estado_fiscal': venta.estado_fiscal}
         negocio = venta.negocio
+        rnc = negocio.identificacion_fiscal.replace('-', '')
+
+        ecf = FacturaElectronica.objects.filter(venta=venta).first()
+        xml_resumen = None
+        if ecf and ecf.xml_firmado:
+            xml_firmado = ecf.xml_firmado
+            if ecf.resumen_id:
+                xml_resumen = ecf.resumen.xml
+        else:
+            generador = ECFGenerator(venta)
+            arbol = generador.generate_tree()
+
+            def firmar(xml):
+                return sign_ecf_xml(
+                    xml,
+                    negocio.certificado_digital_path,
+                    os.getenv(negocio.certificado_pass_env or '', ''),
+                    tenant=negocio.id,
+                )
 
-        generator = ECFGenerator(venta)
-        xml_sin_firma = generator.generar()
-        xml_firmado = sign_ecf_xml(
-            xml_sin_firma,
-            negocio.certificado_digital_path,
-            negocio.certificado_pass_env
-        )
+            if es_resumen_consumo(generador._get_ecf_tipo(), venta.total):
+                xml_resumen = firmar(construir_rfce(arbol))
+            xml_firmado = firmar(arbol)
 
         cliente = DGIIClient(
             ambiente=negocio.ambiente_fiscal,
-            rnc=negocio.identificacion_fiscal,
+            rnc=rnc,
             usuario=negocio.api_fiscal_usuario,
             clave=negocio.api_fiscal_clave_decrypted,
         )
-        resultado = cliente.enviar_ecf(xml_firmado)
-
-        FacturaElectronica.objects.update_or_create(
-            venta=venta,
-            defaults={
-                'track_id': resultado.get('trackId', ''),
-                'xml_firmado': xml_firmado,
-                'respuesta_dgii': resultado,
-                'qr_code_url': (
-                    f"https://dgii.gov.do/ecf?rnc={negocio.identificacion_fiscal}"
-                    f"&encf={venta.ncf}&sc={venta.codigo_seguridad_dgii}"
-                ),
-            }
-        )
-
-        if resultado.get('estado') == 'ACEPTADO':
-            venta.estado_fiscal = 'ACEPTADO'
-        elif resultado.get('estado') == 'RECHAZADO':
-            venta.estado_fiscal = 'RECHAZADO'
+        if xml_resumen:
+            resultado = cliente.enviar_resumen(xml_resumen)
         else:
-            venta.estado_fiscal = 'ENVIADO'
-        venta.save(update_fields=['estado_fiscal'])
+            resultado = cliente.enviar_ecf(xml_firmado)
+        dgii_estado = resultado.get('estado', '')
+        hashes = guardar_documentos([xml_firmado] + ([xml_resumen] if xml_resumen else []))
+
+        with transaction.atomic():
+            ecf, _ = FacturaElectronica.objects.update_or_create(
+                venta=venta,
+                defaults={
+                    'ecf_tipo': TIPO_ECF_MAP.get(venta.tipo_comprobante, '32'),
+                    'track_id': resultado.get('track_id') or None,
+                    'documento_id': hashes[0],
+                    'resumen_id': hashes[1] if xml_resumen else None,
+                    'fecha_firma': ecf.fecha_firma if ecf and ecf.fecha_firma else timezone.now(),
+                    'respuesta_dgii': resultado.get('respuesta_cruda'),
+                    'qr_code_url': qr_code_url(rnc, venta.ncf, venta.codigo_seguridad_dgii),
+                    'proxima_consulta': (
+                        None if xml_resumen else timezone.now() + timedelta(seconds=intervalo_consulta(0))
+                    ),
+                }
+            )
+            estados = ESTADO_FISCAL_RESUMEN if xml_resumen else ESTADO_FISCAL_DGII
+            venta.estado_fiscal = estados.get(dgii_estado, 'ENVIADO')
+            venta.save(update_fields=['estado_fiscal'])
 
-        logger.info('e-CF enviado para venta %s: %s', venta.numero, resultado.get('estado'))
-        return {'status': 'ok', 'track_id': resultado.get('trackId')}
+        logger.info(
+            'e-CF enviado para venta %s: ncf=%s track=%s dgii_status=%s',
+            venta.numero, venta.ncf, ecf.track_id, dgii_estado,
+        )
+        _notificar({
+            'ncf': venta.ncf,
+            'estado_fiscal': venta.estado_fiscal,
+            'dgii_estado': dgii_estado,
+            'track_id': ecf.track_id or '',
+            'qr_url': ecf.qr_code_url,
+            'mensaje': resultado.get('mensaje', ''),
+        })
+        return {'status': 'ok', 'track_id': ecf.track_id, 'estado_fiscal': venta.estado_fiscal}
 
     except Exception as exc:
         logger.error('Error enviando e-CF para venta %s: %s', venta_id, exc)
@@ -66,21 +130,89 @@ def enviar_ecf_async(self, venta_id):
             Venta.objects.filter(id=venta_id).update(estado_fiscal='EN_CONTINGENCIA')
         except Exception:
             pass
-        raise self.retry(exc=exc)
+        _notificar({'estado_fiscal': 'EN_CONTINGENCIA', 'error': str(exc)})
+        return {'status': 'contingencia', 'error': str(exc)}
+    finally:
+        liberar_emision(venta_id, job_id)
+
+
+@shared_task(time_limit=3600, soft_time_limit=3540)
+def emitir_ecf_lote_async(negocio_id, usuario_id=None, venta_ids=None, limite=None, lote_id=None):
+    """Emite en lote los e-CF pendientes de un negocio (cierre de mes)."""
+    from api.models import Negocio, Usuario
+    from api.utils.ecf_lote import EmisorLoteECF
+
+    negocio = Negocio.objects.get(id=negocio_id)
+    usuario = Usuario.objects.filter(id=usuario_id).first() if usuario_id else None
+    emisor = EmisorLoteECF(negocio, usuario=usuario, lote_id=lote_id)
+    try:
+        return emisor.ejecutar(venta_ids=venta_ids, limite=limite)
+    except ValueError as e:
+        logger.error('Lote e-CF %s no ejecutado: %s', emisor.lote_id, e)
+        emisor.notificar({'evento': 'error', 'error': str(e)})
+        return {'lote_id': emisor.lote_id, 'error': str(e)}
 
 
 @shared_task
+def consultar_estados_ecf():
+    """Consulta en la DGII el estado de los e-CF ENVIADO con consulta vencida."""
+    from django.core.cache import cache
+    from api.utils.ecf_estado import ConsultorEstadosECF
+
+    # Un solo ciclo a la vez aunque beat dispare antes de que termine el anterior.
+    if not cache.add('lock:consultar_estados_ecf', 1, timeout=600):
+        return {'status': 'skip'}
+    try:
+        return ConsultorEstadosECF().ejecutar()
+    finally:
+        cache.delete('lock:consultar_estados_ecf')
+
+
+@shared_task(time_limit=900)
 def reintentar_ecf_contingencia():
-    """Reintenta envio de e-CF en contingencia."""
-    from api.models import Venta
+    """Reenvía los e-CF vencidos de la cola de contingencia (ver ecf_contingencia)."""
+    from django.core.cache import cache
+    from api.utils.ecf_contingencia import ColaContingenciaECF
+
+    if not cache.add('lock:reintentar_ecf_contingencia', 1, timeout=900):
+        return {'status': 'skip'}
+    try:
+        return ColaContingenciaECF().ejecutar()
+    finally:
+        cache.delete('lock:reintentar_ecf_contingencia')
 
-    ventas = Venta.objects.filter(
-        estado_fiscal='EN_CONTINGENCIA'
-    ).values_list('id', flat=True)[:20]
-    for venta_id in ventas:
-        enviar_ecf_async.delay(str(venta_id))
 
-    logger.info('Reintentando %d e-CF en contingencia', len(ventas))
+@shared_task
+def mantener_secuencias_ncf():
+    """
+    Anula los NCF de bloques y secuencias vencidas (608) y avisa a los negocios
+    cuyas secuencias se agotan o vencen pronto.
+    """
+    from api.models import Negocio, SecuenciaNCF
+    from api.utils.ncf_manager import cerrar_secuencias_vencidas, pronostico_agotamiento
+    from api.utils.notificaciones import notificar_negocio
+
+    resumen = cerrar_secuencias_vencidas()
+    alertas = 0
+    negocio_ids = SecuenciaNCF.objects.filter(activa=True).values_list('negocio_id', flat=True).distinct()
+    for negocio in Negocio.objects.filter(id__in=negocio_ids):
+        en_alerta = [p for p in pronostico_agotamiento(negocio) if p['alerta']]
+        if not en_alerta:
+            continue
+        alertas += 1
+        logger.warning('Secuencias NCF por agotarse en negocio %s: %s', negocio.id, en_alerta)
+        notificar_negocio(negocio.id, 'ncf_agotamiento', {
+            'secuencias': [
+                {
+                    'tipo_comprobante': p['tipo_comprobante'],
+                    'disponibles': p['disponibles'],
+                    'dias_restantes': p['dias_restantes'],
+                    'fecha_vencimiento': p['fecha_vencimiento'].isoformat(),
+                }
+                for p in en_alerta
+            ],
+        })
+    return {**resumen, 'negocios_en_alerta': alertas}
 
 
 # =============================================================================
@@ -115,18 +247,12 @@ def generar_analisis_ai_async(self, negocio_id, tipo, dias=30):
 def generar_reporte_fiscal_async(negocio_id, year, month, tipo):
     """Genera reporte fiscal 606/607/608 en background."""
     from api.models import Negocio
-    from api.fiscal.strategies.dgii import DGIIStrategy
+    from api.fiscal.registry import FiscalStrategyFactory
 
     try:
         negocio = Negocio.objects.get(id=negocio_id)
-        strategy = DGIIStrategy()
-
-        if tipo == '606':
-            return strategy.generar_reporte_compras(negocio, year, month)
-        elif tipo == '607':
-            return strategy.generar_reporte_ventas(negocio, year, month)
-        elif tipo == '608':
-            return strategy.generar_reporte_anulaciones(negocio, year, month)
+        strategy = FiscalStrategyFactory.get_strategy(negocio)
+        return strategy.generar_reporte(tipo, year, month)
     except Exception as exc:
         logger.error('Error generando reporte %s: %s', tipo, exc)
         raise
@@ -182,6 +308,29 @@ def limpiar_sesiones_expiradas():
     return {'cleaned': count}
 
 
+@shared_task(time_limit=60)
+def volcar_auditoria():
+    """Guarda en lote los eventos de auditoría encolados en Redis."""
+    from api.utils.auditoria import volcar_auditoria as volcar
+
+    count = volcar()
+    if count:
+        logger.info('Volcados %d eventos de auditoría', count)
+    return {'volcados': count}
+
+
+@shared_task
+def mantener_particiones_auditoria():
+    """Crea las particiones de auditoría de los próximos meses y archiva las vencidas."""
+    from api.utils.particiones_auditoria import archivar_particiones, crear_particiones
+
+    creadas = crear_particiones()
+    archivadas = archivar_particiones()
+    for archivo in archivadas:
+        logger.info('Auditoría de %s archivada: %s (%d registros)', f'{archivo.mes:%Y-%m}', archivo.archivo, archivo.registros)
+    return {'creadas': len(creadas), 'archivadas': len(archivadas)}
+
+
 @shared_task
 def detectar_anomalias_todos():
     """Detectar anomalias en todos los negocios activos."""
@@ -383,14 +532,19 @@ def escalar_aprobaciones_timeout():
 
 @shared_task
 def conciliar_automatico_async(importacion_id):
-    """Run auto-matching on a bank import file asynchronously."""
+    """Run auto-matching and cash application on a bank import file asynchronously."""
     from api.models import ArchivoImportacionBancaria
     from api.conciliation_engine import ConciliationEngine
+    from api.cash_application_engine import CashApplicationEngine
 
     try:
-        importacion = ArchivoImportacionBancaria.objects.get(id=importacion_id)
+        importacion = ArchivoImportacionBancaria.objects.select_related('negocio').get(id=importacion_id)
         engine = ConciliationEngine()
         stats = engine.auto_match(importacion)
+        # Credits of the import are then applied to open receivables
+        stats['cobros'] = CashApplicationEngine(importacion.negocio).run(
+            importacion.transacciones.all(), usuario=importacion.importado_por,
+        )
         logger.info('Auto-conciliation for %s: %s', importacion_id, stats)
         return stats
     except ArchivoImportacionBancaria.DoesNotExist:
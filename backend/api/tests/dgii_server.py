@@ -0,0 +1,33 @@
+"""
+Servidor HTTP local que imita la API de e-CF de la DGII, para tests.
+
+Variante determinista de api.utils.dgii_simulador.SimuladorDGII.
+
+Uso:
+    with DGIIStandIn() as dgii:
+        cliente = DGIIClient('TEST', '101000000', base_url=dgii.base_url)
+        dgii.modo = 'error'   # 'ok' | 'error' (HTTP 500) | '401' | 'rechazo' (HTTP 400)
+"""
+from api.utils.dgii_simulador import SimuladorDGII
+
+STATUS_POR_MODO = {'ok': 200, 'error': 500, '401': 401, 'rechazo': 400}
+
+
+class DGIIStandIn(SimuladorDGII):
+    def __init__(self):
+        super().__init__()
+        self.modo = 'ok'
+        self.estado_consulta = 'ACEPTADO'
+        self.fallos_transitorios = 0
+
+    def decidir(self, client_address, recepcion=False):
+        with self.lock:
+            self.peticiones += 1
+            self.conexiones.add(client_address)
+            if self.fallos_transitorios > 0:
+                self.fallos_transitorios -= 1
+                return 503
+        return STATUS_POR_MODO[self.modo]
+
+    def estado_de(self, track_id):
+        return self.estado_consulta
@@ -350,3 +350,107 @@ class TransaccionBancariaFactory(DjangoModelFactory):
     referencia = factory.Sequence(lambda n: f'REF-{n:06d}')
     monto = Decimal('5000.00')
     estado = 'PENDIENTE'
+
+
+def crear_ca(path, cn='CA de prueba e-CF'):
+    """CA autofirmada para tests de recepción: escribe el PEM y retorna (pem_path, clave, certificado)."""
+    from datetime import datetime, timedelta, timezone
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nombre = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, cn)])
+    ahora = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(nombre).issuer_name(nombre)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(ahora - timedelta(days=2))
+        .not_valid_after(ahora + timedelta(days=3650))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False)
+        .add_extension(x509.KeyUsage(
+            digital_signature=True, content_commitment=False, key_encipherment=False,
+            data_encipherment=False, key_agreement=False, key_cert_sign=True, crl_sign=True,
+            encipher_only=False, decipher_only=False,
+        ), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    return str(path), key, cert
+
+
+def crear_p12(path, password, dias=365, cn='Test e-CF', ca=None, rnc=None):
+    """
+    Certificado .p12 para tests de firma e-CF: autofirmado, o emitido por
+    ``ca`` (lo que retorna crear_ca) con el RNC en el serialNumber del sujeto.
+    """
+    from datetime import datetime, timedelta, timezone
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.serialization import pkcs12
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    atributos = [x509.NameAttribute(NameOID.COMMON_NAME, cn)]
+    if rnc:
+        atributos.append(x509.NameAttribute(NameOID.SERIAL_NUMBER, f'RNC{rnc}'))
+    nombre = x509.Name(atributos)
+    emisor, clave_emisor = (ca[2].subject, ca[1]) if ca else (nombre, key)
+    ahora = datetime.now(timezone.utc)
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(nombre).issuer_name(emisor)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(ahora - timedelta(days=2))
+        .not_valid_after(ahora + timedelta(days=dias))
+    )
+    if ca:
+        builder = builder.add_extension(
+            x509.AuthorityKeyIdentifier.from_issuer_public_key(ca[1].public_key()), critical=False,
+        ).add_extension(
+            x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False,
+        ).add_extension(
+            x509.SubjectAlternativeName([x509.RFC822Name(f'{rnc or "firma"}@proveedor.test')]), critical=False,
+        ).add_extension(
+            x509.ExtendedKeyUsage([x509.oid.ExtendedKeyUsageOID.CLIENT_AUTH]), critical=False,
+        )
+    cert = builder.sign(clave_emisor, hashes.SHA256())
+    path.write_bytes(pkcs12.serialize_key_and_certificates(
+        b'test', key, cert, None, serialization.BestAvailableEncryption(password.encode()),
+    ))
+    return str(path)
+
+
+def crear_ecf_firmado(p12_path, password, encf, rnc_comprador, rnc_emisor='131000001',
+                      items=(('Papel bond', '2', '500.00'),)):
+    """e-CF 31 firmado por un proveedor, para tests de recepción."""
+    from datetime import date
+    from api.utils.ecf_generator import construir_ecf, construir_emisor
+    from api.utils.xml_signer import sign_ecf_xml
+
+    detalles = []
+    for nombre, cantidad, precio in items:
+        subtotal = Decimal(cantidad) * Decimal(precio)
+        detalles.append({
+            'cantidad': Decimal(cantidad), 'precio_unitario': Decimal(precio), 'descuento': Decimal('0'),
+            'subtotal': subtotal, 'impuesto': (subtotal * Decimal('0.18')).quantize(Decimal('0.01')),
+            'producto__nombre': nombre, 'producto__tipo': 'PRODUCTO',
+            'producto__aplica_impuesto': True, 'producto__tasa_impuesto': Decimal('18.00'),
+        })
+    subtotal = sum(d['subtotal'] for d in detalles)
+    impuestos = sum(d['impuesto'] for d in detalles)
+    datos = {
+        'ecf_tipo': '31', 'ncf': encf, 'fecha': date(2025, 1, 15), 'fecha_vencimiento': None,
+        'total_impuestos': impuestos, 'total': subtotal + impuestos, 'tipo_pago': 'CREDITO',
+        'codigo_seguridad_dgii': '123456', 'cliente_id': 1,
+        'cliente__numero_documento': rnc_comprador, 'cliente__nombre': 'Comprador',
+        'venta_referencia_id': None, 'detalles': detalles,
+    }
+    emisor = construir_emisor(rnc_emisor, 'Papeleria Proveedor SRL', 'Papeleria', '001', 'Calle 1')
+    return sign_ecf_xml(construir_ecf(datos, emisor), p12_path, password).encode('utf-8')
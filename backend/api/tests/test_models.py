@@ -10,7 +10,8 @@ from .factories import (
     CategoriaActivoFactory, ActivoFijoFactory,
     WorkflowConfigFactory, WorkflowStepFactory, SolicitudAprobacionFactory,
     PresupuestoFactory, LineaPresupuestoFactory,
-    ArchivoImportacionBancariaFactory, TransaccionBancariaFactory,
+    ArchivoImportacionBancariaFactory, TransaccionBancariaFactory, AlmacenFactory,
+    crear_ca, crear_p12, crear_ecf_firmado,
 )
 
 
@@ -500,6 +501,38 @@ class TestTransaccionBancaria:
 
 @pytest.mark.django_db
 class TestConciliationEngine:
+    def test_ledger_entry_linked_meanwhile_is_not_reused(self, monkeypatch):
+        from datetime import date
+        from api import conciliation_engine
+        from api.conciliation_engine import ConciliationEngine
+        from api.models import AsientoContable, MovimientoBancario
+
+        negocio = NegocioFactory()
+        # Without cuenta_contable both accounts compare against total_debe
+        cuenta, otra = CuentaBancariaFactory(negocio=negocio), CuentaBancariaFactory(negocio=negocio)
+        d = date(2025, 3, 10)
+        asiento = AsientoContable.objects.create(
+            negocio=negocio, numero='A-1', fecha=d, descripcion='x',
+            total_debe=Decimal('1000.00'), total_haber=Decimal('1000.00'), estado='CONTABILIZADO',
+        )
+        mov, ajeno = (
+            MovimientoBancario.objects.create(cuenta=c, tipo='CREDITO', monto=Decimal('1000.00'), fecha=d, descripcion='x')
+            for c in (cuenta, otra)
+        )
+
+        solve = conciliation_engine.solve_assignment
+
+        def concurrente(scores, max_cells):
+            # A run on the other account links the entry after it was read as free
+            MovimientoBancario.objects.filter(pk=ajeno.pk).update(conciliado=True, asiento_contable=asiento)
+            return solve(scores, max_cells)
+        monkeypatch.setattr(conciliation_engine, 'solve_assignment', concurrente)
+
+        resultado = ConciliationEngine().match_ledger(cuenta, d, d)
+        assert resultado == {'conciliados': 0, 'pendientes': 1}
+        mov.refresh_from_db()
+        assert mov.asiento_contable_id is None and not mov.conciliado
+
     def test_exact_match(self):
         from api.conciliation_engine import ConciliationEngine
         from api.models import MovimientoBancario
@@ -538,6 +571,1449 @@ class TestConciliationEngine:
         assert txn.movimiento_match == mov
         assert stats['matched'] >= 1
 
+    def test_strategies_run_in_memory(self, django_assert_max_num_queries):
+        from datetime import timedelta
+        from django.utils import timezone
+        from api.conciliation_engine import ConciliationEngine
+        from api.models import MovimientoBancario
+
+        negocio = NegocioFactory()
+        cuenta = CuentaBancariaFactory(negocio=negocio)
+        importacion = ArchivoImportacionBancariaFactory(negocio=negocio, cuenta_bancaria=cuenta)
+        hoy = timezone.localdate()
+
+        def mov(**kwargs):
+            datos = dict(cuenta=cuenta, tipo='CREDITO', fecha=hoy, descripcion='Deposito', referencia='')
+            datos.update(kwargs)
+            return MovimientoBancario.objects.create(**datos)
+
+        def txn(**kwargs):
+            return TransaccionBancariaFactory(
+                negocio=negocio, cuenta_bancaria=cuenta, importacion=importacion, **kwargs,
+            )
+
+        # Rule 2: same reference, one cent off and far in time
+        por_ref = mov(monto=Decimal('100.00'), referencia='CHK-9', fecha=hoy - timedelta(days=30))
+        t_ref = txn(monto=Decimal('100.01'), referencia='CHK-9', fecha=hoy)
+        # Rule 3: unique exact amount within the date window
+        por_monto = mov(monto=Decimal('250.00'), fecha=hoy - timedelta(days=2))
+        t_monto = txn(monto=Decimal('250.00'), referencia='', fecha=hoy)
+        # Rule 4: two candidates, the description decides
+        mov(monto=Decimal('75.00'), fecha=hoy, descripcion='Pago nomina')
+        por_desc = mov(monto=Decimal('75.00'), fecha=hoy, descripcion='Transferencia farmacia central')
+        t_desc = txn(monto=Decimal('75.00'), referencia='', fecha=hoy, descripcion='TRANSF FARMACIA CENTRAL')
+        # Exact match reconciles once: the twin transaction cannot reuse it
+        exacto = mov(monto=Decimal('900.00'), referencia='DUP')
+        gemelas = [txn(monto=Decimal('900.00'), referencia='DUP', fecha=hoy, descripcion='x') for _ in range(2)]
+
+        with django_assert_max_num_queries(9):
+            stats = ConciliationEngine().auto_match(importacion)
+
+        for t in (t_ref, t_monto, t_desc, *gemelas):
+            t.refresh_from_db()
+        assert (t_ref.movimiento_match, t_ref.confianza_match) == (por_ref, Decimal('0.85'))
+        assert (t_monto.movimiento_match, t_monto.confianza_match) == (por_monto, Decimal('0.80'))
+        assert (t_desc.movimiento_match, t_desc.confianza_match) == (por_desc, Decimal('0.75'))
+        assert sorted([t.movimiento_match_id for t in gemelas], key=str) == sorted([exacto.id, None], key=str)
+        assert {t.estado for t in gemelas} == {'CONCILIADA', 'PENDIENTE'}
+        exacto.refresh_from_db()
+        assert exacto.conciliado
+        assert stats == {'total': 5, 'matched': 4, 'unmatched': 1, 'rule_matched': 0}
+        importacion.refresh_from_db()
+        assert importacion.registros_conciliados == 4
+
+    def test_exact_match_wins_over_earlier_weak_claim(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from api.conciliation_engine import ConciliationEngine
+        from api.models import MovimientoBancario
+
+        negocio = NegocioFactory()
+        cuenta = CuentaBancariaFactory(negocio=negocio)
+        importacion = ArchivoImportacionBancariaFactory(negocio=negocio, cuenta_bancaria=cuenta)
+        hoy = timezone.localdate()
+        ayer = hoy - timedelta(days=1)
+
+        m1 = MovimientoBancario.objects.create(
+            cuenta=cuenta, tipo='CREDITO', fecha=ayer, monto=Decimal('500.00'),
+            referencia='R1', descripcion='Deposito',
+        )
+        m2 = MovimientoBancario.objects.create(
+            cuenta=cuenta, tipo='CREDITO', fecha=hoy, monto=Decimal('500.01'),
+            descripcion='Cobro ferreteria lopez',
+        )
+        # Processed first (-fecha): close amount to m1 (0.80) or description to m2 (0.75)
+        debil = TransaccionBancariaFactory(
+            negocio=negocio, cuenta_bancaria=cuenta, importacion=importacion,
+            fecha=hoy, monto=Decimal('500.00'), referencia='', descripcion='COBRO FERRETERIA LOPEZ',
+        )
+        exacta = TransaccionBancariaFactory(
+            negocio=negocio, cuenta_bancaria=cuenta, importacion=importacion,
+            fecha=ayer, monto=Decimal('500.00'), referencia='R1',
+        )
+
+        stats = ConciliationEngine().auto_match(importacion)
+
+        debil.refresh_from_db()
+        exacta.refresh_from_db()
+        assert (exacta.movimiento_match, exacta.estado) == (m1, 'CONCILIADA')
+        assert (debil.movimiento_match, debil.confianza_match) == (m2, Decimal('0.75'))
+        assert stats['matched'] == 2
+
+    def test_learned_rules(self):
+        from datetime import date
+        from api.conciliation_engine import ConciliationEngine, description_pattern
+        from api.models import MovimientoBancario, ReglaConciliacion
+
+        assert description_pattern('TRANSF. Comisión manejo cta 03/2025') == 'comision manejo cta #'
+        assert description_pattern('DEP 000123') == ''
+
+        negocio = NegocioFactory()
+        cuenta = CuentaBancariaFactory(negocio=negocio)
+        usuario = UsuarioFactory(negocio=negocio)
+        engine = ConciliationEngine()
+
+        def mes(n, monto):
+            importacion = ArchivoImportacionBancariaFactory(negocio=negocio, cuenta_bancaria=cuenta)
+            mov = MovimientoBancario.objects.create(
+                cuenta=cuenta, tipo='DEBITO', fecha=date(2025, n, 28), monto=Decimal(monto),
+                descripcion=f'Cargo bancario comision {n:02d}',
+            )
+            # Same amount and date, unrelated description: close-amount is ambiguous
+            MovimientoBancario.objects.create(
+                cuenta=cuenta, tipo='DEBITO', fecha=date(2025, n, 28), monto=Decimal(monto),
+                descripcion='Pago proveedor',
+            )
+            txn = TransaccionBancariaFactory(
+                negocio=negocio, cuenta_bancaria=cuenta, importacion=importacion,
+                fecha=date(2025, n, 28), monto=Decimal(monto), referencia='',
+                descripcion=f'COMISION MANEJO CUENTA {n:02d}/2025',
+            )
+            return importacion, txn, mov
+
+        # Two months matched by hand teach the rule
+        for n, monto in ((1, '-350.00'), (2, '-365.00')):
+            _, txn, mov = mes(n, monto)
+            txn.movimiento_match = mov
+            engine.confirm_match(txn, usuario)
+        regla = ReglaConciliacion.objects.get(cuenta_bancaria=cuenta)
+        assert (regla.patron, regla.patron_movimiento) == ('comision manejo cuenta #', 'bancario comision #')
+        assert (regla.monto_min, regla.monto_max, regla.confirmaciones) == (Decimal('-365.00'), Decimal('-350.00'), 2)
+
+        # Third month: the rule reconciles on its own
+        importacion, txn, mov = mes(3, '-372.00')
+        stats = engine.auto_match(importacion)
+        txn.refresh_from_db()
+        assert (txn.movimiento_match, txn.estado) == (mov, 'CONCILIADA')
+        assert stats['rule_matched'] == 1
+        regla.refresh_from_db()
+        assert regla.aciertos == 1
+
+        # Rejecting the pair disables the rule until confirmed again
+        engine.reject_match(txn)
+        regla.refresh_from_db()
+        assert not regla.activa
+
+    def test_description_similarity(self):
+        from api.conciliation_engine import DescriptionVectorizer, cosine, tokenize_description
+
+        assert tokenize_description('TRANSF. ACH Pago Farmacia Núñez de Arias') == ['farmacia', 'nunez', 'arias']
+        assert tokenize_description('PAGO') == []
+
+        vectorizer = DescriptionVectorizer([
+            'Pago factura agua', 'Pago factura agua', 'Pago factura luz', 'Deposito Ferretería López',
+        ])
+        assert vectorizer.idf['luz'] > vectorizer.idf['agua'] > vectorizer.idf['factura']
+        ferreteria = vectorizer.transform('Deposito Ferretería López')
+        assert cosine(vectorizer.transform('DEP FERRETERIA LOPEZ'), ferreteria) == pytest.approx(1.0)
+        # The shared common token scores lower than the rare one
+        luz = vectorizer.transform('Pago factura luz')
+        assert cosine(vectorizer.transform('FACTURA'), luz) < cosine(vectorizer.transform('LUZ'), luz)
+
+    def test_solve_assignment(self):
+        from api.conciliation_engine import solve_assignment
+
+        scores = {
+            0: {'a': Decimal('0.90'), 'b': Decimal('0.80')},
+            1: {'a': Decimal('0.85')},
+            2: {'c': Decimal('1.00')},
+        }
+        assert solve_assignment(scores) == {0: 'b', 1: 'a', 2: 'c'}
+        # Components above the cell budget fall back to the greedy bound
+        assert solve_assignment(scores, hungarian_max_cells=1) == {0: 'a', 2: 'c'}
+        # More rows than cols
+        assert solve_assignment({0: {'a': 1}, 1: {'a': 2}, 2: {'a': 1, 'b': 1}}) == {1: 'a', 2: 'b'}
+
+
+class TestBankParsers:
+    MT940 = (
+        ':20:STMT\r\n:25:123/456\r\n:60F:C250101DOP1000,00\r\n'
+        ':61:2501100110C5000,00NTRFNONREF//DEP-1\r\n:86:Deposito cliente\r\nsucursal norte\r\n'
+        ':61:XXXX\r\n'
+        ':61:2501110111D1200,50NCHKNONREF//CHK-7\r\n:62F:C250131DOP4799,50\r\n'
+    )
+    OFX = (
+        'OFXHEADER:100\nDATA:OFXSGML\n\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>\n'
+        '<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20250110120000[-4:AST]<TRNAMT>5000.00<FITID>DEP-1'
+        '<MEMO>Deposito cliente &amp; cia</STMTTRN>\n'
+        '<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20250111<TRNAMT>-1200.50<FITID>CHK-7<NAME>PROVEEDOR</STMTTRN>\n'
+        '<STMTTRN><TRNTYPE>DEBIT<TRNAMT>-1.00<FITID>SIN-FECHA</STMTTRN>\n'
+        '</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n'
+    )
+    CSV = (
+        'fecha;descripcion;referencia;monto\n'
+        '10/01/2025;Deposito cliente;DEP-1;5000.00\n'
+        '31/02/2025;Fecha imposible;X;1.00\n'
+        '11/01/2025;"Pago; proveedor";CHK-7;-1200.50\n'
+    )
+
+    @pytest.mark.parametrize('formato,contenido', [('CSV_BANCO', CSV), ('MT940', MT940), ('OFX', OFX)])
+    def test_iter_parse_streams_in_small_chunks(self, formato, contenido):
+        import io
+        from api.parsers import get_parser
+
+        parser = get_parser(formato)
+        parser.CHUNK_SIZE = 16
+        stream = io.BytesIO(contenido.encode())
+        txns = list(parser.iter_parse(stream))
+
+        assert not stream.closed
+        assert parser.invalidos == 1
+        assert [(t.fecha.isoformat(), t.monto, t.referencia[:5]) for t in txns] == [
+            ('2025-01-10', Decimal('5000.00'), 'DEP-1'),
+            ('2025-01-11', Decimal('-1200.50'), 'CHK-7'),
+        ]
+        assert txns[0].descripcion.startswith('Deposito cliente')
+        assert [t.descripcion for t in get_parser(formato).parse(contenido)] == [t.descripcion for t in txns]
+
+    CAMT053 = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02"><BkToCstmrStmt>'
+        '<GrpHdr><MsgId>M1</MsgId></GrpHdr>'
+        # Página 1 de la cuenta 123456: una entrada en lote, una pendiente y una ilegible
+        '<Stmt><Id>P1</Id><Acct><Id><Othr><Id>00123456</Id></Othr></Id></Acct>'
+        '<Ntry><Amt Ccy="DOP">300.00</Amt><CdtDbtInd>CRDT</CdtDbtInd><Sts>BOOK</Sts>'
+        '<BookgDt><Dt>2025-01-10</Dt></BookgDt><AcctSvcrRef>LOTE-1</AcctSvcrRef><NtryDtls>'
+        '<TxDtls><Refs><EndToEndId>E2E-1</EndToEndId></Refs><AmtDtls><TxAmt><Amt Ccy="DOP">100.00</Amt>'
+        '</TxAmt></AmtDtls><RmtInf><Ustrd>Factura 1</Ustrd></RmtInf></TxDtls>'
+        '<TxDtls><Refs><EndToEndId>NOTPROVIDED</EndToEndId><TxId>TX-2</TxId></Refs><AmtDtls><TxAmt>'
+        '<Amt Ccy="DOP">200.00</Amt></TxAmt></AmtDtls><RltdPties><Dbtr><Nm>Cliente Dos</Nm></Dbtr>'
+        '</RltdPties></TxDtls></NtryDtls></Ntry>'
+        '<Ntry><Amt Ccy="DOP">9.00</Amt><CdtDbtInd>CRDT</CdtDbtInd><Sts>PDNG</Sts>'
+        '<BookgDt><Dt>2025-01-10</Dt></BookgDt></Ntry>'
+        '<Ntry><Amt Ccy="DOP">abc</Amt><CdtDbtInd>DBIT</CdtDbtInd><Sts>BOOK</Sts>'
+        '<BookgDt><Dt>2025-01-10</Dt></BookgDt></Ntry></Stmt>'
+        # Otra cuenta en el mismo archivo
+        '<Stmt><Id>X1</Id><Acct><Id><IBAN>DO28BAGR00000000000999999999</IBAN></Id></Acct>'
+        '<Ntry><Amt Ccy="DOP">50.00</Amt><CdtDbtInd>CRDT</CdtDbtInd><Sts>BOOK</Sts>'
+        '<BookgDt><Dt>2025-01-10</Dt></BookgDt></Ntry></Stmt>'
+        # Página 2 de la cuenta 123456
+        '<Stmt><Id>P2</Id><Acct><Id><Othr><Id>00123456</Id></Othr></Id></Acct>'
+        '<Ntry><Amt Ccy="DOP">1200.50</Amt><CdtDbtInd>DBIT</CdtDbtInd><Sts>BOOK</Sts>'
+        '<BookgDt><DtTm>2025-01-11T09:30:00</DtTm></BookgDt><AcctSvcrRef>CHK-7</AcctSvcrRef>'
+        '<AddtlNtryInf>Pago proveedor</AddtlNtryInf></Ntry></Stmt>'
+        '</BkToCstmrStmt></Document>'
+    )
+
+    def test_camt053_multi_account_pages_and_batches(self):
+        import io
+        from api.parsers import get_parser
+
+        parser = get_parser('CAMT053')
+        assert parser.validate(self.CAMT053)
+        txns = list(parser.iter_parse(io.BytesIO(self.CAMT053.encode()), cuenta='123-456'))
+
+        assert parser.invalidos == 1
+        assert [(t.fecha.isoformat(), t.monto, t.referencia, t.descripcion) for t in txns] == [
+            ('2025-01-10', Decimal('100.00'), 'E2E-1', 'Factura 1'),
+            ('2025-01-10', Decimal('200.00'), 'TX-2', 'Cliente Dos'),
+            ('2025-01-11', Decimal('-1200.50'), 'CHK-7', 'Pago proveedor'),
+        ]
+        # Sin filtro de cuenta entran las entradas de todas las cuentas
+        assert len(parser.parse(self.CAMT053)) == 4
+
+
+@pytest.mark.django_db
+class TestCashApplicationEngine:
+    def _cxc(self, cliente, numero, saldo, dias=0):
+        from datetime import date, timedelta
+        from api.models import CuentaPorCobrar
+        emision = date(2025, 1, 1) + timedelta(days=dias)
+        return CuentaPorCobrar.objects.create(
+            negocio=cliente.negocio, cliente=cliente, numero=numero,
+            fecha_emision=emision, fecha_vencimiento=emision + timedelta(days=30),
+            monto_original=Decimal(saldo), saldo_pendiente=Decimal(saldo),
+        )
+
+    def test_applies_credits_and_queues_the_rest(self, django_assert_max_num_queries):
+        from api.cash_application_engine import CashApplicationEngine
+        from api.models import Pago, SugerenciaCobro
+
+        negocio = NegocioFactory()
+        usuario = UsuarioFactory(negocio=negocio)
+        cuenta = CuentaBancariaFactory(negocio=negocio)
+        importacion = ArchivoImportacionBancariaFactory(negocio=negocio, cuenta_bancaria=cuenta)
+        a = ClienteFactory(negocio=negocio, numero_documento='1-01-23456-7', nombre='Constructora Alfa')
+        b = ClienteFactory(negocio=negocio, nombre='Ferreteria Los Pinos')
+        c = ClienteFactory(negocio=negocio, nombre='Cliente Sin Pistas')
+        a1 = self._cxc(a, 'CXC-000001', '1000.00')
+        a2 = self._cxc(a, 'CXC-000002', '250.00', 1)
+        a3 = self._cxc(a, 'CXC-000003', '750.00', 2)
+        a4 = self._cxc(a, 'CXC-000004', '300.00', 3)
+        b1 = self._cxc(b, 'CXC-000005', '400.00')
+        c1 = self._cxc(c, 'CXC-000006', '999.00')
+
+        def credito(descripcion, monto, referencia=''):
+            return TransaccionBancariaFactory(
+                negocio=negocio, cuenta_bancaria=cuenta, importacion=importacion,
+                descripcion=descripcion, referencia=referencia, monto=Decimal(monto),
+            )
+
+        t_rnc = credito('TRANSF RNC 101234567', '1000.00')  # exact invoice, though 250 + 750 also fits
+        t_ref = credito('PAGO FACT', '250.00', 'CXC-000002')
+        t_combo = credito('TRANSF 1-01-23456-7', '1050.00')  # 750 + 300
+        t_nombre = credito('TRANSFERENCIA DE FERRETERIA LOS PINOS SRL', '400.00')
+        t_monto = credito('DEPOSITO', '999.00')
+        credito('DEPOSITO', '123.45')
+        credito('COMISION', '-50.00')
+
+        engine = CashApplicationEngine(negocio)
+        with django_assert_max_num_queries(8):
+            stats = engine.run(usuario=usuario)
+
+        assert stats == {'total': 6, 'aplicadas': 4, 'en_revision': 1, 'sin_match': 1, 'pagos': 5}
+        aplicadas = {
+            s.transaccion_id: (s.metodo, sorted(x['numero'] for x in s.asignaciones))
+            for s in SugerenciaCobro.objects.filter(estado='APLICADA')
+        }
+        assert aplicadas == {
+            t_rnc.id: ('CLIENTE', ['CXC-000001']),
+            t_ref.id: ('REFERENCIA', ['CXC-000002']),
+            t_combo.id: ('COMBINACION', ['CXC-000003', 'CXC-000004']),
+            t_nombre.id: ('CLIENTE', ['CXC-000005']),
+        }
+        for cxc in (a1, a2, a3, a4, b1):
+            cxc.refresh_from_db()
+            assert (cxc.estado, cxc.saldo_pendiente) == ('PAGADA', 0)
+        assert set(Pago.objects.filter(transaccion_bancaria=t_combo).values_list('monto', flat=True)) == {
+            Decimal('750.00'), Decimal('300.00'),
+        }
+
+        # Amount alone is not enough: queued for review, then applied by hand
+        sugerencia = SugerenciaCobro.objects.get(estado='PENDIENTE')
+        assert (sugerencia.transaccion_id, sugerencia.metodo) == (t_monto.id, 'MONTO')
+        assert engine.run()['total'] == 1  # only the unmatched credit is retried
+        engine.accept(sugerencia, usuario)
+        c1.refresh_from_db()
+        assert (c1.estado, c1.saldo_pendiente) == ('PAGADA', 0)
+        with pytest.raises(ValueError):
+            engine.accept(sugerencia, usuario)
+        # The stale PENDIENTE instance cannot turn the applied suggestion into RECHAZADA
+        assert sugerencia.estado == 'PENDIENTE'
+        with pytest.raises(ValueError):
+            engine.reject(sugerencia, usuario)
+        assert SugerenciaCobro.objects.get(pk=sugerencia.pk).estado == 'APLICADA'
+
+    @pytest.mark.django_db(transaction=True)
+    def test_concurrent_run_skips_locked_credits(self):
+        import threading
+        from django.db import IntegrityError, connection, transaction
+        from api.cash_application_engine import CashApplicationEngine
+        from api.models import SugerenciaCobro, TransaccionBancaria
+
+        negocio = NegocioFactory()
+        cuenta = CuentaBancariaFactory(negocio=negocio)
+        cliente = ClienteFactory(negocio=negocio)
+        self._cxc(cliente, 'CXC-000001', '100.00')
+        self._cxc(cliente, 'CXC-000002', '200.00')
+        ocupado = TransaccionBancariaFactory(negocio=negocio, cuenta_bancaria=cuenta, monto=Decimal('100.00'))
+        libre = TransaccionBancariaFactory(negocio=negocio, cuenta_bancaria=cuenta, monto=Decimal('200.00'))
+
+        resultado = {}
+
+        def otro_proceso():
+            try:
+                resultado['stats'] = CashApplicationEngine(negocio).run()
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            # Another run holds this credit
+            TransaccionBancaria.objects.select_for_update().get(pk=ocupado.pk)
+            hilo = threading.Thread(target=otro_proceso)
+            hilo.start()
+            hilo.join(timeout=30)
+
+        assert resultado['stats']['total'] == 1
+        assert list(SugerenciaCobro.objects.values_list('transaccion_id', flat=True)) == [libre.id]
+        assert CashApplicationEngine(negocio).run()['total'] == 1
+        with pytest.raises(IntegrityError):
+            SugerenciaCobro.objects.create(
+                negocio=negocio, transaccion=libre, metodo='MONTO', confianza=Decimal('0.50'),
+            )
+
+    def test_subset_sum_is_bounded(self):
+        from api.cash_application_engine import subset_sum
+        assert subset_sum([500, 300, 200, 100], 600) == ([[0, 3], [1, 2, 3]], True)
+        assert subset_sum([500, 300], 700) == ([], True)
+        # Odd target over even amounts: no solution, the step budget stops the search
+        assert subset_sum([2] * 40, 21, max_size=20, max_steps=50) == ([], False)
+
+
+# =============================================================================
+# FISCAL STRATEGIES
+# =============================================================================
+
+@pytest.mark.django_db
+class TestFiscalStrategyRegistry:
+    def test_resolves_registry_and_legacy_codes(self):
+        from api.fiscal.registry import FiscalStrategyRegistry
+        from api.fiscal.strategies.dgii import DGIIDominicanaStrategy
+        assert FiscalStrategyRegistry.get_class('DO') is DGIIDominicanaStrategy
+        assert FiscalStrategyRegistry.get_class('DOM') is DGIIDominicanaStrategy
+
+    def test_other_countries_use_libro_fiscal(self):
+        from api.fiscal.registry import FiscalStrategyRegistry
+        negocio = NegocioFactory(pais=PaisFactory(codigo='MX', nombre='México'))
+        strategy = FiscalStrategyRegistry.get(negocio)
+        assert type(strategy).__name__ == 'LibroFiscalStrategy'
+        assert strategy.autoridad == 'SAT'
+        assert set(strategy.TIPOS_REPORTE) == {'VENTAS', 'COMPRAS'}
+
+    def test_class_is_cached(self):
+        from api.fiscal.registry import FiscalStrategyRegistry
+        FiscalStrategyRegistry.clear_cache()
+        assert 'CO' not in FiscalStrategyRegistry.loaded_codes()
+        first = FiscalStrategyRegistry.get_class('CO')
+        assert 'CO' in FiscalStrategyRegistry.loaded_codes()
+        assert FiscalStrategyRegistry.get_class('CO') is first
+
+    def test_unknown_country(self):
+        from api.fiscal.registry import FiscalStrategyRegistry
+        with pytest.raises(NotImplementedError):
+            FiscalStrategyRegistry.get_class('ZZ')
+
+    def test_reporte_607(self):
+        from api.fiscal.registry import FiscalStrategyRegistry
+        venta = VentaFactory(ncf='E320000000001', tipo_pago='TARJETA')
+        hoy = venta.fecha
+        strategy = FiscalStrategyRegistry.get(venta.negocio)
+        data = strategy.generar_reporte('607', hoy.year, hoy.month)
+        assert len(data) == 1
+        assert data[0]['Tarjeta'] == float(venta.monto_pagado)
+        assert data[0]['Efectivo'] == 0.0
+
+
+# =============================================================================
+# FIRMA e-CF
+# =============================================================================
+
+class TestSignerCache:
+    XML = b'<ECF><Encabezado><eNCF>E320000000001</eNCF></Encabezado></ECF>'
+
+    def setup_method(self):
+        from api.utils.xml_signer import SignerCache
+        SignerCache.invalidate()
+
+    def test_sign_and_verify_loads_once(self, tmp_path):
+        from signxml import XMLVerifier
+        from api.utils.xml_signer import SignerCache, sign_ecf_xml
+        p12 = crear_p12(tmp_path / 'cert.p12', 'secreto')
+        material = SignerCache.get(p12, 'secreto', tenant=1)
+        firmado = sign_ecf_xml(self.XML, p12, 'secreto', tenant=1)
+        sign_ecf_xml(self.XML, p12, 'secreto', tenant=1)
+        assert SignerCache.get(p12, 'secreto', tenant=1) is material
+        assert SignerCache.size() == 1
+        XMLVerifier().verify(firmado.encode(), x509_cert=material.cert)
+
+    def test_file_change_invalidates(self, tmp_path):
+        import os
+        from api.utils.xml_signer import SignerCache
+        path = tmp_path / 'cert.p12'
+        p12 = crear_p12(path, 'secreto', cn='Viejo')
+        viejo = SignerCache.get(p12, 'secreto', tenant=1)
+        crear_p12(path, 'secreto', cn='Renovado')
+        os.utime(p12, ns=(viejo.mtime_ns + 10**9, viejo.mtime_ns + 10**9))
+        nuevo = SignerCache.get(p12, 'secreto', tenant=1)
+        assert nuevo is not viejo
+        assert 'Renovado' in nuevo.status()['subject']
+
+    def test_wrong_password_not_served_from_cache(self, tmp_path):
+        from api.utils.xml_signer import SignerCache
+        p12 = crear_p12(tmp_path / 'cert.p12', 'secreto')
+        SignerCache.get(p12, 'secreto', tenant=1)
+        with pytest.raises(ValueError):
+            SignerCache.get(p12, 'otra', tenant=1)
+
+    def test_expired_certificate_rejected(self, tmp_path):
+        from api.utils.xml_signer import sign_ecf_xml
+        p12 = crear_p12(tmp_path / 'cert.p12', 'secreto', dias=-1)
+        with pytest.raises(ValueError, match='expirado'):
+            sign_ecf_xml(self.XML, p12, 'secreto', tenant=1)
+
+
+@pytest.mark.django_db
+class TestPlantillaECF:
+    def _venta(self, **kwargs):
+        from api.models import DetalleVenta
+        venta = VentaFactory(ncf='E320000000001', codigo_seguridad_dgii='123456', **kwargs)
+        for producto, subtotal, impuesto in (
+            (ProductoFactory(negocio=venta.negocio), Decimal('1000.00'), Decimal('180.00')),
+            (ProductoFactory(negocio=venta.negocio, aplica_impuesto=False, tipo='SERVICIO'),
+             Decimal('50.00'), Decimal('0.00')),
+        ):
+            DetalleVenta.objects.create(
+                venta=venta, producto=producto, cantidad=1, precio_unitario=subtotal,
+                precio_costo=subtotal, subtotal=subtotal, impuesto=impuesto,
+                total=subtotal + impuesto,
+            )
+        return venta
+
+    def test_mismo_xml_que_ecf_generator(self):
+        from lxml import etree
+        from api.utils.ecf_generator import ECFGenerator, PlantillaECF
+        venta = self._venta(cliente=ClienteFactory(numero_documento='131-12345-6'))
+
+        [(venta_id, root)] = PlantillaECF(venta.negocio).generar([venta.id])
+
+        assert venta_id == venta.id
+        parser = etree.XMLParser(remove_blank_text=True)
+        esperado = etree.fromstring(ECFGenerator(venta).generate_xml().encode('utf-8'), parser)
+        assert etree.tostring(root, method='c14n') == etree.tostring(esperado, method='c14n')
+        assert root.findtext('Encabezado/Comprador/RNCComprador') == '131123456'
+        assert root.findtext('Encabezado/Totales/MontoExentoTotal') == '50.00'
+        assert len(root.findall('DetallesItems/Item')) == 2
+
+    def test_plantilla_emisor_se_renueva_al_editar_negocio(self):
+        from api.utils.ecf_generator import PlantillaECF
+        venta = self._venta()
+        negocio = venta.negocio
+        plantilla = PlantillaECF(negocio)
+        emisor = plantilla.emisor('001')
+        assert plantilla.emisor('001') is emisor
+
+        negocio.razon_social = 'Nueva Razon SRL'
+        root = PlantillaECF(negocio).construir(PlantillaECF(negocio).cargar([venta.id])[0])
+        assert root.findtext('Encabezado/Emisor/RazonSocialEmisor') == 'Nueva Razon SRL'
+        assert PlantillaECF(negocio).emisor('001') is not emisor
+
+    def test_firma_arbol_sin_serializar(self, tmp_path):
+        from signxml import XMLVerifier
+        from api.utils.ecf_generator import PlantillaECF
+        from api.utils.xml_signer import SignerCache, sign_ecf_xml
+        venta = self._venta()
+        p12 = crear_p12(tmp_path / 'cert.p12', 'secreto')
+        [(_, root)] = PlantillaECF(venta.negocio).generar([venta.id])
+        firmado = sign_ecf_xml(root, p12, 'secreto', tenant=1)
+        material = SignerCache.get(p12, 'secreto', tenant=1)
+        XMLVerifier().verify(firmado.encode(), x509_cert=material.cert)
+
+
+@pytest.mark.django_db
+class TestRepresentacionImpresa:
+    def _venta(self, negocio, ncf, items=1):
+        from api.models import DetalleVenta, FacturaElectronica
+        venta = VentaFactory(negocio=negocio, ncf=ncf, codigo_seguridad_dgii='123456')
+        producto = ProductoFactory(negocio=negocio)
+        for _ in range(items):
+            DetalleVenta.objects.create(
+                venta=venta, producto=producto, cantidad=1, precio_unitario=Decimal('100.00'),
+                precio_costo=Decimal('50.00'), subtotal=Decimal('100.00'), impuesto=Decimal('18.00'),
+                total=Decimal('118.00'),
+            )
+        FacturaElectronica.objects.create(
+            venta=venta, ecf_tipo='32', qr_code_url=f'https://dgii.gov.do/ecf?rnc=1&encf={ncf}&sc=123456',
+        )
+        return venta
+
+    def test_pdf_del_lote_con_logo_y_paginas_de_continuacion(self, settings, tmp_path):
+        from io import BytesIO
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from PIL import Image
+        from api.utils.ecf_pdf import RepresentacionImpresa
+
+        settings.MEDIA_ROOT = str(tmp_path)
+        imagen = BytesIO()
+        Image.new('RGB', (60, 30), 'navy').save(imagen, 'PNG')
+        negocio = NegocioFactory(logo=SimpleUploadedFile('logo.png', imagen.getvalue(), 'image/png'))
+        ventas = [self._venta(negocio, 'E320000000001'), self._venta(negocio, 'E320000000002', items=60)]
+
+        impresor = RepresentacionImpresa(negocio)
+        pdf, paginas = impresor.pdf([v.id for v in ventas])
+
+        assert pdf.startswith(b'%PDF') and paginas == 3
+        assert impresor.recursos().logo == imagen.getvalue()
+        assert pdf.count(b'/Subtype /Image') == 1  # logo una vez, dentro del encabezado compartido
+
+    def test_zip_en_streaming_un_pdf_por_factura(self):
+        import zipfile
+        from io import BytesIO
+        from api.utils.ecf_pdf import RepresentacionImpresa
+
+        negocio = NegocioFactory()
+        ventas = [self._venta(negocio, f'E32000000000{i}') for i in range(1, 4)]
+        impresor = RepresentacionImpresa(negocio)
+
+        trozos = list(impresor.zip([v.id for v in ventas]))
+
+        assert len(trozos) > 1
+        archivo = zipfile.ZipFile(BytesIO(b''.join(trozos)))
+        assert sorted(archivo.namelist()) == [f'E32000000000{i}.pdf' for i in range(1, 4)]
+        assert archivo.read('E320000000001.pdf').startswith(b'%PDF')
+        assert impresor.resumen == {'facturas': 3, 'paginas': 3, 'errores': 0}
+
+    def test_recursos_se_renuevan_al_editar_negocio(self):
+        from api.utils.ecf_pdf import RepresentacionImpresa
+        negocio = NegocioFactory()
+        recursos = RepresentacionImpresa(negocio).recursos()
+        assert RepresentacionImpresa(negocio).recursos() is recursos
+
+        negocio.razon_social = 'Nueva Razon SRL'
+        assert RepresentacionImpresa(negocio).recursos().razon_social == 'Nueva Razon SRL'
+
+
+@pytest.mark.django_db
+class TestEmisorLoteECF:
+    def _negocio(self, tmp_path, monkeypatch):
+        from api.utils.xml_signer import SignerCache
+        SignerCache.invalidate()
+        monkeypatch.setenv('TEST_CERT_PASS', 'secreto')
+        return NegocioFactory(
+            certificado_digital_path=crear_p12(tmp_path / 'cert.p12', 'secreto'),
+            certificado_pass_env='TEST_CERT_PASS',
+        )
+
+    def test_emite_pendientes_en_bloque(self, tmp_path, monkeypatch):
+        from api.models import FacturaElectronica, Venta
+        from api.utils.dgii_api import AsyncDGIIClient
+        from api.utils.ecf_lote import EmisorLoteECF
+
+        negocio = self._negocio(tmp_path, monkeypatch)
+        ok = VentaFactory(negocio=negocio, tipo_comprobante='B01', ncf='E310000000001', estado_fiscal='PENDIENTE')
+        caida = VentaFactory(negocio=negocio, tipo_comprobante='B01', ncf='E310000000002', estado_fiscal='PENDIENTE')
+        VentaFactory(negocio=negocio, tipo_comprobante='B01', ncf='E310000000003', estado_fiscal='NO_FISCAL')
+
+        async def enviar(self, xml_firmado):
+            if 'E310000000002' in xml_firmado:
+                return {'estado': 'ERROR', 'track_id': '', 'mensaje': 'timeout', 'respuesta_cruda': {}}
+            return {'estado': 'EN_PROCESO', 'track_id': 'T-1', 'mensaje': '', 'respuesta_cruda': {}}
+        monkeypatch.setattr(AsyncDGIIClient, 'enviar_ecf', enviar)
+
+        eventos = []
+        monkeypatch.setattr(EmisorLoteECF, 'notificar', lambda self, data: eventos.append(data))
+        resumen = EmisorLoteECF(negocio, procesos=1, tamano_bloque=1).ejecutar()
+
+        assert resumen['total'] == 2
+        assert resumen['enviadas'] == 1 and resumen['contingencia'] == 1
+        assert Venta.objects.get(id=ok.id).estado_fiscal == 'ENVIADO'
+        assert Venta.objects.get(id=caida.id).estado_fiscal == 'EN_CONTINGENCIA'
+        assert FacturaElectronica.objects.get(venta=ok).track_id == 'T-1'
+        assert '<ds:Signature' in FacturaElectronica.objects.get(venta=caida).xml_firmado
+        assert [e['procesadas'] for e in eventos if e['evento'] == 'factura'] == [1, 2]
+        assert eventos[-1]['evento'] == 'fin'
+
+    def test_omite_ventas_reclamadas(self, tmp_path, monkeypatch):
+        from django.core.cache import cache
+        from api.models import Venta
+        from api.utils.dgii_api import AsyncDGIIClient
+        from api.utils.ecf_lote import EmisorLoteECF, clave_emision
+
+        negocio = self._negocio(tmp_path, monkeypatch)
+        libre = VentaFactory(negocio=negocio, tipo_comprobante='B01', ncf='E310000000001', estado_fiscal='PENDIENTE')
+        en_curso = VentaFactory(negocio=negocio, tipo_comprobante='B01', ncf='E310000000002', estado_fiscal='PENDIENTE')
+
+        async def enviar(self, xml_firmado):
+            return {'estado': 'EN_PROCESO', 'track_id': 'T-1', 'mensaje': '', 'respuesta_cruda': {}}
+        monkeypatch.setattr(AsyncDGIIClient, 'enviar_ecf', enviar)
+        monkeypatch.setattr(EmisorLoteECF, 'notificar', lambda self, data: None)
+
+        # emitir_ecf ya encoló un job para esta venta
+        cache.set(clave_emision(en_curso.id), 'job-x')
+        try:
+            resumen = EmisorLoteECF(negocio, procesos=1).ejecutar()
+            assert cache.get(clave_emision(en_curso.id)) == 'job-x'
+            assert cache.get(clave_emision(libre.id)) is None
+        finally:
+            cache.clear()
+
+        assert resumen['enviadas'] == 1 and resumen['omitidas'] == 1
+        assert Venta.objects.get(id=libre.id).estado_fiscal == 'ENVIADO'
+        assert Venta.objects.get(id=en_curso.id).estado_fiscal == 'PENDIENTE'
+
+    def test_consumo_bajo_umbral_envia_rfce(self, tmp_path, monkeypatch, settings):
+        from api.models import FacturaElectronica, Venta
+        from api.utils.dgii_api import AsyncDGIIClient
+        from api.utils.ecf_lote import EmisorLoteECF
+
+        settings.ECF_UMBRAL_RESUMEN_CONSUMO = '5000'
+        negocio = self._negocio(tmp_path, monkeypatch)
+        consumo = VentaFactory(negocio=negocio, tipo_comprobante='B02', ncf='E320000000001',
+                               codigo_seguridad_dgii='123456', estado_fiscal='PENDIENTE')
+        mayor = VentaFactory(negocio=negocio, tipo_comprobante='B02', ncf='E320000000002', total=Decimal('5000.00'),
+                             estado_fiscal='PENDIENTE')
+
+        enviados, resumenes = [], []
+
+        async def enviar(self, xml_firmado):
+            enviados.append(xml_firmado)
+            return {'estado': 'EN_PROCESO', 'track_id': 'T-1', 'mensaje': '', 'respuesta_cruda': {}}
+
+        async def enviar_resumen(self, xml_firmado):
+            resumenes.append(xml_firmado)
+            return {'estado': 'ACEPTADO', 'track_id': '', 'mensaje': '', 'respuesta_cruda': {'codigo': 1}}
+        monkeypatch.setattr(AsyncDGIIClient, 'enviar_ecf', enviar)
+        monkeypatch.setattr(AsyncDGIIClient, 'enviar_resumen', enviar_resumen)
+        monkeypatch.setattr(EmisorLoteECF, 'notificar', lambda self, data: None)
+
+        resumen = EmisorLoteECF(negocio, procesos=1).ejecutar()
+
+        assert resumen['resumenes'] == 1 and resumen['enviadas'] == 2
+        assert len(enviados) == 1 and 'E320000000002' in enviados[0]
+        assert '<RFCE' in resumenes[0] and '<CodigoSeguridadeCF>123456</CodigoSeguridadeCF>' in resumenes[0]
+        assert '<DetallesItems' not in resumenes[0]
+        assert Venta.objects.get(id=consumo.id).estado_fiscal == 'ACEPTADO'
+        assert Venta.objects.get(id=mayor.id).estado_fiscal == 'ENVIADO'
+        ecf = FacturaElectronica.objects.get(venta=consumo)
+        assert ecf.track_id is None and ecf.proxima_consulta is None
+        assert ecf.resumen.xml == resumenes[0]
+        assert '<DetallesItems' in ecf.xml_firmado
+
+    def test_certificado_no_configurado(self):
+        from api.utils.ecf_lote import EmisorLoteECF
+        with pytest.raises(ValueError):
+            EmisorLoteECF(NegocioFactory()).ejecutar()
+
+
+@pytest.mark.django_db
+class TestAsignadorNCF:
+    def _secuencia(self, negocio, hasta=1000, **kwargs):
+        from datetime import timedelta
+        from django.utils import timezone
+        from api.models import SecuenciaNCF
+        datos = {
+            'tipo_comprobante': 'B02', 'serie': '0', 'numero_desde': 1, 'numero_hasta': hasta,
+            'numero_actual': 1, 'fecha_vencimiento': timezone.localdate() + timedelta(days=365),
+        }
+        datos.update(kwargs)
+        return SecuenciaNCF.objects.create(negocio=negocio, **datos)
+
+    def test_sucursales_reciben_bloques_disjuntos(self):
+        from api.utils.ncf_manager import AsignadorNCF
+        negocio = NegocioFactory()
+        self._secuencia(negocio)
+        norte = AsignadorNCF(negocio, sucursal=SucursalFactory(negocio=negocio, codigo='N'), tamano_bloque=10)
+        sur = AsignadorNCF(negocio, sucursal=SucursalFactory(negocio=negocio, codigo='S'), tamano_bloque=10)
+
+        assert norte.siguiente('B02') == 'E32000000001'
+        assert sur.siguiente('B02') == 'E32000000011'
+        assert norte.siguiente('B02') == 'E32000000002'
+        assert negocio.bloques_ncf.count() == 2
+
+    def test_rollover_y_agotamiento(self):
+        from api.utils.ncf_manager import AsignadorNCF
+        negocio = NegocioFactory()
+        secuencia = self._secuencia(negocio, hasta=5)
+        asignador = AsignadorNCF(negocio, tamano_bloque=2)
+
+        assert asignador.siguientes('B02', 4) == [f'E3200000000{n}' for n in range(1, 5)]
+        assert list(secuencia.bloques.values_list('estado', flat=True)) == ['AGOTADO', 'AGOTADO']
+        assert asignador.siguientes('B02', 3) == ['E32000000005']
+        assert 'agotada' in asignador.ultimo_error
+        with pytest.raises(ValueError):
+            asignador.siguiente('B02')
+        secuencia.refresh_from_db()
+        assert secuencia.activa is False
+
+    def test_lote_no_consume_ncf_si_falla_guardar_ventas(self, monkeypatch):
+        from django.db import DatabaseError
+        from api.models import BloqueNCF, Venta
+        from api.utils.ecf_lote import EmisorLoteECF
+        negocio = NegocioFactory()
+        self._secuencia(negocio)
+        venta = VentaFactory(negocio=negocio, tipo_comprobante='B02', ncf='', estado_fiscal='NO_FISCAL')
+
+        def falla(*args, **kwargs):
+            raise DatabaseError('conexión perdida')
+        monkeypatch.setattr(type(Venta.objects), 'bulk_update', falla)
+        with pytest.raises(DatabaseError):
+            EmisorLoteECF(negocio)._asignar_ncf([venta], {})
+
+        # Ni bloque reservado ni números consumidos
+        assert not BloqueNCF.objects.filter(negocio=negocio).exists()
+        monkeypatch.undo()
+        venta.ncf = ''
+        EmisorLoteECF(negocio)._asignar_ncf([venta], {})
+        assert Venta.objects.get(id=venta.id).ncf == 'E32000000001'
+
+    def test_secuencia_reservada_no_invalida_bloques_de_otras_cajas(self):
+        from api.utils.ncf_manager import AsignadorNCF, cerrar_secuencias_vencidas, pronostico_agotamiento
+        negocio = NegocioFactory()
+        secuencia = self._secuencia(negocio, hasta=10)
+        caja1 = AsignadorNCF(negocio, caja='CAJA-1', tamano_bloque=5)
+        caja2 = AsignadorNCF(negocio, caja='CAJA-2', tamano_bloque=5)
+        assert caja1.siguiente('B02') == 'E32000000001'
+        assert caja2.siguientes('B02', 6) == [f'E320000000{n:02d}' for n in range(6, 11)]
+        assert 'agotada' in caja2.ultimo_error
+
+        # La caja 1 sigue con su bloque y el cierre diario no lo anula
+        secuencia.refresh_from_db()
+        assert secuencia.activa is True
+        assert caja1.siguiente('B02') == 'E32000000002'
+        assert cerrar_secuencias_vencidas(negocio) == {'bloques': 0, 'numeros': 0}
+        assert pronostico_agotamiento(negocio)[0]['disponibles'] == 3
+
+        assert caja1.siguientes('B02', 3) == ['E32000000003', 'E32000000004', 'E32000000005']
+        with pytest.raises(ValueError):
+            caja1.siguiente('B02')
+        secuencia.refresh_from_db()
+        assert secuencia.activa is False
+
+    def test_bloque_cerrado_sale_en_608(self):
+        from api.fiscal.registry import FiscalStrategyRegistry
+        from api.utils.ncf_manager import AsignadorNCF
+        negocio = NegocioFactory()
+        self._secuencia(negocio)
+        asignador = AsignadorNCF(negocio, caja='CAJA-1', tamano_bloque=5)
+        asignador.siguientes('B02', 2)
+
+        assert asignador.cerrar('Caja dada de baja') == 3
+        hoy = negocio.anulaciones_ncf.get().fecha
+        data = FiscalStrategyRegistry.get(negocio).generar_reporte('608', hoy.year, hoy.month)
+        assert [linea['NCF'] for linea in data] == ['E32000000003', 'E32000000004', 'E32000000005']
+        assert {linea['Tipo_Anulacion'] for linea in data} == {'08'}
+
+    def test_608_grande_en_streaming(self):
+        from itertools import islice
+        from api.fiscal.registry import FiscalStrategyRegistry
+        from api.models import AnulacionNCF
+        negocio = NegocioFactory()
+        secuencia = self._secuencia(negocio, hasta=5_000_000)
+        anulacion = AnulacionNCF.objects.create(
+            negocio=negocio, secuencia=secuencia, desde=3, hasta=5_000_000, motivo='Secuencia NCF vencida sin usar',
+        )
+
+        strategy = FiscalStrategyRegistry.get(negocio)
+        hoy = anulacion.fecha
+        contenido, nombre, _ = strategy.exportar_archivo('608', hoy.year, hoy.month)
+        assert nombre.startswith('DGII_F_608_')
+        assert ''.join(islice(contenido, 3)).split('\n') == [
+            f"608|{negocio.identificacion_fiscal.replace('-', '')}|{hoy:%Y%m}|4999998",
+            f'E32000000003|{hoy:%Y%m%d}|{anulacion.tipo_anulacion}',
+            f'E32000000004|{hoy:%Y%m%d}|{anulacion.tipo_anulacion}',
+        ]
+
+    def test_secuencia_vencida_anula_restantes(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from api.utils.ncf_manager import AsignadorNCF, cerrar_secuencias_vencidas
+        negocio = NegocioFactory()
+        secuencia = self._secuencia(negocio, hasta=20)
+        AsignadorNCF(negocio, tamano_bloque=5).siguiente('B02')
+        type(secuencia).objects.filter(pk=secuencia.pk).update(fecha_vencimiento=timezone.localdate() - timedelta(days=1))
+
+        assert cerrar_secuencias_vencidas(negocio) == {'bloques': 1, 'numeros': 19}
+        secuencia.refresh_from_db()
+        assert secuencia.activa is False
+        assert cerrar_secuencias_vencidas(negocio) == {'bloques': 0, 'numeros': 0}
+
+    def test_pronostico_agotamiento(self):
+        from api.utils.ncf_manager import AsignadorNCF, pronostico_agotamiento
+        negocio = NegocioFactory()
+        self._secuencia(negocio, hasta=40)
+        asignador = AsignadorNCF(negocio, tamano_bloque=10)
+        for _ in range(30):
+            VentaFactory(negocio=negocio, tipo_comprobante='B02', ncf=asignador.siguiente('B02'))
+
+        pronostico, = pronostico_agotamiento(negocio)
+        assert pronostico['disponibles'] == 10
+        assert pronostico['consumo_diario'] == 1
+        assert pronostico['dias_restantes'] == 10
+        assert pronostico['alerta'] is True
+
+
+@pytest.mark.django_db
+class TestEnviarECFAsync:
+    def test_firma_envia_y_notifica(self, tmp_path, monkeypatch):
+        from api.models import FacturaElectronica, Venta
+        from api.tasks import enviar_ecf_async
+        from api.utils import notificaciones
+        from api.utils.dgii_api import DGIIClient
+        from api.utils.xml_signer import SignerCache
+
+        SignerCache.invalidate()
+        monkeypatch.setenv('TEST_CERT_PASS', 'secreto')
+        negocio = NegocioFactory(
+            certificado_digital_path=crear_p12(tmp_path / 'cert.p12', 'secreto'),
+            certificado_pass_env='TEST_CERT_PASS',
+        )
+        venta = VentaFactory(negocio=negocio, tipo_comprobante='B01', ncf='E310000000001', estado_fiscal='PENDIENTE')
+        monkeypatch.setattr(DGIIClient, 'enviar_ecf', lambda self, xml: {
+            'estado': 'EN_PROCESO', 'track_id': 'T-9', 'mensaje': 'ok', 'respuesta_cruda': {},
+        })
+        eventos = []
+        monkeypatch.setattr(
+            notificaciones, 'notificar_usuario',
+            lambda usuario_id, tipo, data: eventos.append((usuario_id, tipo, data)),
+        )
+
+        enviar_ecf_async.apply(args=[str(venta.id)], kwargs={'usuario_id': 7, 'job_id': 'job-1'})
+
+        assert Venta.objects.get(id=venta.id).estado_fiscal == 'ENVIADO'
+        ecf = FacturaElectronica.objects.get(venta=venta)
+        assert ecf.track_id == 'T-9' and ecf.ecf_tipo == '31'
+        assert '<ds:Signature' in ecf.xml_firmado
+        assert eventos == [(7, 'ecf_emision', {
+            'job_id': 'job-1', 'venta_id': str(venta.id), 'ncf': 'E310000000001',
+            'estado_fiscal': 'ENVIADO', 'dgii_estado': 'EN_PROCESO', 'track_id': 'T-9',
+            'qr_url': ecf.qr_code_url, 'mensaje': 'ok',
+        })]
+
+    def test_consumo_envia_rfce(self, tmp_path, monkeypatch):
+        from api.models import FacturaElectronica, Venta
+        from api.tasks import enviar_ecf_async
+        from api.utils.dgii_api import DGIIClient
+        from api.utils.xml_signer import SignerCache
+
+        SignerCache.invalidate()
+        monkeypatch.setenv('TEST_CERT_PASS', 'secreto')
+        negocio = NegocioFactory(
+            certificado_digital_path=crear_p12(tmp_path / 'cert.p12', 'secreto'),
+            certificado_pass_env='TEST_CERT_PASS',
+        )
+        venta = VentaFactory(negocio=negocio, tipo_comprobante='B02', ncf='E320000000001', estado_fiscal='PENDIENTE')
+        monkeypatch.setattr(DGIIClient, 'enviar_resumen', lambda self, xml: {
+            'estado': 'ACEPTADO', 'track_id': '', 'mensaje': '', 'respuesta_cruda': {},
+        })
+
+        enviar_ecf_async.apply(args=[str(venta.id)])
+
+        assert Venta.objects.get(id=venta.id).estado_fiscal == 'ACEPTADO'
+        ecf = FacturaElectronica.objects.get(venta=venta)
+        assert '<RFCE' in ecf.resumen.xml and '<ds:Signature' in ecf.resumen.xml
+        assert ecf.proxima_consulta is None
+
+    def test_fallo_queda_en_la_cola_de_contingencia(self, tmp_path, monkeypatch):
+        from django.core.cache import cache
+        from api.models import ContingenciaECF, Venta
+        from api.tasks import enviar_ecf_async
+        from api.utils.dgii_api import DGIIClient
+        from api.utils.ecf_contingencia import ColaContingenciaECF
+        from api.utils.ecf_lote import clave_emision
+        from api.utils.xml_signer import SignerCache
+
+        SignerCache.invalidate()
+        monkeypatch.setenv('TEST_CERT_PASS', 'secreto')
+        negocio = NegocioFactory(
+            certificado_digital_path=crear_p12(tmp_path / 'cert.p12', 'secreto'),
+            certificado_pass_env='TEST_CERT_PASS',
+        )
+        venta = VentaFactory(negocio=negocio, tipo_comprobante='B01', ncf='E310000000001', estado_fiscal='PENDIENTE')
+
+        def caida(self, xml):
+            raise ConnectionError('DGII no responde')
+        monkeypatch.setattr(DGIIClient, 'enviar_ecf', caida)
+        cache.set(clave_emision(venta.id), 'job-1')
+
+        result = enviar_ecf_async.apply(args=[str(venta.id)], kwargs={'job_id': 'job-1'})
+
+        # Sin reintento de Celery: la venta pasa a la cola de contingencia
+        assert result.state == 'SUCCESS' and result.get()['status'] == 'contingencia'
+        assert Venta.objects.get(id=venta.id).estado_fiscal == 'EN_CONTINGENCIA'
+        assert cache.get(clave_emision(venta.id)) is None
+        ColaContingenciaECF().encolar_nuevas()
+        assert ContingenciaECF.objects.get(venta=venta).estado == 'PENDIENTE'
+
+    def test_no_reenvia_procesadas(self):
+        from api.tasks import enviar_ecf_async
+        venta = VentaFactory(ncf='E320000000001', estado_fiscal='ACEPTADO')
+        result = enviar_ecf_async.apply(args=[str(venta.id)]).get()
+        assert result['status'] == 'skip'
+
+
+@pytest.mark.django_db
+class TestDocumentosECF:
+    def test_comprime_deduplica_y_verifica(self):
+        import zlib
+        from api.models import DocumentoECF, FacturaElectronica
+        from api.utils.ecf_documentos import DocumentoCorrupto, cargar_documentos, guardar_documentos
+
+        xml = '<ECF>' + '<Item>producto</Item>' * 200 + '</ECF>'
+        h1, h2, h3 = guardar_documentos([xml, xml, '<ECF>otro</ECF>'])
+        assert h1 == h2 != h3
+        assert DocumentoECF.objects.count() == 2
+        doc = DocumentoECF.objects.get(pk=h1)
+        assert doc.tamano == len(xml) and doc.tamano_comprimido < doc.tamano / 5
+        assert cargar_documentos([h1, h3]) == {h1: xml, h3: '<ECF>otro</ECF>'}
+
+        ecf = FacturaElectronica.objects.create(venta=VentaFactory(), documento_id=h1)
+        assert FacturaElectronica.objects.get(pk=ecf.pk).xml_firmado == xml
+
+        doc.contenido = zlib.compress(b'<ECF>alterado</ECF>')
+        doc.algoritmo = 'zlib'
+        doc.save()
+        with pytest.raises(DocumentoCorrupto):
+            FacturaElectronica.objects.get(pk=ecf.pk).xml_firmado
+
+    def test_listados_no_cargan_el_xml(self, django_assert_num_queries):
+        from api.models import FacturaElectronica
+        from api.utils.ecf_documentos import guardar_documento
+
+        for i in range(3):
+            FacturaElectronica.objects.create(
+                venta=VentaFactory(), documento_id=guardar_documento(f'<ECF>{i}</ECF>'),
+            )
+        with django_assert_num_queries(1) as ctx:
+            list(FacturaElectronica.objects.select_related('venta'))
+        assert 'documentoecf' not in ctx.captured_queries[0]['sql'].lower()
+
+
+@pytest.mark.django_db
+class TestRecepcionECF:
+    def _zip(self, archivos):
+        import io
+        import zipfile
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            for nombre, datos in archivos.items():
+                zf.writestr(nombre, datos)
+        return SimpleUploadedFile('proveedores.zip', buffer.getvalue(), content_type='application/zip')
+
+    @pytest.fixture
+    def ca(self, tmp_path, settings):
+        ca = crear_ca(tmp_path / 'ca.pem')
+        settings.ECF_RECEPCION_CA_PEM = ca[0]
+        return ca
+
+    def test_importa_verifica_y_deduplica(self, tmp_path, ca):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from api.models import Compra, Proveedor
+        from api.utils.ecf_recepcion import RecepcionECF
+
+        negocio = NegocioFactory()
+        AlmacenFactory(negocio=negocio)
+        papel = ProductoFactory(negocio=negocio, nombre='Papel bond')
+        p12 = crear_p12(tmp_path / 'proveedor.p12', 'secreto', ca=ca, rnc='131000001')
+        autofirmado = crear_p12(tmp_path / 'falso.p12', 'secreto', rnc='131000001')
+        otro_rnc = crear_p12(tmp_path / 'otro.p12', 'secreto', ca=ca, rnc='132000002')
+        rnc = negocio.identificacion_fiscal
+        factura = crear_ecf_firmado(p12, 'secreto', 'E310000000001', rnc, items=[
+            ('Papel bond', '2', '500.00'), ('Toner negro', '1', '1000.00'),
+        ])
+        alterada = crear_ecf_firmado(p12, 'secreto', 'E310000000002', rnc).replace(b'500.00', b'50.00')
+        ajena = crear_ecf_firmado(p12, 'secreto', 'E310000000003', '109999999')
+        falsa = crear_ecf_firmado(autofirmado, 'secreto', 'E310000000004', rnc)
+        suplantada = crear_ecf_firmado(otro_rnc, 'secreto', 'E310000000005', rnc)
+
+        reporte = RecepcionECF(negocio, procesos=1).procesar([self._zip({
+            'a.xml': factura, 'copia.xml': factura, 'alterada.xml': alterada, 'ajena.xml': ajena,
+            'falsa.xml': falsa, 'suplantada.xml': suplantada, 'rota.xml': b'<ECF>', 'leeme.txt': b'ignorado',
+        })])
+
+        assert {k: v for k, v in reporte.items() if k != 'documentos'} == {
+            'total': 7, 'importados': 1, 'duplicados': 1, 'firma_invalida': 3, 'rechazados': 1, 'errores': 1,
+        }
+        estados = {d['archivo']: d['estado'] for d in reporte['documentos']}
+        for nombre in ('alterada', 'falsa', 'suplantada'):
+            assert estados[f'proveedores.zip/{nombre}.xml'] == 'FIRMA_INVALIDA'
+        assert estados['proveedores.zip/rota.xml'] == 'ERROR'
+
+        compra = Compra.objects.get(negocio=negocio)
+        assert compra.estado == 'BORRADOR' and compra.ncf_proveedor == 'E310000000001'
+        assert compra.total == Decimal('2360.00') and compra.total_impuestos == Decimal('360.00')
+        assert compra.proveedor == Proveedor.objects.get(negocio=negocio, identificacion_fiscal='131000001')
+        assert compra.documento_ecf.xml.encode('utf-8') == factura
+        detalles = {d.descripcion: d for d in compra.detalles.select_related('producto')}
+        assert detalles['Papel bond'].producto == papel
+        assert detalles['Toner negro'].producto.codigo_barras == 'ECF-SIN-CLASIFICAR'
+        assert detalles['Toner negro'].impuesto == Decimal('180.00')
+
+        reporte = RecepcionECF(negocio, procesos=1).procesar([
+            SimpleUploadedFile('a.xml', factura, content_type='application/xml'),
+        ])
+        assert reporte['duplicados'] == 1 and Compra.objects.filter(negocio=negocio).count() == 1
+
+    def test_sin_almacen(self, ca):
+        from api.utils.ecf_recepcion import RecepcionECF
+        with pytest.raises(ValueError):
+            RecepcionECF(NegocioFactory()).procesar([])
+
+    def test_sin_ca_no_importa(self, tmp_path, settings):
+        from api.models import Compra
+        from api.utils.ecf_recepcion import RecepcionECF
+
+        settings.ECF_RECEPCION_CA_PEM = ''
+        negocio = NegocioFactory()
+        AlmacenFactory(negocio=negocio)
+        xml = crear_ecf_firmado(
+            crear_p12(tmp_path / 'proveedor.p12', 'secreto', rnc='131000001'), 'secreto',
+            'E310000000001', negocio.identificacion_fiscal,
+        )
+        with pytest.raises(ValueError, match='ECF_RECEPCION_CA_PEM'):
+            RecepcionECF(negocio, procesos=1).procesar([self._zip({'a.xml': xml})])
+        assert not Compra.objects.filter(negocio=negocio).exists()
+
+    def test_firma_envuelta_se_rechaza(self, tmp_path, ca):
+        from lxml import etree
+        from api.utils.ecf_recepcion import FIRMA_INVALIDA, analizar_documento
+
+        negocio = NegocioFactory()
+        p12 = crear_p12(tmp_path / 'proveedor.p12', 'secreto', ca=ca, rnc='131000001')
+        original = etree.fromstring(crear_ecf_firmado(p12, 'secreto', 'E310000000001', negocio.identificacion_fiscal))
+        # Un documento falso que envuelve al firmado y lleva su firma en la raíz
+        falso = etree.fromstring(crear_ecf_firmado(p12, 'secreto', 'E319999999999', negocio.identificacion_fiscal))
+        for firma in falso.findall('{http://www.w3.org/2000/09/xmldsig#}Signature'):
+            falso.remove(firma)
+        firma = original.find('{http://www.w3.org/2000/09/xmldsig#}Signature')
+        original.remove(firma)
+        falso.append(original)
+        falso.append(firma)
+
+        _, resultado = analizar_documento((0, etree.tostring(falso), ca[0]))
+        assert resultado['estado'] == FIRMA_INVALIDA
+
+
+@pytest.mark.django_db
+class TestConsultorEstadosECF:
+    def _ecf(self, track_id, **kwargs):
+        from api.models import FacturaElectronica
+        venta = VentaFactory(estado_fiscal='ENVIADO')
+        return FacturaElectronica.objects.create(venta=venta, track_id=track_id, **kwargs)
+
+    def test_aplica_estados_finales_y_reprograma(self, monkeypatch):
+        from datetime import timedelta
+        from django.utils import timezone
+        from api.models import FacturaElectronica, Venta
+        from api.utils.dgii_api import AsyncDGIIClient
+        from api.utils.ecf_estado import ConsultorEstadosECF
+
+        aceptada = self._ecf('T-ACEP')
+        rechazada = self._ecf('T-RECH')
+        en_proceso = self._ecf('T-PROC', consultas_estado=2)
+        no_vencida = self._ecf('T-LUEGO', proxima_consulta=timezone.now() + timedelta(hours=1))
+
+        consultados = []
+
+        async def consultar(self, track_id):
+            consultados.append(track_id)
+            estado = {'T-ACEP': 'Aceptado Condicional', 'T-RECH': 'Rechazado'}.get(track_id, 'En Proceso')
+            return {'estado': estado, 'mensaje': '', 'respuesta_cruda': {'estado': estado}}
+        monkeypatch.setattr(AsyncDGIIClient, 'consultar_estado', consultar)
+
+        antes = timezone.now()
+        resumen = ConsultorEstadosECF(por_segundo=1000).ejecutar()
+
+        assert sorted(consultados) == ['T-ACEP', 'T-PROC', 'T-RECH']
+        assert resumen == {'consultadas': 3, 'aceptadas': 1, 'rechazadas': 1, 'en_proceso': 1}
+        assert Venta.objects.get(id=aceptada.venta_id).estado_fiscal == 'ACEPTADO'
+        assert Venta.objects.get(id=rechazada.venta_id).estado_fiscal == 'RECHAZADO'
+        assert FacturaElectronica.objects.get(pk=rechazada.pk).respuesta_dgii == {'estado': 'Rechazado'}
+        en_proceso.refresh_from_db()
+        assert en_proceso.consultas_estado == 3
+        # Intervalo del 3er reintento: 240s +/- 20%
+        assert antes + timedelta(seconds=190) < en_proceso.proxima_consulta < antes + timedelta(seconds=300)
+        assert Venta.objects.get(id=no_vencida.venta_id).estado_fiscal == 'ENVIADO'
+
+    def test_intervalo_crece_hasta_el_maximo(self):
+        from api.utils.ecf_estado import INTERVALO_MAXIMO, intervalo_consulta
+        assert 24 <= intervalo_consulta(0) <= 36
+        assert intervalo_consulta(50) <= INTERVALO_MAXIMO * 1.2
+
+
+@pytest.mark.django_db
+class TestColaContingenciaECF:
+    def setup_method(self):
+        from django.core.cache import cache
+        from api.circuit_breakers import reset_breaker
+        from api.utils.ecf_contingencia import ColaContingenciaECF
+        reset_breaker('dgii')
+        cache.delete(ColaContingenciaECF.CACHE_CAPACIDAD)
+
+    def _en_contingencia(self, negocio, ncf, dias):
+        from datetime import timedelta
+        from django.utils import timezone
+        from api.models import FacturaElectronica
+        from api.utils.ecf_documentos import guardar_documento
+        venta = VentaFactory(negocio=negocio, ncf=ncf, estado_fiscal='EN_CONTINGENCIA')
+        venta.fecha = timezone.now() - timedelta(days=dias)
+        venta.save(update_fields=['fecha'])
+        FacturaElectronica.objects.create(venta=venta, documento_id=guardar_documento(f'<ECF>{ncf}</ECF>'))
+        return venta
+
+    def _vencer(self):
+        from django.utils import timezone
+        from api.models import ContingenciaECF
+        ContingenciaECF.objects.update(proximo_intento=timezone.now())
+
+    def test_reenvia_mas_antiguas_primero_con_backoff(self, monkeypatch):
+        from api.models import ContingenciaECF, Venta
+        from api.utils.dgii_api import AsyncDGIIClient
+        from api.utils.ecf_contingencia import ColaContingenciaECF
+
+        negocio = NegocioFactory()
+        reciente = self._en_contingencia(negocio, 'E320000000001', dias=1)
+        antigua = self._en_contingencia(negocio, 'E320000000002', dias=5)
+
+        enviados = []
+
+        async def enviar(self, xml_firmado):
+            enviados.append(xml_firmado)
+            if 'E320000000001' in xml_firmado:
+                return {'estado': 'ERROR', 'track_id': '', 'mensaje': 'timeout', 'respuesta_cruda': {}}
+            return {'estado': 'EN_PROCESO', 'track_id': 'T-1', 'mensaje': '', 'respuesta_cruda': {}}
+        monkeypatch.setattr(AsyncDGIIClient, 'enviar_ecf', enviar)
+
+        cola = ColaContingenciaECF()
+        assert cola.ejecutar()['encoladas'] == 2
+        assert enviados == []  # primer intento tras BACKOFF_BASE
+        self._vencer()
+        monkeypatch.setattr(ColaContingenciaECF, 'CAPACIDAD_MIN', 1)
+        resumen = cola.ejecutar()
+
+        assert enviados == ['<ECF>E320000000002</ECF>']
+        assert resumen['resueltas'] == 1 and resumen['capacidad'] == 2
+        assert Venta.objects.get(id=antigua.id).estado_fiscal == 'ENVIADO'
+        assert ContingenciaECF.objects.get(venta=antigua).estado == 'RESUELTA'
+
+        resumen = cola.ejecutar()
+        fila = ContingenciaECF.objects.get(venta=reciente)
+        assert resumen['reintentos'] == 1 and resumen['capacidad'] == 1
+        assert fila.intentos == 1 and fila.ultimo_error == 'timeout'
+        assert cola.pendientes().count() == 0  # esperando su backoff
+
+    def test_venta_reclamada_se_pospone_sin_contar_intento(self, monkeypatch):
+        from django.core.cache import cache
+        from api.models import ContingenciaECF
+        from api.utils.dgii_api import AsyncDGIIClient
+        from api.utils.ecf_contingencia import ColaContingenciaECF
+        from api.utils.ecf_lote import clave_emision
+
+        venta = self._en_contingencia(NegocioFactory(), 'E320000000001', dias=1)
+        enviados = []
+
+        async def enviar(self, xml_firmado):
+            enviados.append(xml_firmado)
+            return {'estado': 'EN_PROCESO', 'track_id': 'T-1', 'mensaje': '', 'respuesta_cruda': {}}
+        monkeypatch.setattr(AsyncDGIIClient, 'enviar_ecf', enviar)
+
+        cola = ColaContingenciaECF()
+        cola.encolar_nuevas()
+        ContingenciaECF.objects.update(intentos=3)
+        self._vencer()
+        # Otro proceso tiene la venta reclamada mientras corre la cola
+        cache.set(clave_emision(venta.id), 'job-x')
+        try:
+            resumen = cola.ejecutar()
+        finally:
+            cache.delete(clave_emision(venta.id))
+
+        fila = ContingenciaECF.objects.get(venta=venta)
+        assert enviados == []
+        assert resumen['omitidas'] == 1 and resumen['resueltas'] == 0
+        assert (fila.estado, fila.intentos) == ('PENDIENTE', 3)
+        assert cola.pendientes().count() == 0  # vuelve en BACKOFF_BASE
+        assert cola.encolar_nuevas() == (0, 0)
+
+        self._vencer()
+        assert cola.ejecutar()['resueltas'] == 1
+        assert enviados == ['<ECF>E320000000001</ECF>']
+
+    def test_dead_letter_y_reencolar(self, monkeypatch):
+        from api.models import ContingenciaECF
+        from api.utils.dgii_api import AsyncDGIIClient
+        from api.utils.ecf_contingencia import ColaContingenciaECF
+
+        negocio = NegocioFactory()
+        venta = self._en_contingencia(negocio, 'E320000000001', dias=1)
+
+        async def enviar(self, xml_firmado):
+            return {'estado': 'ERROR', 'track_id': '', 'mensaje': 'HTTP 500', 'respuesta_cruda': {}}
+        monkeypatch.setattr(AsyncDGIIClient, 'enviar_ecf', enviar)
+        monkeypatch.setattr(ColaContingenciaECF, 'MAX_INTENTOS', 2)
+
+        cola = ColaContingenciaECF()
+        cola.encolar_nuevas()
+        for _ in range(2):
+            self._vencer()
+            cola.ejecutar()
+        assert ContingenciaECF.objects.get(venta=venta).estado == 'DEAD_LETTER'
+        # No se vuelve a encolar sola aunque la venta siga en contingencia
+        assert cola.encolar_nuevas() == (0, 0)
+        assert ColaContingenciaECF.metricas(negocio)['dead_letter'] == 1
+
+        assert ColaContingenciaECF.reencolar(negocio) == 1
+        fila = ContingenciaECF.objects.get(venta=venta)
+        assert fila.estado == 'PENDIENTE' and fila.intentos == 0
+
+    def test_breaker_abierto_no_envia_ni_cuenta_intentos(self, monkeypatch):
+        from datetime import timedelta
+        from api.circuit_breakers import dgii_breaker
+        from api.models import ContingenciaECF
+        from api.utils.dgii_api import AsyncDGIIClient
+        from api.utils.ecf_contingencia import ColaContingenciaECF
+
+        self._en_contingencia(NegocioFactory(), 'E320000000001', dias=1)
+        cola = ColaContingenciaECF()
+        cola.encolar_nuevas()
+        self._vencer()
+        dgii_breaker.open()
+        try:
+            resumen = cola.ejecutar()
+            assert resumen['procesadas'] == 0
+            assert ContingenciaECF.objects.get().intentos == 0
+
+            # Vencido el reset_timeout se envía una factura de prueba
+            async def enviar(self, xml_firmado):
+                return {'estado': 'EN_PROCESO', 'track_id': 'T-1', 'mensaje': '', 'respuesta_cruda': {}}
+            monkeypatch.setattr(AsyncDGIIClient, 'enviar_ecf', enviar)
+            dgii_breaker._state_storage.opened_at -= timedelta(seconds=dgii_breaker.reset_timeout)
+            self._en_contingencia(NegocioFactory(), 'E320000000002', dias=2)
+            cola.encolar_nuevas()
+            self._vencer()
+            resumen = cola.ejecutar()
+            assert resumen['procesadas'] == 1 and resumen['resueltas'] == 1
+        finally:
+            dgii_breaker.close()
+
+    def test_metricas(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from api.models import ContingenciaECF
+        from api.utils.ecf_contingencia import ColaContingenciaECF
+
+        negocio = NegocioFactory()
+        self._en_contingencia(negocio, 'E320000000001', dias=2)
+        resuelta = self._en_contingencia(negocio, 'E320000000002', dias=3)
+        ColaContingenciaECF().encolar_nuevas()
+        ContingenciaECF.objects.filter(venta=resuelta).update(
+            estado='RESUELTA', fecha_resuelta=timezone.now() - timedelta(minutes=1),
+        )
+
+        metricas = ColaContingenciaECF.metricas(negocio)
+        assert metricas['backlog'] == 1
+        assert metricas['antiguedad_segundos'] >= 2 * 86400
+        assert metricas['tasa_drenado_por_minuto'] == round(1 / 15, 2)
+        assert metricas['eta_minutos'] == 15.0
+        assert metricas['breaker'] == 'closed'
+
+
+# =============================================================================
+# CLIENTE DGII
+# =============================================================================
+
+class TestDGIIClient:
+    def setup_method(self):
+        from api.circuit_breakers import reset_breaker
+        reset_breaker('dgii')
+
+    def teardown_method(self):
+        from api.circuit_breakers import reset_breaker
+        from api.utils.dgii_api import close_sessions
+        reset_breaker('dgii')
+        close_sessions()
+
+    def _cliente(self, dgii, **kwargs):
+        from api.utils.dgii_api import DGIIClient
+        cliente = DGIIClient('TEST', '101000000', base_url=dgii.base_url, **kwargs)
+        cliente.backoff_base = 0
+        return cliente
+
+    def test_ambiente_local_sin_simulador(self, monkeypatch):
+        from api.utils import dgii_api
+        monkeypatch.delitem(dgii_api.AMBIENTES, 'LOCAL', raising=False)
+        monkeypatch.delitem(dgii_api.AMBIENTES_FC, 'LOCAL', raising=False)
+        with pytest.raises(ValueError, match='DGII_LOCAL_URL'):
+            dgii_api.DGIIClient('LOCAL', '101000000')
+        with pytest.raises(ValueError, match='DGII_LOCAL_URL'):
+            dgii_api.AsyncDGIIClient('LOCAL', '101000000')
+
+        monkeypatch.setitem(dgii_api.AMBIENTES, 'LOCAL', 'http://127.0.0.1:8089/')
+        monkeypatch.setitem(dgii_api.AMBIENTES_FC, 'LOCAL', 'http://127.0.0.1:8089/')
+        cliente = dgii_api.DGIIClient('LOCAL', '101000000')
+        assert cliente.base_url == cliente.base_url_fc == 'http://127.0.0.1:8089/'
+
+    def test_reutiliza_conexion(self):
+        from .dgii_server import DGIIStandIn
+        with DGIIStandIn() as dgii:
+            for _ in range(3):
+                resp = self._cliente(dgii).enviar_ecf('<ECF/>')
+                assert resp['estado'] == 'EN_PROCESO'
+                assert resp['track_id']
+            assert dgii.peticiones == 3
+            assert len(dgii.conexiones) == 1
+
+    def test_reintenta_error_transitorio(self):
+        from .dgii_server import DGIIStandIn
+        with DGIIStandIn() as dgii:
+            dgii.fallos_transitorios = 1
+            resp = self._cliente(dgii, max_retries=2).enviar_ecf('<ECF/>')
+            assert resp['estado'] == 'EN_PROCESO'
+            assert dgii.peticiones == 2
+
+    def test_breaker_abierto_no_llama_a_dgii(self):
+        from api.circuit_breakers import dgii_breaker
+        from .dgii_server import DGIIStandIn
+        with DGIIStandIn() as dgii:
+            dgii.modo = 'error'
+            cliente = self._cliente(dgii, max_retries=1)
+            for _ in range(dgii_breaker.fail_max):
+                assert cliente.enviar_ecf('<ECF/>')['estado'] == 'ERROR'
+            assert dgii_breaker.current_state == 'open'
+            peticiones = dgii.peticiones
+            resp = cliente.enviar_ecf('<ECF/>')
+            assert resp['estado'] == 'ERROR'
+            assert 'circuit breaker' in resp['mensaje']
+            assert dgii.peticiones == peticiones
+
+    def test_401_no_cuenta_como_fallo(self):
+        from api.circuit_breakers import dgii_breaker
+        from .dgii_server import DGIIStandIn
+        with DGIIStandIn() as dgii:
+            dgii.modo = '401'
+            resp = self._cliente(dgii).enviar_ecf('<ECF/>')
+            assert resp['estado'] == 'ERROR'
+            assert dgii_breaker.fail_counter == 0
+
+    def test_resumen_consumo(self):
+        from .dgii_server import DGIIStandIn
+        with DGIIStandIn() as dgii:
+            resp = self._cliente(dgii).enviar_resumen('<RFCE/>')
+            assert resp['estado'] == 'ACEPTADO' and resp['track_id'] == ''
+            assert dgii.resumenes == 1
+            dgii.modo = 'rechazo'
+            assert self._cliente(dgii).enviar_resumen('<RFCE/>')['estado'] == 'RECHAZADO'
+
+    def test_cliente_async_lote(self):
+        import asyncio
+        from api.utils.dgii_api import AsyncDGIIClient
+        from .dgii_server import DGIIStandIn
+        with DGIIStandIn() as dgii:
+            cliente = AsyncDGIIClient('TEST', '101000000', base_url=dgii.base_url, concurrencia=2)
+            respuestas = asyncio.run(cliente.enviar_lote(['<ECF/>'] * 5))
+            assert [r['estado'] for r in respuestas] == ['EN_PROCESO'] * 5
+            estados = asyncio.run(cliente.consultar_lote([r['track_id'] for r in respuestas]))
+            assert {e['estado'] for e in estados} == {'ACEPTADO'}
+            assert len(dgii.conexiones) <= 2
+
+    def test_simulador_tasas_y_caida(self):
+        from api.utils.dgii_simulador import SimuladorDGII
+        with SimuladorDGII(tasa_error=0.3, tasa_401=0.2, semilla=7) as dgii:
+            cliente = self._cliente(dgii, max_retries=1)
+            estados = [cliente.enviar_ecf('<ECF/>')['estado'] for _ in range(4)]
+            assert dgii.peticiones == 4
+            assert set(dgii.resumen()['por_status']) <= {'200', '401', '500'}
+            assert 'ERROR' in estados or 'EN_PROCESO' in estados
+
+            dgii.tasa_error = dgii.tasa_401 = 0
+            dgii.caida = True
+            resp = cliente.enviar_ecf('<ECF/>')
+            assert resp['estado'] == 'ERROR'
+            assert 'conexión' in resp['mensaje']
+
+            dgii.caida = False
+            track_id = cliente.enviar_ecf('<ECF/>')['track_id']
+            assert cliente.consultar_estado(track_id)['estado'] == 'Aceptado'
+
 
 # =============================================================================
 # CIRCUIT BREAKERS
@@ -582,6 +2058,23 @@ class TestOFXParser:
         assert parser.validate(b'OFXHEADER:100\n<OFX>...') is True
         assert parser.validate(b'not an ofx file') is False
 
+    def test_parse_decodes_declared_charset(self):
+        from api.parsers.ofx_parser import OFXParser
+        sgml = (
+            'OFXHEADER:100\nDATA:OFXSGML\nVERSION:102\nENCODING:USASCII\nCHARSET:1252\n\n'
+            '<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>\n'
+            '<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20240115<TRNAMT>1500.00<FITID>F1<MEMO>DEPÓSITO PEÑA\n</STMTTRN>\n'
+            '</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n'
+        ).encode('cp1252')
+        xml = (
+            '<?xml version="1.0" encoding="ISO-8859-1"?>\n<?OFX OFXHEADER="200" VERSION="220"?>\n'
+            '<OFX><STMTTRN><DTPOSTED>20240115</DTPOSTED><TRNAMT>10.00</TRNAMT>'
+            '<FITID>F2</FITID><NAME>AÑO NUEVO</NAME></STMTTRN></OFX>\n'
+        ).encode('latin-1')
+
+        assert OFXParser().parse(sgml)[0].descripcion == 'DEPÓSITO PEÑA'
+        assert OFXParser().parse(xml)[0].descripcion == 'AÑO NUEVO'
+
 
 class TestCSVParser:
     def test_parse_basic_csv(self):
@@ -1,11 +1,15 @@
 """
 Security tests: 2FA, lockout, NCF, contabilidad.
 """
+import json
+import uuid
+from datetime import datetime, timezone as dt_timezone
 from decimal import Decimal
 from unittest.mock import patch
 
 import pyotp
 import pytest
+from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db.models import Sum
@@ -536,3 +540,168 @@ class TestPeriodoContableCierre:
         # This test documents current behavior and can be tightened later
         assert asiento.estado == 'CONTABILIZADO'
         assert periodo.estado == 'CERRADO'
+
+
+# ===========================================================================
+# AUDITORÍA ASÍNCRONA
+# ===========================================================================
+
+@pytest.mark.django_db
+class TestAuditoriaAsincrona:
+    @pytest.fixture
+    def stream(self, monkeypatch, settings):
+        from api.circuit_breakers import audit_stream_breaker
+        from api.utils import auditoria
+        settings.AUDITORIA_ASINCRONA = True
+        monkeypatch.setattr(auditoria, 'STREAM', f'test:auditoria:{uuid.uuid4()}')
+        audit_stream_breaker.close()
+        conexion = auditoria._redis()
+        yield auditoria
+        conexion.delete(auditoria.STREAM)
+        audit_stream_breaker.close()
+
+    def test_middleware_encola_y_volcador_guarda(self, stream, auth_client, usuario,
+                                                 django_capture_on_commit_callbacks):
+        from api.models import AuditLog
+        with django_capture_on_commit_callbacks(execute=True):
+            response = auth_client.post('/api/v1/clientes/', {}, format='json')
+        assert response.status_code == 400
+
+        # La respuesta no escribió en la base: el evento está en el stream
+        assert not AuditLog.objects.exists()
+        assert stream._redis().xlen(stream.STREAM) == 1
+
+        assert stream.volcar_auditoria() == 1
+        log = AuditLog.objects.get()
+        assert (log.usuario_id, log.accion, log.resultado) == (usuario.id, 'CREATE', 'FAILED')
+        assert stream._redis().xlen(stream.STREAM) == 0
+        assert stream.volcar_auditoria() == 0
+
+        # Reintentar un lote ya guardado no duplica (el id viaja en el evento)
+        stream.guardar_eventos([json.dumps({
+            'id': str(log.id), 'negocio_id': str(usuario.negocio_id), 'accion': 'CREATE',
+            'modelo': 'Clientes', 'descripcion': 'x', 'fecha': log.fecha.isoformat(),
+        })])
+        assert AuditLog.objects.count() == 1
+
+    def test_sin_redis_escribe_directo(self, stream, monkeypatch, negocio,
+                                       django_capture_on_commit_callbacks):
+        import redis
+        from api.models import AuditLog
+
+        class RedisCaido:
+            def xadd(self, *args, **kwargs):
+                raise redis.ConnectionError('sin conexión')
+
+        monkeypatch.setattr(stream, '_conexion', RedisCaido())
+        with django_capture_on_commit_callbacks(execute=True):
+            for i in range(4):  # la cuarta ya no intenta Redis: el breaker está abierto
+                stream.registrar_auditoria(
+                    negocio_id=negocio.id, accion='UPDATE', modelo='Venta', descripcion=f'evento {i}',
+                )
+        assert AuditLog.objects.filter(negocio=negocio).count() == 4
+
+    def test_auditlog_inmutable_sin_select(self, negocio, django_assert_num_queries):
+        from api.models import AuditLog
+        with django_assert_num_queries(1):
+            log = AuditLog.objects.create(negocio=negocio, accion='VIEW', modelo='X', descripcion='x')
+        with pytest.raises(ValidationError):
+            AuditLog.objects.get(pk=log.pk).save()
+
+
+
+@pytest.mark.django_db
+class TestParticionesAuditoria:
+    def _mes(self, atras):
+        """Primer día del mes de hace ``atras`` meses (UTC)."""
+        from datetime import date
+        hoy = timezone.now().astimezone(dt_timezone.utc).date()
+        indice = hoy.year * 12 + hoy.month - 1 - atras
+        return date(indice // 12, indice % 12 + 1, 1)
+
+    def _log(self, negocio, mes, dia=15, **campos):
+        from api.models import AuditLog
+        return AuditLog.objects.create(
+            negocio=negocio, accion=campos.pop('accion', 'UPDATE'), modelo='Venta', descripcion='x',
+            fecha=datetime(mes.year, mes.month, dia, 12, tzinfo=dt_timezone.utc), **campos,
+        )
+
+    def _particion_de(self, log):
+        from django.db import connection
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text FROM api_auditlog WHERE id = %s', [log.id])
+            return cursor.fetchone()[0]
+
+    def test_crear_particiones_mueve_filas_del_default(self, negocio):
+        from api.utils import particiones_auditoria as particiones
+
+        mes = self._mes(4)
+        log = self._log(negocio, mes)
+        assert self._particion_de(log) == 'api_auditlog_default'
+
+        creados = particiones.crear_particiones(meses_adelante=5, desde=mes)
+        assert creados[0] == mes and creados[-1] == self._mes(-5)
+        assert particiones.crear_particiones(meses_adelante=5, desde=mes) == []
+        assert self._particion_de(log) == particiones.nombre_particion(mes)
+        assert self._mes(-5) in particiones.particiones()
+
+    def test_listado_por_defecto_poda_particiones_viejas(self, negocio, auth_client):
+        from django.db import connection
+        from api.models import AuditLog
+        from api.utils import particiones_auditoria as particiones
+
+        viejo = self._mes(6)
+        particiones.crear_particiones(desde=viejo)
+        self._log(negocio, viejo)
+        reciente = AuditLog.objects.create(negocio=negocio, accion='VIEW', modelo='Venta', descripcion='x')
+
+        response = auth_client.get('/api/v1/seguridad/audit-log/')
+        assert response.status_code == 200
+        resultados = response.data['results'] if isinstance(response.data, dict) else response.data
+        assert [r['id'] for r in resultados] == [str(reciente.id)]
+
+        desde = timezone.now() - timezone.timedelta(days=settings.AUDITORIA_VENTANA_DIAS)
+        sql, params = AuditLog.objects.filter(negocio=negocio, fecha__gte=desde).query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN {sql}', params)
+            plan = '\n'.join(fila[0] for fila in cursor.fetchall())
+        assert particiones.nombre_particion(viejo) not in plan
+        assert particiones.nombre_particion(self._mes(0)) in plan
+
+    def test_archivar_y_leer_mes(self, negocio, usuario, auth_client, tmp_path):
+        from api.models import ArchivoAuditoria, AuditLog
+        from api.utils import particiones_auditoria as particiones
+
+        mes = self._mes(3)
+        particiones.crear_particiones(desde=mes)
+        otro = NegocioFactory()
+        propio = self._log(negocio, mes, usuario=usuario, accion='DELETE')
+        self._log(negocio, mes, dia=20, accion='VIEW')
+        self._log(otro, mes)
+        vigente = self._log(negocio, self._mes(2))
+
+        archivados = particiones.archivar_particiones(retencion_meses=2, directorio=str(tmp_path))
+        assert [a.mes for a in archivados] == [mes]
+        archivo = ArchivoAuditoria.objects.get(mes=mes)
+        assert archivo.registros == 3
+        assert archivo.checksum_sha256 == particiones.compute_file_sha256(archivo.archivo)
+        assert mes not in particiones.particiones()
+        assert list(AuditLog.objects.filter(negocio=negocio).values_list('id', flat=True)) == [vigente.id]
+
+        response = auth_client.get('/api/v1/seguridad/audit-log/archivados/')
+        assert [r['mes'] for r in response.data] == [mes.isoformat()]
+
+        url = '/api/v1/seguridad/audit-log/archivo/'
+        response = auth_client.get(url, {'mes': f'{mes:%Y-%m}', 'accion': 'DELETE'})
+        assert response.status_code == 200
+        filas = [json.loads(linea) for linea in b''.join(response.streaming_content).splitlines()]
+        assert [f['id'] for f in filas] == [str(propio.id)]
+
+        response = auth_client.get(url, {'mes': f'{mes:%Y-%m}'})
+        assert len(b''.join(response.streaming_content).splitlines()) == 2
+        assert auth_client.get(url, {'mes': f'{self._mes(5):%Y-%m}'}).status_code == 404
+        assert auth_client.get(url, {'mes': 'marzo'}).status_code == 400
+
+        with open(archivo.archivo, 'ab') as f:
+            f.write(b'x')
+        assert auth_client.get(url, {'mes': f'{mes:%Y-%m}'}).status_code == 409
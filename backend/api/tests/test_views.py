@@ -2,11 +2,12 @@ import pytest
 from decimal import Decimal
 from rest_framework.test import APIClient
 from django.urls import reverse
+from django.utils import timezone
 from .factories import (
     NegocioFactory, UsuarioFactory, ProductoFactory, ClienteFactory,
     ProveedorFactory, CategoriaFactory, CuentaContableFactory,
     VentaFactory, CompraFactory, CuentaBancariaFactory, PeriodoContableFactory,
-    SucursalFactory, AlmacenFactory,
+    SucursalFactory, AlmacenFactory, crear_ca, crear_p12, crear_ecf_firmado,
 )
 
 
@@ -131,6 +132,181 @@ class TestVentaViewSet:
         }, format='json')
         assert response.status_code == 201
 
+    def test_emitir_ecf_responde_202_y_encola(
+        self, auth_client, usuario, tmp_path, monkeypatch, django_capture_on_commit_callbacks,
+    ):
+        from api import tasks
+        from api.models import Venta
+        llamadas = []
+        monkeypatch.setattr(
+            tasks.enviar_ecf_async, 'apply_async', lambda *a, **kw: llamadas.append(kw),
+        )
+        monkeypatch.setenv('TEST_CERT_PASS', 'secreto')
+        negocio = usuario.negocio
+        negocio.certificado_digital_path = crear_p12(tmp_path / 'cert.p12', 'secreto')
+        negocio.certificado_pass_env = 'TEST_CERT_PASS'
+        negocio.save()
+        venta = VentaFactory(negocio=negocio, ncf='E320000000001')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = auth_client.post(f'/api/v1/ventas/{venta.id}/emitir-ecf/')
+        assert response.status_code == 202
+        job_id = response.data['job_id']
+        assert llamadas[0]['task_id'] == job_id
+        assert llamadas[0]['kwargs']['usuario_id'] == usuario.id
+        assert Venta.objects.get(id=venta.id).estado_fiscal == 'PENDIENTE'
+
+        # Segundo clic: mismo job, sin encolar otra vez
+        response = auth_client.post(f'/api/v1/ventas/{venta.id}/emitir-ecf/')
+        assert response.status_code == 202
+        assert response.data['job_id'] == job_id
+        assert len(llamadas) == 1
+
+    def test_emitir_ecf_reclamo_de_lote_y_broker_caido(
+        self, auth_client, usuario, tmp_path, monkeypatch, django_capture_on_commit_callbacks,
+    ):
+        from django.core.cache import cache
+        from api import tasks
+        from api.models import Venta
+        from api.utils import notificaciones
+        from api.utils.ecf_lote import clave_emision
+
+        eventos = []
+        monkeypatch.setattr(
+            notificaciones, 'notificar_usuario', lambda usuario_id, tipo, data: eventos.append((tipo, data)),
+        )
+
+        def broker_caido(*args, **kwargs):
+            raise ConnectionError('broker no disponible')
+        monkeypatch.setattr(tasks.enviar_ecf_async, 'apply_async', broker_caido)
+        monkeypatch.setenv('TEST_CERT_PASS', 'secreto')
+        negocio = usuario.negocio
+        negocio.certificado_digital_path = crear_p12(tmp_path / 'cert.p12', 'secreto')
+        negocio.certificado_pass_env = 'TEST_CERT_PASS'
+        negocio.save()
+        venta = VentaFactory(negocio=negocio, ncf='E320000000001', estado_fiscal='PENDIENTE')
+        url = f'/api/v1/ventas/{venta.id}/emitir-ecf/'
+
+        # Un lote tiene la venta: no hay job que devolver
+        cache.set(clave_emision(venta.id), 'lote:abc')
+        try:
+            assert auth_client.post(url).status_code == 409
+        finally:
+            cache.delete(clave_emision(venta.id))
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = auth_client.post(url)
+        assert response.status_code == 202
+        # El job no existe: el resultado llega igual como evento 'ecf_emision'
+        assert eventos == [('ecf_emision', {
+            'job_id': response.data['job_id'], 'venta_id': str(venta.id),
+            'estado_fiscal': 'EN_CONTINGENCIA', 'error': 'broker no disponible',
+        })]
+        assert Venta.objects.get(id=venta.id).estado_fiscal == 'EN_CONTINGENCIA'
+        assert cache.get(clave_emision(venta.id)) is None
+
+    def test_emitir_ecf_lote_encola(self, auth_client, usuario, monkeypatch):
+        from api import tasks
+        llamadas = []
+        monkeypatch.setattr(
+            tasks.emitir_ecf_lote_async, 'delay',
+            lambda *a, **kw: llamadas.append((a, kw)) or type('T', (), {'id': 'task-1'})(),
+        )
+        negocio = usuario.negocio
+        negocio.certificado_digital_path = '/tmp/cert.p12'
+        negocio.certificado_pass_env = 'CERT_PASS'
+        negocio.save()
+        VentaFactory(negocio=negocio, estado_fiscal='PENDIENTE')
+        response = auth_client.post('/api/v1/ventas/emitir-ecf-lote/', {}, format='json')
+        assert response.status_code == 202
+        assert response.data['pendientes'] == 1
+        assert llamadas[0][1]['lote_id'] == response.data['lote_id']
+
+    def test_emitir_ecf_lote_sin_pendientes(self, auth_client, usuario):
+        negocio = usuario.negocio
+        negocio.certificado_digital_path = '/tmp/cert.p12'
+        negocio.certificado_pass_env = 'CERT_PASS'
+        negocio.save()
+        response = auth_client.post('/api/v1/ventas/emitir-ecf-lote/', {}, format='json')
+        assert response.status_code == 400
+
+    def test_contingencia_metricas_y_reencolar(self, auth_client, usuario):
+        from api.models import ContingenciaECF
+        venta = VentaFactory(negocio=usuario.negocio, ncf='E320000000001', estado_fiscal='EN_CONTINGENCIA')
+        ContingenciaECF.objects.create(
+            venta=venta, negocio=usuario.negocio, estado='DEAD_LETTER', intentos=8,
+            proximo_intento=timezone.now(), fecha_venta=venta.fecha, ultimo_error='HTTP 500',
+        )
+        response = auth_client.get('/api/v1/ventas/contingencia/')
+        assert response.status_code == 200
+        assert response.data['dead_letter'] == 1
+        assert response.data['descartadas'][0]['ncf'] == 'E320000000001'
+
+        response = auth_client.post('/api/v1/ventas/contingencia/reencolar/', {}, format='json')
+        assert response.data['reencoladas'] == 1
+        assert ContingenciaECF.objects.get(venta=venta).estado == 'PENDIENTE'
+
+    def test_representacion_impresa(self, auth_client, usuario, settings, django_capture_on_commit_callbacks):
+        import zipfile
+        from io import BytesIO
+        from api.models import AuditLog
+        settings.AUDITORIA_ASINCRONA = False
+        ventas = [
+            VentaFactory(negocio=usuario.negocio, ncf=f'E32000000000{i}', codigo_seguridad_dgii='123456')
+            for i in range(1, 3)
+        ]
+        VentaFactory(negocio=usuario.negocio)  # sin NCF: no se imprime
+
+        response = auth_client.get(f'/api/v1/ventas/{ventas[0].id}/representacion-impresa/')
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/pdf'
+        assert response.content.startswith(b'%PDF')
+
+        hoy = timezone.localdate().isoformat()
+        with django_capture_on_commit_callbacks(execute=True):
+            response = auth_client.post('/api/v1/ventas/representacion-impresa-lote/', {
+                'formato': 'zip', 'desde': hoy, 'hasta': hoy,
+            }, format='json')
+        assert response.status_code == 200 and response.streaming
+        archivo = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        assert sorted(archivo.namelist()) == ['E320000000001.pdf', 'E320000000002.pdf']
+        assert AuditLog.objects.filter(accion='EXPORT', modelo='FacturaElectronica').exists()
+
+        response = auth_client.post('/api/v1/ventas/representacion-impresa-lote/', {
+            'formato': 'xls', 'venta_ids': [str(ventas[0].id)],
+        }, format='json')
+        assert response.status_code == 400
+
+
+# --- Reportes fiscales ---
+
+@pytest.mark.django_db
+class TestReporteFiscalViewSet:
+    def test_preview_607(self, auth_client, usuario):
+        VentaFactory(negocio=usuario.negocio, ncf='E320000000001')
+        hoy = timezone.now()
+        response = auth_client.get(
+            f'/api/v1/reportes-fiscales/preview/?year={hoy.year}&month={hoy.month}&tipo=607'
+        )
+        assert response.status_code == 200
+        assert len(response.data) == 1
+
+    def test_tipo_invalido(self, auth_client, usuario):
+        response = auth_client.get('/api/v1/reportes-fiscales/preview/?year=2024&month=1&tipo=VENTAS')
+        assert response.status_code == 400
+
+    def test_ncf_pronostico(self, auth_client, usuario):
+        from datetime import timedelta
+        from api.models import SecuenciaNCF
+        SecuenciaNCF.objects.create(
+            negocio=usuario.negocio, tipo_comprobante='B01', serie='0', numero_desde=1,
+            numero_hasta=100, numero_actual=1, fecha_vencimiento=timezone.localdate() + timedelta(days=10),
+        )
+        response = auth_client.get('/api/v1/reportes-fiscales/ncf-pronostico/')
+        assert response.status_code == 200
+        assert response.data[0]['disponibles'] == 100
+        assert response.data[0]['alerta'] is True
+
 
 # --- Compras ---
 
@@ -157,6 +333,30 @@ class TestCompraViewSet:
         }, format='json')
         assert response.status_code == 201
 
+    def test_importar_ecf(self, auth_client, usuario, tmp_path, settings, django_capture_on_commit_callbacks):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from api.models import AuditLog, Compra
+        AlmacenFactory(negocio=usuario.negocio, sucursal=usuario.sucursal)
+        ca = crear_ca(tmp_path / 'ca.pem')
+        settings.ECF_RECEPCION_CA_PEM = ca[0]
+        settings.AUDITORIA_ASINCRONA = False
+        xml = crear_ecf_firmado(
+            crear_p12(tmp_path / 'proveedor.p12', 'secreto', ca=ca, rnc='131000001'), 'secreto',
+            'E310000000001', usuario.negocio.identificacion_fiscal,
+        )
+        with django_capture_on_commit_callbacks(execute=True):
+            response = auth_client.post('/api/v1/compras/importar-ecf/', {
+                'archivos': [SimpleUploadedFile('factura.xml', xml, content_type='application/xml')],
+            }, format='multipart')
+        assert response.status_code == 201
+        assert response.data['importados'] == 1
+        assert Compra.objects.get(negocio=usuario.negocio).ncf_proveedor == 'E310000000001'
+        assert AuditLog.objects.filter(modelo='Compra', accion='CREATE').exists()
+
+    def test_importar_ecf_sin_archivos(self, auth_client):
+        response = auth_client.post('/api/v1/compras/importar-ecf/', {}, format='multipart')
+        assert response.status_code == 400
+
 
 # --- Contabilidad ---
 
@@ -186,6 +386,174 @@ class TestCuentaBancariaViewSet:
         response = auth_client.get('/api/v1/cuentas-bancarias/')
         assert response.status_code == 200
 
+    def test_importar_movimientos_deduplica(self, auth_client, usuario):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from api.models import MovimientoBancario
+        cuenta = CuentaBancariaFactory(negocio=usuario.negocio)
+        csv_texto = (
+            'fecha,descripcion,referencia,monto,tipo\n'
+            '2025-01-10,Cargo comision,,150.00,DEBITO\n'
+            '2025-01-10,Cargo comision,,150.00,DEBITO\n'
+            '2025-01-11,Deposito cliente,DEP-1,5000.00,CREDITO\n'
+            'no-es-fecha,Fila rota,,10.00,DEBITO\n'
+        )
+        url = f'/api/v1/cuentas-bancarias/{cuenta.id}/importar-movimientos/'
+
+        def subir(texto):
+            archivo = SimpleUploadedFile('extracto.csv', texto.encode(), content_type='text/csv')
+            return auth_client.post(url, {'archivo': archivo}, format='multipart')
+
+        response = subir(csv_texto)
+        assert response.status_code == 200
+        # Dos cargos idénticos del mismo extracto son legítimos
+        assert response.data['movimientos_importados'] == 3
+        assert response.data['invalidos'] == 1
+        assert response.data['errores'][0]['fila'] == 5
+
+        # Extracto solapado: solo la fila nueva entra
+        response = subir(csv_texto + '2025-01-12,Pago luz,,900.00,DEBITO\n')
+        assert (response.data['movimientos_importados'], response.data['duplicados']) == (1, 3)
+        assert MovimientoBancario.objects.filter(cuenta=cuenta).count() == 4
+
+
+    def test_conciliar_contra_asientos(self, auth_client, usuario, django_assert_max_num_queries):
+        from datetime import date, timedelta
+        from api.models import AsientoContable, LineaAsiento, MovimientoBancario
+        negocio = usuario.negocio
+        banco = CuentaContableFactory(negocio=negocio)
+        ingresos = CuentaContableFactory(negocio=negocio, tipo='INGRESO', naturaleza='ACREEDORA')
+        cuenta = CuentaBancariaFactory(negocio=negocio, cuenta_contable=banco)
+        d = date(2025, 3, 10)
+
+        def asiento(numero, fecha, lineas):
+            total = sum(debe for _, debe, _ in lineas)
+            a = AsientoContable.objects.create(
+                negocio=negocio, numero=numero, fecha=fecha, descripcion=numero,
+                total_debe=total, total_haber=total, estado='CONTABILIZADO',
+            )
+            for cuenta_contable, debe, haber in lineas:
+                LineaAsiento.objects.create(asiento=a, cuenta=cuenta_contable, debe=debe, haber=haber)
+            return a
+
+        # Depósito de varias líneas: el lado del banco es 1000 al debe
+        deposito = asiento('A-1', d + timedelta(days=1), [
+            (banco, Decimal('1000.00'), 0), (ingresos, 0, Decimal('847.46')), (ingresos, 0, Decimal('152.54')),
+        ])
+        retiro = asiento('A-2', d, [(ingresos, Decimal('500.00'), 0), (banco, 0, Decimal('500.00'))])
+
+        def mov(tipo, monto, fecha):
+            return MovimientoBancario.objects.create(
+                cuenta=cuenta, tipo=tipo, monto=Decimal(monto), fecha=fecha, descripcion='x',
+            )
+        lejano = mov('CREDITO', '1000.00', d)
+        cercano = mov('CREDITO', '1000.00', d + timedelta(days=1))
+        debito = mov('DEBITO', '500.00', d + timedelta(days=2))
+        signo_contrario = mov('CREDITO', '500.00', d)
+
+        url = f'/api/v1/cuentas-bancarias/{cuenta.id}/conciliar/'
+        datos = {'fecha_desde': '2025-03-01', 'fecha_hasta': '2025-03-31', 'saldo_extracto': '50000'}
+        with django_assert_max_num_queries(12):
+            response = auth_client.post(url, datos, format='json')
+        assert response.status_code == 200
+        assert (response.data['movimientos_conciliados'], response.data['movimientos_pendientes']) == (2, 2)
+        for m in (lejano, cercano, debito, signo_contrario):
+            m.refresh_from_db()
+        assert (cercano.asiento_contable, debito.asiento_contable) == (deposito, retiro)
+        assert not lejano.conciliado and not signo_contrario.conciliado
+
+        # Un asiento ya usado no vuelve a conciliar otro movimiento
+        response = auth_client.post(url, datos, format='json')
+        assert response.data['movimientos_conciliados'] == 0
+
+
+@pytest.mark.django_db
+class TestImportacionBancariaViewSet:
+    def test_importar_csv_deduplica(self, auth_client, usuario, monkeypatch):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from api import tasks
+        from api.models import TransaccionBancaria
+        encoladas = []
+        monkeypatch.setattr(tasks.conciliar_automatico_async, 'delay', encoladas.append)
+        cuenta = CuentaBancariaFactory(negocio=usuario.negocio)
+        csv_texto = (
+            'fecha;descripcion;referencia;monto\n'
+            '10/01/2025;Deposito cliente;DEP-1;5000.00\n'
+            '11/01/2025;Pago proveedor;CHK-7;-1200.50\n'
+            '31/02/2025;Fecha imposible;X;1.00\n'
+        )
+
+        def subir():
+            archivo = SimpleUploadedFile('extracto.csv', csv_texto.encode(), content_type='text/csv')
+            return auth_client.post('/api/v1/importaciones-bancarias/importar/', {
+                'archivo': archivo, 'cuenta_bancaria': str(cuenta.id), 'formato': 'CSV_BANCO',
+            }, format='multipart')
+
+        response = subir()
+        assert response.status_code == 201
+        assert (response.data['registros_importados'], response.data['registros_invalidos']) == (2, 1)
+        assert len(encoladas) == 1
+
+        response = subir()
+        assert (response.data['registros_importados'], response.data['registros_duplicados']) == (0, 2)
+        assert len(encoladas) == 1
+        assert TransaccionBancaria.objects.filter(cuenta_bancaria=cuenta).count() == 2
+
+
+@pytest.mark.django_db
+class TestSugerenciaCobroViewSet:
+    def test_cola_de_revision(self, auth_client, usuario):
+        from datetime import date
+        from api.models import (
+            ArchivoImportacionBancaria, CuentaPorCobrar, SugerenciaCobro, TransaccionBancaria,
+        )
+        negocio = usuario.negocio
+        cuenta = CuentaBancariaFactory(negocio=negocio)
+        cliente = ClienteFactory(negocio=negocio, numero_documento='131000001')
+        facturas = [
+            CuentaPorCobrar.objects.create(
+                negocio=negocio, cliente=cliente, numero=f'CXC-00000{i}',
+                fecha_emision=date(2025, 1, i), fecha_vencimiento=date(2025, 2, i),
+                monto_original=Decimal('500.00'), saldo_pendiente=Decimal('500.00'),
+            )
+            for i in (1, 2)
+        ]
+        importacion = ArchivoImportacionBancaria.objects.create(
+            negocio=negocio, cuenta_bancaria=cuenta, archivo_nombre='x.csv', formato='CSV_BANCO',
+        )
+        for descripcion, monto in (('ABONO RNC 131000001', '600.00'), ('DEPOSITO', '500.00')):
+            TransaccionBancaria.objects.create(
+                negocio=negocio, cuenta_bancaria=cuenta, importacion=importacion,
+                fecha=date(2025, 3, 1), descripcion=descripcion, monto=Decimal(monto),
+            )
+
+        response = auth_client.post('/api/v1/sugerencias-cobro/ejecutar/', {}, format='json')
+        assert response.status_code == 200
+        assert (response.data['aplicadas'], response.data['en_revision']) == (0, 2)
+
+        response = auth_client.get('/api/v1/sugerencias-cobro/', {'estado': 'PENDIENTE'})
+        cola = {s['transaccion_descripcion']: s for s in response.data['results']}
+        abono = cola['ABONO RNC 131000001']
+        # Pago parcial: se reparte de la factura más antigua a la más nueva
+        assert [(a['numero'], a['monto']) for a in abono['asignaciones']] == [
+            ('CXC-000001', '500.00'), ('CXC-000002', '100.00'),
+        ]
+
+        url = f"/api/v1/sugerencias-cobro/{abono['id']}/aplicar/"
+        excedida = [{'cuenta_por_cobrar': str(facturas[1].id), 'monto': '600.00'}]
+        assert auth_client.post(url, {'asignaciones': excedida}, format='json').status_code == 400
+        response = auth_client.post(url, {'asignaciones': [
+            {'cuenta_por_cobrar': str(facturas[1].id), 'monto': '500.00'},
+        ]}, format='json')
+        assert response.status_code == 200
+        assert response.data['estado'] == 'APLICADA'
+        facturas[1].refresh_from_db()
+        assert (facturas[1].estado, facturas[1].saldo_pendiente) == ('PAGADA', 0)
+
+        deposito = cola['DEPOSITO']
+        response = auth_client.post(f"/api/v1/sugerencias-cobro/{deposito['id']}/rechazar/")
+        assert response.data['estado'] == 'RECHAZADA'
+        assert not SugerenciaCobro.objects.filter(estado='PENDIENTE').exists()
+
 
 # --- Periodos Contables ---
 
@@ -79,6 +79,7 @@ router.register(r'presupuestos', views.PresupuestoViewSet, basename='presupuesto
 # --- Conciliación Bancaria ---
 router.register(r'importaciones-bancarias', views.ImportacionBancariaViewSet, basename='importacion-bancaria')
 router.register(r'transacciones-bancarias', views.TransaccionBancariaViewSet, basename='transaccion-bancaria')
+router.register(r'sugerencias-cobro', views.SugerenciaCobroViewSet, basename='sugerencia-cobro')
 
 # --- Seguridad ---
 router.register(r'seguridad/api-keys', views.ApiKeyViewSet, basename='api-key')
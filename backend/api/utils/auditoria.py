@@ -0,0 +1,174 @@
+"""
+Escritura asíncrona y por lotes del AuditLog.
+
+registrar_auditoria() no inserta en la base de datos: al confirmarse la
+transacción en curso agrega el evento (con su id y fecha ya fijados) a un
+stream de Redis con XADD, que cuesta una fracción de milisegundo. La tarea
+periódica volcar_auditoria lee el stream con un grupo de consumidores y
+guarda los eventos con bulk_create, así que ni la respuesta de la API ni los
+signals esperan por el INSERT.
+
+Durabilidad:
+- Un evento se confirma (XACK) y borra del stream solo después de guardado;
+  los que quedan tomados por un volcador que murió se reclaman con XAUTOCLAIM.
+  Como el id viene del evento, reintentar un lote no duplica filas.
+- Si Redis no responde, el circuit breaker 'audit_stream' se abre y los
+  eventos se escriben directo en la base de datos (el mismo bulk_create).
+- Si tampoco hay base de datos, el evento completo queda en el log 'audit'
+  (logs/audit.log) para reconstruirlo a mano.
+Redis debe correr con appendonly para no perder el stream en un reinicio.
+
+Uso:
+    registrar_auditoria(
+        negocio_id=negocio.id, usuario_id=usuario.id, accion='UPDATE',
+        modelo='Venta', objeto_id=str(venta.pk), descripcion='Venta modificada',
+    )
+"""
+import json
+import logging
+import os
+import socket
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, DataError, IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger('audit')
+
+STREAM = 'auditoria:eventos'
+GRUPO = 'auditoria-volcador'
+TAMANO_BLOQUE = 1000
+RECLAMO_MS = 60_000  # Eventos tomados hace más de esto por otro volcador se reclaman
+
+CAMPOS = (
+    'id', 'negocio_id', 'usuario_id', 'accion', 'modelo', 'objeto_id', 'descripcion',
+    'datos_anteriores', 'datos_nuevos', 'ip_address', 'user_agent', 'sesion_id',
+    'duracion_ms', 'resultado', 'fecha',
+)
+
+_conexion = None
+
+
+def _redis():
+    global _conexion
+    if _conexion is None:
+        import redis
+        _conexion = redis.Redis.from_url(
+            settings.AUDITORIA_REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5,
+        )
+    return _conexion
+
+
+def registrar_auditoria(**campos):
+    """
+    Encola un evento de auditoría (mismos campos que AuditLog, con *_id para
+    las llaves foráneas). Se publica al confirmar la transacción en curso, así
+    que un cambio revertido no deja rastro, igual que con un INSERT directo.
+    Devuelve el id que tendrá el AuditLog.
+    """
+    desconocidos = set(campos) - set(CAMPOS)
+    if desconocidos:
+        raise TypeError(f'Campos de auditoría desconocidos: {", ".join(sorted(desconocidos))}')
+    evento = dict(campos)
+    evento['id'] = str(evento.get('id') or uuid.uuid4())
+    evento['fecha'] = evento.get('fecha') or timezone.now()
+    for campo in ('negocio_id', 'usuario_id'):
+        if evento.get(campo) is not None:
+            evento[campo] = str(evento[campo])
+    datos = json.dumps(evento, cls=DjangoJSONEncoder)
+    transaction.on_commit(lambda: _publicar(datos), robust=True)
+    return evento['id']
+
+
+def _publicar(datos):
+    from api.circuit_breakers import audit_stream_breaker
+    import pybreaker
+
+    if settings.AUDITORIA_ASINCRONA:
+        try:
+            audit_stream_breaker.call(_redis().xadd, STREAM, {'evento': datos})
+            return
+        except pybreaker.CircuitBreakerError:
+            pass
+        except Exception as e:
+            logger.warning('Stream de auditoría no disponible, escritura directa: %s', e)
+    try:
+        guardar_eventos([datos])
+    except DatabaseError:
+        # Sin Redis ni base de datos: que al menos quede el evento en el log
+        logger.exception('Evento de auditoría no guardado: %s', datos)
+
+
+def _desde_evento(datos):
+    from api.models import AuditLog
+
+    evento = json.loads(datos)
+    evento['fecha'] = parse_datetime(evento['fecha'])
+    return AuditLog(**evento)
+
+
+def guardar_eventos(eventos):
+    """
+    Inserta eventos serializados con bulk_create (sin la verificación de
+    inmutabilidad de AuditLog.save, que no aplica a filas nuevas). Si una
+    fila inválida hace fallar el lote, se guarda fila por fila y la inválida
+    se descarta al log. Los errores de conexión se propagan: el volcador no
+    confirma el lote y se reintenta.
+    """
+    from api.models import AuditLog
+
+    filas = []
+    for datos in eventos:
+        try:
+            filas.append((datos, _desde_evento(datos)))
+        except (ValueError, TypeError, KeyError) as e:
+            logger.error('Evento de auditoría ilegible descartado: %s (%s)', datos, e)
+    try:
+        with transaction.atomic():
+            AuditLog.objects.bulk_create([f for _, f in filas], ignore_conflicts=True, batch_size=TAMANO_BLOQUE)
+    except (IntegrityError, DataError):
+        for datos, fila in filas:
+            try:
+                with transaction.atomic():
+                    AuditLog.objects.bulk_create([fila], ignore_conflicts=True)
+            except (IntegrityError, DataError) as e:
+                logger.error('Evento de auditoría inválido descartado: %s (%s)', datos, e)
+
+
+def volcar_auditoria(limite=TAMANO_BLOQUE * 20, conexion=None):
+    """
+    Pasa a la base de datos hasta ``limite`` eventos del stream; devuelve
+    cuántos. Varios volcadores pueden correr a la vez (grupo de consumidores).
+    """
+    import redis
+
+    conexion = conexion or _redis()
+    try:
+        conexion.xgroup_create(STREAM, GRUPO, id='0', mkstream=True)
+    except redis.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+    consumidor = f'{socket.gethostname()}-{os.getpid()}'
+
+    # Primero lo que un volcador caído dejó tomado sin confirmar
+    lote = conexion.xautoclaim(
+        STREAM, GRUPO, consumidor, min_idle_time=RECLAMO_MS, start_id='0-0', count=TAMANO_BLOQUE,
+    )[1]
+    total = 0
+    while total < limite:
+        if not lote:
+            respuesta = conexion.xreadgroup(GRUPO, consumidor, {STREAM: '>'}, count=TAMANO_BLOQUE)
+            lote = respuesta[0][1] if respuesta else []
+            if not lote:
+                break
+        ids = [mensaje_id for mensaje_id, _ in lote]
+        eventos = [campos[b'evento'].decode() for _, campos in lote if campos and b'evento' in campos]
+        guardar_eventos(eventos)
+        conexion.xack(STREAM, GRUPO, *ids)
+        conexion.xdel(STREAM, *ids)
+        total += len(ids)
+        lote = []
+    return total
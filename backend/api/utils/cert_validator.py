@@ -6,6 +6,43 @@ from cryptography.hazmat.backends import default_backend
 logger = logging.getLogger('security')
 
 
+def certificate_status(cert, now=None):
+    """
+    Estado de un certificado X.509 ya cargado (sin leer ni descifrar el .p12).
+
+    Returns:
+        dict con: valid, subject, issuer, not_before, not_after, days_remaining, error
+    """
+    now = now or datetime.now(timezone.utc)
+    not_before = cert.not_valid_before_utc
+    not_after = cert.not_valid_after_utc
+
+    subject_parts = []
+    for attr in cert.subject:
+        subject_parts.append(f"{attr.oid._name}={attr.value}")
+    issuer_parts = []
+    for attr in cert.issuer:
+        issuer_parts.append(f"{attr.oid._name}={attr.value}")
+
+    result = {
+        'valid': False,
+        'subject': ', '.join(subject_parts),
+        'issuer': ', '.join(issuer_parts),
+        'not_before': not_before.isoformat(),
+        'not_after': not_after.isoformat(),
+        'days_remaining': (not_after - now).days,
+        'error': None,
+    }
+
+    if now < not_before:
+        result['error'] = 'El certificado aún no es válido.'
+    elif now > not_after:
+        result['error'] = 'El certificado ha expirado.'
+    else:
+        result['valid'] = True
+    return result
+
+
 def validate_p12_certificate(p12_path, p12_password):
     """
     Valida un certificado .p12 y retorna información de estado.
@@ -37,29 +74,7 @@ def validate_p12_certificate(p12_path, p12_password):
             result['error'] = 'El archivo .p12 no contiene un certificado válido.'
             return result
 
-        now = datetime.now(timezone.utc)
-        not_before = cert.not_valid_before_utc
-        not_after = cert.not_valid_after_utc
-
-        subject_parts = []
-        for attr in cert.subject:
-            subject_parts.append(f"{attr.oid._name}={attr.value}")
-        issuer_parts = []
-        for attr in cert.issuer:
-            issuer_parts.append(f"{attr.oid._name}={attr.value}")
-
-        result['subject'] = ', '.join(subject_parts)
-        result['issuer'] = ', '.join(issuer_parts)
-        result['not_before'] = not_before.isoformat()
-        result['not_after'] = not_after.isoformat()
-        result['days_remaining'] = (not_after - now).days
-
-        if now < not_before:
-            result['error'] = 'El certificado aún no es válido.'
-        elif now > not_after:
-            result['error'] = 'El certificado ha expirado.'
-        else:
-            result['valid'] = True
+        result.update(certificate_status(cert))
 
     except FileNotFoundError:
         result['error'] = f'Archivo de certificado no encontrado: {p12_path}'
@@ -1,58 +1,258 @@
+import asyncio
 import logging
+import os
+import random
+import threading
 import time
+
+import pybreaker
 import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 
+from ..circuit_breakers import dgii_breaker
+
 logger = logging.getLogger('security')
 
 AMBIENTES = {
     'TEST': 'https://ecf.dgii.gov.do/TesteCF/',
     'PROD': 'https://ecf.dgii.gov.do/CerteCF/',
 }
+# Recepción de Resúmenes de Factura de Consumo (RFCE): servicio aparte, síncrono.
+AMBIENTES_FC = {
+    'TEST': 'https://fc.dgii.gov.do/TesteCF/',
+    'PROD': 'https://fc.dgii.gov.do/CerteCF/',
+}
+if getattr(settings, 'DGII_LOCAL_URL', ''):
+    # Simulador local (api.utils.dgii_simulador); sin URL configurada el
+    # ambiente no existe y DGIIClient lo rechaza.
+    AMBIENTES['LOCAL'] = AMBIENTES_FC['LOCAL'] = settings.DGII_LOCAL_URL
 
 ESTADO_ACEPTADO = 'ACEPTADO'
 ESTADO_RECHAZADO = 'RECHAZADO'
 ESTADO_EN_PROCESO = 'EN_PROCESO'
 ESTADO_ERROR = 'ERROR'
 
+MENSAJE_BREAKER_ABIERTO = 'DGII no disponible (circuit breaker abierto).'
+
+# Conexiones keep-alive por host; debe cubrir la concurrencia de los lotes.
+POOL_MAXSIZE = 32
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class DGIIServerError(RequestException):
+    """HTTP 5xx de la DGII: cuenta como fallo para el circuit breaker y se reintenta."""
+
+
+def get_session(base_url):
+    """
+    Session compartida (pool de conexiones keep-alive) por proceso y base_url.
+
+    Se indexa también por PID para que un worker creado con fork (gunicorn
+    --preload, Celery prefork) no reutilice sockets abiertos por el padre.
+    """
+    key = (os.getpid(), base_url)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=0,
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({
+                    'Content-Type': 'application/xml',
+                    'Accept': 'application/json',
+                })
+                _sessions[key] = session
+    return session
+
+
+def close_sessions():
+    """Cierra las sessions del proceso actual (tests, shutdown de workers)."""
+    with _sessions_lock:
+        for key in [k for k in _sessions if k[0] == os.getpid()]:
+            _sessions.pop(key).close()
+
 
 class DGIIClient:
-    """Cliente para la API de e-CF de la DGII."""
+    """
+    Cliente para la API de e-CF de la DGII.
 
-    def __init__(self, ambiente, rnc, usuario=None, clave=None):
-        self.base_url = AMBIENTES.get(ambiente, AMBIENTES['TEST'])
+    Usa una Session compartida por proceso, protegida por dgii_breaker: con el
+    breaker abierto las llamadas fallan al instante con ESTADO_ERROR (la venta
+    queda en contingencia) en vez de esperar timeouts. En vistas web use
+    max_retries=1 para no dormir nunca dentro del request.
+    """
+
+    def __init__(self, ambiente, rnc, usuario=None, clave=None,
+                 max_retries=3, base_url=None):
+        if not base_url and ambiente == 'LOCAL' and 'LOCAL' not in AMBIENTES:
+            # Nunca enviar a TesteCF un e-CF pensado para el simulador
+            raise ValueError("Ambiente fiscal 'LOCAL' sin simulador: configure DGII_LOCAL_URL.")
+        self.base_url = base_url or AMBIENTES.get(ambiente, AMBIENTES['TEST'])
+        self.base_url_fc = base_url or AMBIENTES_FC.get(ambiente, AMBIENTES_FC['TEST'])
         self.rnc = rnc
         self.usuario = usuario
         self.clave = clave
-        self.timeout = 30
-        self.max_retries = 3
-        self.session = requests.Session()
-        if usuario and clave:
-            self.session.auth = (usuario, clave)
-        self.session.headers.update({
-            'Content-Type': 'application/xml',
-            'Accept': 'application/json',
-        })
+        self.timeout = (5, 30)  # (connect, read)
+        self.max_retries = max_retries
+        self.backoff_base = 1
+        self.backoff_max = 20
+        self.auth = (usuario, clave) if usuario and clave else None
+        self.session = get_session(self.base_url)
+
+    def backoff(self, attempt):
+        """Full jitter: espera aleatoria en [0, min(max, base * 2^intento)]."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def request_once(self, method, url, **kwargs):
+        """Un intento HTTP a través del circuit breaker."""
+        def _send():
+            response = self.session.request(
+                method, url, timeout=self.timeout, auth=self.auth, **kwargs
+            )
+            if response.status_code >= 500:
+                raise DGIIServerError(f'HTTP {response.status_code}', response=response)
+            return response
+        return dgii_breaker.call(_send)
 
     def _request_with_retry(self, method, url, **kwargs):
-        """Ejecuta request con retry y backoff exponencial."""
+        """Ejecuta request con retry y backoff exponencial con jitter."""
         last_exception = None
         for attempt in range(self.max_retries):
             try:
-                response = self.session.request(
-                    method, url, timeout=self.timeout, **kwargs
-                )
-                return response
+                return self.request_once(method, url, **kwargs)
+            except pybreaker.CircuitBreakerError:
+                raise
             except RequestException as e:
                 last_exception = e
-                wait = 2 ** attempt
+                if attempt + 1 >= self.max_retries:
+                    break
+                wait = self.backoff(attempt)
                 logger.warning(
-                    'DGII API intento %d/%d falló: %s. Reintentando en %ds...',
+                    'DGII API intento %d/%d falló: %s. Reintentando en %.1fs...',
                     attempt + 1, self.max_retries, e, wait,
                 )
                 time.sleep(wait)
         raise last_exception
 
+    # --- URLs y parseo de respuestas (compartidos con AsyncDGIIClient) ---
+
+    def url_recepcion(self):
+        return f'{self.base_url}eCFRecepcion/api/ECFRecepcion'
+
+    def url_recepcion_fc(self):
+        return f'{self.base_url_fc}RecepcionFC/api/recepcion/ecf'
+
+    def url_consulta(self, track_id):
+        return f'{self.base_url}eCFConsulta/api/ECFConsulta/{track_id}'
+
+    def url_timbre(self, track_id):
+        return f'{self.base_url}eCFTimbre/api/ECFTimbre/{track_id}'
+
+    @staticmethod
+    def _json(response):
+        if response.headers.get('content-type', '').startswith('application/json'):
+            return response.json()
+        return {}
+
+    @staticmethod
+    def _error_envio(exc):
+        if isinstance(exc, pybreaker.CircuitBreakerError):
+            mensaje = MENSAJE_BREAKER_ABIERTO
+        else:
+            logger.error('Error de conexión con DGII: %s', exc)
+            mensaje = f'Error de conexión con DGII: {exc}'
+        return {
+            'estado': ESTADO_ERROR,
+            'track_id': '',
+            'mensaje': mensaje,
+            'respuesta_cruda': {'error': str(exc)},
+        }
+
+    def respuesta_envio(self, response):
+        if response.status_code == 200:
+            data = self._json(response)
+            track_id = data.get('trackId', data.get('TrackId', ''))
+            return {
+                'estado': ESTADO_EN_PROCESO,
+                'track_id': track_id,
+                'mensaje': data.get('mensaje', 'e-CF enviado correctamente'),
+                'respuesta_cruda': data,
+            }
+        elif response.status_code == 401:
+            return {
+                'estado': ESTADO_ERROR,
+                'track_id': '',
+                'mensaje': 'Credenciales DGII inválidas.',
+                'respuesta_cruda': {'status_code': 401},
+            }
+        return {
+            'estado': ESTADO_RECHAZADO,
+            'track_id': '',
+            'mensaje': f'DGII rechazó el e-CF. HTTP {response.status_code}',
+            'respuesta_cruda': {
+                'status_code': response.status_code,
+                'body': response.text[:500],
+            },
+        }
+
+    def respuesta_resumen(self, response):
+        """
+        La recepción de RFCE responde en el acto: estado ACEPTADO o RECHAZADO,
+        sin track_id ni consultas posteriores.
+        """
+        if response.status_code == 200:
+            data = self._json(response)
+            estado = (data.get('estado') or '').upper()
+            return {
+                'estado': ESTADO_ACEPTADO if estado.startswith(ESTADO_ACEPTADO) else ESTADO_RECHAZADO,
+                'track_id': '',
+                'mensaje': '; '.join(
+                    m.get('valor', '') if isinstance(m, dict) else str(m)
+                    for m in data.get('mensajes') or []
+                ) or data.get('estado', ''),
+                'respuesta_cruda': data,
+            }
+        return self.respuesta_envio(response)
+
+    def respuesta_consulta(self, response):
+        if response.status_code == 200:
+            data = self._json(response)
+            return {
+                'estado': data.get('estado', ESTADO_EN_PROCESO),
+                'mensaje': data.get('mensaje', ''),
+                'respuesta_cruda': data,
+            }
+        return {
+            'estado': ESTADO_EN_PROCESO,
+            'mensaje': f'HTTP {response.status_code}',
+            'respuesta_cruda': {'status_code': response.status_code},
+        }
+
+    def respuesta_timbre(self, response):
+        if response.status_code == 200:
+            data = self._json(response)
+            return {
+                'exito': True,
+                'qr_data': data.get('qrCode', data.get('QRCode', '')),
+                'respuesta_cruda': data,
+            }
+        return {
+            'exito': False,
+            'qr_data': '',
+            'respuesta_cruda': {'status_code': response.status_code},
+        }
+
+    # --- API pública ---
+
     def enviar_ecf(self, xml_firmado):
         """
         Envía un e-CF firmado a la DGII.
@@ -60,93 +260,130 @@ class DGIIClient:
         Returns:
             dict: {estado, track_id, mensaje, respuesta_cruda}
         """
-        url = f'{self.base_url}eCFRecepcion/api/ECFRecepcion'
         try:
             response = self._request_with_retry(
-                'POST', url, data=xml_firmado.encode('utf-8'),
+                'POST', self.url_recepcion(), data=xml_firmado.encode('utf-8'),
             )
+        except (RequestException, pybreaker.CircuitBreakerError) as e:
+            return self._error_envio(e)
+        return self.respuesta_envio(response)
 
-            if response.status_code == 200:
-                data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
-                track_id = data.get('trackId', data.get('TrackId', ''))
-                return {
-                    'estado': ESTADO_EN_PROCESO,
-                    'track_id': track_id,
-                    'mensaje': data.get('mensaje', 'e-CF enviado correctamente'),
-                    'respuesta_cruda': data,
-                }
-            elif response.status_code == 401:
-                return {
-                    'estado': ESTADO_ERROR,
-                    'track_id': '',
-                    'mensaje': 'Credenciales DGII inválidas.',
-                    'respuesta_cruda': {'status_code': 401},
-                }
-            else:
-                return {
-                    'estado': ESTADO_RECHAZADO,
-                    'track_id': '',
-                    'mensaje': f'DGII rechazó el e-CF. HTTP {response.status_code}',
-                    'respuesta_cruda': {
-                        'status_code': response.status_code,
-                        'body': response.text[:500],
-                    },
-                }
-
-        except RequestException as e:
-            logger.error('Error de conexión con DGII: %s', e)
-            return {
-                'estado': ESTADO_ERROR,
-                'track_id': '',
-                'mensaje': f'Error de conexión con DGII: {e}',
-                'respuesta_cruda': {'error': str(e)},
-            }
+    def enviar_resumen(self, xml_firmado):
+        """
+        Envía el Resumen de Factura de Consumo (RFCE) firmado de un e-CF 32.
+
+        Returns:
+            dict: {estado, track_id, mensaje, respuesta_cruda}; estado es final.
+        """
+        try:
+            response = self._request_with_retry(
+                'POST', self.url_recepcion_fc(), data=xml_firmado.encode('utf-8'),
+            )
+        except (RequestException, pybreaker.CircuitBreakerError) as e:
+            return self._error_envio(e)
+        return self.respuesta_resumen(response)
 
     def consultar_estado(self, track_id):
         """Consulta el estado de un e-CF enviado."""
-        url = f'{self.base_url}eCFConsulta/api/ECFConsulta/{track_id}'
         try:
-            response = self._request_with_retry('GET', url)
-            if response.status_code == 200:
-                data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
-                estado = data.get('estado', ESTADO_EN_PROCESO)
-                return {
-                    'estado': estado,
-                    'mensaje': data.get('mensaje', ''),
-                    'respuesta_cruda': data,
-                }
-            return {
-                'estado': ESTADO_EN_PROCESO,
-                'mensaje': f'HTTP {response.status_code}',
-                'respuesta_cruda': {'status_code': response.status_code},
-            }
-        except RequestException as e:
+            response = self._request_with_retry('GET', self.url_consulta(track_id))
+        except (RequestException, pybreaker.CircuitBreakerError) as e:
             return {
                 'estado': ESTADO_ERROR,
                 'mensaje': str(e),
                 'respuesta_cruda': {'error': str(e)},
             }
+        return self.respuesta_consulta(response)
 
     def consultar_timbre(self, track_id):
         """Consulta datos del timbre/QR de un e-CF."""
-        url = f'{self.base_url}eCFTimbre/api/ECFTimbre/{track_id}'
         try:
-            response = self._request_with_retry('GET', url)
-            if response.status_code == 200:
-                data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
-                return {
-                    'exito': True,
-                    'qr_data': data.get('qrCode', data.get('QRCode', '')),
-                    'respuesta_cruda': data,
-                }
+            response = self._request_with_retry('GET', self.url_timbre(track_id))
+        except (RequestException, pybreaker.CircuitBreakerError) as e:
             return {
                 'exito': False,
                 'qr_data': '',
-                'respuesta_cruda': {'status_code': response.status_code},
+                'respuesta_cruda': {'error': str(e)},
             }
-        except RequestException as e:
+        return self.respuesta_timbre(response)
+
+
+class AsyncDGIIClient:
+    """
+    Variante asyncio de DGIIClient para trabajo por lotes.
+
+    Cada intento HTTP corre en un hilo (asyncio.to_thread) sobre la misma Session
+    compartida, con un semáforo que acota las peticiones simultáneas; el backoff
+    usa asyncio.sleep, así que esperar un reintento no ocupa ningún hilo.
+    """
+
+    def __init__(self, ambiente, rnc, usuario=None, clave=None,
+                 max_retries=3, base_url=None, concurrencia=8):
+        self.client = DGIIClient(
+            ambiente, rnc, usuario=usuario, clave=clave,
+            max_retries=max_retries, base_url=base_url,
+        )
+        self.concurrencia = concurrencia
+        self._semaforo = None
+        self._loop = None
+
+    async def _request_with_retry(self, method, url, **kwargs):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Un semáforo queda ligado a su event loop (un asyncio.run por bloque).
+            self._semaforo = asyncio.Semaphore(self.concurrencia)
+            self._loop = loop
+        last_exception = None
+        for attempt in range(self.client.max_retries):
+            try:
+                async with self._semaforo:
+                    return await asyncio.to_thread(self.client.request_once, method, url, **kwargs)
+            except pybreaker.CircuitBreakerError:
+                raise
+            except RequestException as e:
+                last_exception = e
+                if attempt + 1 >= self.client.max_retries:
+                    break
+                await asyncio.sleep(self.client.backoff(attempt))
+        raise last_exception
+
+    async def enviar_ecf(self, xml_firmado):
+        try:
+            response = await self._request_with_retry(
+                'POST', self.client.url_recepcion(), data=xml_firmado.encode('utf-8'),
+            )
+        except (RequestException, pybreaker.CircuitBreakerError) as e:
+            return self.client._error_envio(e)
+        return self.client.respuesta_envio(response)
+
+    async def enviar_resumen(self, xml_firmado):
+        try:
+            response = await self._request_with_retry(
+                'POST', self.client.url_recepcion_fc(), data=xml_firmado.encode('utf-8'),
+            )
+        except (RequestException, pybreaker.CircuitBreakerError) as e:
+            return self.client._error_envio(e)
+        return self.client.respuesta_resumen(response)
+
+    async def consultar_estado(self, track_id):
+        try:
+            response = await self._request_with_retry('GET', self.client.url_consulta(track_id))
+        except (RequestException, pybreaker.CircuitBreakerError) as e:
             return {
-                'exito': False,
-                'qr_data': '',
+                'estado': ESTADO_ERROR,
+                'mensaje': str(e),
                 'respuesta_cruda': {'error': str(e)},
             }
+        return self.client.respuesta_consulta(response)
+
+    async def enviar_lote(self, xmls):
+        """Envía varios e-CF; retorna las respuestas en el mismo orden."""
+        return await asyncio.gather(*(self.enviar_ecf(x) for x in xmls))
+
+    async def enviar_resumenes(self, xmls):
+        """Envía varios RFCE; retorna las respuestas en el mismo orden."""
+        return await asyncio.gather(*(self.enviar_resumen(x) for x in xmls))
+
+    async def consultar_lote(self, track_ids):
+        """Consulta varios track_id; retorna las respuestas en el mismo orden."""
+        return await asyncio.gather(*(self.consultar_estado(t) for t in track_ids))
@@ -0,0 +1,179 @@
+"""
+Simulador local de la API de e-CF de la DGII (recepción, consulta, timbre y
+recepción de resúmenes de factura de consumo).
+
+Sirve para pruebas de carga y de caos del pipeline fiscal sin tocar
+ecf.dgii.gov.do. Se conecta con el ambiente 'LOCAL' de dgii_api.AMBIENTES
+(settings.DGII_LOCAL_URL).
+
+Comportamiento configurable en caliente (atributos de SimuladorDGII):
+    latencia_ms / latencia_sigma   latencia lognormal (mediana en ms, dispersión)
+    tasa_error                     fracción de respuestas HTTP 500
+    tasa_401                       fracción de HTTP 401 (credenciales)
+    tasa_rechazo                   fracción de HTTP 400 en recepción
+    caida                          outage: cierra la conexión sin responder
+    tasa_aceptado                  fracción de consultas que resuelven ACEPTADO
+                                   (el resto queda 'En Proceso' hasta la siguiente)
+
+Uso:
+    with SimuladorDGII(puerto=8089, latencia_ms=80, tasa_error=0.02) as dgii:
+        ...
+    python manage.py simular_dgii --puerto 8089 --latencia-ms 80 --tasa-error 0.02
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, como la DGII real
+
+    def log_message(self, format, *args):
+        pass
+
+    def _responder(self, status, data=None):
+        body = json.dumps(data or {}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _atender(self, ruta_valida, respuesta_ok):
+        simulador = self.server.simulador
+        status = simulador.decidir(self.client_address, recepcion=self.command == 'POST')
+        if status is None:
+            # Outage: la conexión se cierra sin respuesta (ConnectionError en el cliente).
+            self.close_connection = True
+            return
+        if status != 200:
+            return self._responder(status, {'mensaje': f'HTTP {status}'})
+        if not ruta_valida:
+            return self._responder(404)
+        self._responder(200, respuesta_ok())
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        simulador = self.server.simulador
+        if self.path.endswith('/RecepcionFC/api/recepcion/ecf'):
+            with simulador.lock:
+                simulador.resumenes += 1
+            return self._atender(True, lambda: {'codigo': 1, 'estado': 'Aceptado', 'mensajes': []})
+        self._atender(
+            self.path.endswith('/eCFRecepcion/api/ECFRecepcion'),
+            lambda: {'trackId': simulador.nuevo_track(), 'mensaje': 'Recibido'},
+        )
+
+    def do_GET(self):
+        simulador = self.server.simulador
+        track_id = self.path.rsplit('/', 1)[-1]
+        if '/eCFConsulta/api/ECFConsulta/' in self.path:
+            return self._atender(True, lambda: {'estado': simulador.estado_de(track_id)})
+        self._atender(
+            '/eCFTimbre/api/ECFTimbre/' in self.path,
+            lambda: {'qrCode': track_id},
+        )
+
+
+class SimuladorDGII:
+    """Servidor HTTP en un hilo; ver el docstring del módulo para la configuración."""
+
+    def __init__(self, host='127.0.0.1', puerto=0, latencia_ms=0, latencia_sigma=0.5,
+                 tasa_error=0.0, tasa_401=0.0, tasa_rechazo=0.0, tasa_aceptado=1.0,
+                 semilla=None):
+        self.latencia_ms = latencia_ms
+        self.latencia_sigma = latencia_sigma
+        self.tasa_error = tasa_error
+        self.tasa_401 = tasa_401
+        self.tasa_rechazo = tasa_rechazo
+        self.tasa_aceptado = tasa_aceptado
+        self.caida = False
+        self.peticiones = 0
+        self.resumenes = 0
+        self.por_status = {}
+        self.conexiones = set()
+        self.tracks = {}
+        self.lock = threading.Lock()
+        self._random = random.Random(semilla)
+        self._server = ThreadingHTTPServer((host, puerto), _Handler)
+        self._server.daemon_threads = True
+        self._server.simulador = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/'
+
+    def latencia(self):
+        """Segundos de latencia de una petición (lognormal con mediana latencia_ms)."""
+        if not self.latencia_ms:
+            return 0.0
+        with self.lock:
+            factor = self._random.lognormvariate(0, self.latencia_sigma) if self.latencia_sigma else 1.0
+        return self.latencia_ms * factor / 1000
+
+    def decidir(self, client_address, recepcion=False):
+        """Status HTTP de la petición (None = outage), tras aplicar la latencia."""
+        espera = self.latencia()
+        if espera:
+            time.sleep(espera)
+        with self.lock:
+            self.peticiones += 1
+            self.conexiones.add(client_address)
+            if self.caida:
+                status = None
+            else:
+                r = self._random.random()
+                if r < self.tasa_error:
+                    status = 500
+                elif r < self.tasa_error + self.tasa_401:
+                    status = 401
+                elif recepcion and r < self.tasa_error + self.tasa_401 + self.tasa_rechazo:
+                    status = 400
+                else:
+                    status = 200
+            self.por_status[status] = self.por_status.get(status, 0) + 1
+        return status
+
+    def nuevo_track(self):
+        track_id = uuid.uuid4().hex
+        with self.lock:
+            self.tracks[track_id] = 'En Proceso'
+        return track_id
+
+    def estado_de(self, track_id):
+        with self.lock:
+            estado = self.tracks.get(track_id, 'No encontrado')
+            if estado == 'En Proceso' and self._random.random() < self.tasa_aceptado:
+                estado = self.tracks[track_id] = 'Aceptado'
+        return estado
+
+    def resumen(self):
+        with self.lock:
+            return {
+                'peticiones': self.peticiones,
+                'conexiones': len(self.conexiones),
+                'por_status': {str(k or 'caida'): v for k, v in self.por_status.items()},
+                'tracks': len(self.tracks),
+                'resumenes': self.resumenes,
+            }
+
+    def iniciar(self):
+        self._thread.start()
+        return self
+
+    def detener(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
+
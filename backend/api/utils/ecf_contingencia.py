@@ -0,0 +1,299 @@
+"""
+Cola de contingencia de e-CF.
+
+Cada venta EN_CONTINGENCIA tiene una fila ContingenciaECF con su número de
+intentos y la hora del próximo. Cada ciclo (tarea beat reintentar_ecf_contingencia)
+toma las filas vencidas por orden de fecha de la venta (las más antiguas
+primero, para respetar los plazos de envío) y las reenvía con EmisorLoteECF
+reutilizando el XML ya firmado.
+
+- Backoff por factura: 1m, 2m, 4m, ... hasta 6h, con jitter. Tras MAX_INTENTOS
+  fallos la fila pasa a DEAD_LETTER y queda para revisión manual (reencolar()).
+- Un fallo por breaker abierto no cuenta como intento: la DGII estaba caída,
+  no la factura.
+- Capacidad por ciclo adaptativa (AIMD): con el breaker abierto no se envía
+  nada; semiabierto (o abierto con reset_timeout vencido) se envía una sola
+  factura de prueba; con el breaker cerrado la capacidad se duplica cada
+  ciclo sin fallos hasta CAPACIDAD_MAX (se reduce a la mitad cuando hay fallos).
+"""
+import logging
+import random
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from ..circuit_breakers import dgii_breaker, reset_timeout_elapsed
+from .dgii_api import MENSAJE_BREAKER_ABIERTO
+from .ecf_lote import EmisorLoteECF
+
+logger = logging.getLogger('api')
+
+
+class ColaContingenciaECF:
+    """
+    Uso:
+        resumen = ColaContingenciaECF().ejecutar()
+        metricas = ColaContingenciaECF.metricas(negocio)
+    """
+
+    MAX_INTENTOS = 8
+    BACKOFF_BASE = 60           # segundos
+    BACKOFF_MAX = 6 * 3600
+    CAPACIDAD_MIN = 20
+    CAPACIDAD_MAX = 2000
+    TAMANO_BLOQUE = 200
+    VENTANA_DRENADO = timedelta(minutes=15)
+    RETENCION_RESUELTAS = timedelta(days=7)
+    CACHE_CAPACIDAD = 'ecf_contingencia:capacidad'
+
+    @classmethod
+    def backoff(cls, intentos):
+        """Segundos hasta el próximo intento tras `intentos` fallos."""
+        base = min(cls.BACKOFF_MAX, cls.BACKOFF_BASE * 2 ** min(max(intentos - 1, 0), 16))
+        return base * random.uniform(0.8, 1.2)
+
+    @classmethod
+    def capacidad(cls):
+        return cache.get(cls.CACHE_CAPACIDAD, cls.CAPACIDAD_MIN)
+
+    @classmethod
+    def _ajustar_capacidad(cls, sin_fallos):
+        actual = cls.capacidad()
+        if sin_fallos:
+            nueva = min(cls.CAPACIDAD_MAX, actual * 2)
+        else:
+            nueva = max(cls.CAPACIDAD_MIN, actual // 2)
+        cache.set(cls.CACHE_CAPACIDAD, nueva, timeout=None)
+        return nueva
+
+    # --- Cola ------------------------------------------------------------
+
+    def encolar_nuevas(self):
+        """
+        Crea filas para las ventas EN_CONTINGENCIA que no están en la cola y
+        resuelve las filas cuya venta ya salió de contingencia por otra vía
+        (p. ej. un reenvío manual).
+        """
+        from ..models import ContingenciaECF, Venta
+
+        ahora = timezone.now()
+        nuevas = list(
+            Venta.objects.filter(estado_fiscal='EN_CONTINGENCIA')
+            .exclude(contingencia__estado__in=('PENDIENTE', 'DEAD_LETTER'))
+            .values('id', 'negocio_id', 'fecha')
+        )
+        if nuevas:
+            ContingenciaECF.objects.bulk_create(
+                [
+                    ContingenciaECF(
+                        venta_id=v['id'], negocio_id=v['negocio_id'], fecha_venta=v['fecha'],
+                        estado='PENDIENTE', intentos=0, ultimo_error='', fecha_resuelta=None,
+                        proximo_intento=ahora + timedelta(seconds=self.BACKOFF_BASE),
+                    )
+                    for v in nuevas
+                ],
+                update_conflicts=True,
+                unique_fields=['venta'],
+                update_fields=[
+                    'estado', 'intentos', 'proximo_intento', 'ultimo_error',
+                    'fecha_venta', 'fecha_ingreso', 'fecha_resuelta',
+                ],
+            )
+        resueltas = (
+            ContingenciaECF.objects.filter(estado__in=('PENDIENTE', 'DEAD_LETTER'))
+            .exclude(venta__estado_fiscal='EN_CONTINGENCIA')
+            .update(estado='RESUELTA', fecha_resuelta=ahora)
+        )
+        return len(nuevas), resueltas
+
+    def pendientes(self, ahora=None):
+        """Filas vencidas, más antiguas primero, sin cargar la venta."""
+        from ..models import ContingenciaECF
+
+        ahora = ahora or timezone.now()
+        return (
+            ContingenciaECF.objects
+            .filter(estado='PENDIENTE', proximo_intento__lte=ahora)
+            .order_by('fecha_venta')
+            .values('venta_id', 'negocio_id', 'intentos')
+        )
+
+    def ejecutar(self):
+        from ..models import ContingenciaECF, Negocio
+
+        encoladas, _ = self.encolar_nuevas()
+        resumen = {
+            'encoladas': encoladas, 'procesadas': 0, 'resueltas': 0, 'omitidas': 0,
+            'reintentos': 0, 'dead_letter': 0, 'capacidad': self.capacidad(),
+        }
+
+        estado_breaker = dgii_breaker.current_state
+        if estado_breaker == 'open' and not reset_timeout_elapsed(dgii_breaker):
+            logger.info('Cola de contingencia e-CF en espera: DGII breaker abierto')
+            return resumen
+        # Abierto con el timeout vencido o semiabierto: una sola factura de prueba.
+        limite = resumen['capacidad'] if estado_breaker == 'closed' else 1
+
+        filas = list(self.pendientes()[:limite])
+        por_negocio = {}
+        for fila in filas:
+            por_negocio.setdefault(fila['negocio_id'], []).append(fila)
+        negocios = Negocio.objects.in_bulk(list(por_negocio))
+
+        fallos = 0
+        for negocio_id, grupo in por_negocio.items():
+            emisor = EmisorLoteECF(negocios[negocio_id])
+            for inicio in range(0, len(grupo), self.TAMANO_BLOQUE):
+                if dgii_breaker.current_state == 'open' and not reset_timeout_elapsed(dgii_breaker):
+                    # El resto sigue vencido y se toma en el próximo ciclo.
+                    break
+                bloque = grupo[inicio:inicio + self.TAMANO_BLOQUE]
+                try:
+                    resultados = emisor.procesar_bloque([f['venta_id'] for f in bloque])
+                except Exception as e:
+                    logger.error('Contingencia e-CF negocio %s: %s', negocio_id, e)
+                    resultados = []
+                    errores = {f['venta_id']: str(e) for f in bloque}
+                else:
+                    errores = {}
+                parcial = self._guardar(bloque, resultados, errores)
+                fallos += parcial['reintentos'] + parcial['dead_letter']
+                for k, v in parcial.items():
+                    resumen[k] += v
+
+        if filas:
+            sin_fallos = fallos == 0 and dgii_breaker.current_state == 'closed'
+            resumen['capacidad'] = self._ajustar_capacidad(sin_fallos)
+
+        ContingenciaECF.objects.filter(
+            estado='RESUELTA', fecha_resuelta__lt=timezone.now() - self.RETENCION_RESUELTAS,
+        ).delete()
+        logger.info('Cola de contingencia e-CF: %s', resumen)
+        return resumen
+
+    def _guardar(self, bloque, resultados, errores):
+        from ..models import ContingenciaECF, Venta
+
+        ahora = timezone.now()
+        por_venta = {str(r.venta_id): r for r in resultados}
+        # Sin resultado: la venta ya salió de contingencia, o la tiene reclamada
+        # otro proceso (emitir_ecf, un lote) y solo se pospone, sin contar intento
+        sin_resultado = [
+            f['venta_id'] for f in bloque
+            if f['venta_id'] not in errores and str(f['venta_id']) not in por_venta
+        ]
+        reclamadas = {
+            str(pk) for pk in Venta.objects.filter(
+                id__in=sin_resultado, estado_fiscal='EN_CONTINGENCIA',
+            ).values_list('id', flat=True)
+        } if sin_resultado else set()
+        cambios, omitidas = [], []
+        parcial = {'procesadas': len(bloque), 'resueltas': 0, 'omitidas': 0, 'reintentos': 0, 'dead_letter': 0}
+        for fila in bloque:
+            resultado = por_venta.get(str(fila['venta_id']))
+            if fila['venta_id'] in errores:
+                error = errores[fila['venta_id']]
+            elif resultado is None:
+                if str(fila['venta_id']) in reclamadas:
+                    omitidas.append(ContingenciaECF(
+                        venta_id=fila['venta_id'],
+                        proximo_intento=ahora + timedelta(seconds=self.BACKOFF_BASE),
+                    ))
+                    parcial['omitidas'] += 1
+                    continue
+                error = None  # la venta ya no existe o no está en contingencia
+            elif resultado.error:
+                error = resultado.error
+            elif resultado.estado_fiscal == 'EN_CONTINGENCIA':
+                error = resultado.mensaje or 'Error de envío'
+            else:
+                error = None
+
+            fila_db = ContingenciaECF(venta_id=fila['venta_id'], intentos=fila['intentos'])
+            if error is None:
+                fila_db.estado = 'RESUELTA'
+                fila_db.fecha_resuelta = ahora
+                fila_db.ultimo_error = ''
+                parcial['resueltas'] += 1
+            elif error == MENSAJE_BREAKER_ABIERTO:
+                fila_db.estado = 'PENDIENTE'
+                fila_db.ultimo_error = error
+                fila_db.proximo_intento = ahora + timedelta(seconds=self.BACKOFF_BASE)
+                parcial['reintentos'] += 1
+            else:
+                fila_db.intentos += 1
+                fila_db.ultimo_error = error[:2000]
+                fila_db.proximo_intento = ahora + timedelta(seconds=self.backoff(fila_db.intentos))
+                if fila_db.intentos >= self.MAX_INTENTOS:
+                    fila_db.estado = 'DEAD_LETTER'
+                    parcial['dead_letter'] += 1
+                    logger.error(
+                        'e-CF %s descartado de la cola de contingencia tras %d intentos: %s',
+                        fila['venta_id'], fila_db.intentos, error,
+                    )
+                else:
+                    fila_db.estado = 'PENDIENTE'
+                    parcial['reintentos'] += 1
+            cambios.append(fila_db)
+
+        resueltas = [c for c in cambios if c.estado == 'RESUELTA']
+        fallidas = [c for c in cambios if c.estado != 'RESUELTA']
+        with transaction.atomic():
+            if resueltas:
+                ContingenciaECF.objects.bulk_update(
+                    resueltas, ['estado', 'fecha_resuelta', 'ultimo_error'],
+                )
+            if fallidas:
+                ContingenciaECF.objects.bulk_update(
+                    fallidas, ['estado', 'intentos', 'ultimo_error', 'proximo_intento'],
+                )
+            if omitidas:
+                ContingenciaECF.objects.bulk_update(omitidas, ['proximo_intento'])
+        return parcial
+
+    # --- Administración y métricas ---------------------------------------
+
+    @classmethod
+    def reencolar(cls, negocio, venta_ids=None):
+        """Devuelve a la cola las facturas en DEAD_LETTER (todas o las indicadas)."""
+        from ..models import ContingenciaECF
+
+        qs = ContingenciaECF.objects.filter(negocio=negocio, estado='DEAD_LETTER')
+        if venta_ids:
+            qs = qs.filter(venta_id__in=venta_ids)
+        return qs.update(estado='PENDIENTE', intentos=0, proximo_intento=timezone.now())
+
+    @classmethod
+    def metricas(cls, negocio=None):
+        """Tamaño de la cola, antigüedad, tasa de drenado y tiempo estimado para vaciarla."""
+        from ..models import ContingenciaECF
+
+        ahora = timezone.now()
+        qs = ContingenciaECF.objects.all()
+        if negocio is not None:
+            qs = qs.filter(negocio=negocio)
+        datos = qs.aggregate(
+            backlog=Count('pk', filter=Q(estado='PENDIENTE')),
+            dead_letter=Count('pk', filter=Q(estado='DEAD_LETTER')),
+            mas_antigua=Min('fecha_venta', filter=Q(estado='PENDIENTE')),
+            drenadas=Count('pk', filter=Q(
+                estado='RESUELTA', fecha_resuelta__gte=ahora - cls.VENTANA_DRENADO,
+            )),
+        )
+        tasa = datos['drenadas'] / (cls.VENTANA_DRENADO.total_seconds() / 60)
+        return {
+            'backlog': datos['backlog'],
+            'dead_letter': datos['dead_letter'],
+            'antiguedad_segundos': (
+                int((ahora - datos['mas_antigua']).total_seconds()) if datos['mas_antigua'] else 0
+            ),
+            'drenadas_ventana': datos['drenadas'],
+            'ventana_minutos': int(cls.VENTANA_DRENADO.total_seconds() // 60),
+            'tasa_drenado_por_minuto': round(tasa, 2),
+            'eta_minutos': round(datos['backlog'] / tasa, 1) if tasa else None,
+            'capacidad_por_ciclo': cls.capacidad(),
+            'breaker': dgii_breaker.current_state,
+        }
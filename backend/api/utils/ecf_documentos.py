@@ -0,0 +1,104 @@
+"""
+Almacén de XML firmados de e-CF, comprimido y direccionado por contenido.
+
+El XML firmado (varios KB, mucho base64) ya no vive en la fila de
+FacturaElectronica: se guarda en DocumentoECF, cuya clave es el SHA-256 del
+XML, y FacturaElectronica.documento_id es ese hash. Así:
+
+- los listados y reportes de FacturaElectronica/Venta no leen el payload;
+- el XML se descomprime solo al pedirlo (FacturaElectronica.xml_firmado) y se
+  verifica contra el hash al leerlo (DocumentoCorrupto si no coincide);
+- un mismo XML reenviado no se guarda dos veces.
+
+Compresión: zstd si el paquete zstandard está instalado, si no zlib. El
+algoritmo queda en cada fila, así que ambos conviven en la misma tabla.
+
+Uso:
+    hashes = guardar_documentos([xml1, xml2])     # [sha256, sha256]
+    xmls = cargar_documentos(hashes)              # {sha256: xml}
+"""
+import hashlib
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depende del entorno
+    zstandard = None
+
+NIVEL_ZLIB = 9
+NIVEL_ZSTD = 19
+
+
+class DocumentoCorrupto(Exception):
+    """El contenido descomprimido no coincide con su hash."""
+
+
+def huella(xml):
+    if isinstance(xml, str):
+        xml = xml.encode('utf-8')
+    return hashlib.sha256(xml).hexdigest()
+
+
+def comprimir(datos):
+    """(algoritmo, bytes comprimidos) con el mejor compresor disponible."""
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=NIVEL_ZSTD).compress(datos)
+    return 'zlib', zlib.compress(datos, NIVEL_ZLIB)
+
+
+def descomprimir(algoritmo, datos):
+    if algoritmo == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstandard es necesario para leer este documento. Instale con: pip install zstandard')
+        return zstandard.ZstdDecompressor().decompress(datos)
+    if algoritmo == 'zlib':
+        return zlib.decompress(datos)
+    raise ValueError(f'Algoritmo de compresión desconocido: {algoritmo}')
+
+
+def leer(documento):
+    """XML de un DocumentoECF, verificado contra su hash."""
+    datos = descomprimir(documento.algoritmo, bytes(documento.contenido))
+    if hashlib.sha256(datos).hexdigest() != documento.sha256:
+        raise DocumentoCorrupto(f'Documento e-CF {documento.sha256} corrupto')
+    return datos.decode('utf-8')
+
+
+def guardar_documentos(xmls):
+    """
+    Guarda los XML (los ya existentes se ignoran por su hash) y devuelve sus
+    hashes en el mismo orden.
+    """
+    from ..models import DocumentoECF
+
+    hashes, nuevos = [], {}
+    for xml in xmls:
+        datos = xml.encode('utf-8') if isinstance(xml, str) else xml
+        sha = hashlib.sha256(datos).hexdigest()
+        hashes.append(sha)
+        if sha not in nuevos:
+            algoritmo, contenido = comprimir(datos)
+            nuevos[sha] = DocumentoECF(
+                sha256=sha, algoritmo=algoritmo, contenido=contenido,
+                tamano=len(datos), tamano_comprimido=len(contenido),
+            )
+    if nuevos:
+        DocumentoECF.objects.bulk_create(list(nuevos.values()), ignore_conflicts=True)
+    return hashes
+
+
+def guardar_documento(xml):
+    return guardar_documentos([xml])[0]
+
+
+def cargar_documentos(hashes):
+    """{sha256: xml} para los hashes dados, en una sola consulta."""
+    from ..models import DocumentoECF
+
+    hashes = {h for h in hashes if h}
+    if not hashes:
+        return {}
+    return {
+        doc.sha256: leer(doc)
+        for doc in DocumentoECF.objects.filter(sha256__in=hashes)
+    }
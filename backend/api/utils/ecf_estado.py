@@ -0,0 +1,191 @@
+"""
+Consulta periódica del estado de los e-CF enviados a la DGII.
+
+Cada FacturaElectronica con track_id cuya venta sigue ENVIADO tiene una
+`proxima_consulta`. El intervalo crece con cada consulta sin respuesta final
+(30s, 1m, 2m, ... hasta 1h, con jitter), de modo que los e-CF recién enviados
+se resuelven rápido y los atascados no saturan la DGII.
+
+Cada ciclo (tarea beat consultar_estados_ecf) toma como máximo MAX_POR_CICLO
+facturas vencidas por orden de proxima_consulta, consulta por negocio en
+bloques con AsyncDGIIClient bajo un límite de peticiones por segundo, y
+escribe los resultados con una actualización en bloque por estado.
+"""
+import asyncio
+import logging
+import random
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ..circuit_breakers import dgii_breaker
+from .dgii_api import AsyncDGIIClient, ESTADO_ACEPTADO, ESTADO_RECHAZADO
+
+logger = logging.getLogger('api')
+
+INTERVALO_INICIAL = 30      # segundos
+INTERVALO_MAXIMO = 3600
+
+
+def intervalo_consulta(consultas):
+    """Segundos hasta la próxima consulta tras `consultas` respuestas no finales."""
+    base = min(INTERVALO_MAXIMO, INTERVALO_INICIAL * 2 ** min(consultas, 10))
+    return base * random.uniform(0.8, 1.2)
+
+
+def normalizar_estado(estado):
+    """'Aceptado Condicional' -> ACEPTADO, 'Rechazado' -> RECHAZADO; otro -> None."""
+    estado = (estado or '').upper().replace(' ', '_')
+    if estado.startswith(ESTADO_ACEPTADO):
+        return ESTADO_ACEPTADO
+    if estado == ESTADO_RECHAZADO:
+        return ESTADO_RECHAZADO
+    return None
+
+
+class RateLimiter:
+    """Espaciado mínimo entre inicios de petición (N por segundo) para asyncio."""
+
+    def __init__(self, por_segundo):
+        self.intervalo = 1.0 / por_segundo
+        self._siguiente = 0.0
+        self._lock = None
+
+    async def esperar(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            ahora = time.monotonic()
+            espera = self._siguiente - ahora
+            self._siguiente = max(ahora, self._siguiente) + self.intervalo
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+
+class ConsultorEstadosECF:
+    """
+    Uso:
+        resumen = ConsultorEstadosECF().ejecutar()
+    """
+
+    # 2000 consultas/ciclo a 40 req/s caben en el minuto del beat: 120k/hora,
+    # suficiente para 100k e-CF pendientes con el intervalo máximo de 1h.
+    MAX_POR_CICLO = 2000
+    TAMANO_BLOQUE = 200
+    PETICIONES_POR_SEGUNDO = 40
+    CONCURRENCIA = 10
+
+    def __init__(self, max_por_ciclo=None, por_segundo=None, concurrencia=None):
+        self.max_por_ciclo = max_por_ciclo or self.MAX_POR_CICLO
+        self.por_segundo = por_segundo or self.PETICIONES_POR_SEGUNDO
+        self.concurrencia = concurrencia or self.CONCURRENCIA
+
+    def pendientes(self, ahora=None):
+        """Facturas vencidas para consulta, sin cargar el XML ni la respuesta."""
+        from ..models import FacturaElectronica
+
+        ahora = ahora or timezone.now()
+        return (
+            FacturaElectronica.objects
+            .filter(venta__estado_fiscal='ENVIADO', track_id__isnull=False)
+            .exclude(track_id='')
+            .filter(Q(proxima_consulta__isnull=True) | Q(proxima_consulta__lte=ahora))
+            .order_by(F('proxima_consulta').asc(nulls_first=True))
+            .values('venta_id', 'venta__negocio_id', 'track_id', 'consultas_estado')
+        )
+
+    def ejecutar(self):
+        from ..models import Negocio
+
+        resumen = {'consultadas': 0, 'aceptadas': 0, 'rechazadas': 0, 'en_proceso': 0}
+        filas = list(self.pendientes()[:self.max_por_ciclo])
+        if not filas:
+            return resumen
+
+        por_negocio = {}
+        for fila in filas:
+            por_negocio.setdefault(fila['venta__negocio_id'], []).append(fila)
+        negocios = Negocio.objects.in_bulk(list(por_negocio))
+
+        limiter = RateLimiter(self.por_segundo)
+        for negocio_id, grupo in por_negocio.items():
+            negocio = negocios[negocio_id]
+            cliente = AsyncDGIIClient(
+                ambiente=negocio.ambiente_fiscal,
+                rnc=negocio.identificacion_fiscal.replace('-', ''),
+                usuario=negocio.api_fiscal_usuario,
+                clave=negocio.api_fiscal_clave_decrypted,
+                max_retries=1,
+                concurrencia=self.concurrencia,
+            )
+            for inicio in range(0, len(grupo), self.TAMANO_BLOQUE):
+                if dgii_breaker.current_state == 'open':
+                    logger.warning('Consulta de estados e-CF detenida: DGII breaker abierto')
+                    return resumen
+                bloque = grupo[inicio:inicio + self.TAMANO_BLOQUE]
+                respuestas = asyncio.run(self._consultar(cliente, limiter, bloque))
+                parcial = self._guardar(bloque, respuestas)
+                for k, v in parcial.items():
+                    resumen[k] += v
+        logger.info('Consulta de estados e-CF: %s', resumen)
+        return resumen
+
+    async def _consultar(self, cliente, limiter, bloque):
+        async def uno(track_id):
+            await limiter.esperar()
+            return await cliente.consultar_estado(track_id)
+        return await asyncio.gather(*(uno(f['track_id']) for f in bloque))
+
+    def _guardar(self, bloque, respuestas):
+        from ..models import FacturaElectronica, Venta
+
+        ahora = timezone.now()
+        aceptadas, rechazadas, finales, pendientes = [], [], [], []
+        for fila, respuesta in zip(bloque, respuestas):
+            estado = normalizar_estado(respuesta.get('estado'))
+            if estado:
+                (aceptadas if estado == ESTADO_ACEPTADO else rechazadas).append(fila['venta_id'])
+                finales.append(FacturaElectronica(
+                    venta_id=fila['venta_id'],
+                    consultas_estado=fila['consultas_estado'] + 1,
+                    ultima_consulta=ahora,
+                    proxima_consulta=None,
+                    respuesta_dgii=respuesta.get('respuesta_cruda'),
+                ))
+            else:
+                consultas = fila['consultas_estado'] + 1
+                pendientes.append(FacturaElectronica(
+                    venta_id=fila['venta_id'],
+                    consultas_estado=consultas,
+                    ultima_consulta=ahora,
+                    proxima_consulta=ahora + timedelta(seconds=intervalo_consulta(consultas)),
+                ))
+
+        with transaction.atomic():
+            if aceptadas:
+                Venta.objects.filter(id__in=aceptadas, estado_fiscal='ENVIADO').update(
+                    estado_fiscal='ACEPTADO',
+                )
+            if rechazadas:
+                Venta.objects.filter(id__in=rechazadas, estado_fiscal='ENVIADO').update(
+                    estado_fiscal='RECHAZADO',
+                )
+            if finales:
+                FacturaElectronica.objects.bulk_update(
+                    finales,
+                    ['consultas_estado', 'ultima_consulta', 'proxima_consulta', 'respuesta_dgii'],
+                )
+            if pendientes:
+                FacturaElectronica.objects.bulk_update(
+                    pendientes, ['consultas_estado', 'ultima_consulta', 'proxima_consulta'],
+                )
+
+        return {
+            'consultadas': len(bloque),
+            'aceptadas': len(aceptadas),
+            'rechazadas': len(rechazadas),
+            'en_proceso': len(pendientes),
+        }
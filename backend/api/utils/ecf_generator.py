@@ -1,13 +1,215 @@
-from lxml import etree
-from datetime import datetime
+import copy
+import threading
 from decimal import Decimal
 
+from django.conf import settings
+from lxml import etree
+
+from .ncf_manager import TIPO_ECF_MAP
+
+NSMAP = {
+    "ecf": "http://www.dgii.gov.do/xml/ecf",
+    "xsi": "http://www.w3.org/2001/XMLSchema-instance",
+}
+
+TIPO_PAGO_MAP = {
+    'EFECTIVO': '01', 'CHEQUE': '02', 'TARJETA': '03',
+    'TRANSFERENCIA': '04', 'CREDITO': '05', 'MIXTO': '07',
+}
+
+# Campos de Venta que usa el XML, leídos con values() (sin instanciar modelos).
+CAMPOS_VENTA = (
+    'id', 'negocio_id', 'ncf', 'tipo_comprobante', 'fecha', 'fecha_vencimiento',
+    'total_impuestos', 'total', 'tipo_pago', 'codigo_seguridad_dgii',
+    'sucursal__codigo', 'cliente_id', 'cliente__numero_documento', 'cliente__nombre',
+    'venta_referencia_id', 'venta_referencia__ncf', 'venta_referencia__fecha', 'ecf_data__ecf_tipo',
+)
+CAMPOS_DETALLE = (
+    'venta_id', 'cantidad', 'precio_unitario', 'descuento', 'subtotal', 'impuesto',
+    'producto__nombre', 'producto__tipo', 'producto__aplica_impuesto', 'producto__tasa_impuesto',
+)
+
+TASA_16 = Decimal('16.00')
+
+
+def _format_date(dt):
+    if hasattr(dt, 'strftime'):
+        return dt.strftime('%d-%m-%Y')
+    return str(dt)
+
+
+def _format_decimal(amount, precision=2):
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return f"{amount:.{precision}f}"
+
+
+def _sub(parent, tag, text):
+    elemento = etree.SubElement(parent, tag)
+    elemento.text = text
+    return elemento
+
+
+def construir_emisor(rnc, razon_social, nombre_comercial, sucursal, direccion):
+    """
+    Subárbol Emisor sin FechaEmision: es estático por negocio y sucursal, así
+    que se construye una vez y se copia en cada factura.
+    """
+    emisor = etree.Element("Emisor")
+    _sub(emisor, "RNCEmisor", rnc.replace('-', ''))
+    _sub(emisor, "RazonSocialEmisor", razon_social)
+    _sub(emisor, "NombreComercial", nombre_comercial)
+    _sub(emisor, "Sucursal", sucursal)
+    _sub(emisor, "DireccionEmisor", direccion)
+    return emisor
+
+
+def construir_ecf(datos, emisor):
+    """
+    Construye el árbol e-CF de una venta.
+
+    Args:
+        datos: dict con los CAMPOS_VENTA y la lista 'detalles' (dicts con CAMPOS_DETALLE).
+        emisor: subárbol de construir_emisor(); se copia, no se modifica.
+    """
+    root = etree.Element("ECF", nsmap=NSMAP)
+    encabezado = etree.SubElement(root, "Encabezado")
+    ecf_tipo = datos['ecf_tipo']
+
+    # IdDoc
+    id_doc = etree.SubElement(encabezado, "IdDoc")
+    _sub(id_doc, "TipoeCF", ecf_tipo)
+    _sub(id_doc, "eNCF", datos['ncf'])
+    if datos['fecha_vencimiento']:
+        _sub(id_doc, "FechaVencimientoSecuencia", _format_date(datos['fecha_vencimiento']))
+    _sub(id_doc, "IndicadorMontoGravado", "1" if datos['total_impuestos'] > 0 else "0")
+    _sub(id_doc, "TipoIngresos", "01")
+    _sub(id_doc, "TipoPago", TIPO_PAGO_MAP.get(datos['tipo_pago'], '01'))
+    fecha = _format_date(datos['fecha'])
+    _sub(id_doc, "FechaLimitePago", fecha)
+    # Código de seguridad e-CF (6 dígitos)
+    if datos['codigo_seguridad_dgii']:
+        _sub(id_doc, "CodigoSeguridadeNCF", datos['codigo_seguridad_dgii'])
+
+    # Emisor (plantilla) + fecha de emisión
+    emisor = copy.deepcopy(emisor)
+    _sub(emisor, "FechaEmision", fecha)
+    encabezado.append(emisor)
+
+    # Comprador
+    comprador = etree.SubElement(encabezado, "Comprador")
+    if datos['cliente_id']:
+        _sub(comprador, "RNCComprador", datos['cliente__numero_documento'].replace('-', ''))
+        _sub(comprador, "RazonSocialComprador", datos['cliente__nombre'])
+    else:
+        _sub(comprador, "RNCComprador", "000000000")
+        _sub(comprador, "RazonSocialComprador", "CLIENTE AL CONTADO")
+
+    # Totales: desglose de montos gravados por tasa ITBIS real
+    monto_gravado_18 = monto_gravado_16 = monto_exento = Decimal('0')
+    total_itbis_18 = total_itbis_16 = Decimal('0')
+    for detalle in datos['detalles']:
+        if not detalle['producto__aplica_impuesto']:
+            monto_exento += detalle['subtotal']
+        elif detalle['producto__tasa_impuesto'] == TASA_16:
+            monto_gravado_16 += detalle['subtotal']
+            total_itbis_16 += detalle['impuesto']
+        else:
+            monto_gravado_18 += detalle['subtotal']
+            total_itbis_18 += detalle['impuesto']
+
+    totales = etree.SubElement(encabezado, "Totales")
+    _sub(totales, "MontoGravadoTotal", _format_decimal(monto_gravado_18 + monto_gravado_16))
+    if monto_gravado_18 > 0:
+        _sub(totales, "MontoGravado18", _format_decimal(monto_gravado_18))
+        _sub(totales, "ITBIS18", _format_decimal(total_itbis_18))
+    if monto_gravado_16 > 0:
+        _sub(totales, "MontoGravado16", _format_decimal(monto_gravado_16))
+        _sub(totales, "ITBIS16", _format_decimal(total_itbis_16))
+    _sub(totales, "MontoExentoTotal", _format_decimal(monto_exento))
+    _sub(totales, "TotalITBIS", _format_decimal(datos['total_impuestos']))
+    _sub(totales, "MontoTotal", _format_decimal(datos['total']))
+
+    # Detalles
+    items = etree.SubElement(root, "DetallesItems")
+    for index, detalle in enumerate(datos['detalles'], start=1):
+        item = etree.SubElement(items, "Item")
+        _sub(item, "NumeroLinea", str(index))
+        es_bien = detalle['producto__tipo'] == 'PRODUCTO'
+        # Indicador Bien/Servicio: 1=Bien, 2=Servicio
+        _sub(item, "IndicadorBienServicio", "1" if es_bien else "2")
+        # Indicador de facturación: 01=bienes, 02=servicios
+        _sub(item, "IndicadorFacturacion", "01" if es_bien else "02")
+        _sub(item, "NombreItem", detalle['producto__nombre'][:80])
+        _sub(item, "CantidadItem", _format_decimal(detalle['cantidad']))
+        _sub(item, "PrecioUnitarioItem", _format_decimal(detalle['precio_unitario']))
+        _sub(item, "DescuentoMonto", _format_decimal(detalle['descuento']))
+        _sub(item, "MontoItem", _format_decimal(detalle['subtotal']))
+        if detalle['impuesto'] > 0:
+            _sub(item, "MontoITBIS", _format_decimal(detalle['impuesto']))
+
+    # Referencia para notas de crédito/débito (tipos 33/34)
+    if ecf_tipo in (ECFGenerator.TIPO_NOTA_CREDITO, ECFGenerator.TIPO_NOTA_DEBITO):
+        ref = etree.SubElement(root, "InformacionReferencia")
+        if datos['venta_referencia_id']:
+            _sub(ref, "NCFModificado", datos['venta_referencia__ncf'])
+            _sub(ref, "FechaNCFModificado", _format_date(datos['venta_referencia__fecha']))
+            # Código de modificación: 01=Descuento, 02=Devolución, 03=Anulación, 04=Corrección
+            _sub(ref, "CodigoModificacion", "03")
+
+    return root
+
+
+def es_resumen_consumo(ecf_tipo, total):
+    """
+    True si el e-CF es de consumo (32) y su monto no llega al umbral: a la DGII
+    se envía solo el RFCE y el e-CF completo queda en el emisor.
+    """
+    return ecf_tipo == ECFGenerator.TIPO_CONSUMO and Decimal(total) < Decimal(
+        settings.ECF_UMBRAL_RESUMEN_CONSUMO,
+    )
+
+
+def _copiar(origen, destino, tags):
+    for tag in tags:
+        elemento = origen.find(tag)
+        if elemento is not None:
+            destino.append(copy.deepcopy(elemento))
+
+
+def construir_rfce(ecf):
+    """
+    Resumen de Factura de Consumo Electrónica (RFCE) a partir del árbol e-CF
+    sin firmar: IdDoc, Emisor y Comprador reducidos, Totales completos y el
+    código de seguridad del e-CF.
+    """
+    encabezado = ecf.find("Encabezado")
+    id_doc = encabezado.find("IdDoc")
+
+    root = etree.Element("RFCE", nsmap={"xsi": NSMAP["xsi"]})
+    resumen = etree.SubElement(root, "Encabezado")
+    _sub(resumen, "Version", "1.0")
+    _copiar(id_doc, etree.SubElement(resumen, "IdDoc"), ("TipoeCF", "eNCF", "TipoIngresos", "TipoPago"))
+    _copiar(
+        encabezado.find("Emisor"), etree.SubElement(resumen, "Emisor"),
+        ("RNCEmisor", "RazonSocialEmisor", "FechaEmision"),
+    )
+    comprador = encabezado.find("Comprador")
+    if comprador is not None and comprador.findtext("RNCComprador") != "000000000":
+        _copiar(comprador, etree.SubElement(resumen, "Comprador"), ("RNCComprador", "RazonSocialComprador"))
+    resumen.append(copy.deepcopy(encabezado.find("Totales")))
+    _sub(resumen, "CodigoSeguridadeCF", id_doc.findtext("CodigoSeguridadeNCF") or "")
+    return root
+
 
 class ECFGenerator:
     """
     Generador de XML para Factura Electrónica (e-CF) República Dominicana.
     Cumple con la estructura de la Norma 06-2018 DGII.
     Soporte multi-tipo: 31, 32, 33, 34, 41, 43, 44, 45.
+
+    Para lotes use PlantillaECF, que lee los datos con values() y reutiliza
+    el subárbol Emisor del negocio.
     """
 
     # Tipos e-CF soportados
@@ -24,206 +226,142 @@ class ECFGenerator:
         self.venta = venta
         self.negocio = venta.negocio
         self.cliente = venta.cliente
-        self.nsmap = {
-            "ecf": "http://www.dgii.gov.do/xml/ecf",
-            "xsi": "http://www.w3.org/2001/XMLSchema-instance",
-        }
-
-    def _format_date(self, dt):
-        if hasattr(dt, 'strftime'):
-            return dt.strftime('%d-%m-%Y')
-        return str(dt)
-
-    def _format_decimal(self, amount, precision=2):
-        return f"{Decimal(str(amount)):.{precision}f}"
+        self.nsmap = NSMAP
 
     def _get_ecf_tipo(self):
         if hasattr(self.venta, 'ecf_data') and self.venta.ecf_data:
             return self.venta.ecf_data.ecf_tipo
-        tipo_map = {
-            'B01': '31', 'B02': '32', 'B03': '33', 'B04': '34',
-            'B11': '41', 'B13': '43', 'B14': '44', 'B15': '45',
+        return TIPO_ECF_MAP.get(self.venta.tipo_comprobante, '32')
+
+    def _datos(self):
+        venta = self.venta
+        referencia = venta.venta_referencia
+        return {
+            'ecf_tipo': self._get_ecf_tipo(),
+            'ncf': venta.ncf,
+            'fecha': venta.fecha,
+            'fecha_vencimiento': venta.fecha_vencimiento,
+            'total_impuestos': venta.total_impuestos,
+            'total': venta.total,
+            'tipo_pago': venta.tipo_pago,
+            'codigo_seguridad_dgii': venta.codigo_seguridad_dgii,
+            'cliente_id': venta.cliente_id,
+            'cliente__numero_documento': self.cliente.numero_documento if self.cliente else None,
+            'cliente__nombre': self.cliente.nombre if self.cliente else None,
+            'venta_referencia_id': venta.venta_referencia_id,
+            'venta_referencia__ncf': referencia.ncf if referencia else None,
+            'venta_referencia__fecha': referencia.fecha if referencia else None,
+            'detalles': [
+                {
+                    'cantidad': d.cantidad,
+                    'precio_unitario': d.precio_unitario,
+                    'descuento': d.descuento,
+                    'subtotal': d.subtotal,
+                    'impuesto': d.impuesto,
+                    'producto__nombre': d.producto.nombre,
+                    'producto__tipo': d.producto.tipo,
+                    'producto__aplica_impuesto': d.producto.aplica_impuesto,
+                    'producto__tasa_impuesto': d.producto.tasa_impuesto,
+                }
+                # Mismo orden que PlantillaECF.cargar (sin romper el prefetch)
+                for d in sorted(venta.detalles.all(), key=lambda d: d.id)
+            ],
         }
-        return tipo_map.get(self.venta.tipo_comprobante, '32')
-
-    def generate_xml(self):
-        root = etree.Element("ECF", nsmap=self.nsmap)
-
-        encabezado = etree.SubElement(root, "Encabezado")
-
-        self._build_id_doc(encabezado)
-        self._build_emisor(encabezado)
-        self._build_comprador(encabezado)
-        self._build_totales(encabezado)
-        self._build_detalles(root)
 
-        # Referencia para notas de crédito/débito
-        ecf_tipo = self._get_ecf_tipo()
-        if ecf_tipo in (self.TIPO_NOTA_CREDITO, self.TIPO_NOTA_DEBITO):
-            self._build_referencia_informacion(root)
+    def generate_tree(self):
+        """Árbol lxml del e-CF, listo para sign_ecf_xml sin serializar."""
+        emisor = construir_emisor(
+            self.negocio.identificacion_fiscal,
+            self.negocio.razon_social,
+            self.negocio.nombre_comercial,
+            self.venta.sucursal.codigo if self.venta.sucursal else "001",
+            self.negocio.direccion,
+        )
+        return construir_ecf(self._datos(), emisor)
 
+    def generate_xml(self):
         return etree.tostring(
-            root, pretty_print=True, encoding="UTF-8", xml_declaration=True,
+            self.generate_tree(), pretty_print=True, encoding="UTF-8", xml_declaration=True,
         ).decode("utf-8")
 
-    def _build_id_doc(self, parent):
-        id_doc = etree.SubElement(parent, "IdDoc")
-
-        ecf_tipo = self._get_ecf_tipo()
-        etree.SubElement(id_doc, "TipoeCF").text = ecf_tipo
-        etree.SubElement(id_doc, "eNCF").text = self.venta.ncf
 
-        # Fecha vencimiento secuencia
-        if self.venta.fecha_vencimiento:
-            etree.SubElement(id_doc, "FechaVencimientoSecuencia").text = (
-                self._format_date(self.venta.fecha_vencimiento)
-            )
-
-        # Indicador monto gravado
-        etree.SubElement(id_doc, "IndicadorMontoGravado").text = (
-            "1" if self.venta.total_impuestos > 0 else "0"
-        )
+class PlantillaECF:
+    """
+    Generación de e-CF por lotes.
 
-        # Tipo de ingreso
-        etree.SubElement(id_doc, "TipoIngresos").text = "01"
+    Lee ventas y detalles con dos consultas values() (sin instanciar modelos
+    ni acceder a FKs) y copia el subárbol Emisor, que se construye una sola
+    vez por negocio y sucursal. Retorna árboles lxml que se pasan directo al
+    firmador.
 
-        # Tipo de pago
-        tipo_pago_map = {
-            'EFECTIVO': '01', 'CHEQUE': '02', 'TARJETA': '03',
-            'TRANSFERENCIA': '04', 'CREDITO': '05', 'MIXTO': '07',
-        }
-        etree.SubElement(id_doc, "TipoPago").text = tipo_pago_map.get(
-            self.venta.tipo_pago, '01'
-        )
+    Uso:
+        for venta_id, root in PlantillaECF(negocio).generar(venta_ids):
+            ...
+    """
 
-        # Fecha límite pago
-        etree.SubElement(id_doc, "FechaLimitePago").text = self._format_date(self.venta.fecha)
+    # negocio_id -> (datos del emisor, {codigo_sucursal: subárbol Emisor})
+    _emisores = {}
+    _lock = threading.Lock()
 
-        # Código de seguridad e-CF (6 dígitos)
-        if self.venta.codigo_seguridad_dgii:
-            etree.SubElement(id_doc, "CodigoSeguridadeNCF").text = (
-                self.venta.codigo_seguridad_dgii
-            )
+    def __init__(self, negocio):
+        self.negocio = negocio
 
-    def _build_emisor(self, parent):
-        emisor = etree.SubElement(parent, "Emisor")
-        etree.SubElement(emisor, "RNCEmisor").text = (
-            self.negocio.identificacion_fiscal.replace('-', '')
+    def emisor(self, codigo_sucursal):
+        negocio = self.negocio
+        valores = (
+            negocio.identificacion_fiscal, negocio.razon_social,
+            negocio.nombre_comercial, negocio.direccion,
         )
-        etree.SubElement(emisor, "RazonSocialEmisor").text = self.negocio.razon_social
-        etree.SubElement(emisor, "NombreComercial").text = self.negocio.nombre_comercial
-        etree.SubElement(emisor, "Sucursal").text = (
-            self.venta.sucursal.codigo if self.venta.sucursal else "001"
-        )
-        etree.SubElement(emisor, "DireccionEmisor").text = self.negocio.direccion
-        etree.SubElement(emisor, "FechaEmision").text = self._format_date(self.venta.fecha)
-
-    def _build_comprador(self, parent):
-        comprador = etree.SubElement(parent, "Comprador")
-        if self.cliente:
-            etree.SubElement(comprador, "RNCComprador").text = (
-                self.cliente.numero_documento.replace('-', '')
-            )
-            etree.SubElement(comprador, "RazonSocialComprador").text = self.cliente.nombre
-        else:
-            etree.SubElement(comprador, "RNCComprador").text = "000000000"
-            etree.SubElement(comprador, "RazonSocialComprador").text = "CLIENTE AL CONTADO"
-
-    def _build_totales(self, parent):
-        totales = etree.SubElement(parent, "Totales")
-
-        # Desglosar montos gravados por tasa ITBIS real
-        monto_gravado_18 = Decimal('0')
-        monto_gravado_16 = Decimal('0')
-        monto_exento = Decimal('0')
-        total_itbis_18 = Decimal('0')
-        total_itbis_16 = Decimal('0')
-
-        for detalle in self.venta.detalles.all():
-            if not detalle.producto.aplica_impuesto:
-                monto_exento += detalle.subtotal
-            elif detalle.producto.tasa_impuesto == Decimal('16.00'):
-                monto_gravado_16 += detalle.subtotal
-                total_itbis_16 += detalle.impuesto
+        with self._lock:
+            entrada = self._emisores.get(negocio.id)
+            if entrada is None or entrada[0] != valores:
+                # Primer uso o datos fiscales editados: se descartan las plantillas viejas.
+                entrada = (valores, {})
+                self._emisores[negocio.id] = entrada
+            plantillas = entrada[1]
+            plantilla = plantillas.get(codigo_sucursal)
+            if plantilla is None:
+                rnc, razon_social, nombre_comercial, direccion = valores
+                plantilla = construir_emisor(
+                    rnc, razon_social, nombre_comercial, codigo_sucursal, direccion,
+                )
+                plantillas[codigo_sucursal] = plantilla
+        return plantilla
+
+    @classmethod
+    def invalidar(cls, negocio_id=None):
+        with cls._lock:
+            if negocio_id is None:
+                cls._emisores.clear()
             else:
-                monto_gravado_18 += detalle.subtotal
-                total_itbis_18 += detalle.impuesto
+                cls._emisores.pop(negocio_id, None)
 
-        monto_gravado_total = monto_gravado_18 + monto_gravado_16
+    def cargar(self, venta_ids):
+        """Datos de las ventas (por fecha) con sus detalles, en dos consultas."""
+        from ..models import DetalleVenta, Venta
 
-        etree.SubElement(totales, "MontoGravadoTotal").text = (
-            self._format_decimal(monto_gravado_total)
+        filas = list(
+            Venta.objects.filter(id__in=venta_ids, negocio=self.negocio)
+            .order_by('fecha')
+            .values(*CAMPOS_VENTA)
         )
-        if monto_gravado_18 > 0:
-            etree.SubElement(totales, "MontoGravado18").text = (
-                self._format_decimal(monto_gravado_18)
-            )
-            etree.SubElement(totales, "ITBIS18").text = (
-                self._format_decimal(total_itbis_18)
-            )
-        if monto_gravado_16 > 0:
-            etree.SubElement(totales, "MontoGravado16").text = (
-                self._format_decimal(monto_gravado_16)
-            )
-            etree.SubElement(totales, "ITBIS16").text = (
-                self._format_decimal(total_itbis_16)
+        por_venta = {}
+        for fila in filas:
+            fila['detalles'] = por_venta[fila['id']] = []
+            fila['ecf_tipo'] = fila['ecf_data__ecf_tipo'] or TIPO_ECF_MAP.get(
+                fila['tipo_comprobante'], '32',
             )
-
-        etree.SubElement(totales, "MontoExentoTotal").text = (
-            self._format_decimal(monto_exento)
-        )
-        etree.SubElement(totales, "TotalITBIS").text = (
-            self._format_decimal(self.venta.total_impuestos)
-        )
-        etree.SubElement(totales, "MontoTotal").text = (
-            self._format_decimal(self.venta.total)
-        )
-
-    def _build_detalles(self, parent):
-        detalles = etree.SubElement(parent, "DetallesItems")
-
-        for index, detalle in enumerate(self.venta.detalles.all(), start=1):
-            item = etree.SubElement(detalles, "Item")
-            etree.SubElement(item, "NumeroLinea").text = str(index)
-
-            # Indicador Bien/Servicio: 1=Bien, 2=Servicio
-            indicador = "1" if detalle.producto.tipo == 'PRODUCTO' else "2"
-            etree.SubElement(item, "IndicadorBienServicio").text = indicador
-
-            # Indicador de facturación: 01=bienes, 02=servicios
-            etree.SubElement(item, "IndicadorFacturacion").text = (
-                "01" if detalle.producto.tipo == 'PRODUCTO' else "02"
-            )
-
-            etree.SubElement(item, "NombreItem").text = detalle.producto.nombre[:80]
-            etree.SubElement(item, "CantidadItem").text = (
-                self._format_decimal(detalle.cantidad)
-            )
-            etree.SubElement(item, "PrecioUnitarioItem").text = (
-                self._format_decimal(detalle.precio_unitario)
-            )
-            etree.SubElement(item, "DescuentoMonto").text = (
-                self._format_decimal(detalle.descuento)
-            )
-            etree.SubElement(item, "MontoItem").text = (
-                self._format_decimal(detalle.subtotal)
-            )
-
-            # ITBIS por item
-            if detalle.impuesto > 0:
-                etree.SubElement(item, "MontoITBIS").text = (
-                    self._format_decimal(detalle.impuesto)
-                )
-
-    def _build_referencia_informacion(self, parent):
-        """Construye InformacionReferencia para notas de crédito/débito (tipos 33/34)."""
-        ref = etree.SubElement(parent, "InformacionReferencia")
-
-        venta_original = self.venta.venta_referencia
-        if venta_original:
-            etree.SubElement(ref, "NCFModificado").text = venta_original.ncf
-            etree.SubElement(ref, "FechaNCFModificado").text = (
-                self._format_date(venta_original.fecha)
-            )
-            # Código de modificación: 01=Descuento, 02=Devolución, 03=Anulación, 04=Corrección
-            etree.SubElement(ref, "CodigoModificacion").text = "03"
+        for detalle in (
+            DetalleVenta.objects.filter(venta_id__in=list(por_venta))
+            .order_by('venta_id', 'id')
+            .values(*CAMPOS_DETALLE)
+        ):
+            por_venta[detalle['venta_id']].append(detalle)
+        return filas
+
+    def construir(self, datos):
+        return construir_ecf(datos, self.emisor(datos['sucursal__codigo'] or "001"))
+
+    def generar(self, venta_ids):
+        """Lista de (venta_id, árbol e-CF) en orden de fecha."""
+        return [(datos['id'], self.construir(datos)) for datos in self.cargar(venta_ids)]
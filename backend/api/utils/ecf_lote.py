@@ -0,0 +1,391 @@
+"""
+Emisión de e-CF por lotes.
+
+Para el cierre de mes: toma las ventas pendientes de un negocio y las emite en
+bloques. Cada bloque asigna NCF, genera los XML con PlantillaECF (en el proceso
+actual), los firma en un pool de procesos (RSA, CPU-bound), los envía a la DGII
+con AsyncDGIIClient (concurrencia acotada, conexiones reutilizadas) y guarda
+FacturaElectronica (XML firmado en DocumentoECF, ver ecf_documentos.py) y Venta
+con bulk writes. El progreso por factura se publica por el WebSocket de
+notificaciones.
+
+Las facturas de consumo (32) bajo el umbral (es_resumen_consumo) se reportan
+con el RFCE: se firma también el resumen, se envía al servicio de recepción de
+resúmenes (respuesta final en el acto, sin track_id ni consultas de estado) y
+el e-CF completo se guarda igual en DocumentoECF.
+
+Cada venta se reclama antes de emitirla (reclamar_emision: cache.add atómico
+de la clave ecf_job:<venta>, la misma que toma emitir_ecf para su tarea), así
+que un lote de cierre, la cola de contingencia y una emisión individual nunca
+firman ni envían el mismo eNCF a la vez. El reclamo vence solo (RECLAMO_TTL)
+si el proceso que lo tomó muere.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import secrets
+import uuid
+from dataclasses import dataclass, asdict
+from datetime import timedelta
+from typing import Optional
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .dgii_api import AsyncDGIIClient, ESTADO_ACEPTADO, ESTADO_ERROR, ESTADO_RECHAZADO
+from .ecf_documentos import cargar_documentos, guardar_documentos
+from .ecf_estado import intervalo_consulta
+from .ecf_generator import PlantillaECF, construir_rfce, es_resumen_consumo
+from .ncf_manager import TIPO_ECF_MAP, AsignadorNCF
+from .notificaciones import notificar_negocio, notificar_usuario
+from .xml_signer import SignerCache, sign_ecf_batch, signing_pool
+
+logger = logging.getLogger('api')
+
+# Estado DGII -> Venta.estado_fiscal (cualquier otro estado queda ENVIADO)
+ESTADO_FISCAL_DGII = {
+    ESTADO_ERROR: 'EN_CONTINGENCIA',
+    ESTADO_RECHAZADO: 'RECHAZADO',
+}
+# La respuesta al RFCE ya es final
+ESTADO_FISCAL_RESUMEN = {**ESTADO_FISCAL_DGII, ESTADO_ACEPTADO: 'ACEPTADO'}
+
+# Estados fiscales desde los que una venta se puede (re)emitir
+ESTADOS_EMITIBLES = ('NO_FISCAL', 'PENDIENTE', 'EN_CONTINGENCIA')
+RECLAMO_TTL = 3600
+
+
+PREFIJO_LOTE = 'lote:'  # Dueño de los reclamos de EmisorLoteECF (lotes y contingencia)
+
+
+def clave_emision(venta_id):
+    return f'ecf_job:{venta_id}'
+
+
+def es_reclamo_de_lote(dueno):
+    """True si el reclamo es de un lote y no de un job de emitir_ecf."""
+    return str(dueno).startswith(PREFIJO_LOTE)
+
+
+def reclamar_emision(venta_id, dueno, ttl=RECLAMO_TTL):
+    """Toma la emisión de una venta para ``dueno`` (job o lote); False si otro la tiene."""
+    return cache.add(clave_emision(venta_id), dueno, ttl)
+
+
+def liberar_emision(venta_id, dueno):
+    clave = clave_emision(venta_id)
+    if cache.get(clave) == dueno:
+        cache.delete(clave)
+
+
+def qr_code_url(rnc, ncf, codigo_seguridad):
+    return f"https://dgii.gov.do/ecf?rnc={rnc}&encf={ncf}&sc={codigo_seguridad}"
+
+
+@dataclass
+class ResultadoECF:
+    venta_id: str
+    numero: str
+    ncf: str = ''
+    estado_fiscal: str = ''
+    dgii_estado: str = ''
+    track_id: str = ''
+    mensaje: str = ''
+    error: Optional[str] = None
+    resumen: bool = False
+
+
+class EmisorLoteECF:
+    """
+    Emite en lote los e-CF pendientes de un negocio.
+
+    Uso:
+        emisor = EmisorLoteECF(negocio, usuario=request.user)
+        resumen = emisor.ejecutar()
+    """
+
+    TAMANO_BLOQUE = 200
+    CONCURRENCIA_DGII = 8
+    CAJA_NCF = 'LOTE'
+
+    def __init__(self, negocio, usuario=None, procesos=None,
+                 concurrencia=None, tamano_bloque=None, lote_id=None):
+        self.negocio = negocio
+        self.usuario = usuario
+        self.procesos = procesos
+        self.concurrencia = concurrencia or self.CONCURRENCIA_DGII
+        self.tamano_bloque = tamano_bloque or self.TAMANO_BLOQUE
+        self.lote_id = lote_id or uuid.uuid4().hex
+        self.dueno = f'{PREFIJO_LOTE}{self.lote_id}'
+        self.rnc = negocio.identificacion_fiscal.replace('-', '')
+        self.p12_path = negocio.certificado_digital_path
+        self.p12_pass = (
+            os.getenv(negocio.certificado_pass_env) if negocio.certificado_pass_env else None
+        )
+
+    # --- Selección -------------------------------------------------------
+
+    def ventas_pendientes(self, venta_ids=None, limite=None):
+        """Ventas completadas sin e-CF firmado, más antiguas primero."""
+        from ..models import Venta
+
+        qs = Venta.objects.filter(negocio=self.negocio, estado='COMPLETADA').exclude(
+            ecf_data__documento__isnull=False,
+        )
+        if venta_ids:
+            qs = qs.filter(id__in=venta_ids, estado_fiscal__in=('NO_FISCAL', 'PENDIENTE'))
+        else:
+            qs = qs.filter(estado_fiscal='PENDIENTE')
+        qs = qs.order_by('fecha').values_list('id', flat=True)
+        return list(qs[:limite] if limite else qs)
+
+    # --- Ejecución -------------------------------------------------------
+
+    def ejecutar(self, venta_ids=None, limite=None) -> dict:
+        if not self.p12_path or not self.p12_pass:
+            raise ValueError('Certificado digital no configurado en el Negocio.')
+        material = SignerCache.get(self.p12_path, self.p12_pass, tenant=self.negocio.id)
+        if not material.is_valid:
+            raise ValueError(f'Certificado digital inválido: {material.status()["error"]}')
+
+        ids = self.ventas_pendientes(venta_ids=venta_ids, limite=limite)
+        total = len(ids)
+        resumen = {
+            'lote_id': self.lote_id, 'total': total, 'enviadas': 0,
+            'contingencia': 0, 'rechazadas': 0, 'errores': 0, 'resumenes': 0, 'omitidas': 0,
+        }
+        logger.info('Lote e-CF %s: %d ventas (negocio: %s)', self.lote_id, total, self.negocio.id)
+        if not total:
+            self.notificar({'evento': 'fin', **resumen})
+            return resumen
+
+        procesadas = 0
+        pool = signing_pool(self.procesos)
+        try:
+            for inicio in range(0, total, self.tamano_bloque):
+                bloque = ids[inicio:inicio + self.tamano_bloque]
+                resultados = self.procesar_bloque(bloque, pool)
+                # Las que otro proceso está emitiendo (o ya emitió) no se tocan
+                resumen['omitidas'] += len(bloque) - len(resultados)
+                for resultado in resultados:
+                    procesadas += 1
+                    resumen['resumenes'] += resultado.resumen
+                    if resultado.error:
+                        resumen['errores'] += 1
+                    elif resultado.estado_fiscal == 'EN_CONTINGENCIA':
+                        resumen['contingencia'] += 1
+                    elif resultado.estado_fiscal == 'RECHAZADO':
+                        resumen['rechazadas'] += 1
+                    else:
+                        resumen['enviadas'] += 1
+                    self.notificar({
+                        'evento': 'factura', 'procesadas': procesadas, 'total': total,
+                        **asdict(resultado),
+                    })
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        logger.info('Lote e-CF %s terminado: %s', self.lote_id, resumen)
+        self.notificar({'evento': 'fin', **resumen})
+        return resumen
+
+    def procesar_bloque(self, ids, pool=None):
+        """
+        Emite un bloque de ventas y retorna sus ResultadoECF.
+
+        Las ventas que ya tienen XML firmado (reintentos de contingencia) se
+        reenvían tal cual, sin regenerar ni volver a firmar (su RFCE si lo tienen).
+        Solo se procesan las que este emisor logra reclamar; las demás no
+        tienen ResultadoECF.
+        """
+        ventas = self._reclamar(ids)
+        if not ventas:
+            return []
+        try:
+            return self._procesar(ventas, pool)
+        finally:
+            for venta in ventas:
+                liberar_emision(venta.id, self.dueno)
+
+    def _reclamar(self, ids):
+        """
+        Ventas emitibles de ``ids`` reclamadas por este lote. El FOR UPDATE
+        SKIP LOCKED salta las que otra transacción está modificando y vuelve a
+        comprobar el estado ya con la fila tomada.
+        """
+        from ..models import Venta
+
+        with transaction.atomic():
+            ventas = list(
+                Venta.objects.select_for_update(skip_locked=True, of=('self',))
+                .filter(id__in=ids, estado='COMPLETADA', estado_fiscal__in=ESTADOS_EMITIBLES)
+                .select_related('ecf_data')
+                .order_by('fecha')
+            )
+            return [v for v in ventas if reclamar_emision(v.id, self.dueno)]
+
+    def _procesar(self, ventas, pool):
+        por_id = {v.id: v for v in ventas}
+        resultados = {}
+        self._asignar_ncf(ventas, resultados)
+
+        # 1. XML (plantilla por negocio, datos con values(), proceso actual)
+        por_generar = []
+        firmados, resumenes = {}, {}
+        existentes = {}
+        for venta in ventas:
+            if venta.id in resultados:
+                continue
+            ecf_data = getattr(venta, 'ecf_data', None)
+            if ecf_data is not None and ecf_data.documento_id:
+                existentes[venta.id] = (ecf_data.documento_id, ecf_data.resumen_id)
+            else:
+                por_generar.append(venta.id)
+        if existentes:
+            xmls = cargar_documentos(sha for par in existentes.values() for sha in par)
+            for venta_id, (documento, resumen) in existentes.items():
+                firmados[venta_id] = xmls[documento]
+                if resumen:
+                    resumenes[venta_id] = xmls[resumen]
+        documentos = []
+        plantilla = PlantillaECF(self.negocio)
+        for datos in plantilla.cargar(por_generar) if por_generar else []:
+            try:
+                ecf = plantilla.construir(datos)
+                documentos.append((datos['id'], ecf))
+                if es_resumen_consumo(datos['ecf_tipo'], datos['total']):
+                    documentos.append(((datos['id'], 'RFCE'), construir_rfce(ecf)))
+            except Exception as e:
+                venta = por_id[datos['id']]
+                logger.error('Lote e-CF %s: error generando XML de %s: %s', self.lote_id, venta.numero, e)
+                resultados[venta.id] = ResultadoECF(str(venta.id), venta.numero, venta.ncf, error=str(e))
+
+        # 2. Firma (pool de procesos); e-CF y RFCE en el mismo lote
+        for clave, xml_firmado, error in sign_ecf_batch(
+            documentos, self.p12_path, self.p12_pass, tenant=self.negocio.id, pool=pool,
+        ):
+            venta_id = clave[0] if isinstance(clave, tuple) else clave
+            if error:
+                venta = por_id[venta_id]
+                logger.error('Lote e-CF %s: error firmando %s: %s', self.lote_id, venta.numero, error)
+                resultados[venta_id] = ResultadoECF(str(venta_id), venta.numero, venta.ncf, error=error)
+            elif isinstance(clave, tuple):
+                resumenes[venta_id] = xml_firmado
+            else:
+                firmados[venta_id] = xml_firmado
+
+        # 3. Envío a la DGII (asyncio, concurrencia acotada, conexiones reutilizadas)
+        por_enviar = [v for v in ventas if firmados.get(v.id) and v.id not in resultados]
+        respuestas = asyncio.run(self._enviar(por_enviar, firmados, resumenes))
+
+        # 4. Persistencia en bloque
+        self._guardar(por_enviar, firmados, resumenes, respuestas, resultados)
+        return [resultados[v.id] for v in ventas if v.id in resultados]
+
+    async def _enviar(self, ventas, firmados, resumenes):
+        """{venta_id: respuesta}: e-CF a recepción y RFCE a recepción de resúmenes, a la vez."""
+        cliente = self._cliente_dgii()
+        con_ecf = [v.id for v in ventas if v.id not in resumenes]
+        con_rfce = [v.id for v in ventas if v.id in resumenes]
+        respuestas_ecf, respuestas_rfce = await asyncio.gather(
+            cliente.enviar_lote([firmados[i] for i in con_ecf]),
+            cliente.enviar_resumenes([resumenes[i] for i in con_rfce]),
+        )
+        return {**dict(zip(con_ecf, respuestas_ecf)), **dict(zip(con_rfce, respuestas_rfce))}
+
+    def _asignar_ncf(self, ventas, resultados):
+        from ..models import Venta
+
+        por_tipo = {}
+        for venta in ventas:
+            if not venta.codigo_seguridad_dgii:
+                venta.codigo_seguridad_dgii = f"{secrets.randbelow(1000000):06d}"
+            if not venta.ncf:
+                por_tipo.setdefault(venta.tipo_comprobante or 'B02', []).append(venta)
+        # El lote toma sus NCF de un bloque propio: no compite con las cajas.
+        asignador = AsignadorNCF(self.negocio, caja=self.CAJA_NCF)
+        # NCF y ventas en la misma transacción: un fallo no deja números
+        # consumidos sin venta (huecos que ningún 608 anula).
+        with transaction.atomic():
+            for tipo, grupo in por_tipo.items():
+                ncfs = asignador.siguientes(tipo, len(grupo))
+                for venta, ncf in itertools.zip_longest(grupo, ncfs):
+                    if ncf is None:
+                        resultados[venta.id] = ResultadoECF(
+                            str(venta.id), venta.numero, error=asignador.ultimo_error,
+                        )
+                    else:
+                        venta.ncf = ncf
+                        venta.tipo_comprobante = tipo
+            Venta.objects.bulk_update(ventas, ['ncf', 'tipo_comprobante', 'codigo_seguridad_dgii'])
+
+    def _cliente_dgii(self):
+        return AsyncDGIIClient(
+            ambiente=self.negocio.ambiente_fiscal,
+            rnc=self.rnc,
+            usuario=self.negocio.api_fiscal_usuario,
+            clave=self.negocio.api_fiscal_clave_decrypted,
+            concurrencia=self.concurrencia,
+        )
+
+    def _guardar(self, ventas, firmados, resumenes, respuestas, resultados):
+        from ..models import FacturaElectronica, Venta
+
+        ahora = timezone.now()
+        registros = []
+        con_rfce = [v.id for v in ventas if v.id in resumenes]
+        hashes = guardar_documentos(
+            [firmados[v.id] for v in ventas] + [resumenes[i] for i in con_rfce],
+        )
+        documentos = dict(zip([v.id for v in ventas], hashes))
+        hashes_rfce = dict(zip(con_rfce, hashes[len(ventas):]))
+        for venta in ventas:
+            respuesta = respuestas[venta.id]
+            dgii_estado = respuesta.get('estado', '')
+            es_resumen = venta.id in hashes_rfce
+            venta.estado_fiscal = (ESTADO_FISCAL_RESUMEN if es_resumen else ESTADO_FISCAL_DGII).get(
+                dgii_estado, 'ENVIADO',
+            )
+            registros.append(FacturaElectronica(
+                venta=venta,
+                ecf_tipo=TIPO_ECF_MAP.get(venta.tipo_comprobante, '32'),
+                documento_id=documentos[venta.id],
+                resumen_id=hashes_rfce.get(venta.id),
+                fecha_firma=ahora,
+                track_id=respuesta.get('track_id') or None,
+                respuesta_dgii=respuesta.get('respuesta_cruda'),
+                qr_code_url=qr_code_url(self.rnc, venta.ncf, venta.codigo_seguridad_dgii),
+                proxima_consulta=None if es_resumen else ahora + timedelta(seconds=intervalo_consulta(0)),
+            ))
+            resultados[venta.id] = ResultadoECF(
+                venta_id=str(venta.id), numero=venta.numero, ncf=venta.ncf,
+                estado_fiscal=venta.estado_fiscal, dgii_estado=dgii_estado,
+                track_id=respuesta.get('track_id') or '',
+                mensaje=respuesta.get('mensaje', ''),
+                resumen=es_resumen,
+            )
+
+        with transaction.atomic():
+            FacturaElectronica.objects.bulk_create(
+                registros,
+                update_conflicts=True,
+                unique_fields=['venta'],
+                update_fields=[
+                    'ecf_tipo', 'documento', 'resumen', 'fecha_firma',
+                    'track_id', 'respuesta_dgii', 'qr_code_url', 'proxima_consulta',
+                ],
+            )
+            Venta.objects.bulk_update(ventas, ['estado_fiscal'])
+
+    # --- Notificaciones --------------------------------------------------
+
+    def notificar(self, data):
+        """Publica el progreso al usuario que lanzó el lote (o a todo el negocio)."""
+        data = {'lote_id': self.lote_id, **data}
+        if self.usuario:
+            notificar_usuario(self.usuario.id, 'ecf_lote', data)
+        else:
+            notificar_negocio(self.negocio.id, 'ecf_lote', data)
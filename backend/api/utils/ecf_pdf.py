@@ -0,0 +1,433 @@
+"""
+Representación impresa de e-CF (PDF con reportlab).
+
+Pensado para reimpresiones masivas y el archivo de fin de día:
+
+- Los datos se leen con dos consultas values() por lote (sin instanciar
+  modelos), igual que PlantillaECF.
+- Recursos por negocio en cache (RecursosNegocio): datos del emisor y el logo,
+  leído del storage una sola vez y renovado cuando se edita el negocio. En cada
+  proceso el logo se decodifica y la fuente TTF opcional (settings.ECF_PDF_FUENTE)
+  se registra una sola vez; el encabezado se dibuja una vez por documento como
+  form XObject que todas las páginas reutilizan.
+- Lote en un PDF: un solo canvas, en el proceso actual.
+- Lote en ZIP: un PDF por factura, renderizados por bloques en un pool de
+  procesos; el ZIP se emite a medida que llegan los bloques (streaming).
+
+Uso:
+    impresor = RepresentacionImpresa(negocio)
+    pdf, paginas = impresor.pdf(venta_ids)
+    response = StreamingHttpResponse(impresor.zip(venta_ids), content_type='application/zip')
+"""
+import functools
+import io
+import itertools
+import logging
+import threading
+import zipfile
+from dataclasses import dataclass
+
+import qrcode
+from django.conf import settings
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from .ncf_manager import TIPO_ECF_MAP
+from .xml_signer import signing_pool
+
+logger = logging.getLogger('api')
+
+TITULOS = {
+    '31': 'Factura de Crédito Fiscal Electrónica',
+    '32': 'Factura de Consumo Electrónica',
+    '33': 'Nota de Débito Electrónica',
+    '34': 'Nota de Crédito Electrónica',
+    '41': 'Comprobante Electrónico de Compras',
+    '43': 'Comprobante Electrónico para Gastos Menores',
+    '44': 'Comprobante Electrónico para Regímenes Especiales',
+    '45': 'Comprobante Electrónico Gubernamental',
+}
+
+CAMPOS_VENTA = (
+    'id', 'numero', 'ncf', 'tipo_comprobante', 'fecha', 'fecha_vencimiento',
+    'subtotal', 'descuento', 'total_impuestos', 'total', 'codigo_seguridad_dgii',
+    'cliente__nombre', 'cliente__numero_documento', 'venta_referencia__ncf',
+    'ecf_data__ecf_tipo', 'ecf_data__qr_code_url', 'ecf_data__fecha_firma',
+)
+CAMPOS_DETALLE = ('venta_id', 'cantidad', 'precio_unitario', 'impuesto', 'total', 'producto__nombre')
+
+ANCHO, ALTO = letter
+MARGEN = 15 * mm
+ALTO_ENCABEZADO = 38 * mm
+ALTO_FILA = 5 * mm
+ALTO_PIE = 45 * mm
+TAMANO_QR = 30 * mm
+MASCARA_QR = 2
+# Columnas de la tabla de items: (título, x, alineado a la derecha)
+COLUMNAS = (
+    ('Cant.', MARGEN, False),
+    ('Descripción', MARGEN + 18 * mm, False),
+    ('Precio', ANCHO - MARGEN - 60 * mm, True),
+    ('ITBIS', ANCHO - MARGEN - 30 * mm, True),
+    ('Total', ANCHO - MARGEN, True),
+)
+# A partir de cuántas facturas compensa levantar el pool para el ZIP
+MIN_POOL = 50
+TAMANO_BLOQUE = 50
+
+
+@dataclass(frozen=True)
+class RecursosNegocio:
+    """Encabezado del emisor; se envía tal cual a los procesos del pool."""
+    negocio_id: str
+    razon_social: str
+    nombre_comercial: str
+    rnc: str
+    direccion: str
+    telefono: str
+    logo: bytes = b''
+    fuente: str = ''
+    fuente_negrita: str = ''
+
+
+@functools.lru_cache(maxsize=None)
+def fuentes(ruta='', ruta_negrita=''):
+    """(normal, negrita); una TTF configurada se registra una sola vez por proceso."""
+    if not ruta:
+        return 'Helvetica', 'Helvetica-Bold'
+    pdfmetrics.registerFont(TTFont('ECF', ruta))
+    pdfmetrics.registerFont(TTFont('ECF-Negrita', ruta_negrita or ruta))
+    return 'ECF', 'ECF-Negrita'
+
+
+@functools.lru_cache(maxsize=16)
+def _logo(logo):
+    return ImageReader(io.BytesIO(logo))
+
+
+def _fecha(valor):
+    return valor.strftime('%d-%m-%Y') if valor else ''
+
+
+def _monto(valor):
+    return f'{valor or 0:,.2f}'
+
+
+def _encabezado(c, recursos, fuente, negrita):
+    """Encabezado del emisor como form XObject: se dibuja una vez por documento."""
+    c.beginForm('encabezado')
+    x = MARGEN
+    if recursos.logo:
+        try:
+            c.drawImage(
+                _logo(recursos.logo), MARGEN, ALTO - MARGEN - 22 * mm, width=35 * mm, height=22 * mm,
+                preserveAspectRatio=True, anchor='sw', mask='auto',
+            )
+            x += 40 * mm
+        except Exception as e:
+            logger.warning('Logo inválido para negocio %s: %s', recursos.negocio_id, e)
+    y = ALTO - MARGEN - 4 * mm
+    c.setFont(negrita, 12)
+    c.drawString(x, y, recursos.razon_social)
+    c.setFont(fuente, 9)
+    direccion = ', '.join(linea.strip() for linea in recursos.direccion.splitlines() if linea.strip())
+    for linea in (recursos.nombre_comercial, f'RNC: {recursos.rnc}', direccion, recursos.telefono):
+        if linea:
+            y -= 4.5 * mm
+            c.drawString(x, y, linea[:90])
+    c.endForm()
+
+
+def _cabecera_tabla(c, y, negrita):
+    c.setFont(negrita, 8)
+    for titulo, x, derecha in COLUMNAS:
+        (c.drawRightString if derecha else c.drawString)(x, y, titulo)
+    c.line(MARGEN, y - 1.5 * mm, ANCHO - MARGEN, y - 1.5 * mm)
+    return y - ALTO_FILA
+
+
+def _nueva_pagina(c, negrita):
+    c.showPage()
+    c.doForm('encabezado')
+    return _cabecera_tabla(c, ALTO - MARGEN - ALTO_ENCABEZADO, negrita)
+
+
+def _qr(c, url, x, y):
+    """
+    QR de la DGII como un único path (una corrida de módulos oscuros = un
+    rectángulo). El widget de reportlab crea un objeto por módulo y prueba las
+    8 máscaras; con máscara fija (válida según la norma) el QR deja de costar
+    más que el resto de la página.
+    """
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=0, mask_pattern=MASCARA_QR)
+    qr.add_data(url)
+    qr.make(fit=True)
+    modulos = qr.modules
+    lado = TAMANO_QR / len(modulos)
+    path = c.beginPath()
+    for fila, valores in enumerate(modulos):
+        columna = 0
+        fy = y + TAMANO_QR - (fila + 1) * lado
+        for oscuro, corrida in itertools.groupby(valores, key=bool):
+            ancho = len(list(corrida))
+            if oscuro:
+                path.rect(x + columna * lado, fy, ancho * lado, lado)
+            columna += ancho
+    c.drawPath(path, stroke=0, fill=1)
+
+
+def _dibujar(c, datos, fuente, negrita):
+    """Dibuja una factura desde una página nueva; devuelve las páginas usadas."""
+    paginas = 1
+    c.doForm('encabezado')
+    derecha = ANCHO - MARGEN
+    y = ALTO - MARGEN - 4 * mm
+    c.setFont(negrita, 11)
+    c.drawRightString(derecha, y, TITULOS.get(datos['ecf_tipo'], 'Comprobante Fiscal Electrónico'))
+    c.setFont(fuente, 9)
+    lineas = [f"e-NCF: {datos['ncf']}", f"Fecha de emisión: {_fecha(datos['fecha'])}"]
+    if datos['fecha_vencimiento']:
+        lineas.append(f"Válida hasta: {_fecha(datos['fecha_vencimiento'])}")
+    if datos['venta_referencia__ncf']:
+        lineas.append(f"NCF modificado: {datos['venta_referencia__ncf']}")
+    lineas.append(f"Factura interna: {datos['numero']}")
+    for linea in lineas:
+        y -= 4.5 * mm
+        c.drawRightString(derecha, y, linea)
+
+    y = ALTO - MARGEN - ALTO_ENCABEZADO + 8 * mm
+    c.setFont(negrita, 9)
+    c.drawString(MARGEN, y, 'Cliente:')
+    c.setFont(fuente, 9)
+    c.drawString(MARGEN + 15 * mm, y, (datos['cliente__nombre'] or 'Consumidor Final')[:80])
+    if datos['cliente__numero_documento']:
+        c.drawRightString(derecha, y, f"RNC/Cédula: {datos['cliente__numero_documento']}")
+
+    y = _cabecera_tabla(c, ALTO - MARGEN - ALTO_ENCABEZADO, negrita)
+    for detalle in datos['detalles']:
+        if y < MARGEN:
+            y = _nueva_pagina(c, negrita)
+            paginas += 1
+        c.setFont(fuente, 8)
+        c.drawString(COLUMNAS[0][1], y, f"{detalle['cantidad']:g}")
+        c.drawString(COLUMNAS[1][1], y, (detalle['producto__nombre'] or '')[:70])
+        c.drawRightString(COLUMNAS[2][1], y, _monto(detalle['precio_unitario']))
+        c.drawRightString(COLUMNAS[3][1], y, _monto(detalle['impuesto']))
+        c.drawRightString(COLUMNAS[4][1], y, _monto(detalle['total']))
+        y -= ALTO_FILA
+
+    if y - ALTO_PIE < MARGEN:
+        c.showPage()
+        c.doForm('encabezado')
+        paginas += 1
+        y = ALTO - MARGEN - ALTO_ENCABEZADO
+    c.line(MARGEN, y + 2 * mm, derecha, y + 2 * mm)
+    totales = [('Subtotal', datos['subtotal'])]
+    if datos['descuento']:
+        totales.append(('Descuento', datos['descuento']))
+    totales += [('ITBIS', datos['total_impuestos']), ('Total', datos['total'])]
+    ty = y - 3 * mm
+    for etiqueta, valor in totales:
+        c.setFont(negrita if etiqueta == 'Total' else fuente, 9)
+        c.drawRightString(derecha - 35 * mm, ty, etiqueta)
+        c.drawRightString(derecha, ty, _monto(valor))
+        ty -= 5 * mm
+
+    if datos['ecf_data__qr_code_url']:
+        _qr(c, datos['ecf_data__qr_code_url'], MARGEN, y - 3 * mm - TAMANO_QR)
+    c.setFont(fuente, 8)
+    c.drawString(MARGEN + TAMANO_QR + 4 * mm, y - 8 * mm, f"Código de seguridad: {datos['codigo_seguridad_dgii']}")
+    c.drawString(
+        MARGEN + TAMANO_QR + 4 * mm, y - 12 * mm,
+        f"Fecha de firma digital: {_fecha(datos['ecf_data__fecha_firma'])}",
+    )
+    c.showPage()
+    return paginas
+
+
+def renderizar(recursos, facturas):
+    """(PDF en bytes, páginas) con las facturas dadas, en un solo documento."""
+    fuente, negrita = fuentes(recursos.fuente, recursos.fuente_negrita)
+    salida = io.BytesIO()
+    c = canvas.Canvas(salida, pagesize=letter)
+    c.setTitle(f'e-CF {recursos.razon_social}')
+    c.setAuthor(recursos.razon_social)
+    _encabezado(c, recursos, fuente, negrita)
+    paginas = sum(_dibujar(c, datos, fuente, negrita) for datos in facturas)
+    c.save()
+    return salida.getvalue(), paginas
+
+
+def _renderizar_bloque(args):
+    """Un PDF por factura: list de (nombre, pdf, páginas, error). Corre en el pool."""
+    recursos, facturas = args
+    resultados = []
+    for datos in facturas:
+        nombre = f"{datos['ncf'] or datos['numero']}.pdf"
+        try:
+            pdf, paginas = renderizar(recursos, [datos])
+            resultados.append((nombre, pdf, paginas, None))
+        except Exception as e:
+            resultados.append((nombre, None, 0, str(e)))
+    return resultados
+
+
+class _Salida(io.RawIOBase):
+    """Destino de solo escritura del ZIP; lo escrito se entrega por trozos."""
+
+    def __init__(self):
+        self.trozos = []
+        self.posicion = 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self.trozos.append(bytes(datos))
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self.posicion
+
+    def vaciar(self):
+        datos = b''.join(self.trozos)
+        self.trozos.clear()
+        return datos
+
+
+def generar_zip(recursos, facturas, pool=None, resumen=None):
+    """
+    Trozos de un ZIP con un PDF por factura, emitidos a medida que se
+    renderiza cada bloque. Las facturas que fallan se listan en ERRORES.txt.
+    """
+    resumen = resumen if resumen is not None else {}
+    resumen.update(facturas=0, paginas=0, errores=0)
+    bloques = [
+        (recursos, facturas[i:i + TAMANO_BLOQUE]) for i in range(0, len(facturas), TAMANO_BLOQUE)
+    ]
+    resultados = pool.map(_renderizar_bloque, bloques) if pool else map(_renderizar_bloque, bloques)
+    salida = _Salida()
+    errores = []
+    with zipfile.ZipFile(salida, 'w', compression=zipfile.ZIP_STORED) as archivo:
+        for bloque in resultados:
+            for nombre, pdf, paginas, error in bloque:
+                if error:
+                    errores.append(f'{nombre}: {error}')
+                    continue
+                archivo.writestr(nombre, pdf)
+                resumen['facturas'] += 1
+                resumen['paginas'] += paginas
+            yield salida.vaciar()
+        if errores:
+            archivo.writestr('ERRORES.txt', '\n'.join(errores))
+    resumen['errores'] = len(errores)
+    yield salida.vaciar()
+
+
+class RepresentacionImpresa:
+    """
+    Uso:
+        impresor = RepresentacionImpresa(negocio)
+        pdf, paginas = impresor.pdf(venta_ids)
+        for trozo in impresor.zip(venta_ids): ...
+    """
+
+    # negocio_id -> (firma de los datos del negocio, RecursosNegocio)
+    _recursos = {}
+    _lock = threading.Lock()
+
+    def __init__(self, negocio):
+        self.negocio = negocio
+        self.resumen = {'facturas': 0, 'paginas': 0, 'errores': 0}
+
+    def recursos(self):
+        negocio = self.negocio
+        logo_nombre = negocio.logo.name if negocio.logo else ''
+        fuente = getattr(settings, 'ECF_PDF_FUENTE', '')
+        fuente_negrita = getattr(settings, 'ECF_PDF_FUENTE_NEGRITA', '')
+        firma = (
+            negocio.razon_social, negocio.nombre_comercial, negocio.identificacion_fiscal,
+            negocio.direccion, negocio.telefono, logo_nombre, fuente, fuente_negrita,
+        )
+        with self._lock:
+            entrada = self._recursos.get(negocio.id)
+        if entrada is not None and entrada[0] == firma:
+            return entrada[1]
+
+        logo = b''
+        if logo_nombre:
+            try:
+                with negocio.logo.open('rb') as archivo:
+                    logo = archivo.read()
+            except (OSError, ValueError) as e:
+                logger.warning('No se pudo leer el logo del negocio %s: %s', negocio.id, e)
+        recursos = RecursosNegocio(
+            negocio_id=str(negocio.id), razon_social=negocio.razon_social,
+            nombre_comercial=negocio.nombre_comercial, rnc=negocio.identificacion_fiscal,
+            direccion=negocio.direccion, telefono=negocio.telefono, logo=logo,
+            fuente=fuente, fuente_negrita=fuente_negrita,
+        )
+        with self._lock:
+            self._recursos[negocio.id] = (firma, recursos)
+        return recursos
+
+    @classmethod
+    def invalidar(cls, negocio_id=None):
+        with cls._lock:
+            if negocio_id is None:
+                cls._recursos.clear()
+            else:
+                cls._recursos.pop(negocio_id, None)
+
+    def cargar(self, venta_ids):
+        """Datos de las ventas (por fecha) con sus detalles, en dos consultas."""
+        from ..models import DetalleVenta, Venta
+
+        filas = list(
+            Venta.objects.filter(id__in=venta_ids, negocio=self.negocio)
+            .order_by('fecha')
+            .values(*CAMPOS_VENTA)
+        )
+        por_venta = {}
+        for fila in filas:
+            fila['detalles'] = por_venta[fila['id']] = []
+            fila['ecf_tipo'] = fila['ecf_data__ecf_tipo'] or TIPO_ECF_MAP.get(
+                fila['tipo_comprobante'], '32',
+            )
+        for detalle in (
+            DetalleVenta.objects.filter(venta_id__in=list(por_venta))
+            .order_by('venta_id', 'id')
+            .values(*CAMPOS_DETALLE)
+        ):
+            por_venta[detalle['venta_id']].append(detalle)
+        return filas
+
+    def pdf(self, venta_ids):
+        """(PDF en bytes, páginas) con todas las facturas en un solo documento."""
+        facturas = self.cargar(venta_ids)
+        pdf, paginas = renderizar(self.recursos(), facturas)
+        self.resumen.update(facturas=len(facturas), paginas=paginas)
+        return pdf, paginas
+
+    def zip(self, venta_ids, procesos=None, pool=None):
+        """
+        Generador de trozos de un ZIP con un PDF por factura.
+
+        Sin pool propio, se levanta uno (y se cierra al terminar) cuando el lote
+        tiene al menos MIN_POOL facturas.
+        """
+        recursos = self.recursos()
+        facturas = self.cargar(venta_ids)
+        propio = pool is None and len(facturas) >= MIN_POOL
+        if propio:
+            pool = signing_pool(procesos)
+        try:
+            yield from generar_zip(recursos, facturas, pool=pool, resumen=self.resumen)
+        finally:
+            if propio and pool is not None:
+                pool.shutdown()
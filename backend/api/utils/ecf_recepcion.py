@@ -0,0 +1,389 @@
+"""
+Recepción de e-CF de proveedores.
+
+Los proveedores envían sus e-CF firmados (XML sueltos o en ZIP). En vez de
+digitar la compra, RecepcionECF:
+
+1. lee los XML del upload; los ZIP miembro a miembro, sin extraerlos a disco;
+2. verifica la firma (verify_ecf_xml) contra la CA de ECF_RECEPCION_CA_PEM,
+   exige que el certificado sea del RNCEmisor y extrae los datos del XML
+   firmado que devuelve la verificación (no de los bytes recibidos) con
+   iterparse de lxml (cada Item se libera al leerlo) en el pool de procesos
+   de firma, en bloques de TAMANO_BLOQUE documentos. Sin CA configurada no
+   se importa nada;
+3. descarta los que no son para este negocio (RNCComprador) y los duplicados
+   por eNCF + RNC del emisor, contra la base y dentro del mismo upload;
+4. crea los Proveedor que falten, Compra en BORRADOR y DetalleCompra con bulk
+   writes, y guarda el XML firmado en DocumentoECF (Compra.documento_ecf).
+
+Las líneas se asocian a Producto por código (CodigoItem contra código de
+barras o interno) o por nombre; las que no coinciden van al producto
+inactivo PRODUCTO_SIN_CLASIFICAR con la descripción del proveedor, para
+reclasificar antes de recibir la compra.
+
+Uso:
+    reporte = RecepcionECF(negocio, almacen=almacen).procesar(request.FILES.getlist('archivos'))
+"""
+import io
+import itertools
+import logging
+import os
+import zipfile
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from lxml import etree
+
+from .ecf_documentos import guardar_documentos
+from .xml_signer import rnc_en_certificado, signing_pool, verify_ecf_xml
+
+logger = logging.getLogger('api')
+
+IMPORTADO = 'IMPORTADO'
+DUPLICADO = 'DUPLICADO'
+FIRMA_INVALIDA = 'FIRMA_INVALIDA'
+RECHAZADO = 'RECHAZADO'
+ERROR = 'ERROR'
+
+# Estado del documento -> contador del reporte
+CONTADORES = {
+    IMPORTADO: 'importados', DUPLICADO: 'duplicados', FIRMA_INVALIDA: 'firma_invalida',
+    RECHAZADO: 'rechazados', ERROR: 'errores',
+}
+
+# Tipos e-CF que emite un proveedor y se registran como compra
+TIPOS_COMPRA = {'31', '32', '33', '44', '45'}
+
+# TipoPago del e-CF (1 contado, 2 crédito; 01-05 los de TIPO_PAGO_MAP) -> Compra.forma_pago
+FORMA_PAGO_ECF = {
+    '1': 'EFECTIVO', '2': 'CREDITO',
+    '01': 'EFECTIVO', '02': 'CHEQUE', '03': 'TARJETA', '04': 'TRANSFERENCIA', '05': 'CREDITO',
+}
+
+CAMPOS_ENCABEZADO = {
+    'TipoeCF', 'eNCF', 'TipoPago', 'RNCEmisor', 'RazonSocialEmisor', 'FechaEmision',
+    'RNCComprador', 'MontoGravadoTotal', 'MontoExento', 'MontoExentoTotal', 'TotalITBIS', 'MontoTotal',
+}
+
+MAX_TAMANO_XML = 5 * 1024 * 1024
+PRODUCTO_SIN_CLASIFICAR = 'ECF-SIN-CLASIFICAR'
+
+CERO = Decimal('0')
+CENTAVO = Decimal('0.01')
+
+
+def _decimal(texto):
+    return Decimal(texto.strip()) if texto and texto.strip() else CERO
+
+
+def extraer_ecf(datos):
+    """
+    Encabezado y líneas de un e-CF con iterparse. Retorna un dict simple
+    (se envía de vuelta desde el pool de procesos). Los campos del encabezado
+    solo se toman dentro de <Encabezado>.
+    """
+    encabezado, items = {}, []
+    for _, elemento in etree.iterparse(io.BytesIO(datos), events=('end',), resolve_entities=False):
+        tag = etree.QName(elemento).localname
+        if tag == 'Item':
+            campos = {etree.QName(hijo).localname: hijo.text for hijo in elemento}
+            items.append({
+                'nombre': (campos.get('NombreItem') or '').strip()[:200],
+                'codigo': (campos.get('CodigoItem') or '').strip(),
+                'cantidad': _decimal(campos.get('CantidadItem')) or Decimal('1'),
+                'precio_unitario': _decimal(campos.get('PrecioUnitarioItem')),
+                'monto': _decimal(campos.get('MontoItem')),
+                'itbis': _decimal(campos['MontoITBIS']) if campos.get('MontoITBIS') else None,
+            })
+            elemento.clear()
+            while elemento.getprevious() is not None:
+                del elemento.getparent()[0]
+        elif tag in CAMPOS_ENCABEZADO and tag not in encabezado and any(
+            etree.QName(ancestro).localname == 'Encabezado' for ancestro in elemento.iterancestors()
+        ):
+            encabezado[tag] = (elemento.text or '').strip()
+
+    for requerido in ('eNCF', 'RNCEmisor', 'FechaEmision', 'MontoTotal'):
+        if not encabezado.get(requerido):
+            raise ValueError(f'El e-CF no tiene {requerido}.')
+
+    total_itbis = _decimal(encabezado.get('TotalITBIS'))
+    if items and any(item['itbis'] is None for item in items):
+        # Sin MontoITBIS por línea: se reparte el TotalITBIS según el monto.
+        base = sum(item['monto'] for item in items) or Decimal('1')
+        asignado = CERO
+        for item in items[:-1]:
+            item['itbis'] = (total_itbis * item['monto'] / base).quantize(CENTAVO)
+            asignado += item['itbis']
+        items[-1]['itbis'] = total_itbis - asignado
+
+    return {
+        'tipo': encabezado.get('TipoeCF', ''),
+        'encf': encabezado['eNCF'],
+        'rnc_emisor': encabezado['RNCEmisor'].replace('-', ''),
+        'razon_social_emisor': encabezado.get('RazonSocialEmisor', '')[:200],
+        'rnc_comprador': encabezado.get('RNCComprador', '').replace('-', ''),
+        'fecha': datetime.strptime(encabezado['FechaEmision'], '%d-%m-%Y').date(),
+        'forma_pago': FORMA_PAGO_ECF.get(encabezado.get('TipoPago', ''), 'CREDITO'),
+        'subtotal': _decimal(encabezado.get('MontoGravadoTotal')) + _decimal(
+            encabezado.get('MontoExento') or encabezado.get('MontoExentoTotal'),
+        ),
+        'total_impuestos': total_itbis,
+        'total': _decimal(encabezado['MontoTotal']),
+        'items': items,
+    }
+
+
+def analizar_documento(args):
+    """Worker del pool: verifica y extrae un e-CF; nunca propaga la excepción."""
+    indice, datos, ca_pem_file = args
+    try:
+        cert, firmado = verify_ecf_xml(datos, ca_pem_file)
+    except etree.XMLSyntaxError as e:
+        return indice, {'estado': ERROR, 'mensaje': f'XML mal formado: {e}'[:500]}
+    except Exception as e:
+        return indice, {'estado': FIRMA_INVALIDA, 'mensaje': str(e)[:500]}
+    try:
+        resultado = extraer_ecf(etree.tostring(firmado))
+    except (etree.XMLSyntaxError, ValueError, InvalidOperation) as e:
+        return indice, {'estado': ERROR, 'mensaje': f'e-CF ilegible: {e}'[:500]}
+    if not rnc_en_certificado(cert, resultado['rnc_emisor']):
+        return indice, {
+            'estado': FIRMA_INVALIDA,
+            'mensaje': f"El certificado firmante no corresponde al RNCEmisor {resultado['rnc_emisor']}.",
+        }
+    return indice, {'estado': IMPORTADO, **resultado}
+
+
+def iter_documentos(archivos):
+    """(nombre, bytes o None si excede MAX_TAMANO_XML) de cada XML, abriendo los ZIP."""
+    for archivo in archivos:
+        nombre = getattr(archivo, 'name', '') or 'archivo'
+        if zipfile.is_zipfile(archivo):
+            archivo.seek(0)
+            with zipfile.ZipFile(archivo) as zf:
+                for info in zf.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith('.xml'):
+                        continue
+                    ruta = f'{nombre}/{info.filename}'
+                    yield ruta, (zf.read(info) if info.file_size <= MAX_TAMANO_XML else None)
+        else:
+            archivo.seek(0)
+            datos = archivo.read(MAX_TAMANO_XML + 1)
+            yield nombre, (datos if len(datos) <= MAX_TAMANO_XML else None)
+
+
+class RecepcionECF:
+    """Ver el docstring del módulo."""
+
+    TAMANO_BLOQUE = 500
+
+    def __init__(self, negocio, usuario=None, almacen=None, procesos=None, tamano_bloque=None):
+        self.negocio = negocio
+        self.usuario = usuario
+        self.almacen = almacen
+        self.procesos = procesos
+        self.tamano_bloque = tamano_bloque or self.TAMANO_BLOQUE
+        self.rnc = negocio.identificacion_fiscal.replace('-', '')
+        self._proveedores = None
+        self._productos = None
+        self._vistos = set()
+
+    def procesar(self, archivos) -> dict:
+        if not getattr(settings, 'ECF_RECEPCION_CA_PEM', ''):
+            raise ValueError(
+                'La recepción de e-CF requiere ECF_RECEPCION_CA_PEM (CA de las entidades de '
+                'certificación) para verificar a los emisores.'
+            )
+        almacen = self.almacen or self._almacen_principal()
+        if almacen is None:
+            raise ValueError('El negocio no tiene almacén para registrar las compras.')
+        self.almacen = almacen
+
+        lock = f'lock:recepcion_ecf:{self.negocio.id}'
+        if not cache.add(lock, 1, timeout=1800):
+            raise ValueError('Ya hay una recepción de e-CF en curso para este negocio.')
+        reporte = {'total': 0, **{c: 0 for c in CONTADORES.values()}, 'documentos': []}
+        pool = signing_pool(self.procesos)
+        try:
+            documentos = iter_documentos(archivos)
+            while True:
+                bloque = list(itertools.islice(documentos, self.tamano_bloque))
+                if not bloque:
+                    break
+                for entrada in self._procesar_bloque(bloque, pool):
+                    reporte['total'] += 1
+                    reporte[CONTADORES[entrada['estado']]] += 1
+                    reporte['documentos'].append(entrada)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            cache.delete(lock)
+
+        logger.info(
+            'Recepción e-CF negocio %s: %s',
+            self.negocio.id, {k: v for k, v in reporte.items() if k != 'documentos'},
+        )
+        return reporte
+
+    # --- Bloque ----------------------------------------------------------
+
+    def _procesar_bloque(self, bloque, pool):
+        ca_pem_file = getattr(settings, 'ECF_RECEPCION_CA_PEM', '')
+        entradas = [
+            {'archivo': nombre, 'encf': '', 'rnc_emisor': '', 'compra_id': None, 'mensaje': ''}
+            for nombre, _ in bloque
+        ]
+        args = []
+        for indice, (_, datos) in enumerate(bloque):
+            if datos is None:
+                entradas[indice].update(estado=ERROR, mensaje='Archivo XML demasiado grande.')
+            else:
+                args.append((indice, datos, ca_pem_file))
+        if pool is not None and len(args) > 1:
+            chunksize = max(1, len(args) // ((os.cpu_count() or 1) * 4))
+            analizados = list(pool.map(analizar_documento, args, chunksize=chunksize))
+        else:
+            analizados = [analizar_documento(a) for a in args]
+
+        validos = []
+        for indice, resultado in analizados:
+            entrada = entradas[indice]
+            if resultado['estado'] != IMPORTADO:
+                entrada.update(estado=resultado['estado'], mensaje=resultado['mensaje'])
+                continue
+            entrada.update(encf=resultado['encf'], rnc_emisor=resultado['rnc_emisor'])
+            if resultado['rnc_comprador'] != self.rnc:
+                entrada.update(
+                    estado=RECHAZADO,
+                    mensaje=f"El comprador del e-CF ({resultado['rnc_comprador'] or 'sin RNC'}) no es este negocio.",
+                )
+            elif resultado['tipo'] not in TIPOS_COMPRA:
+                entrada.update(estado=RECHAZADO, mensaje=f"Tipo e-CF {resultado['tipo']} no se registra como compra.")
+            else:
+                validos.append((indice, resultado))
+
+        self._descartar_duplicados(validos, entradas)
+        validos = [(i, r) for i, r in validos if 'estado' not in entradas[i]]
+        if validos:
+            self._crear_compras(validos, entradas, [bloque[i][1] for i, _ in validos])
+        return entradas
+
+    def _descartar_duplicados(self, validos, entradas):
+        from ..models import Compra
+
+        encfs = {r['encf'] for _, r in validos}
+        existentes = {
+            (rnc.replace('-', ''), encf)
+            for rnc, encf in Compra.objects.filter(negocio=self.negocio, ncf_proveedor__in=encfs)
+            .values_list('proveedor__identificacion_fiscal', 'ncf_proveedor')
+        }
+        for indice, resultado in validos:
+            clave = (resultado['rnc_emisor'], resultado['encf'])
+            if clave in existentes or clave in self._vistos:
+                entradas[indice].update(estado=DUPLICADO, mensaje='El e-CF ya está registrado.')
+            else:
+                self._vistos.add(clave)
+
+    def _crear_compras(self, validos, entradas, xmls):
+        from ..models import Compra, DetalleCompra
+
+        hashes = guardar_documentos(xmls)
+        with transaction.atomic():
+            proveedores = self._proveedores_por_rnc(validos)
+            productos = self._productos_por_clave()
+            consecutivo = Compra.objects.filter(negocio=self.negocio).count()
+            compras, detalles = [], []
+            for (indice, r), sha in zip(validos, hashes):
+                consecutivo += 1
+                compra = Compra(
+                    negocio=self.negocio, proveedor_id=proveedores[r['rnc_emisor']], almacen=self.almacen,
+                    numero=f'CMP-{consecutivo:06d}', ncf_proveedor=r['encf'], factura_proveedor=r['encf'],
+                    fecha=r['fecha'], forma_pago=r['forma_pago'],
+                    subtotal=r['subtotal'], total_impuestos=r['total_impuestos'], total=r['total'],
+                    documento_ecf_id=sha, notas=f"Importada del e-CF {r['encf']} ({entradas[indice]['archivo']})",
+                )
+                compras.append(compra)
+                for item in r['items']:
+                    detalles.append(DetalleCompra(
+                        compra=compra,
+                        producto_id=self._producto_de(item, productos),
+                        descripcion=item['nombre'],
+                        cantidad=item['cantidad'],
+                        precio_unitario=item['precio_unitario'],
+                        subtotal=item['monto'],
+                        impuesto=item['itbis'],
+                        total=item['monto'] + item['itbis'],
+                    ))
+                entradas[indice].update(estado=IMPORTADO, mensaje='', compra_id=str(compra.id))
+            Compra.objects.bulk_create(compras)
+            DetalleCompra.objects.bulk_create(detalles, batch_size=1000)
+
+    # --- Catálogos (una carga por recepción) ------------------------------
+
+    def _almacen_principal(self):
+        from ..models import Almacen
+
+        return (
+            Almacen.objects.filter(negocio=self.negocio, activo=True)
+            .order_by('-es_principal', 'codigo').first()
+        )
+
+    def _proveedores_por_rnc(self, validos):
+        from ..models import Proveedor
+
+        if self._proveedores is None:
+            self._proveedores = {
+                rnc.replace('-', ''): pk
+                for pk, rnc in Proveedor.objects.filter(negocio=self.negocio)
+                .values_list('id', 'identificacion_fiscal')
+            }
+        nuevos = {}
+        for _, r in validos:
+            if r['rnc_emisor'] not in self._proveedores and r['rnc_emisor'] not in nuevos:
+                nuevos[r['rnc_emisor']] = Proveedor(
+                    negocio=self.negocio, identificacion_fiscal=r['rnc_emisor'],
+                    nombre=r['razon_social_emisor'] or r['rnc_emisor'], telefono='',
+                )
+        if nuevos:
+            Proveedor.objects.bulk_create(nuevos.values())
+            self._proveedores.update({rnc: p.id for rnc, p in nuevos.items()})
+        return self._proveedores
+
+    def _productos_por_clave(self):
+        from ..models import Producto
+
+        if self._productos is None:
+            self._productos = {}
+            for pk, barras, interno, nombre in Producto.objects.filter(negocio=self.negocio).values_list(
+                'id', 'codigo_barras', 'codigo_interno', 'nombre',
+            ):
+                for clave in (('codigo', barras), ('codigo', interno), ('nombre', nombre.strip().lower())):
+                    if clave[1]:
+                        self._productos.setdefault(clave, pk)
+        return self._productos
+
+    def _producto_de(self, item, productos):
+        from ..models import Producto
+
+        pk = (
+            (item['codigo'] and productos.get(('codigo', item['codigo'])))
+            or productos.get(('nombre', item['nombre'].lower()))
+        )
+        if pk:
+            return pk
+        clave = ('codigo', PRODUCTO_SIN_CLASIFICAR)
+        if clave not in productos:
+            producto, _ = Producto.objects.get_or_create(
+                negocio=self.negocio, codigo_barras=PRODUCTO_SIN_CLASIFICAR,
+                defaults={
+                    'nombre': 'Compras e-CF sin clasificar', 'tipo': 'SERVICIO',
+                    'precio_costo': CERO, 'precio_venta': CENTAVO,
+                    'aplica_impuesto': False, 'activo': False,
+                },
+            )
+            productos[clave] = producto.id
+        return productos[clave]
@@ -1,18 +1,54 @@
+"""
+Numeración NCF por bloques.
+
+Cada sucursal o caja reserva un sub-rango (BloqueNCF) de la SecuenciaNCF en una
+transacción corta y asigna de ahí bajo el lock de su propia fila. Las cajas
+de un negocio ya no se serializan sobre la fila de la secuencia; la toman solo
+al reservar otro bloque (cada TAMANO_BLOQUE números).
+
+Los números de un bloque que ya no se usarán (secuencia vencida o
+desactivada, caja dada de baja) se registran en AnulacionNCF y salen en el
+reporte 608. pronostico_agotamiento() estima por tipo de comprobante cuándo
+se acaban los números, según el consumo reciente.
+"""
 import logging
+from datetime import timedelta
+
 from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
 from django.utils import timezone
 
 logger = logging.getLogger('audit')
 
+# Mapeo tipo comprobante a código e-CF
+TIPO_ECF_MAP = {
+    'B01': '31',  # Crédito Fiscal
+    'B02': '32',  # Consumo
+    'B03': '33',  # Nota de Débito
+    'B04': '34',  # Nota de Crédito
+    'B11': '41',  # Compras
+    'B13': '43',  # Gastos Menores
+    'B14': '44',  # Regímenes Especiales
+    'B15': '45',  # Gubernamental
+}
+
+# Días de margen antes del agotamiento (o del vencimiento) para alertar
+DIAS_ALERTA_AGOTAMIENTO = 30
+
+
+def formatear_ncf(tipo_comprobante, serie, numero):
+    return f"E{TIPO_ECF_MAP.get(tipo_comprobante, '32')}{serie}{numero:08d}"
+
 
-def obtener_siguiente_ncf(negocio, tipo_comprobante):
+def obtener_siguiente_ncf(negocio, tipo_comprobante, sucursal=None, caja=''):
     """
-    Obtiene el siguiente NCF disponible para un tipo de comprobante.
-    Usa select_for_update() para manejar concurrencia.
+    Obtiene el siguiente NCF disponible para un tipo de comprobante, del bloque
+    de la sucursal/caja (reservando uno nuevo si hace falta).
 
     Args:
         negocio: Instancia de Negocio
         tipo_comprobante: str — 'B01', 'B02', 'B04', 'B14', 'B15', etc.
+        sucursal, caja: dueño del bloque (None/'' = bloque común del negocio)
 
     Returns:
         str: NCF formateado (ej: 'E310000000001')
@@ -20,56 +56,285 @@ def obtener_siguiente_ncf(negocio, tipo_comprobante):
     Raises:
         ValueError: Si no hay secuencia disponible o está agotada.
     """
-    from ..models import SecuenciaNCF
-
-    # Mapeo tipo comprobante a código e-CF
-    tipo_ecf_map = {
-        'B01': '31',  # Crédito Fiscal
-        'B02': '32',  # Consumo
-        'B03': '33',  # Nota de Débito
-        'B04': '34',  # Nota de Crédito
-        'B11': '41',  # Compras
-        'B13': '43',  # Gastos Menores
-        'B14': '44',  # Regímenes Especiales
-        'B15': '45',  # Gubernamental
-    }
+    return AsignadorNCF(negocio, sucursal=sucursal, caja=caja).siguiente(tipo_comprobante)
 
-    with transaction.atomic():
-        secuencia = (
-            SecuenciaNCF.objects
-            .select_for_update()
-            .filter(
-                negocio=negocio,
-                tipo_comprobante=tipo_comprobante,
-                activa=True,
-                fecha_vencimiento__gte=timezone.now().date(),
-            )
-            .first()
-        )
 
-        if not secuencia:
-            raise ValueError(
-                f'No hay secuencia NCF activa y vigente para tipo {tipo_comprobante} '
-                f'en negocio {negocio.nombre_comercial}.'
+class AsignadorNCF:
+    """
+    Uso:
+        asignador = AsignadorNCF(negocio, sucursal=venta.sucursal)
+        asignador.asegurar_bloque('B02')     # fuera de la transacción del llamador
+        ncf = asignador.siguiente('B02')
+        ncfs = asignador.siguientes('B02', 200)
+    """
+
+    TAMANO_BLOQUE = 500
+
+    def __init__(self, negocio, sucursal=None, caja='', tamano_bloque=None):
+        self.negocio = negocio
+        self.sucursal = sucursal
+        self.caja = caja or ''
+        self.tamano_bloque = tamano_bloque or self.TAMANO_BLOQUE
+        self.ultimo_error = ''
+
+    def _bloque_activo(self, tipo_comprobante, lock=False):
+        # Sin filtrar por secuencia__activa: la secuencia se desactiva al
+        # reservarse completa y los bloques ACTIVO que ya tiene cada caja siguen
+        # siendo válidos hasta agotarse (o hasta que cerrar_bloque los cierre).
+        from ..models import BloqueNCF
+
+        qs = BloqueNCF.objects.filter(
+            negocio=self.negocio, sucursal=self.sucursal, caja=self.caja, estado='ACTIVO',
+            secuencia__tipo_comprobante=tipo_comprobante,
+            secuencia__fecha_vencimiento__gte=timezone.now().date(),
+        ).select_related('secuencia').order_by('fecha_reserva')
+        if lock:
+            qs = qs.select_for_update(of=('self',))
+        return qs.first()
+
+    def reservar(self, tipo_comprobante):
+        """Reserva un bloque nuevo; el lock sobre la SecuenciaNCF dura solo esta transacción."""
+        from ..models import BloqueNCF, SecuenciaNCF
+
+        with transaction.atomic():
+            vigentes = list(
+                SecuenciaNCF.objects
+                .select_for_update()
+                .filter(
+                    negocio=self.negocio,
+                    tipo_comprobante=tipo_comprobante,
+                    activa=True,
+                    fecha_vencimiento__gte=timezone.now().date(),
+                )
+                .order_by('fecha_vencimiento', 'numero_desde')
             )
 
-        if secuencia.numero_actual > secuencia.numero_hasta:
-            secuencia.activa = False
-            secuencia.save(update_fields=['activa'])
+            if not vigentes:
+                raise ValueError(
+                    f'No hay secuencia NCF activa y vigente para tipo {tipo_comprobante} '
+                    f'en negocio {self.negocio.nombre_comercial}.'
+                )
+
+            secuencia = next((s for s in vigentes if s.numero_actual <= s.numero_hasta), None)
+            agotada = secuencia is None
+            if agotada:
+                # Solo se desactivan las que ya no tienen bloques vivos: los de
+                # otras cajas siguen asignando (y cerrar_secuencias_vencidas
+                # anularía sus números si la secuencia quedara inactiva).
+                secuencia = vigentes[0]
+                con_bloques = set(
+                    BloqueNCF.objects.filter(secuencia__in=vigentes, estado='ACTIVO')
+                    .values_list('secuencia_id', flat=True)
+                )
+                SecuenciaNCF.objects.filter(
+                    pk__in=[s.pk for s in vigentes if s.pk not in con_bloques],
+                ).update(activa=False)
+            else:
+                desde = secuencia.numero_actual
+                hasta = min(desde + self.tamano_bloque - 1, secuencia.numero_hasta)
+                secuencia.numero_actual = hasta + 1
+                secuencia.save(update_fields=['numero_actual'])
+                bloque = BloqueNCF.objects.create(
+                    negocio=self.negocio, secuencia=secuencia, sucursal=self.sucursal, caja=self.caja,
+                    desde=desde, hasta=hasta, actual=desde,
+                )
+
+        # Fuera del atomic, para que el raise no deshaga la desactivación
+        if agotada:
             raise ValueError(
                 f'Secuencia NCF agotada para tipo {tipo_comprobante}. '
                 f'Rango: {secuencia.numero_desde}-{secuencia.numero_hasta}.'
             )
 
-        numero = secuencia.numero_actual
-        secuencia.numero_actual += 1
-        secuencia.save(update_fields=['numero_actual'])
+        logger.info(
+            'Bloque NCF reservado: %s %s-%s (negocio: %s, sucursal: %s, caja: %s)',
+            tipo_comprobante, desde, hasta, self.negocio.id, self.sucursal and self.sucursal.id, self.caja,
+        )
+        return bloque
+
+    def asegurar_bloque(self, tipo_comprobante):
+        """
+        Reserva un bloque si la caja no tiene uno usable. Conviene llamarlo antes
+        de abrir la transacción que asigna el NCF, para que la reserva no quede
+        dentro de ella.
+        """
+        bloque = self._bloque_activo(tipo_comprobante)
+        if bloque is None or bloque.actual > bloque.hasta:
+            bloque = self.reservar(tipo_comprobante)
+        return bloque
+
+    def siguiente(self, tipo_comprobante):
+        ncfs = self.siguientes(tipo_comprobante, 1)
+        if not ncfs:
+            raise ValueError(self.ultimo_error)
+        ncf = ncfs[0]
+        logger.info(
+            'NCF asignado: %s (tipo: %s, negocio: %s)',
+            ncf, tipo_comprobante, self.negocio.id,
+        )
+        return ncf
+
+    def siguientes(self, tipo_comprobante, cantidad):
+        """
+        Hasta `cantidad` NCF consecutivos de los bloques de la caja. Si la
+        secuencia se agota a mitad, retorna los que alcanzó y deja el motivo en
+        ultimo_error.
+        """
+        ncfs = []
+        self.ultimo_error = ''
+        with transaction.atomic():
+            while len(ncfs) < cantidad:
+                bloque = self._bloque_activo(tipo_comprobante, lock=True)
+                if bloque is None:
+                    try:
+                        bloque = self.reservar(tipo_comprobante)
+                    except ValueError as e:
+                        self.ultimo_error = str(e)
+                        break
+                tomar = min(cantidad - len(ncfs), bloque.hasta - bloque.actual + 1)
+                serie = bloque.secuencia.serie
+                ncfs.extend(
+                    formatear_ncf(tipo_comprobante, serie, numero)
+                    for numero in range(bloque.actual, bloque.actual + tomar)
+                )
+                bloque.actual += tomar
+                if bloque.actual > bloque.hasta:
+                    bloque.estado = 'AGOTADO'
+                    bloque.fecha_cierre = timezone.now()
+                bloque.save(update_fields=['actual', 'estado', 'fecha_cierre'])
+        return ncfs
+
+    def cerrar(self, motivo, tipo_anulacion='08'):
+        """Cierra los bloques activos de la caja (p. ej. al darla de baja)."""
+        from ..models import BloqueNCF
+
+        bloques = BloqueNCF.objects.filter(
+            negocio=self.negocio, sucursal=self.sucursal, caja=self.caja, estado='ACTIVO',
+        )
+        return sum(cerrar_bloque(b, motivo, tipo_anulacion) for b in bloques)
+
+
+def cerrar_bloque(bloque, motivo, tipo_anulacion='08'):
+    """
+    Cierra un bloque y registra sus números sin usar como anulados (608).
+    Retorna cuántos números se anularon.
+    """
+    from ..models import AnulacionNCF, BloqueNCF
+
+    with transaction.atomic():
+        bloque = BloqueNCF.objects.select_for_update().get(pk=bloque.pk)
+        if bloque.estado != 'ACTIVO':
+            return 0
+        sin_usar = bloque.hasta - bloque.actual + 1
+        if sin_usar > 0:
+            AnulacionNCF.objects.create(
+                negocio_id=bloque.negocio_id, secuencia_id=bloque.secuencia_id, bloque=bloque,
+                desde=bloque.actual, hasta=bloque.hasta, tipo_anulacion=tipo_anulacion, motivo=motivo,
+            )
+        bloque.estado = 'CERRADO' if sin_usar > 0 else 'AGOTADO'
+        bloque.fecha_cierre = timezone.now()
+        bloque.save(update_fields=['estado', 'fecha_cierre'])
+    return max(sin_usar, 0)
+
 
-    tipo_ecf = tipo_ecf_map.get(tipo_comprobante, '32')
-    ncf = f"E{tipo_ecf}{secuencia.serie}{numero:08d}"
+def cerrar_secuencias_vencidas(negocio=None):
+    """
+    Anula los números que ya no se pueden usar: los bloques activos de
+    secuencias vencidas o desactivadas y el resto sin reservar de las
+    secuencias vencidas. Retorna {'bloques': n, 'numeros': n}.
+    """
+    from ..models import AnulacionNCF, BloqueNCF, SecuenciaNCF
 
-    logger.info(
-        'NCF asignado: %s (tipo: %s, negocio: %s)',
-        ncf, tipo_comprobante, negocio.id,
+    hoy = timezone.now().date()
+    resumen = {'bloques': 0, 'numeros': 0}
+    bloques = BloqueNCF.objects.filter(estado='ACTIVO').filter(
+        Q(secuencia__activa=False) | Q(secuencia__fecha_vencimiento__lt=hoy),
     )
-    return ncf
+    if negocio is not None:
+        bloques = bloques.filter(negocio=negocio)
+    for bloque in bloques:
+        resumen['numeros'] += cerrar_bloque(bloque, 'Secuencia NCF vencida o desactivada')
+        resumen['bloques'] += 1
+
+    secuencias = SecuenciaNCF.objects.filter(
+        fecha_vencimiento__lt=hoy, numero_actual__lte=F('numero_hasta'),
+    )
+    if negocio is not None:
+        secuencias = secuencias.filter(negocio=negocio)
+    for secuencia in secuencias:
+        with transaction.atomic():
+            secuencia = SecuenciaNCF.objects.select_for_update().get(pk=secuencia.pk)
+            if secuencia.numero_actual > secuencia.numero_hasta:
+                continue
+            AnulacionNCF.objects.create(
+                negocio_id=secuencia.negocio_id, secuencia=secuencia,
+                desde=secuencia.numero_actual, hasta=secuencia.numero_hasta,
+                motivo='Secuencia NCF vencida sin usar',
+            )
+            resumen['numeros'] += secuencia.numero_hasta - secuencia.numero_actual + 1
+            secuencia.numero_actual = secuencia.numero_hasta + 1
+            secuencia.activa = False
+            secuencia.save(update_fields=['numero_actual', 'activa'])
+    return resumen
+
+
+def pronostico_agotamiento(negocio, dias=30):
+    """
+    Por tipo de comprobante con secuencias activas: números disponibles (sin
+    reservar + restantes en bloques), consumo diario de los últimos `dias` y
+    fecha estimada de agotamiento (o el vencimiento, si llega antes).
+    """
+    from ..models import BloqueNCF, SecuenciaNCF, Venta
+
+    ahora = timezone.now()
+    hoy = ahora.date()
+    tipos = {}
+    for secuencia in SecuenciaNCF.objects.filter(
+        negocio=negocio, activa=True, fecha_vencimiento__gte=hoy,
+    ).values('tipo_comprobante', 'numero_actual', 'numero_hasta', 'fecha_vencimiento'):
+        tipo = tipos.setdefault(secuencia['tipo_comprobante'], {
+            'sin_reservar': 0, 'en_bloques': 0, 'fecha_vencimiento': secuencia['fecha_vencimiento'],
+        })
+        tipo['sin_reservar'] += max(secuencia['numero_hasta'] - secuencia['numero_actual'] + 1, 0)
+        tipo['fecha_vencimiento'] = max(tipo['fecha_vencimiento'], secuencia['fecha_vencimiento'])
+
+    # Los bloques vivos cuentan aunque su secuencia ya esté reservada completa
+    for fila in (
+        BloqueNCF.objects.filter(negocio=negocio, estado='ACTIVO', secuencia__fecha_vencimiento__gte=hoy)
+        .values('secuencia__tipo_comprobante')
+        .annotate(restantes=Sum(F('hasta') - F('actual') + 1), vence=Max('secuencia__fecha_vencimiento'))
+    ):
+        tipo = tipos.setdefault(fila['secuencia__tipo_comprobante'], {
+            'sin_reservar': 0, 'en_bloques': 0, 'fecha_vencimiento': fila['vence'],
+        })
+        tipo['en_bloques'] += fila['restantes'] or 0
+        tipo['fecha_vencimiento'] = max(tipo['fecha_vencimiento'], fila['vence'])
+
+    consumo = dict(
+        Venta.objects.filter(
+            negocio=negocio, fecha__gte=ahora - timedelta(days=dias), tipo_comprobante__in=list(tipos),
+        )
+        .exclude(ncf='')
+        .values('tipo_comprobante')
+        .annotate(n=Count('id'))
+        .values_list('tipo_comprobante', 'n')
+    )
+
+    pronostico = []
+    for tipo_comprobante, datos in sorted(tipos.items()):
+        disponibles = datos['sin_reservar'] + datos['en_bloques']
+        por_dia = consumo.get(tipo_comprobante, 0) / dias
+        dias_restantes = int(disponibles / por_dia) if por_dia else None
+        agotamiento = hoy + timedelta(days=dias_restantes) if dias_restantes is not None else None
+        limite = min(agotamiento, datos['fecha_vencimiento']) if agotamiento else datos['fecha_vencimiento']
+        pronostico.append({
+            'tipo_comprobante': tipo_comprobante,
+            'disponibles': disponibles,
+            'en_bloques': datos['en_bloques'],
+            'consumo_diario': round(por_dia, 2),
+            'dias_restantes': dias_restantes,
+            'fecha_agotamiento': agotamiento,
+            'fecha_vencimiento': datos['fecha_vencimiento'],
+            'alerta': (limite - hoy).days <= DIAS_ALERTA_AGOTAMIENTO,
+        })
+    return pronostico
@@ -0,0 +1,31 @@
+"""
+Envío de eventos al WebSocket de notificaciones (NotificacionesConsumer).
+
+Los grupos son los que el consumer une al conectar: 'user_<id>' para el
+usuario y 'notificaciones_<negocio_id>' para todo el negocio. `tipo` debe
+tener un handler con el mismo nombre en el consumer.
+"""
+import logging
+
+logger = logging.getLogger('api')
+
+
+def notificar_grupo(grupo, tipo, data):
+    try:
+        from channels.layers import get_channel_layer
+        from asgiref.sync import async_to_sync
+
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        async_to_sync(channel_layer.group_send)(grupo, {'type': tipo, 'data': data})
+    except Exception as e:
+        logger.debug('Could not send WS notification: %s', e)
+
+
+def notificar_usuario(usuario_id, tipo, data):
+    notificar_grupo(f'user_{usuario_id}', tipo, data)
+
+
+def notificar_negocio(negocio_id, tipo, data):
+    notificar_grupo(f'notificaciones_{negocio_id}', tipo, data)
@@ -0,0 +1,200 @@
+"""
+Particiones mensuales del AuditLog y archivo de los meses vencidos.
+
+api_auditlog está particionada por rango sobre fecha (migración 0024): una
+partición por mes UTC (api_auditlog_pAAAAMM) más una DEFAULT que recibe lo
+que cae fuera de ellas para que un INSERT de auditoría nunca falle.
+
+- crear_particiones() deja creadas las particiones hasta N meses adelante.
+  Crea cada una como tabla suelta, le pasa las filas de ese mes que hubieran
+  caído en la DEFAULT y la adjunta (ATTACH), así que sirve también para meses
+  pasados.
+- archivar_particiones() exporta cada mes anterior a la retención a un JSON
+  lines comprimido con gzip, verifica el archivo (filas y SHA-256), lo
+  registra en ArchivoAuditoria y retira la partición (DETACH + DROP).
+- leer_archivo() verifica el checksum y recorre un mes archivado, filtrado
+  por negocio.
+
+Las consultas con rango de fecha (AuditLogViewSet) solo leen las particiones
+de ese rango.
+
+Uso:
+    crear_particiones()                     # tarea diaria mantener_particiones_auditoria
+    archivar_particiones(retencion_meses=24)
+    archivo = ArchivoAuditoria.objects.get(mes=date(2024, 1, 1))
+    for fila in leer_archivo(archivo, negocio_id=negocio.id):
+        ...
+"""
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.security.backup_manager import compute_file_sha256
+
+logger = logging.getLogger('audit')
+
+TABLA = 'api_auditlog'
+DEFAULT = f'{TABLA}_default'
+PATRON = re.compile(rf'^{TABLA}_p(\d{{4}})(\d{{2}})$')
+TAMANO_BLOQUE = 5000
+
+
+def siguiente_mes(mes):
+    return date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+def _limite(mes):
+    return datetime(mes.year, mes.month, 1, tzinfo=dt_timezone.utc)
+
+
+def nombre_particion(mes):
+    return f'{TABLA}_p{mes:%Y%m}'
+
+
+def particiones():
+    """Meses (primer día) con partición adjunta, en orden."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [TABLA],
+        )
+        nombres = [fila[0] for fila in cursor.fetchall()]
+    meses = []
+    for nombre in nombres:
+        coincide = PATRON.match(nombre)
+        if coincide:
+            meses.append(date(int(coincide.group(1)), int(coincide.group(2)), 1))
+    return sorted(meses)
+
+
+def crear_particiones(meses_adelante=None, desde=None):
+    """
+    Crea las particiones que falten desde ``desde`` (por defecto el mes en
+    curso) hasta ``meses_adelante`` meses después del actual. Devuelve los
+    meses creados.
+    """
+    if meses_adelante is None:
+        meses_adelante = settings.AUDITORIA_PARTICIONES_ADELANTE
+    actual = timezone.now().astimezone(dt_timezone.utc).date().replace(day=1)
+    mes = (desde or actual).replace(day=1)
+    ultimo = actual
+    for _ in range(meses_adelante):
+        ultimo = siguiente_mes(ultimo)
+
+    existentes = set(particiones())
+    creados = []
+    while mes <= ultimo:
+        if mes not in existentes:
+            _crear_particion(mes)
+            creados.append(mes)
+        mes = siguiente_mes(mes)
+    if creados:
+        logger.info('Particiones de auditoría creadas: %s', ', '.join(f'{m:%Y-%m}' for m in creados))
+    return creados
+
+
+@transaction.atomic
+def _crear_particion(mes):
+    nombre = nombre_particion(mes)
+    desde, hasta = _limite(mes), _limite(siguiente_mes(mes))
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {nombre} (LIKE {TABLA} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        # Lo que haya caído en la DEFAULT para este mes se muda antes de adjuntar
+        cursor.execute(
+            f'WITH movidas AS (DELETE FROM {DEFAULT} WHERE fecha >= %s AND fecha < %s RETURNING *) '
+            f'INSERT INTO {nombre} SELECT * FROM movidas',
+            [desde, hasta],
+        )
+        cursor.execute(
+            f'ALTER TABLE {TABLA} ATTACH PARTITION {nombre} FOR VALUES FROM (%s) TO (%s)',
+            [desde, hasta],
+        )
+
+
+def archivar_particiones(retencion_meses=None, directorio=None):
+    """
+    Archiva y retira las particiones de los meses anteriores a los últimos
+    ``retencion_meses``. Devuelve los ArchivoAuditoria creados.
+    """
+    if retencion_meses is None:
+        retencion_meses = settings.AUDITORIA_RETENCION_MESES
+    directorio = directorio or settings.AUDITORIA_ARCHIVO_DIR
+    corte = timezone.now().astimezone(dt_timezone.utc).date().replace(day=1)
+    for _ in range(retencion_meses):
+        corte = date(corte.year - (corte.month == 1), (corte.month - 2) % 12 + 1, 1)
+
+    archivados = []
+    for mes in particiones():
+        if mes >= corte:
+            break
+        archivados.append(archivar_mes(mes, directorio))
+    return archivados
+
+
+@transaction.atomic
+def archivar_mes(mes, directorio):
+    """Exporta, verifica y retira la partición de un mes."""
+    from api.models import ArchivoAuditoria
+
+    nombre = nombre_particion(mes)
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f'auditlog_{mes:%Y_%m}.jsonl.gz')
+    temporal = f'{ruta}.tmp'
+
+    with connection.cursor() as cursor:
+        # Nadie escribe en el mes mientras se exporta
+        cursor.execute(f'LOCK TABLE {nombre} IN SHARE MODE')
+        cursor.execute(f'SELECT * FROM {nombre} ORDER BY fecha, id')
+        columnas = [col[0] for col in cursor.description]
+        registros = 0
+        with gzip.open(temporal, 'wt', encoding='utf-8') as salida:
+            while True:
+                filas = cursor.fetchmany(TAMANO_BLOQUE)
+                if not filas:
+                    break
+                for fila in filas:
+                    salida.write(json.dumps(dict(zip(columnas, fila)), cls=DjangoJSONEncoder) + '\n')
+                registros += len(filas)
+
+        with gzip.open(temporal, 'rt', encoding='utf-8') as entrada:
+            leidos = sum(1 for _ in entrada)
+        if leidos != registros:
+            os.remove(temporal)
+            raise ValueError(f'El archivo de {mes:%Y-%m} tiene {leidos} filas de {registros}')
+        os.replace(temporal, ruta)
+
+        archivo = ArchivoAuditoria.objects.create(
+            mes=mes, archivo=ruta, registros=registros,
+            tamano_bytes=os.path.getsize(ruta), checksum_sha256=compute_file_sha256(ruta),
+        )
+        # Las FK de Django son diferidas: sin esto, filas de la misma transacción impiden el DROP
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(f'ALTER TABLE {TABLA} DETACH PARTITION {nombre}')
+        cursor.execute(f'DROP TABLE {nombre}')
+
+    logger.info('AuditLog %s archivado en %s (%d registros)', f'{mes:%Y-%m}', ruta, registros)
+    return archivo
+
+
+def leer_archivo(archivo, negocio_id=None):
+    """
+    Filas (dict) de un ArchivoAuditoria, opcionalmente de un solo negocio.
+    Lanza ValueError si el archivo no coincide con su checksum.
+    """
+    if compute_file_sha256(archivo.archivo) != archivo.checksum_sha256:
+        raise ValueError(f'El archivo de auditoría {archivo.mes:%Y-%m} no coincide con su checksum.')
+    negocio_id = str(negocio_id) if negocio_id is not None else None
+    with gzip.open(archivo.archivo, 'rt', encoding='utf-8') as entrada:
+        for linea in entrada:
+            fila = json.loads(linea)
+            if negocio_id is None or fila['negocio_id'] == negocio_id:
+                yield fila
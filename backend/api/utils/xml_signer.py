@@ -1,76 +1,279 @@
+import base64
+import hashlib
+import logging
+import multiprocessing
 import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
 from lxml import etree
-from signxml import XMLSigner, XMLVerifier
+from cryptography import x509
+from signxml import XMLSigner, XMLVerifier, SignatureConstructionMethod
 from cryptography.hazmat.primitives.serialization import pkcs12
-from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.backends import default_backend
 
-def sign_ecf_xml(xml_content: bytes, p12_path: str, p12_password: str) -> str:
+from .cert_validator import certificate_status
+
+logger = logging.getLogger('security')
+
+
+@dataclass(frozen=True)
+class SigningMaterial:
+    """Clave privada y certificado ya descifrados de un .p12, con su ventana de validez."""
+    private_key: object
+    cert: object
+    not_before: datetime
+    not_after: datetime
+    mtime_ns: int
+    password_digest: str
+
+    @property
+    def is_valid(self) -> bool:
+        now = datetime.now(timezone.utc)
+        return self.not_before <= now <= self.not_after
+
+    def status(self) -> dict:
+        """Mismo formato que validate_p12_certificate, sin volver a descifrar el .p12."""
+        return certificate_status(self.cert)
+
+
+class SignerCache:
+    """
+    Cache de proceso de material de firma por tenant.
+
+    Descifrar un PKCS#12 es lento a propósito, así que cada worker lo hace una
+    sola vez por (ruta, mtime, tenant). Si el archivo cambia en disco (renovación
+    del certificado) el mtime ya no coincide y la entrada se recarga. La
+    contraseña no se guarda: solo su digest, para no servir la clave a quien
+    presente una contraseña distinta.
+    """
+    _entries: Dict[Tuple[str, Optional[str]], SigningMaterial] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _digest(password) -> str:
+        if isinstance(password, str):
+            password = password.encode()
+        return hashlib.sha256(password or b'').hexdigest()
+
+    @classmethod
+    def get(cls, p12_path: str, p12_password, tenant=None) -> SigningMaterial:
+        """
+        Retorna el material de firma, cargándolo del .p12 si no está en cache.
+
+        Raises:
+            FileNotFoundError: si el .p12 no existe.
+            ValueError: contraseña incorrecta, .p12 corrupto o sin certificado.
+        """
+        path = os.path.realpath(p12_path)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            raise FileNotFoundError(f"El certificado no existe en: {p12_path}")
+
+        key = (path, str(tenant) if tenant is not None else None)
+        digest = cls._digest(p12_password)
+
+        material = cls._entries.get(key)
+        if material and material.mtime_ns == mtime_ns and material.password_digest == digest:
+            return material
+
+        with cls._lock:
+            material = cls._entries.get(key)
+            if material and material.mtime_ns == mtime_ns and material.password_digest == digest:
+                return material
+            material = cls._load(path, p12_password, mtime_ns, digest)
+            cls._entries[key] = material
+            logger.info('Certificado de firma cargado: %s (tenant: %s)', path, tenant)
+        return material
+
+    @staticmethod
+    def _load(path, p12_password, mtime_ns, digest) -> SigningMaterial:
+        with open(path, 'rb') as f:
+            p12_data = f.read()
+
+        private_key, cert, _chain = pkcs12.load_key_and_certificates(
+            p12_data,
+            p12_password.encode() if isinstance(p12_password, str) else p12_password,
+            backend=default_backend(),
+        )
+        if private_key is None or cert is None:
+            raise ValueError('El archivo .p12 no contiene clave privada y certificado.')
+
+        return SigningMaterial(
+            private_key=private_key,
+            cert=cert,
+            not_before=cert.not_valid_before_utc,
+            not_after=cert.not_valid_after_utc,
+            mtime_ns=mtime_ns,
+            password_digest=digest,
+        )
+
+    @classmethod
+    def invalidate(cls, p12_path: Optional[str] = None, tenant=None):
+        """Descarta entradas por ruta y/o tenant. Sin argumentos vacía la cache."""
+        path = os.path.realpath(p12_path) if p12_path else None
+        tenant = str(tenant) if tenant is not None else None
+        with cls._lock:
+            for key in list(cls._entries):
+                if (path is None or key[0] == path) and (tenant is None or key[1] == tenant):
+                    del cls._entries[key]
+
+    @classmethod
+    def size(cls) -> int:
+        return len(cls._entries)
+
+
+def sign_ecf_xml(xml_content, p12_path: str, p12_password: str, tenant=None) -> str:
     """
     Firma un XML (e-CF) usando un certificado .p12 bajo el estándar XMLDSig.
     Cumple con los requisitos de la DGII (República Dominicana).
     Valida el certificado antes de firmar.
 
     Args:
-        xml_content (bytes): Contenido del XML a firmar.
+        xml_content (bytes | etree._Element): XML a firmar, o el árbol ya
+            construido (PlantillaECF) para evitar serializar y volver a parsear.
         p12_path (str): Ruta al archivo .p12.
         p12_password (str): Contraseña del archivo .p12.
+        tenant: Identificador del negocio dueño del certificado (clave de cache).
 
     Returns:
         str: XML firmado en formato string.
     """
 
-    if not os.path.exists(p12_path):
-        raise FileNotFoundError(f"El certificado no existe en: {p12_path}")
-
-    # Validate certificate before signing
-    from .cert_validator import validate_p12_certificate
-    cert_status = validate_p12_certificate(p12_path, p12_password)
-    if not cert_status['valid']:
-        raise ValueError(f"Certificado inválido: {cert_status['error']}")
+    # 1. Clave y certificado desde la cache del proceso (un solo descifrado del .p12)
+    material = SignerCache.get(p12_path, p12_password, tenant=tenant)
+    if not material.is_valid:
+        raise ValueError(f"Certificado inválido: {material.status()['error']}")
 
-    # 1. Cargar el .p12
-    with open(p12_path, "rb") as f:
-        p12_data = f.read()
+    # 2. Parsear XML
+    if isinstance(xml_content, etree._Element):
+        root = xml_content
+    else:
+        root = etree.fromstring(xml_content)
 
-    p12 = pkcs12.load_key_and_certificates(
-        p12_data,
-        p12_password.encode(),
-        backend=default_backend()
-    )
-    
-    private_key = p12[0]
-    cert = p12[1]
-    
-    # 2. Preparar Key y Cert para signxml
-    # signxml espera la clave en formato PEM y el certificado en PEM
-    key_pem = private_key.private_bytes(
-        encoding=serialization.Encoding.PEM,
-        format=serialization.PrivateFormat.PKCS8,
-        encryption_algorithm=serialization.NoEncryption()
-    )
-    
-    cert_pem = cert.public_bytes(serialization.Encoding.PEM)
-    
-    # 3. Parsear XML
-    root = etree.fromstring(xml_content)
-    
-    # 4. Firmar
+    # 3. Firmar
     # La DGII requiere:
     # - Method: http://www.w3.org/2000/09/xmldsig#rsa-sha1 (o sha256 según norma actual)
     # - Canonicalization: http://www.w3.org/TR/2001/REC-xml-c14n-20010315
     signer = XMLSigner(
-        method=XMLSigner.SignatureMethods.RSA_SHA256,
+        method=SignatureConstructionMethod.enveloped,
         signature_algorithm="rsa-sha256",
         digest_algorithm="sha256",
         c14n_algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
     )
-    
+
     signed_root = signer.sign(
         root,
-        key=key_pem,
-        cert=cert_pem,
+        key=material.private_key,
+        cert=[material.cert],
         always_add_key_value=True # Incluir KeyValue
     )
-    
+
     return etree.tostring(signed_root, encoding="UTF-8", xml_declaration=True).decode("utf-8")
+
+
+DS_NS = 'http://www.w3.org/2000/09/xmldsig#'
+DS_X509_CERTIFICATE = f'{{{DS_NS}}}X509Certificate'
+DS_REFERENCE = f'{{{DS_NS}}}SignedInfo/{{{DS_NS}}}Reference'
+
+
+def verify_ecf_xml(xml_content, ca_pem_file):
+    """
+    Verifica la firma XMLDSig de un e-CF recibido de un proveedor.
+
+    La firma debe ser enveloped (hija directa de la raíz), con una sola
+    referencia a todo el documento (URI=""), y el certificado que la trae en
+    KeyInfo debe encadenar con la CA de las entidades de certificación
+    autorizadas (ca_pem_file). Sin CA no se verifica nada: un certificado
+    autofirmado no prueba quién emitió el documento.
+
+    Returns:
+        (certificado firmante, raíz del XML firmado sin la firma). Los datos
+        del e-CF se deben leer de esta raíz y no del XML recibido.
+
+    Raises:
+        ValueError si no hay CA, si el XML no trae certificado o la referencia
+        no cubre el documento completo; signxml.exceptions.InvalidInput (o sus
+        subclases) si la firma o la cadena no son válidas.
+    """
+    from signxml.verifier import SignatureConfiguration
+
+    if not ca_pem_file:
+        raise ValueError('No hay CA configurada para verificar e-CF recibidos.')
+    if isinstance(xml_content, etree._Element):
+        root = xml_content
+    else:
+        root = etree.fromstring(xml_content, parser=etree.XMLParser(resolve_entities=False, no_network=True))
+    config = SignatureConfiguration(location='./', expect_references=1, ignore_ambiguous_key_info=True)
+    resultado = XMLVerifier().verify(root, ca_pem_file=ca_pem_file, expect_config=config)
+
+    referencia = resultado.signature_xml.find(DS_REFERENCE)
+    if referencia is None or referencia.get('URI') != '':
+        raise ValueError('La firma del e-CF no cubre el documento completo (Reference URI="").')
+    der = resultado.signature_xml.findtext('.//' + DS_X509_CERTIFICATE)
+    if not der:
+        raise ValueError('El e-CF no incluye el certificado del firmante (X509Certificate).')
+    cert = x509.load_der_x509_certificate(base64.b64decode(der))
+    return cert, resultado.signed_xml
+
+
+def rnc_en_certificado(cert, rnc) -> bool:
+    """Si el sujeto del certificado (serialNumber, CN, ...) contiene el RNC/cédula dado."""
+    rnc = re.sub(r'\D', '', rnc or '')
+    if not rnc:
+        return False
+    return any(rnc in re.findall(r'\d+', str(atributo.value)) for atributo in cert.subject)
+
+
+def _sign_document(args):
+    """Worker del pool: firma un documento y nunca propaga la excepción."""
+    clave, xml_content, p12_path, p12_password, tenant = args
+    try:
+        return clave, sign_ecf_xml(xml_content, p12_path, p12_password, tenant=tenant), None
+    except Exception as e:
+        return clave, None, str(e)
+
+
+def signing_pool(procesos=None) -> Optional[ProcessPoolExecutor]:
+    """
+    Pool de procesos para firmar lotes (la firma RSA es CPU-bound).
+
+    Usa 'forkserver' para que los hijos no hereden conexiones de base de datos
+    ni sockets del proceso padre; cada hijo carga el .p12 una vez en su propia
+    SignerCache. Retorna None cuando no conviene o no se puede crear procesos
+    (un solo núcleo, o dentro de un worker daemon de Celery prefork).
+    """
+    procesos = procesos or os.cpu_count() or 1
+    if procesos <= 1 or multiprocessing.current_process().daemon:
+        return None
+    return ProcessPoolExecutor(
+        max_workers=procesos,
+        mp_context=multiprocessing.get_context('forkserver'),
+    )
+
+
+def sign_ecf_batch(documentos, p12_path: str, p12_password: str, tenant=None, pool=None) -> list:
+    """
+    Firma varios e-CF, en paralelo si se pasa un pool de signing_pool().
+
+    Args:
+        documentos: iterable de (clave, xml_bytes o árbol lxml).
+
+    Returns:
+        list de (clave, xml_firmado, error) en el mismo orden; error es None si firmó.
+    """
+    args = [(clave, xml, p12_path, p12_password, tenant) for clave, xml in documentos]
+    if pool is None or len(args) < 2:
+        return [_sign_document(a) for a in args]
+    # Los árboles lxml no se pueden enviar a otro proceso: se serializan (sin pretty print).
+    args = [
+        (clave, etree.tostring(xml) if isinstance(xml, etree._Element) else xml, *resto)
+        for clave, xml, *resto in args
+    ]
+    chunksize = max(1, len(args) // ((os.cpu_count() or 1) * 4))
+    return list(pool.map(_sign_document, args, chunksize=chunksize))
@@ -14,17 +14,17 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.conf import settings
-from django.db import transaction
+from django.db import DatabaseError, transaction
 from django.db.models import Sum, Count, Q, F
 from django.utils import timezone
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 
 from .models import (
     Pais, Moneda, Impuesto, Negocio, Sucursal, Usuario, AuditLog,
     CuentaContable, PeriodoContable, AsientoContable, LineaAsiento,
     Categoria, Producto, Almacen,
     Cliente, Proveedor, SecuenciaNCF, Venta, DetalleVenta, CuadreCaja, AnalisisAI,
-    FacturaElectronica, Compra, DetalleCompra,
+    Compra, DetalleCompra,
     CuentaBancaria, MovimientoBancario, Conciliacion,
     Cotizacion, OrdenCompra,
     CuentaPorCobrar, CuentaPorPagar, Pago,
@@ -35,7 +35,7 @@ from .models import (
     CategoriaActivo, ActivoFijo, DepreciacionMensual, BajaActivo,
     WorkflowConfig, WorkflowStep, SolicitudAprobacion, DecisionAprobacion,
     Presupuesto, LineaPresupuesto,
-    ArchivoImportacionBancaria, TransaccionBancaria,
+    ArchivoImportacionBancaria, TransaccionBancaria, SugerenciaCobro, ArchivoAuditoria,
 )
 from .serializers import (
     PaisSerializer, MonedaSerializer, ImpuestoSerializer, NegocioSerializer, SucursalSerializer,
@@ -52,14 +52,14 @@ from .serializers import (
     ChangePasswordSerializer, Setup2FASerializer, Verify2FASerializer, MFALoginSerializer,
     SesionActivaSerializer, ApiKeyCreateSerializer, ApiKeySerializer,
     IPBloqueadaSerializer, AlertaSeguridadSerializer,
-    ConfirmacionTransaccionSerializer, AuditLogSerializer,
+    ConfirmacionTransaccionSerializer, AuditLogSerializer, ArchivoAuditoriaSerializer,
     LicenciaSistemaSerializer, BackupRegistroSerializer,
     CategoriaActivoSerializer, ActivoFijoSerializer, ActivoFijoListSerializer,
     DepreciacionMensualSerializer, BajaActivoSerializer,
     WorkflowConfigSerializer, WorkflowStepSerializer,
     SolicitudAprobacionSerializer, DecisionAprobacionSerializer,
     PresupuestoSerializer, LineaPresupuestoSerializer,
-    ArchivoImportacionBancariaSerializer, TransaccionBancariaSerializer,
+    ArchivoImportacionBancariaSerializer, TransaccionBancariaSerializer, SugerenciaCobroSerializer,
 )
 from .permissions import (
     IsNegocioMember, CanEmitECF, CanViewReports,
@@ -70,12 +70,11 @@ from .permissions import (
     CanManageApiKeys, CanViewAuditLogs, CanManageSecurity,
     RequiresDifferentApprover,
 )
-from .utils.ecf_generator import ECFGenerator
-from .utils.xml_signer import sign_ecf_xml
+from .utils.xml_signer import SignerCache
 from .utils.cert_validator import validate_p12_certificate
-from .utils.ncf_manager import obtener_siguiente_ncf
-from .utils.dgii_api import DGIIClient
-from .fiscal.strategies.dgii import FiscalStrategyFactory
+from .utils.ncf_manager import AsignadorNCF
+from .utils.auditoria import registrar_auditoria
+from .fiscal.registry import FiscalStrategyFactory
 
 logger = logging.getLogger('security')
 
@@ -236,9 +235,9 @@ class CustomLoginView(TokenObtainPairView):
                 user.save(update_fields=update_fields)
 
                 if user.negocio:
-                    AuditLog.objects.create(
-                        negocio=user.negocio,
-                        usuario=user,
+                    registrar_auditoria(
+                        negocio_id=user.negocio_id,
+                        usuario_id=user.id,
                         accion='LOGIN_FALLIDO',
                         modelo='Usuario',
                         objeto_id=str(user.id),
@@ -302,9 +301,9 @@ class CustomLoginView(TokenObtainPairView):
                 self._check_new_ip(user, client_ip, request)
 
                 if user.negocio:
-                    AuditLog.objects.create(
-                        negocio=user.negocio,
-                        usuario=user,
+                    registrar_auditoria(
+                        negocio_id=user.negocio_id,
+                        usuario_id=user.id,
                         accion='LOGIN',
                         modelo='Usuario',
                         objeto_id=str(user.id),
@@ -455,9 +454,9 @@ class MFAVerifyView(APIView):
             pass
 
         if user.negocio:
-            AuditLog.objects.create(
-                negocio=user.negocio,
-                usuario=user,
+            registrar_auditoria(
+                negocio_id=user.negocio_id,
+                usuario_id=user.id,
                 accion='MFA_VERIFY',
                 modelo='Usuario',
                 objeto_id=str(user.id),
@@ -554,9 +553,9 @@ class LogoutView(APIView):
                 pass
 
         if request.user.negocio:
-            AuditLog.objects.create(
-                negocio=request.user.negocio,
-                usuario=request.user,
+            registrar_auditoria(
+                negocio_id=request.user.negocio_id,
+                usuario_id=request.user.id,
                 accion='LOGOUT',
                 modelo='Usuario',
                 objeto_id=str(request.user.id),
@@ -578,9 +577,9 @@ class LogoutAllView(APIView):
         count = invalidate_all_sessions(request.user)
 
         if request.user.negocio:
-            AuditLog.objects.create(
-                negocio=request.user.negocio,
-                usuario=request.user,
+            registrar_auditoria(
+                negocio_id=request.user.negocio_id,
+                usuario_id=request.user.id,
                 accion='SESSION_INVALIDATE',
                 modelo='Usuario',
                 objeto_id=str(request.user.id),
@@ -619,9 +618,9 @@ class ChangePasswordView(APIView):
         invalidate_all_sessions(user)
 
         if user.negocio:
-            AuditLog.objects.create(
-                negocio=user.negocio,
-                usuario=user,
+            registrar_auditoria(
+                negocio_id=user.negocio_id,
+                usuario_id=user.id,
                 accion='PASSWORD_CHANGE',
                 modelo='Usuario',
                 objeto_id=str(user.id),
@@ -649,9 +648,9 @@ class Setup2FAView(APIView):
         result = setup_2fa(request.user)
 
         if request.user.negocio:
-            AuditLog.objects.create(
-                negocio=request.user.negocio,
-                usuario=request.user,
+            registrar_auditoria(
+                negocio_id=request.user.negocio_id,
+                usuario_id=request.user.id,
                 accion='MFA_SETUP',
                 modelo='Usuario',
                 objeto_id=str(request.user.id),
@@ -677,9 +676,9 @@ class Confirm2FAView(APIView):
         from api.security.totp import confirm_2fa
         if confirm_2fa(request.user, token):
             if request.user.negocio:
-                AuditLog.objects.create(
-                    negocio=request.user.negocio,
-                    usuario=request.user,
+                registrar_auditoria(
+                    negocio_id=request.user.negocio_id,
+                    usuario_id=request.user.id,
                     accion='MFA_SETUP',
                     modelo='Usuario',
                     objeto_id=str(request.user.id),
@@ -725,9 +724,9 @@ class Disable2FAView(APIView):
         disable_2fa(request.user)
 
         if request.user.negocio:
-            AuditLog.objects.create(
-                negocio=request.user.negocio,
-                usuario=request.user,
+            registrar_auditoria(
+                negocio_id=request.user.negocio_id,
+                usuario_id=request.user.id,
                 accion='MFA_SETUP',
                 modelo='Usuario',
                 objeto_id=str(request.user.id),
@@ -864,9 +863,9 @@ class ApiKeyViewSet(viewsets.ModelViewSet):
         )
 
         if request.user.negocio:
-            AuditLog.objects.create(
-                negocio=request.user.negocio,
-                usuario=request.user,
+            registrar_auditoria(
+                negocio_id=request.user.negocio_id,
+                usuario_id=request.user.id,
                 accion='API_KEY_CREATE',
                 modelo='ApiKey',
                 objeto_id=str(api_key.id),
@@ -905,7 +904,13 @@ class AlertaSeguridadViewSet(viewsets.ModelViewSet):
 
 
 class AuditLogViewSet(viewsets.ReadOnlyModelViewSet):
-    """Audit log viewer (read-only, immutable)."""
+    """
+    Audit log viewer (read-only, immutable).
+
+    AuditLog is partitioned by month: without fecha_desde the list covers the
+    last AUDITORIA_VENTANA_DIAS days, so the query (and its count) only scans
+    those partitions. Months past retention are read with ``archivo``.
+    """
     serializer_class = AuditLogSerializer
     permission_classes = [IsAuthenticated, CanViewAuditLogs]
 
@@ -924,10 +929,66 @@ class AuditLogViewSet(viewsets.ReadOnlyModelViewSet):
             qs = qs.filter(modelo__icontains=modelo)
         if fecha_desde:
             qs = qs.filter(fecha__gte=fecha_desde)
+        elif self.action == 'list':
+            qs = qs.filter(fecha__gte=timezone.now() - timedelta(days=settings.AUDITORIA_VENTANA_DIAS))
         if fecha_hasta:
             qs = qs.filter(fecha__lte=fecha_hasta)
         return qs
 
+    @action(detail=False, methods=['get'])
+    def archivados(self, request):
+        """Months already moved out of the table into archive files."""
+        return Response(ArchivoAuditoriaSerializer(ArchivoAuditoria.objects.all(), many=True).data)
+
+    @action(detail=False, methods=['get'])
+    def archivo(self, request):
+        """
+        Archived month (?mes=AAAA-MM) as JSON lines, streamed, only for the
+        user's business. Accepts the accion/usuario/modelo filters.
+        """
+        import json
+        from datetime import datetime
+        from itertools import chain
+        from .utils.particiones_auditoria import leer_archivo
+
+        try:
+            mes = datetime.strptime(request.query_params.get('mes', ''), '%Y-%m').date()
+        except ValueError:
+            raise ValidationError('mes debe tener el formato AAAA-MM.')
+        archivo = ArchivoAuditoria.objects.filter(mes=mes).first()
+        if archivo is None:
+            return Response({'error': f'El mes {mes:%Y-%m} no está archivado.'}, status=status.HTTP_404_NOT_FOUND)
+
+        negocio = request.user.negocio
+        filas = leer_archivo(archivo, negocio_id=negocio.id)
+        try:
+            primera = next(filas, None)  # checksum is verified before the response starts
+        except (ValueError, OSError) as e:
+            logger.error('Archivo de auditoría %s ilegible: %s', archivo.archivo, e)
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+
+        accion = request.query_params.get('accion')
+        usuario_id = request.query_params.get('usuario')
+        modelo = (request.query_params.get('modelo') or '').lower()
+
+        def lineas():
+            for fila in chain([primera] if primera else [], filas):
+                if accion and fila['accion'] != accion:
+                    continue
+                if usuario_id and str(fila['usuario_id']) != usuario_id:
+                    continue
+                if modelo and modelo not in fila['modelo'].lower():
+                    continue
+                yield json.dumps(fila, ensure_ascii=False) + '\n'
+
+        registrar_auditoria(
+            negocio_id=negocio.id, usuario_id=request.user.id, accion='EXPORT',
+            modelo='AuditLog', objeto_id='', descripcion=f'Lectura del archivo de auditoría {mes:%Y-%m}',
+        )
+        response = StreamingHttpResponse(lineas(), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="auditoria_{mes:%Y_%m}.jsonl"'
+        return response
+
 
 class ConfirmacionTransaccionViewSet(viewsets.ModelViewSet):
     """Double confirmation for high-value transactions."""
@@ -1229,6 +1290,7 @@ class ProveedorViewSet(viewsets.ModelViewSet):
 class VentaViewSet(viewsets.ModelViewSet):
     serializer_class = VentaSerializer
     permission_classes = [IsAuthenticated]
+    MAX_REPRESENTACION_IMPRESA = 5000
 
     def get_queryset(self):
         user = self.request.user
@@ -1277,8 +1339,18 @@ class VentaViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'], url_path='emitir-ecf')
     def emitir_ecf(self, request, pk=None):
-        """Generate, sign, and submit an e-CF to DGII."""
+        """
+        Assign the NCF and queue signing + DGII submission of an e-CF.
+
+        Returns 202 with a job id right after the NCF commit; the worker
+        (enviar_ecf_async) pushes the result to the user's WebSocket group
+        as an 'ecf_emision' event.
+        """
         import random
+        from django.core.cache import cache
+        from .tasks import enviar_ecf_async
+        from .utils.ecf_lote import clave_emision, es_reclamo_de_lote, liberar_emision, reclamar_emision
+        from .utils.notificaciones import notificar_usuario
 
         venta = self.get_object()
 
@@ -1293,9 +1365,22 @@ class VentaViewSet(viewsets.ModelViewSet):
         if venta.estado != 'COMPLETADA':
             raise ValidationError('Solo se pueden emitir facturas de ventas completadas.')
 
-        if hasattr(venta, 'ecf_data') and venta.ecf_data.xml_firmado:
+        if hasattr(venta, 'ecf_data') and venta.ecf_data.documento_id:
             raise ValidationError('Esta venta ya tiene un e-CF generado.')
 
+        # A job for this sale is already queued (double click / retry): same answer.
+        # A batch or the contingency queue holding it sends no 'ecf_emision' event.
+        job_id = cache.get(clave_emision(venta.id))
+        if job_id and (es_reclamo_de_lote(job_id) or venta.estado_fiscal != 'PENDIENTE'):
+            return Response(
+                {'error': 'La venta se está emitiendo en otro proceso.'}, status=status.HTTP_409_CONFLICT,
+            )
+        if job_id:
+            return Response({
+                'status': 'accepted', 'job_id': job_id, 'ncf': venta.ncf,
+                'estado_fiscal': venta.estado_fiscal,
+            }, status=status.HTTP_202_ACCEPTED)
+
         # --- Certificate validation ---
         negocio = venta.negocio
         p12_path = negocio.certificado_digital_path
@@ -1310,102 +1395,225 @@ class VentaViewSet(viewsets.ModelViewSet):
                 'Archivo de certificado digital no encontrado. Verifique la configuracion.'
             )
 
-        # Validate certificate before signing
-        cert_status = validate_p12_certificate(p12_path, p12_pass)
-        if not cert_status['valid']:
-            raise ValidationError(f'Certificado digital inválido: {cert_status["error"]}')
+        # Validate certificate (cached per process; the worker reuses its own cache)
+        try:
+            material = SignerCache.get(p12_path, p12_pass, tenant=negocio.id)
+        except ValueError as e:
+            raise ValidationError(f'Certificado digital inválido: Contraseña incorrecta o certificado corrupto: {e}')
+        if not material.is_valid:
+            raise ValidationError(f'Certificado digital inválido: {material.status()["error"]}')
+
+        # Claim the sale (shared with batch emission and the contingency queue)
+        job_id = uuid.uuid4().hex
+        if not reclamar_emision(venta.id, job_id):
+            return Response(
+                {'error': 'La venta se está emitiendo en otro proceso.'}, status=status.HTTP_409_CONFLICT,
+            )
+        def encolar():
+            try:
+                enviar_ecf_async.apply_async(
+                    args=[str(venta.id)],
+                    kwargs={'usuario_id': request.user.id, 'job_id': job_id},
+                    task_id=job_id,
+                )
+            except Exception as e:
+                # Broker unreachable: the NCF is committed, the contingency queue sends it
+                logger.error('e-CF job not queued for venta %s: %s', venta.numero, e)
+                liberar_emision(venta.id, job_id)
+                Venta.objects.filter(id=venta.id).update(estado_fiscal='EN_CONTINGENCIA')
+                notificar_usuario(request.user.id, 'ecf_emision', {
+                    'job_id': job_id, 'venta_id': str(venta.id),
+                    'estado_fiscal': 'EN_CONTINGENCIA', 'error': str(e),
+                })
 
         try:
+            # NCF from the sucursal's block; a new block (the only step that locks
+            # the SecuenciaNCF row) is reserved before the sale's transaction.
+            asignador = AsignadorNCF(negocio, sucursal=venta.sucursal)
+            tipo = venta.tipo_comprobante or 'B02'
+            if not venta.ncf:
+                asignador.asegurar_bloque(tipo)
             with transaction.atomic():
-                # 0. Auto-assign NCF if not present
                 if not venta.ncf:
-                    tipo = venta.tipo_comprobante or 'B02'
-                    venta.ncf = obtener_siguiente_ncf(negocio, tipo)
+                    venta.ncf = asignador.siguiente(tipo)
                     venta.tipo_comprobante = tipo
 
                 # Generate security code (6 random digits)
-                codigo_seguridad = f"{random.randint(0, 999999):06d}"
-                venta.codigo_seguridad_dgii = codigo_seguridad
-                venta.save(update_fields=['ncf', 'tipo_comprobante', 'codigo_seguridad_dgii'])
-
-                # Determine e-CF type
-                tipo_ecf_map = {
-                    'B01': '31', 'B02': '32', 'B03': '33', 'B04': '34',
-                    'B11': '41', 'B13': '43', 'B14': '44', 'B15': '45',
+                if not venta.codigo_seguridad_dgii:
+                    venta.codigo_seguridad_dgii = f"{random.randint(0, 999999):06d}"
+                venta.estado_fiscal = 'PENDIENTE'
+                venta.save(update_fields=[
+                    'ncf', 'tipo_comprobante', 'codigo_seguridad_dgii', 'estado_fiscal',
+                ])
+                transaction.on_commit(encolar)
+        except ValueError as e:
+            liberar_emision(venta.id, job_id)
+            raise ValidationError(str(e))
+
+        logger.info(
+            'e-CF queued: venta=%s ncf=%s job=%s user=%s',
+            venta.numero, venta.ncf, job_id, request.user.username,
+        )
+        return Response({
+            'status': 'accepted',
+            'job_id': job_id,
+            'ncf': venta.ncf,
+            'codigo_seguridad': venta.codigo_seguridad_dgii,
+            'estado_fiscal': venta.estado_fiscal,
+        }, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['post'], url_path='emitir-ecf-lote')
+    def emitir_ecf_lote(self, request):
+        """Encola la emisión en lote de los e-CF pendientes. El progreso llega por WebSocket."""
+        if request.user.rol not in ('SUPER_ADMIN', 'ADMIN_NEGOCIO', 'CONTADOR', 'GERENTE'):
+            raise PermissionDenied('No tiene permisos para emitir facturas electronicas.')
+
+        negocio = request.user.negocio
+        if not negocio.certificado_digital_path or not negocio.certificado_pass_env:
+            raise ValidationError('Certificado digital no configurado en el Negocio.')
+
+        venta_ids = request.data.get('venta_ids') or None
+        if venta_ids is not None and not isinstance(venta_ids, list):
+            raise ValidationError('venta_ids debe ser una lista.')
+        limite = request.data.get('limite')
+        try:
+            limite = int(limite) if limite else None
+        except (TypeError, ValueError):
+            raise ValidationError('limite debe ser un entero.')
+
+        from .utils.ecf_lote import EmisorLoteECF
+        from .tasks import emitir_ecf_lote_async
+
+        emisor = EmisorLoteECF(negocio, usuario=request.user)
+        pendientes = len(emisor.ventas_pendientes(venta_ids=venta_ids, limite=limite))
+        if not pendientes:
+            raise ValidationError('No hay ventas pendientes de emisión.')
+
+        task = emitir_ecf_lote_async.delay(
+            str(negocio.id), usuario_id=request.user.id,
+            venta_ids=[str(v) for v in venta_ids] if venta_ids else None,
+            limite=limite, lote_id=emisor.lote_id,
+        )
+        registrar_auditoria(
+            negocio_id=negocio.id, usuario_id=request.user.id, accion='CREATE',
+            modelo='FacturaElectronica', objeto_id=emisor.lote_id,
+            descripcion=f'Emisión e-CF en lote encolada: {pendientes} ventas',
+        )
+        return Response({
+            'lote_id': emisor.lote_id,
+            'task_id': task.id,
+            'pendientes': pendientes,
+        }, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], url_path='contingencia')
+    def contingencia(self, request):
+        """Métricas de la cola de contingencia e-CF y facturas descartadas (dead letter)."""
+        from .models import ContingenciaECF
+        from .utils.ecf_contingencia import ColaContingenciaECF
+
+        negocio = request.user.negocio
+        descartadas = (
+            ContingenciaECF.objects.filter(negocio=negocio, estado='DEAD_LETTER')
+            .order_by('fecha_venta')
+            .values('venta_id', 'venta__numero', 'venta__ncf', 'intentos', 'ultimo_error', 'fecha_venta')[:100]
+        )
+        return Response({
+            **ColaContingenciaECF.metricas(negocio),
+            'descartadas': [
+                {
+                    'venta_id': str(d['venta_id']),
+                    'numero': d['venta__numero'],
+                    'ncf': d['venta__ncf'],
+                    'intentos': d['intentos'],
+                    'ultimo_error': d['ultimo_error'],
+                    'fecha_venta': d['fecha_venta'],
                 }
-                ecf_tipo = tipo_ecf_map.get(venta.tipo_comprobante, '32')
+                for d in descartadas
+            ],
+        })
 
-                # 1. Generate XML
-                generator = ECFGenerator(venta)
-                xml_content = generator.generate_xml()
+    @action(detail=False, methods=['post'], url_path='contingencia/reencolar')
+    def reencolar_contingencia(self, request):
+        """Devuelve a la cola de contingencia las facturas descartadas."""
+        if request.user.rol not in ('SUPER_ADMIN', 'ADMIN_NEGOCIO', 'CONTADOR', 'GERENTE'):
+            raise PermissionDenied('No tiene permisos para emitir facturas electronicas.')
+        venta_ids = request.data.get('venta_ids') or None
+        if venta_ids is not None and not isinstance(venta_ids, list):
+            raise ValidationError('venta_ids debe ser una lista.')
 
-                # 2. Sign XML
-                xml_firmado = sign_ecf_xml(
-                    xml_content.encode('utf-8'), p12_path, p12_pass,
-                )
+        from .utils.ecf_contingencia import ColaContingenciaECF
 
-                # 3. Create / update e-CF record
-                ecf_record, _ = FacturaElectronica.objects.get_or_create(
-                    venta=venta,
-                    defaults={'ecf_tipo': ecf_tipo},
-                )
-                ecf_record.ecf_tipo = ecf_tipo
-                ecf_record.xml_firmado = xml_firmado
-                ecf_record.fecha_firma = timezone.now()
-
-                # 4. Send to DGII API
-                dgii_client = DGIIClient(
-                    ambiente=negocio.ambiente_fiscal,
-                    rnc=negocio.identificacion_fiscal.replace('-', ''),
-                    usuario=negocio.api_fiscal_usuario,
-                    clave=negocio.api_fiscal_clave_decrypted,
-                )
-                dgii_response = dgii_client.enviar_ecf(xml_firmado)
+        negocio = request.user.negocio
+        reencoladas = ColaContingenciaECF.reencolar(negocio, venta_ids=venta_ids)
+        registrar_auditoria(
+            negocio_id=negocio.id, usuario_id=request.user.id, accion='UPDATE',
+            modelo='ContingenciaECF', objeto_id='',
+            descripcion=f'Reencoladas {reencoladas} facturas de contingencia e-CF',
+        )
+        return Response({'reencoladas': reencoladas})
 
-                ecf_record.track_id = dgii_response.get('track_id') or f"TRACK-{uuid.uuid4().hex[:10].upper()}"
-                ecf_record.respuesta_dgii = dgii_response.get('respuesta_cruda')
+    @action(detail=True, methods=['get'], url_path='representacion-impresa')
+    def representacion_impresa(self, request, pk=None):
+        """PDF de la representación impresa del e-CF de la venta."""
+        venta = self.get_object()
+        if not venta.ncf:
+            raise ValidationError('La venta no tiene NCF asignado.')
 
-                # 5. Generate QR URL
-                rnc = negocio.identificacion_fiscal.replace('-', '')
-                ecf_record.qr_code_url = (
-                    f"https://dgii.gov.do/ecf?rnc={rnc}&encf={venta.ncf}&sc={codigo_seguridad}"
-                )
-                ecf_record.save()
-
-                # 6. Update fiscal status based on DGII response
-                dgii_estado = dgii_response.get('estado', '')
-                if dgii_estado == 'ERROR':
-                    venta.estado_fiscal = 'EN_CONTINGENCIA'
-                elif dgii_estado == 'RECHAZADO':
-                    venta.estado_fiscal = 'RECHAZADO'
-                else:
-                    venta.estado_fiscal = 'ENVIADO'
-                venta.save(update_fields=['estado_fiscal'])
-
-                logger.info(
-                    'e-CF emitted: venta=%s ncf=%s track=%s dgii_status=%s user=%s',
-                    venta.numero, venta.ncf, ecf_record.track_id,
-                    dgii_estado, request.user.username,
-                )
+        from .utils.ecf_pdf import RepresentacionImpresa
 
-                return Response({
-                    'status': 'success',
-                    'ncf': venta.ncf,
-                    'codigo_seguridad': codigo_seguridad,
-                    'track_id': ecf_record.track_id,
-                    'dgii_estado': dgii_estado,
-                    'qr_url': ecf_record.qr_code_url,
-                    'xml_preview': xml_firmado[:200] + '...',
-                })
+        pdf, _ = RepresentacionImpresa(venta.negocio).pdf([venta.id])
+        response = HttpResponse(pdf, content_type='application/pdf')
+        response['Content-Disposition'] = f'inline; filename="{venta.ncf}.pdf"'
+        return response
 
-        except ValueError as e:
-            raise ValidationError(str(e))
-        except (FileNotFoundError, OSError) as e:
-            logger.error('Certificate error for venta %s: %s', venta.numero, e)
-            raise ValidationError(f'Error de certificado: {e}')
-        except Exception as e:
-            logger.error('e-CF generation failed for venta %s: %s', venta.numero, e)
-            return Response({'error': 'Error generando e-CF. Contacte al administrador.'}, status=500)
+    @action(detail=False, methods=['post'], url_path='representacion-impresa-lote')
+    def representacion_impresa_lote(self, request):
+        """
+        Representación impresa de varias facturas: un PDF o un ZIP con un PDF
+        por factura (streaming). Acepta venta_ids o un rango desde/hasta.
+        """
+        from .utils.ecf_pdf import RepresentacionImpresa
+
+        formato = request.data.get('formato', 'pdf')
+        if formato not in ('pdf', 'zip'):
+            raise ValidationError('formato debe ser pdf o zip.')
+        venta_ids = request.data.get('venta_ids') or None
+        if venta_ids is not None and not isinstance(venta_ids, list):
+            raise ValidationError('venta_ids debe ser una lista.')
+        desde = request.data.get('desde')
+        hasta = request.data.get('hasta')
+        if not venta_ids and not (desde and hasta):
+            raise ValidationError('Indique venta_ids o el rango desde/hasta.')
+
+        ventas = self.get_queryset().filter(estado='COMPLETADA').exclude(ncf='')
+        if venta_ids:
+            ventas = ventas.filter(id__in=venta_ids)
+        else:
+            ventas = ventas.filter(fecha__date__gte=desde, fecha__date__lte=hasta)
+        ids = list(ventas.values_list('id', flat=True)[:self.MAX_REPRESENTACION_IMPRESA + 1])
+        if not ids:
+            raise ValidationError('No hay facturas con NCF para imprimir.')
+        if len(ids) > self.MAX_REPRESENTACION_IMPRESA:
+            raise ValidationError(
+                f'Máximo {self.MAX_REPRESENTACION_IMPRESA} facturas por lote; use un rango menor.'
+            )
+
+        negocio = request.user.negocio
+        registrar_auditoria(
+            negocio_id=negocio.id, usuario_id=request.user.id, accion='EXPORT',
+            modelo='FacturaElectronica', objeto_id='',
+            descripcion=f'Representación impresa de {len(ids)} e-CF ({formato})',
+        )
+        impresor = RepresentacionImpresa(negocio)
+        nombre = f'ecf_{negocio.identificacion_fiscal}_{timezone.now():%Y%m%d%H%M}'
+        if formato == 'zip':
+            response = StreamingHttpResponse(impresor.zip(ids), content_type='application/zip')
+            response['Content-Disposition'] = f'attachment; filename="{nombre}.zip"'
+            return response
+        pdf, _ = impresor.pdf(ids)
+        response = HttpResponse(pdf, content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="{nombre}.pdf"'
+        return response
 
     @action(detail=True, methods=['post'], url_path='anular')
     def anular_venta(self, request, pk=None):
@@ -1469,7 +1677,7 @@ class VentaViewSet(viewsets.ModelViewSet):
 # =============================================================================
 
 class ReporteFiscalViewSet(viewsets.ViewSet):
-    """Fiscal reports (DGII 606/607) via Strategy Pattern."""
+    """Fiscal reports (DGII 606/607/608, libros fiscales) via Strategy Pattern."""
     permission_classes = [IsAuthenticated, CanViewReports]
 
     def _get_params(self, request):
@@ -1485,24 +1693,28 @@ class ReporteFiscalViewSet(viewsets.ViewSet):
             raise ValidationError('Mes debe estar entre 1 y 12.')
         return year, month
 
+    def _get_strategy(self, request):
+        try:
+            return FiscalStrategyFactory.get_strategy(request.user.negocio)
+        except NotImplementedError as e:
+            raise ValidationError(str(e))
+
+    def _get_tipo(self, request, strategy):
+        tipo = request.query_params.get('tipo', strategy.TIPO_DEFECTO)
+        if tipo not in strategy.TIPOS_REPORTE:
+            raise ValidationError(
+                f"Tipo de reporte no valido. Use {', '.join(strategy.TIPOS_REPORTE)}."
+            )
+        return tipo
+
     @action(detail=False, methods=['get'])
     def preview(self, request):
         """JSON preview for frontend."""
         year, month = self._get_params(request)
-        tipo = request.query_params.get('tipo', '607')
-
-        if tipo not in ('606', '607', '608'):
-            raise ValidationError('Tipo de reporte no valido. Use 606, 607 o 608.')
-
-        strategy = FiscalStrategyFactory.get_strategy(request.user.negocio)
-
-        if tipo == '607':
-            data = strategy.generar_reporte_ventas(year, month)
-        elif tipo == '608':
-            data = strategy.generar_reporte_anulaciones(year, month)
-        else:
-            data = strategy.generar_reporte_compras(year, month)
+        strategy = self._get_strategy(request)
+        tipo = self._get_tipo(request, strategy)
 
+        data = strategy.generar_reporte(tipo, year, month)
         return Response(data)
 
     @action(detail=False, methods=['get'])
@@ -1513,19 +1725,16 @@ class ReporteFiscalViewSet(viewsets.ViewSet):
             raise PermissionDenied('No tiene permisos para exportar datos.')
 
         year, month = self._get_params(request)
-        tipo = request.query_params.get('tipo', '607')
-
-        if tipo not in ('606', '607', '608'):
-            raise ValidationError('Tipo de reporte no valido.')
+        strategy = self._get_strategy(request)
+        tipo = self._get_tipo(request, strategy)
 
-        strategy = FiscalStrategyFactory.get_strategy(request.user.negocio)
         content, filename, content_type = strategy.exportar_archivo(tipo, year, month)
 
         # Audit log
         if request.user.negocio:
-            AuditLog.objects.create(
-                negocio=request.user.negocio,
-                usuario=request.user,
+            registrar_auditoria(
+                negocio_id=request.user.negocio_id,
+                usuario_id=request.user.id,
                 accion='EXPORT',
                 modelo='ReporteFiscal',
                 objeto_id=f'{tipo}-{year}{month:02d}',
@@ -1533,10 +1742,25 @@ class ReporteFiscalViewSet(viewsets.ViewSet):
                 ip_address=_get_client_ip(request),
             )
 
-        response = HttpResponse(content, content_type=content_type)
+        if isinstance(content, (str, bytes)):
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            response = StreamingHttpResponse(content, content_type=content_type)
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
 
+    @action(detail=False, methods=['get'], url_path='ncf-pronostico')
+    def ncf_pronostico(self, request):
+        """Números NCF disponibles por tipo y fecha estimada de agotamiento."""
+        from .utils.ncf_manager import pronostico_agotamiento
+        try:
+            dias = int(request.query_params.get('dias', 30))
+        except (TypeError, ValueError):
+            raise ValidationError("Parametro 'dias' debe ser un numero.")
+        if not 1 <= dias <= 365:
+            raise ValidationError("Parametro 'dias' debe estar entre 1 y 365.")
+        return Response(pronostico_agotamiento(request.user.negocio, dias=dias))
+
 
 # =============================================================================
 # CASH & AI
@@ -1619,6 +1843,43 @@ class CompraViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(compra)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'], url_path='importar-ecf')
+    def importar_ecf(self, request):
+        """
+        Registra compras desde e-CF firmados de proveedores (XML o ZIP en
+        'archivos'): verifica la firma, descarta duplicados por eNCF + RNC y
+        crea las compras en borrador. Retorna el reporte por documento.
+        """
+        from .utils.ecf_recepcion import RecepcionECF
+
+        archivos = request.FILES.getlist('archivos')
+        if not archivos:
+            raise ValidationError('Se requiere al menos un archivo XML o ZIP en archivos.')
+        negocio = request.user.negocio
+        almacen = None
+        if request.data.get('almacen'):
+            try:
+                almacen = Almacen.objects.get(negocio=negocio, id=uuid.UUID(str(request.data['almacen'])))
+            except (Almacen.DoesNotExist, ValueError):
+                raise ValidationError('Almacén no encontrado.')
+
+        try:
+            reporte = RecepcionECF(negocio, usuario=request.user, almacen=almacen).procesar(archivos)
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+        registrar_auditoria(
+            negocio_id=negocio.id, usuario_id=request.user.id, accion='CREATE',
+            modelo='Compra', objeto_id='',
+            descripcion=(
+                f"Recepción de e-CF: {reporte['importados']} importados, "
+                f"{reporte['duplicados']} duplicados de {reporte['total']}"
+            ),
+        )
+        return Response(
+            reporte, status=status.HTTP_201_CREATED if reporte['importados'] else status.HTTP_200_OK,
+        )
+
 
 # =============================================================================
 # PERÍODO CONTABLE
@@ -1777,9 +2038,18 @@ class CuentaBancariaViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'], url_path='importar-movimientos')
     def importar_movimientos(self, request, pk=None):
-        """POST /cuentas-bancarias/{id}/importar-movimientos/ — acepta CSV con movimientos."""
+        """
+        POST /cuentas-bancarias/{id}/importar-movimientos/ — acepta CSV con movimientos.
+
+        Inserta en bloque y en una sola transacción; las filas ya importadas
+        (mismo hash de contenido) se cuentan como duplicadas y las que no se
+        pueden interpretar como inválidas, sin abortar el resto.
+        """
         import csv
-        import io
+        from datetime import date as dt_date
+        from decimal import Decimal as D, InvalidOperation
+        from .parsers.base import text_stream
+        from .utils.importacion_bancaria import ImportadorBancario
 
         cuenta = self.get_object()
         archivo = request.FILES.get('archivo')
@@ -1787,32 +2057,41 @@ class CuentaBancariaViewSet(viewsets.ModelViewSet):
         if not archivo:
             raise ValidationError('Se requiere un archivo CSV.')
 
+        importador = ImportadorBancario(MovimientoBancario, campo_cuenta='cuenta')
+        # Se lee el upload en streaming: la memoria no depende del tamaño del CSV
+        texto = text_stream(archivo, errors='strict')
         try:
-            decoded = archivo.read().decode('utf-8')
-            reader = csv.DictReader(io.StringIO(decoded))
-
-            created = 0
-            for row in reader:
-                from datetime import date as dt_date
-                MovimientoBancario.objects.create(
-                    cuenta=cuenta,
-                    fecha=dt_date.fromisoformat(row.get('fecha', '')),
-                    descripcion=row.get('descripcion', '')[:300],
-                    referencia=row.get('referencia', '')[:100],
-                    monto=row.get('monto', 0),
-                    tipo=row.get('tipo', 'DEBITO').upper(),
-                    saldo_posterior=row.get('saldo', 0),
-                    importado_de=archivo.name[:100],
-                )
-                created += 1
-
-            return Response({
-                'status': 'success',
-                'movimientos_importados': created,
-            })
-        except Exception as e:
+            with transaction.atomic():
+                # La fila 1 es el encabezado
+                for numero, row in enumerate(csv.DictReader(texto), start=2):
+                    try:
+                        tipo = (row.get('tipo') or 'DEBITO').strip().upper()
+                        if tipo not in ('DEBITO', 'CREDITO'):
+                            raise ValueError(f'tipo inválido: {tipo}')
+                        importador.agregar(MovimientoBancario(
+                            cuenta=cuenta,
+                            fecha=dt_date.fromisoformat((row.get('fecha') or '').strip()),
+                            descripcion=(row.get('descripcion') or '')[:300],
+                            referencia=(row.get('referencia') or '')[:100],
+                            monto=D(str(row.get('monto') or 0).strip()).quantize(D('0.01')),
+                            tipo=tipo,
+                            saldo_posterior=D(str(row.get('saldo') or 0).strip()).quantize(D('0.01')),
+                            importado_de=archivo.name[:100],
+                        ))
+                    except (ValueError, InvalidOperation) as e:
+                        importador.invalida(numero, e)
+                resumen = importador.guardar()
+        except UnicodeDecodeError as e:
             raise ValidationError(f'Error procesando archivo: {e}')
 
+        return Response({
+            'status': 'success',
+            'movimientos_importados': resumen['importados'],
+            'duplicados': resumen['duplicados'],
+            'invalidos': resumen['invalidos'],
+            'errores': importador.errores,
+        })
+
     @action(detail=True, methods=['post'])
     def conciliar(self, request, pk=None):
         """POST /cuentas-bancarias/{id}/conciliar/ — match automático entre movimientos y asientos."""
@@ -1830,30 +2109,16 @@ class CuentaBancariaViewSet(viewsets.ModelViewSet):
         fecha_desde = dt_date.fromisoformat(fecha_desde)
         fecha_hasta = dt_date.fromisoformat(fecha_hasta)
 
-        movimientos = MovimientoBancario.objects.filter(
-            cuenta=cuenta,
-            fecha__gte=fecha_desde,
-            fecha__lte=fecha_hasta,
-            conciliado=False,
-        )
+        try:
+            dias = int(request.data.get('dias_tolerancia', 3))
+        except (TypeError, ValueError):
+            raise ValidationError('dias_tolerancia debe ser un entero.')
+        if not 0 <= dias <= 30:
+            raise ValidationError('dias_tolerancia debe estar entre 0 y 30.')
 
-        # Try auto-match: find asientos with same amount and similar date
-        matched = 0
-        for mov in movimientos:
-            asiento = AsientoContable.objects.filter(
-                negocio=self.request.user.negocio,
-                estado='CONTABILIZADO',
-                fecha__gte=mov.fecha - timedelta(days=3),
-                fecha__lte=mov.fecha + timedelta(days=3),
-                total_debe=mov.monto if mov.tipo == 'DEBITO' else 0,
-                total_haber=mov.monto if mov.tipo == 'CREDITO' else 0,
-            ).first()
-
-            if asiento:
-                mov.conciliado = True
-                mov.asiento_contable = asiento
-                mov.save(update_fields=['conciliado', 'asiento_contable'])
-                matched += 1
+        # Match en bloque: una consulta de asientos, cruce en memoria y un bulk_update
+        from .conciliation_engine import ConciliationEngine
+        resultado = ConciliationEngine().match_ledger(cuenta, fecha_desde, fecha_hasta, dias=dias)
 
         # Calculate book balance
         saldo_libros = cuenta.saldo
@@ -1871,8 +2136,8 @@ class CuentaBancariaViewSet(viewsets.ModelViewSet):
         return Response({
             'status': 'success',
             'conciliacion_id': str(conciliacion.id),
-            'movimientos_conciliados': matched,
-            'movimientos_pendientes': movimientos.filter(conciliado=False).count(),
+            'movimientos_conciliados': resultado['conciliados'],
+            'movimientos_pendientes': resultado['pendientes'],
             'diferencia': float(conciliacion.diferencia),
         })
 
@@ -3132,35 +3397,51 @@ class ImportacionBancariaViewSet(viewsets.ModelViewSet):
 
         try:
             parser = get_parser(formato)
-            content = archivo.read()
-            parsed_txns = parser.parse(content)
-        except Exception as e:
+        except ValueError as e:
             return Response({'error': f'Error parseando archivo: {e}'}, status=status.HTTP_400_BAD_REQUEST)
 
-        importacion = ArchivoImportacionBancaria.objects.create(
-            negocio=request.user.negocio,
-            cuenta_bancaria=cuenta,
-            archivo_nombre=archivo.name,
-            formato=formato,
-            registros_importados=len(parsed_txns),
-            importado_por=request.user,
-        )
+        from .utils.importacion_bancaria import ImportadorBancario
 
-        for txn in parsed_txns:
-            TransaccionBancaria.objects.create(
-                negocio=request.user.negocio,
-                cuenta_bancaria=cuenta,
-                importacion=importacion,
-                fecha=txn.fecha,
-                descripcion=txn.descripcion,
-                referencia=txn.referencia,
-                monto=txn.monto,
-                saldo=txn.saldo,
-            )
+        # El archivo se parsea en streaming y se inserta por bloques a medida
+        # que llega: la memoria no depende del tamaño del extracto
+        importador = ImportadorBancario(TransaccionBancaria, campo_cuenta='cuenta_bancaria')
+        try:
+            with transaction.atomic():
+                importacion = ArchivoImportacionBancaria.objects.create(
+                    negocio=request.user.negocio,
+                    cuenta_bancaria=cuenta,
+                    archivo_nombre=archivo.name,
+                    formato=formato,
+                    importado_por=request.user,
+                )
+                # Los formatos multicuenta (camt.053) filtran por el número de la cuenta
+                for txn in parser.iter_parse(archivo, cuenta=cuenta.numero):
+                    importador.agregar(TransaccionBancaria(
+                        negocio=request.user.negocio,
+                        cuenta_bancaria=cuenta,
+                        importacion=importacion,
+                        fecha=txn.fecha,
+                        descripcion=(txn.descripcion or '')[:300],
+                        referencia=(txn.referencia or '')[:100],
+                        monto=txn.monto,
+                        saldo=txn.saldo,
+                    ))
+                resumen = importador.guardar()
+                importacion.registros_importados = resumen['importados']
+                importacion.registros_duplicados = resumen['duplicados']
+                importacion.registros_invalidos = parser.invalidos
+                importacion.save(update_fields=[
+                    'registros_importados', 'registros_duplicados', 'registros_invalidos',
+                ])
+        except DatabaseError:
+            raise
+        except Exception as e:
+            return Response({'error': f'Error parseando archivo: {e}'}, status=status.HTTP_400_BAD_REQUEST)
 
         # Trigger async auto-matching
-        from .tasks import conciliar_automatico_async
-        conciliar_automatico_async.delay(str(importacion.id))
+        if resumen['importados']:
+            from .tasks import conciliar_automatico_async
+            conciliar_automatico_async.delay(str(importacion.id))
 
         return Response(
             ArchivoImportacionBancariaSerializer(importacion).data,
@@ -3219,6 +3500,60 @@ class TransaccionBancariaViewSet(viewsets.ModelViewSet):
         return Response(TransaccionBancariaSerializer(txn).data)
 
 
+class SugerenciaCobroViewSet(viewsets.ReadOnlyModelViewSet):
+    """Cola de revisión de la aplicación automática de cobros bancarios."""
+    serializer_class = SugerenciaCobroSerializer
+    permission_classes = [IsAuthenticated, CanManageAccounting]
+
+    def get_queryset(self):
+        qs = SugerenciaCobro.objects.filter(
+            negocio=self.request.user.negocio,
+        ).select_related('transaccion', 'cliente')
+
+        estado = self.request.query_params.get('estado')
+        if estado:
+            qs = qs.filter(estado=estado)
+        return qs
+
+    @action(detail=False, methods=['post'])
+    def ejecutar(self, request):
+        """Aplica los créditos bancarios pendientes (opcional: solo los de una importación)."""
+        from .cash_application_engine import CashApplicationEngine
+
+        transacciones = TransaccionBancaria.objects.filter(negocio=request.user.negocio)
+        importacion_id = request.data.get('importacion')
+        if importacion_id:
+            transacciones = transacciones.filter(importacion_id=importacion_id)
+        engine = CashApplicationEngine(request.user.negocio)
+        return Response(engine.run(transacciones, usuario=request.user))
+
+    @action(detail=True, methods=['post'])
+    def aplicar(self, request, pk=None):
+        """Aplica la sugerencia; acepta asignaciones corregidas [{cuenta_por_cobrar, monto}]."""
+        from .cash_application_engine import CashApplicationEngine
+
+        sugerencia = self.get_object()
+        engine = CashApplicationEngine(request.user.negocio)
+        try:
+            sugerencia = engine.accept(sugerencia, request.user, request.data.get('asignaciones'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(SugerenciaCobroSerializer(sugerencia).data)
+
+    @action(detail=True, methods=['post'])
+    def rechazar(self, request, pk=None):
+        """Descarta la sugerencia; el crédito no se vuelve a proponer."""
+        from .cash_application_engine import CashApplicationEngine
+
+        sugerencia = self.get_object()
+        engine = CashApplicationEngine(request.user.negocio)
+        try:
+            sugerencia = engine.reject(sugerencia, request.user)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(SugerenciaCobroSerializer(sugerencia).data)
+
+
 # =============================================================================
 # CIRCUIT BREAKERS HEALTH
 # =============================================================================
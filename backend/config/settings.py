@@ -352,6 +352,25 @@ LOGGING = {
     },
 }
 
+# --- DGII --------------------------------------------------------------------
+
+# Ambiente 'LOCAL' de e-CF: simulador (manage.py simular_dgii) para pruebas de carga.
+# Vacío deshabilita el ambiente (un negocio en 'LOCAL' no puede enviar: DGIIClient
+# lanza ValueError, nunca cae en TEST); en DEBUG apunta al puerto por defecto del simulador.
+DGII_LOCAL_URL = os.getenv('DGII_LOCAL_URL', 'http://127.0.0.1:8089/' if DEBUG else '')
+
+# Facturas de consumo (e-CF 32) por debajo de este monto (DOP) se reportan a la
+# DGII con el Resumen de Factura de Consumo (RFCE); el e-CF completo se guarda local.
+ECF_UMBRAL_RESUMEN_CONSUMO = os.getenv('ECF_UMBRAL_RESUMEN_CONSUMO', '250000')
+
+# CA (PEM) de las entidades de certificación autorizadas, para validar la cadena
+# del certificado de los e-CF recibidos. Vacío: la recepción de e-CF se rechaza.
+ECF_RECEPCION_CA_PEM = os.getenv('ECF_RECEPCION_CA_PEM', '')
+
+# Fuente TTF de la representación impresa de e-CF (vacío = Helvetica).
+ECF_PDF_FUENTE = os.getenv('ECF_PDF_FUENTE', '')
+ECF_PDF_FUENTE_NEGRITA = os.getenv('ECF_PDF_FUENTE_NEGRITA', '')
+
 # --- CELERY --------------------------------------------------------------
 
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/1')
@@ -365,7 +384,15 @@ CELERY_TASK_TIME_LIMIT = 300
 CELERY_BEAT_SCHEDULE = {
     'reintentar-ecf-contingencia': {
         'task': 'api.tasks.reintentar_ecf_contingencia',
-        'schedule': 300.0,
+        'schedule': 60.0,
+    },
+    'consultar-estados-ecf': {
+        'task': 'api.tasks.consultar_estados_ecf',
+        'schedule': 60.0,
+    },
+    'mantener-secuencias-ncf': {
+        'task': 'api.tasks.mantener_secuencias_ncf',
+        'schedule': 86400.0,
     },
     'backup-diario': {
         'task': 'api.tasks.backup_diario',
@@ -391,6 +418,14 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'api.tasks.limpiar_ips_expiradas',
         'schedule': 3600.0,
     },
+    'volcar-auditoria': {
+        'task': 'api.tasks.volcar_auditoria',
+        'schedule': 5.0,
+    },
+    'mantener-particiones-auditoria': {
+        'task': 'api.tasks.mantener_particiones_auditoria',
+        'schedule': 86400.0,  # cada 24 horas
+    },
 }
 
 # --- CACHE (Redis) -------------------------------------------------------
@@ -406,6 +441,26 @@ CACHES = {
     }
 }
 
+# --- AUDITORÍA ------------------------------------------------------------
+
+# Los eventos de AuditLog se encolan en un stream de Redis y los guarda en
+# lote la tarea volcar-auditoria (api.utils.auditoria). Con 0 se escriben
+# directo en la base de datos al confirmar la transacción.
+AUDITORIA_ASINCRONA = os.getenv('AUDITORIA_ASINCRONA', '1') == '1'
+AUDITORIA_REDIS_URL = os.getenv('AUDITORIA_REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+
+# api_auditlog está particionada por mes (api.utils.particiones_auditoria):
+# la tarea mantener-particiones-auditoria crea las de los próximos meses y
+# archiva (gzip + SHA-256) y retira las anteriores a la retención.
+AUDITORIA_PARTICIONES_ADELANTE = int(os.getenv('AUDITORIA_PARTICIONES_ADELANTE', '3'))
+AUDITORIA_RETENCION_MESES = int(os.getenv('AUDITORIA_RETENCION_MESES', '24'))
+AUDITORIA_ARCHIVO_DIR = os.getenv(
+    'AUDITORIA_ARCHIVO_DIR',
+    os.path.join(os.getenv('BACKUP_DIR', '/var/backups/sistema-ventas'), 'auditoria'),
+)
+# Sin fecha_desde, el listado de auditoría se limita a estos días (y a sus particiones)
+AUDITORIA_VENTANA_DIAS = int(os.getenv('AUDITORIA_VENTANA_DIAS', '90'))
+
 # --- DBBACKUP ------------------------------------------------------------
 
 DBBACKUP_STORAGE = 'django.core.files.storage.FileSystemStorage'
@@ -80,7 +80,7 @@ export default function VentasPage() {
     setEmitiendo(ventaId);
     try {
       await fiscalService.emitirECF(ventaId);
-      alert("e-CF emitido exitosamente.");
+      alert("e-CF en proceso. Recibira una notificacion al completarse.");
       cargarDatos();
     } catch {
       alert("Error al emitir e-CF. Verifique la configuracion fiscal.");